@@ -51,6 +51,13 @@ def create_app():
 
     # Phase 1: Initialize background sync scheduler (2-hour interval)
     if app.config.get('DB_MODE') == 'offline':
+        try:
+            # Change journal first: it records the writes the scheduler pushes
+            from services.change_journal import init_change_journal
+            init_change_journal(app)
+        except Exception as e:
+            logging.warning(f"[WARNING] Change journal failed to initialize: {e}")
+
         try:
             from services.sync_scheduler import init_sync_scheduler
             sync_scheduler = init_sync_scheduler(app)
@@ -61,6 +68,22 @@ def create_app():
     else:
         logging.info("[INFO] Running in online mode - sync scheduler disabled")
 
+    # Audit log rows are written in batches by a background writer
+    try:
+        from services.audit_writer import init_audit_writer
+        init_audit_writer(app)
+        logging.info("[OK] Audit writer initialized")
+    except Exception as e:
+        logging.warning(f"[WARNING] Audit writer failed to initialize: {e}")
+
+    # Background jobs for long imports, exports and PDF generation
+    try:
+        from services.job_runner import init_job_runner
+        app.config['JOB_RUNNER'] = init_job_runner(app)
+        logging.info("[OK] Background job runner initialized")
+    except Exception as e:
+        logging.warning(f"[WARNING] Background job runner failed to initialize: {e}")
+
     # Register blueprints with error handling
     blueprints_registered = []
     import_errors = []
@@ -68,7 +91,7 @@ def create_app():
     # Import each blueprint separately to identify which one fails
     auth_bp = billing_bp = stock_bp = report_bp = audit_bp = None
     client_bp = payment_bp = customer_bp = analytics_bp = None
-    permissions_bp = admin_bp = notes_bp = bulk_order_bp = expense_bp = profile_bp = None
+    permissions_bp = admin_bp = notes_bp = bulk_order_bp = expense_bp = profile_bp = jobs_bp = None
 
     try:
         from routes.auth import auth_bp
@@ -160,6 +183,12 @@ def create_app():
         import_errors.append(f"profile: {str(e)}")
         logging.error(f"Failed to import profile blueprint: {e}")
 
+    try:
+        from routes.jobs import jobs_bp
+    except Exception as e:
+        import_errors.append(f"jobs: {str(e)}")
+        logging.error(f"Failed to import jobs blueprint: {e}")
+
     # Store import errors for debugging
     app.config['IMPORT_ERRORS'] = import_errors
     if import_errors:
@@ -271,6 +300,13 @@ def create_app():
         except Exception as e:
             print(f"Warning: Could not register profile blueprint: {e}")
 
+    if jobs_bp:
+        try:
+            app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
+            blueprints_registered.append('jobs')
+        except Exception as e:
+            print(f"Warning: Could not register jobs blueprint: {e}")
+
     # Store blueprint registration status
     app.config['BLUEPRINTS_REGISTERED'] = blueprints_registered
 
@@ -283,6 +319,8 @@ def create_app():
     @app.route('/api/status', methods=['GET'])
     def status_check():
         from config import Config
+        from utils.cache_helper import get_cache_manager
+        from utils.product_index import product_index
 
         # Test database connection
         db_connected = False
@@ -320,6 +358,8 @@ def create_app():
                 'import_errors': app.config.get('IMPORT_ERRORS', [])
             },
             'cors_origins': os.environ.get('CORS_ORIGINS', 'not set'),
+            'cache': get_cache_manager().get_stats(),
+            'product_index': product_index.get_stats(),
             'warnings': []
         }
 
@@ -0,0 +1,160 @@
+"""
+Group Commit - coalesce concurrent SQLite write transactions (offline mode)
+
+With SQLITE_GROUP_COMMIT_MS > 0 the sessions that write share one writer
+connection and one outer transaction (a "batch"). Each session's writes run in
+a SAVEPOINT on it:
+
+    session A: SAVEPOINT ... writes ... RELEASE   ┐
+    session B: SAVEPOINT ... writes ... RELEASE   ├ one COMMIT for the batch
+    session C: SAVEPOINT ... ROLLBACK TO          ┘ (C's writes are undone alone)
+
+A session's commit() returns once the batch is committed, so success and
+failure are still reported per request: if the batch COMMIT fails every
+member's commit() raises, before the session's after_commit listeners run
+(see database/manager.py RoutingSession). The batch commits when it has
+SQLITE_GROUP_COMMIT_MAX members or when its oldest member has waited
+SQLITE_GROUP_COMMIT_MS, whichever is first. Sessions still write one at a
+time - the batch only shares the commit.
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Failed batches remembered for their waiting members
+_FAILED_KEEP = 100
+
+
+class GroupCommit:
+    """Batches commits of the sessions writing through one engine"""
+
+    def __init__(self, engine, window_seconds, max_batch, lock_timeout):
+        self.engine = engine
+        self.window = window_seconds
+        self.max_batch = max_batch
+        self.lock_timeout = lock_timeout
+
+        self._writer = threading.Lock()  # held by the session writing into the batch
+        self._done = threading.Condition()
+        self._connection = None
+        self._transaction = None
+        self._batch = 0  # id of the open (or last) batch
+        self._members = 0
+        self._committed = 0  # id of the last finished batch
+        self._failed = {}  # batch id -> exception
+
+        self.stats = {"batches": 0, "commits": 0, "failed": 0}
+
+    def acquire(self):
+        """
+        Take the writer connection for a session (call release() when its transaction ends).
+
+        Returns:
+            Connection: in the batch transaction; the session works in a savepoint
+        """
+        if not self._writer.acquire(timeout=self.lock_timeout):
+            raise PoolTimeoutError(f"Writer busy for more than {self.lock_timeout:.0f}s")
+
+        try:
+            if self._transaction is None:
+                self._connection = self.engine.connect()
+                self._transaction = self._connection.begin()
+                self._batch += 1
+                self._members = 0
+        except Exception:
+            self._writer.release()
+            raise
+        return self._connection
+
+    def release(self, committed):
+        """
+        A session's transaction ended (savepoint released or rolled back).
+
+        Returns:
+            int or None: batch to wait for if the session committed
+        """
+        try:
+            if not committed:
+                if self._members == 0:
+                    self._finish()
+                return None
+
+            self._members += 1
+            ticket = self._batch
+            if self._members >= self.max_batch:
+                self._finish()
+            return ticket
+        finally:
+            self._writer.release()
+
+    def wait(self, ticket):
+        """
+        Block until the batch is committed; raises if its COMMIT failed.
+
+        Only returns or raises once the batch's outcome is known, so callers
+        can trust it to decide between their commit and rollback handling.
+        """
+        deadline = time.monotonic() + self.window
+        with self._done:
+            while self._committed < ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._done.wait(remaining)
+
+        while self._committed < ticket:
+            # Window elapsed: commit the batch (after the session writing now joins it)
+            if not self._writer.acquire(timeout=self.lock_timeout):
+                logger.warning(f"[GroupCommit] Writer busy for more than {self.lock_timeout:.0f}s, still waiting for batch {ticket}")
+                continue
+            try:
+                if self._batch == ticket and self._transaction is not None:
+                    self._finish()
+            finally:
+                self._writer.release()
+
+        error = self._failed.get(ticket)
+        if error is not None:
+            raise error
+
+    def _finish(self):
+        """Commit the open batch (writer lock held)"""
+        batch, members = self._batch, self._members
+        error = None
+        try:
+            self._transaction.commit()
+        except Exception as e:
+            error = e
+            logger.error(f"[GroupCommit] Commit of {members} transactions failed: {e}")
+            try:
+                self._transaction.rollback()
+            except Exception:
+                pass
+        finally:
+            self._connection.close()
+            self._connection = None
+            self._transaction = None
+
+        with self._done:
+            self._committed = batch
+            if members:
+                self.stats["batches"] += 1
+                self.stats["commits"] += members
+            if error is not None:
+                self.stats["failed"] += members
+                self._failed[batch] = error
+                for old in [key for key in self._failed if key <= batch - _FAILED_KEEP]:
+                    del self._failed[old]
+            self._done.notify_all()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["average_batch"] = round(stats["commits"] / stats["batches"], 2) if stats["batches"] else 0
+        return stats
+
+
+__all__ = ['GroupCommit']
@@ -6,8 +6,59 @@ Handles automatic detection of online/offline mode and manages database connecti
 """
 
 import os
+from flask_sqlalchemy.session import Session as FlaskSession
 from sqlalchemy import create_engine, event, pool
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import Select, CompoundSelect, TextClause
+
+from database.group_commit import GroupCommit
+
+# Offline mode: SQLite (WAL) runs any number of readers next to one writer.
+# Reads go to a pool of SQLITE_READERS read-only connections; every write goes
+# through a single writer connection (the Flask-SQLAlchemy engine), so writers
+# queue in the pool instead of colliding on SQLite's lock.
+# SQLITE_READERS=0 (and in-memory databases) keep the previous setup: one
+# engine with SQLAlchemy's default pool for both reads and writes.
+SQLITE_READERS = int(os.getenv('SQLITE_READERS', '4'))
+SQLITE_WRITE_TIMEOUT = float(os.getenv('SQLITE_WRITE_TIMEOUT', '10'))
+
+# Group commit (0 = off): a batch commits after this many milliseconds or members
+SQLITE_GROUP_COMMIT_MS = float(os.getenv('SQLITE_GROUP_COMMIT_MS', '0'))
+SQLITE_GROUP_COMMIT_MAX = int(os.getenv('SQLITE_GROUP_COMMIT_MAX', '50'))
+
+# session.info flag: this transaction has used the writer (later reads must see its writes)
+_WRITER_KEY = 'db_manager_writer'
+# session.info: batch connection held by the session / the batch it joined failed to commit
+_GROUP_CONNECTION_KEY = 'db_manager_group_connection'
+_GROUP_FAILED_KEY = 'db_manager_group_failed'
+
+
+def _set_sqlite_pragma(dbapi_conn, connection_record):
+    """Enable WAL mode and foreign keys for SQLite"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=10000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def _set_reader_pragma(dbapi_conn, connection_record):
+    _set_sqlite_pragma(dbapi_conn, connection_record)
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def _is_read(clause):
+    """True for plain SELECTs (no FOR UPDATE) - the statements a reader connection may run"""
+    if isinstance(clause, (Select, CompoundSelect)):
+        return clause._for_update_arg is None
+    if isinstance(clause, TextClause):
+        words = clause.text.lstrip().split(None, 1)
+        return bool(words) and words[0].upper() in ('SELECT', 'WITH')
+    return False
 
 
 class DatabaseManager:
@@ -21,6 +72,8 @@ class DatabaseManager:
         self.app = app
         self.mode = None
         self.engine = None
+        self.reader_engine = None
+        self.group_commit = None
 
         if app:
             self.init_app(app)
@@ -29,12 +82,42 @@ class DatabaseManager:
         """Initialize with Flask app"""
         self.app = app
         self.mode = self._detect_mode()
-        self.engine = self._initialize_engine()
 
         # Store mode in app config for other modules
         app.config['DB_MODE'] = self.mode
         app.config['SQLALCHEMY_DATABASE_URI'] = self._get_database_uri()
 
+        if self.mode == 'online':
+            self.engine = self._initialize_engine()
+        else:
+            # Flask-SQLAlchemy creates the writer engine from these options
+            # (adopted in bind_writer); the reader pool is created here
+            database_uri = self._get_database_uri()
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = self._sqlite_writer_options(database_uri)
+            self.reader_engine = self._create_reader_engine(database_uri)
+
+    def bind_writer(self, engine):
+        """Adopt the Flask-SQLAlchemy engine as the SQLite writer (offline mode)"""
+        if self.mode != 'offline':
+            return
+        event.listen(engine, "connect", _set_sqlite_pragma)
+        self.engine = engine
+
+        if SQLITE_GROUP_COMMIT_MS > 0:
+            # pysqlite's implicit transactions break SAVEPOINT: let SQLAlchemy emit BEGIN
+            @event.listens_for(engine, "connect")
+            def disable_pysqlite_transactions(dbapi_conn, connection_record):
+                dbapi_conn.isolation_level = None
+
+            @event.listens_for(engine, "begin")
+            def emit_begin(conn):
+                conn.exec_driver_sql("BEGIN")
+
+            self.group_commit = GroupCommit(
+                engine, SQLITE_GROUP_COMMIT_MS / 1000, SQLITE_GROUP_COMMIT_MAX, SQLITE_WRITE_TIMEOUT
+            )
+            print(f"[DatabaseManager] Group commit: {SQLITE_GROUP_COMMIT_MS:.0f}ms / {SQLITE_GROUP_COMMIT_MAX} transactions")
+
     def _detect_mode(self):
         """
         Detect whether to use online (PostgreSQL) or offline (SQLite) mode.
@@ -99,32 +182,69 @@ class DatabaseManager:
             print(f"[DatabaseManager] PostgreSQL engine initialized")
 
         else:
-            # SQLite configuration
-            engine = create_engine(
-                database_uri,
-                connect_args={
-                    'check_same_thread': False,  # Allow multi-threading
-                    'timeout': 10  # 10 second lock timeout
-                },
-                poolclass=pool.StaticPool,  # Single connection pool for SQLite
-                echo=os.getenv('SQLALCHEMY_ECHO', 'false').lower() == 'true'
-            )
-
-            # Enable WAL mode and foreign keys for SQLite
-            @event.listens_for(engine, "connect")
-            def set_sqlite_pragma(dbapi_conn, connection_record):
-                cursor = dbapi_conn.cursor()
-                cursor.execute("PRAGMA journal_mode=WAL")
-                cursor.execute("PRAGMA foreign_keys=ON")
-                cursor.execute("PRAGMA synchronous=NORMAL")
-                cursor.execute("PRAGMA cache_size=10000")
-                cursor.execute("PRAGMA temp_store=MEMORY")
-                cursor.close()
+            # SQLite configuration: single writer plus read-only pool
+            engine = create_engine(database_uri, **self._sqlite_writer_options(database_uri))
+            event.listen(engine, "connect", _set_sqlite_pragma)
+            self.reader_engine = self._create_reader_engine(database_uri)
 
             print(f"[DatabaseManager] SQLite engine initialized at: {database_uri}")
 
         return engine
 
+    @staticmethod
+    def _routes_reads(database_uri):
+        """True if reads get their own pool and the writer is a single connection"""
+        return SQLITE_READERS > 0 and ':memory:' not in database_uri
+
+    @staticmethod
+    def _sqlite_writer_options(database_uri):
+        """
+        One connection: writes queue for it (up to SQLITE_WRITE_TIMEOUT) instead of hitting SQLite's lock.
+
+        Without read routing the engine serves reads too and keeps SQLAlchemy's
+        default multi-connection pool.
+        """
+        connect_args = {
+            'check_same_thread': False,  # Allow multi-threading
+            'timeout': SQLITE_WRITE_TIMEOUT  # lock timeout (other processes, e.g. sync)
+        }
+        echo = os.getenv('SQLALCHEMY_ECHO', 'false').lower() == 'true'
+        if not DatabaseManager._routes_reads(database_uri):
+            return {'connect_args': connect_args, 'echo': echo}
+
+        return {
+            'connect_args': connect_args,
+            'poolclass': pool.QueuePool,
+            'pool_size': 1,
+            'max_overflow': 0,
+            'pool_timeout': SQLITE_WRITE_TIMEOUT,
+            'echo': echo
+        }
+
+    @staticmethod
+    def _create_reader_engine(database_uri):
+        """
+        Pool of read-only connections (WAL readers never block the writer).
+
+        Returns:
+            Engine or None: None if disabled (SQLITE_READERS=0) or for in-memory databases
+        """
+        if not DatabaseManager._routes_reads(database_uri):
+            return None
+
+        engine = create_engine(
+            database_uri,
+            connect_args={'check_same_thread': False, 'timeout': SQLITE_WRITE_TIMEOUT},
+            poolclass=pool.QueuePool,
+            pool_size=SQLITE_READERS,
+            max_overflow=0,
+            pool_timeout=30,
+            echo=os.getenv('SQLALCHEMY_ECHO', 'false').lower() == 'true'
+        )
+        event.listen(engine, "connect", _set_reader_pragma)
+        print(f"[DatabaseManager] SQLite read pool: {SQLITE_READERS} connections")
+        return engine
+
     def is_online(self):
         """Check if currently in online mode"""
         return self.mode == 'online'
@@ -137,6 +257,16 @@ class DatabaseManager:
         """Get current database engine"""
         return self.engine
 
+    def holds_writer(self, session):
+        """
+        True if the session's transaction is on the SQLite writer (offline mode).
+
+        Work that needs a transaction of its own on the writer (engine.begin())
+        would wait for the session - for the pool's only connection, or for
+        SQLite's write lock - until it times out; run it in the session instead.
+        """
+        return self.mode == 'offline' and bool(session.info.get(_WRITER_KEY))
+
     def switch_mode(self, new_mode):
         """
         Manually switch database mode.
@@ -156,9 +286,12 @@ class DatabaseManager:
 
         print(f"[DatabaseManager] Switching from {self.mode} to {new_mode} mode")
 
-        # Dispose old engine
+        # Dispose old engines
         if self.engine:
             self.engine.dispose()
+        if self.reader_engine:
+            self.reader_engine.dispose()
+            self.reader_engine = None
 
         # Update mode and reinitialize
         self.mode = new_mode
@@ -171,5 +304,82 @@ class DatabaseManager:
         print(f"[DatabaseManager] Switched to {new_mode} mode successfully")
 
 
+class RoutingSession(FlaskSession):
+    """
+    Session that sends reads to the SQLite reader pool (offline mode).
+
+    Writes, flushes and anything else that is not a plain SELECT use the
+    writer. Once a transaction has used the writer it keeps using it, so reads
+    after a write (e.g. autoflush, then query) see the transaction's own rows.
+    With group commit the writer is the shared batch connection and commit()
+    returns once the batch is committed. The wait happens before the other
+    after_commit listeners (bill numbers, audit events) run; if the batch
+    COMMIT fails, commit() raises and the transaction ends as rolled back for
+    them (after_transaction_end without after_commit).
+    """
+
+    def __init__(self, *args, **kwargs):
+        # Group commit hands out a connection inside the batch transaction:
+        # the session works in a savepoint of it
+        kwargs.setdefault('join_transaction_mode', 'create_savepoint')
+        super().__init__(*args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or engine is not db_manager.engine:
+            return engine
+
+        reader = db_manager.reader_engine
+        if reader is not None and not self._flushing and not self.info.get(_WRITER_KEY) and _is_read(clause):
+            return reader
+
+        self.info[_WRITER_KEY] = True
+        group = db_manager.group_commit
+        if group is None:
+            return engine
+
+        connection = self.info.get(_GROUP_CONNECTION_KEY)
+        if connection is None:
+            connection = self.info[_GROUP_CONNECTION_KEY] = group.acquire()
+        return connection
+
+    def commit(self):
+        try:
+            super().commit()
+        except Exception:
+            if self.info.pop(_GROUP_FAILED_KEY, False):
+                # The savepoint was released but the batch did not commit: the
+                # transaction is stuck "committed" - close it, which runs the
+                # rollback hooks (after_transaction_end)
+                self.close()
+            raise
+
+
+@event.listens_for(RoutingSession, 'after_commit', insert=True)
+def _wait_group_committed(session):
+    """Runs first: later after_commit listeners only see a committed batch"""
+    # begin_nested() savepoints commit too; only the session's transaction joins the batch
+    if session.in_nested_transaction() or session.info.pop(_GROUP_CONNECTION_KEY, None) is None:
+        return
+
+    group = db_manager.group_commit
+    try:
+        group.wait(group.release(True))
+    except Exception:
+        session.info[_GROUP_FAILED_KEY] = True
+        raise
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _reset_writer_flag(session, transaction):
+    if transaction.parent is not None:
+        return
+
+    session.info.pop(_WRITER_KEY, None)
+    if session.info.pop(_GROUP_CONNECTION_KEY, None) is not None:
+        # Rolled back (or closed) without committing
+        db_manager.group_commit.release(False)
+
+
 # Global instance
 db_manager = DatabaseManager()
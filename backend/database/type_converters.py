@@ -7,10 +7,109 @@ Converts data types between PostgreSQL and SQLite to ensure compatibility.
 
 import json
 import uuid
-from datetime import datetime, date
+from datetime import datetime, date, timezone
+from collections.abc import Mapping
 from decimal import Decimal
 
 
+def _uuid_to_sqlite(value):
+    return str(value) if not isinstance(value, str) else value
+
+
+def _json_to_sqlite(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _numeric_to_sqlite(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _timestamp_to_sqlite(value):
+    # Naive UTC, the format SQLAlchemy's SQLite DateTime writes, so converted
+    # rows sort and compare with rows the app wrote
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+    return value
+
+
+def _date_to_sqlite(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _boolean_to_sqlite(value):
+    return 1 if value else 0
+
+
+def _uuid_from_sqlite(value):
+    if isinstance(value, str):
+        return uuid.UUID(value)
+    return value
+
+
+def _json_from_sqlite(value):
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def _numeric_from_sqlite(value):
+    if isinstance(value, float):
+        return Decimal(str(value))
+    return value
+
+
+def _timestamp_from_sqlite(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _date_from_sqlite(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).date()
+    return value
+
+
+# Conversion per column type (values are never None here)
+_TO_SQLITE = {
+    'UUID': _uuid_to_sqlite,          # UUID → TEXT
+    'JSONB': _json_to_sqlite,         # JSONB → TEXT (JSON string)
+    'NUMERIC': _numeric_to_sqlite,    # NUMERIC → REAL
+    'TIMESTAMP': _timestamp_to_sqlite,  # TIMESTAMP → TEXT
+    'DATE': _date_to_sqlite,          # DATE → TEXT
+    'BOOLEAN': _boolean_to_sqlite,    # BOOLEAN → INTEGER (0 or 1)
+}
+
+_FROM_SQLITE = {
+    'UUID': _uuid_from_sqlite,
+    'JSONB': _json_from_sqlite,
+    'NUMERIC': _numeric_from_sqlite,
+    'TIMESTAMP': _timestamp_from_sqlite,
+    'DATE': _date_from_sqlite,
+    'BOOLEAN': bool,
+}
+
+
+def _converter_for(converters, column_type):
+    """Conversion function for a column type name, or None if values pass through"""
+    column_type = column_type.upper()
+    if column_type.startswith('NUMERIC') or column_type.startswith('DECIMAL'):
+        column_type = 'NUMERIC'
+    elif column_type == 'JSON':
+        column_type = 'JSONB'
+    elif column_type == 'TIMESTAMPTZ':
+        column_type = 'TIMESTAMP'
+    return converters.get(column_type)
+
+
 class TypeConverter:
     """
     Handles type conversions between PostgreSQL and SQLite.
@@ -19,13 +118,16 @@ class TypeConverter:
     - UUID → TEXT
     - JSONB → TEXT (JSON string)
     - NUMERIC(12,2) → REAL
-    - TIMESTAMP → TEXT (ISO format)
+    - TIMESTAMP → TEXT (YYYY-MM-DD HH:MM:SS.ffffff, UTC)
 
     SQLite → PostgreSQL:
     - TEXT → UUID (parse)
     - TEXT → JSONB (parse JSON)
     - REAL → NUMERIC
     - TEXT → TIMESTAMP (parse ISO)
+
+    For many rows of one table, compile a RowConverter once
+    (compile_to_sqlite / compile_from_sqlite) instead of converting dict by dict.
     """
 
     @staticmethod
@@ -43,43 +145,8 @@ class TypeConverter:
         if value is None:
             return None
 
-        column_type = column_type.upper()
-
-        if column_type == 'UUID':
-            # UUID → TEXT
-            return str(value) if not isinstance(value, str) else value
-
-        elif column_type in ['JSONB', 'JSON']:
-            # JSONB → TEXT (JSON string)
-            if isinstance(value, str):
-                return value
-            return json.dumps(value)
-
-        elif column_type.startswith('NUMERIC') or column_type.startswith('DECIMAL'):
-            # NUMERIC → REAL
-            if isinstance(value, Decimal):
-                return float(value)
-            return value
-
-        elif column_type in ['TIMESTAMP', 'TIMESTAMPTZ']:
-            # TIMESTAMP → TEXT (ISO format)
-            if isinstance(value, datetime):
-                return value.isoformat()
-            return value
-
-        elif column_type == 'DATE':
-            # DATE → TEXT
-            if isinstance(value, date):
-                return value.isoformat()
-            return value
-
-        elif column_type == 'BOOLEAN':
-            # BOOLEAN → INTEGER (0 or 1)
-            return 1 if value else 0
-
-        else:
-            # No conversion needed
-            return value
+        convert = _converter_for(_TO_SQLITE, column_type)
+        return convert(value) if convert else value
 
     @staticmethod
     def from_sqlite(value, column_type):
@@ -96,45 +163,8 @@ class TypeConverter:
         if value is None:
             return None
 
-        column_type = column_type.upper()
-
-        if column_type == 'UUID':
-            # TEXT → UUID
-            if isinstance(value, str):
-                return uuid.UUID(value)
-            return value
-
-        elif column_type in ['JSONB', 'JSON']:
-            # TEXT → JSONB (parse JSON)
-            if isinstance(value, str):
-                return json.loads(value)
-            return value
-
-        elif column_type.startswith('NUMERIC') or column_type.startswith('DECIMAL'):
-            # REAL → NUMERIC
-            if isinstance(value, float):
-                return Decimal(str(value))
-            return value
-
-        elif column_type in ['TIMESTAMP', 'TIMESTAMPTZ']:
-            # TEXT → TIMESTAMP
-            if isinstance(value, str):
-                return datetime.fromisoformat(value)
-            return value
-
-        elif column_type == 'DATE':
-            # TEXT → DATE
-            if isinstance(value, str):
-                return datetime.fromisoformat(value).date()
-            return value
-
-        elif column_type == 'BOOLEAN':
-            # INTEGER → BOOLEAN
-            return bool(value)
-
-        else:
-            # No conversion needed
-            return value
+        convert = _converter_for(_FROM_SQLITE, column_type)
+        return convert(value) if convert else value
 
     @staticmethod
     def convert_dict_to_sqlite(data_dict, column_types):
@@ -176,6 +206,99 @@ class TypeConverter:
                 converted[key] = value
         return converted
 
+    @staticmethod
+    def type_name(sql_type):
+        """Type name used by this converter for a reflected SQLAlchemy column type (None: no conversion)"""
+        name = type(sql_type).__name__.upper()
+        if name == 'UUID':
+            return 'UUID'
+        if name in ('JSONB', 'JSON'):
+            return 'JSONB'
+        if name in ('NUMERIC', 'DECIMAL'):
+            return 'NUMERIC'
+        if name in ('TIMESTAMP', 'DATETIME'):
+            return 'TIMESTAMP'
+        if name == 'DATE':
+            return 'DATE'
+        if name == 'BOOLEAN':
+            return 'BOOLEAN'
+        return None
+
+    @staticmethod
+    def column_types(table):
+        """Mapping of column names to type names for a reflected PostgreSQL table"""
+        return {
+            column.name: TypeConverter.type_name(column.type)
+            for column in table.columns if TypeConverter.type_name(column.type)
+        }
+
+    @staticmethod
+    def compile_to_sqlite(columns, column_types):
+        """
+        Compile a PostgreSQL → SQLite converter for rows with these columns.
+
+        Example:
+            converter = TypeConverter.compile_to_sqlite(result.keys(), STOCK_COLUMN_TYPES)
+            sqlite_conn.execute(stock_table.insert(), converter.records(result.fetchall()))
+        """
+        return RowConverter(columns, column_types, _TO_SQLITE)
+
+    @staticmethod
+    def compile_from_sqlite(columns, column_types):
+        """Compile a SQLite → PostgreSQL converter for rows with these columns"""
+        return RowConverter(columns, column_types, _FROM_SQLITE)
+
+
+class RowConverter:
+    """
+    Column plan for one table: the conversion function of every column is
+    looked up once, then applied a column at a time to a whole batch.
+
+    Rows can be mappings (dicts, row._mapping), sequences in column order
+    (SQLAlchemy Row objects, tuples) or a pandas DataFrame (convert_frame).
+    """
+
+    def __init__(self, columns, column_types, converters):
+        self.columns = tuple(columns)
+        self._conversions = [
+            (index, convert) for index, convert in (
+                (index, _converter_for(converters, column_types[name]))
+                for index, name in enumerate(self.columns) if name in column_types
+            ) if convert
+        ]
+
+    def convert_rows(self, rows):
+        """
+        Convert a batch of rows.
+
+        Returns:
+            list: One tuple per row, values in self.columns order (ready for
+                  executemany with positional parameters)
+        """
+        if not rows:
+            return []
+
+        if isinstance(rows[0], Mapping):
+            values = [[row.get(name) for row in rows] for name in self.columns]
+        else:
+            values = [list(column) for column in zip(*rows)]
+        return self._convert_columns(values)
+
+    def convert_frame(self, frame):
+        """Convert a pandas DataFrame holding (at least) self.columns; NaN/NaT become None"""
+        frame = frame[list(self.columns)].astype(object)
+        frame = frame.where(frame.notna(), None)
+        return self._convert_columns([frame[name].tolist() for name in self.columns])
+
+    def records(self, rows):
+        """Convert a batch of rows to dicts (for executemany with named parameters)"""
+        return [dict(zip(self.columns, row)) for row in self.convert_rows(rows)]
+
+    def _convert_columns(self, values):
+        for index, convert in self._conversions:
+            values[index] = [None if value is None else convert(value) for value in values[index]]
+        return list(zip(*values))
+
 
 # Column type mappings for common tables
 BILLING_COLUMN_TYPES = {
@@ -5,8 +5,10 @@ Phase 1: Integrated dual database support (PostgreSQL + SQLite)
 from flask_sqlalchemy import SQLAlchemy
 import logging
 
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+from database.manager import RoutingSession
+
+# Initialize SQLAlchemy (offline mode: reads use the SQLite reader pool)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 def init_db_safely(app):
     """
@@ -29,7 +31,9 @@ def init_db_safely(app):
 
         # Test the connection
         with app.app_context():
-            db.engine.connect()
+            db_manager.bind_writer(db.engine)
+            with db.engine.connect():
+                pass
 
         logging.info(f"Database initialized successfully in {mode} mode")
         return True
@@ -44,7 +48,8 @@ def test_db_connection(app):
     """
     try:
         with app.app_context():
-            db.engine.connect()
+            with db.engine.connect():
+                pass
         return True
     except Exception as e:
         logging.error(f"Database connection test failed: {str(e)}")
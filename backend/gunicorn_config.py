@@ -56,6 +56,12 @@ def pre_fork(server, worker):
 
 def post_fork(server, worker):
     """Called just after a worker has been forked"""
+    # Start the bcrypt pool before the worker's request threads exist
+    try:
+        from utils.password_hasher import password_hasher
+        password_hasher.start()
+    except Exception as e:
+        server.log.warning(f"Password pool not started in worker {worker.pid}: {e}")
     server.log.info(f"Worker {worker.pid} ready")
 
 def when_ready(server):
@@ -1,9 +1,32 @@
 """
 One-time data migration: Supabase (PostgreSQL) → SQLite
-Run this ONCE to copy your existing data for offline mode
+Run this ONCE to copy your existing data for offline mode (e.g. a new terminal)
+
+Each table is streamed from PostgreSQL in chunks through a server-side cursor,
+several tables at a time (--workers reader threads, one connection each). A
+single writer loads SQLite: once a table's stream has started, its local rows
+are cleared and its indexes dropped, every chunk is one bulk INSERT
+transaction, and afterwards the indexes are rebuilt (also when a load fails)
+and ANALYZE refreshes the query planner statistics. A table whose stream
+cannot start keeps its local rows; one failing midway is reported - run again.
+
+The copy replaces local rows, so it refuses to run while the change journal
+still holds unpushed changes to a table it would copy: sync first. Copied stock starts the sync's delta
+bases (sync_base) at the copied quantities.
+
+Usage:
+    python migrate_to_sqlite.py                    # master data (no bills)
+    python migrate_to_sqlite.py --bill-days 365    # + bills of the last year
+    python migrate_to_sqlite.py --all-bills        # + full bill history
+    python migrate_to_sqlite.py --workers 4 --chunk-size 5000
 """
 import os
 import sys
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -14,33 +37,23 @@ if sys.platform == 'win32':
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
     sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
 
-from sqlalchemy import create_engine, text
-from datetime import datetime
+from sqlalchemy import create_engine, event, inspect, text, select, func, MetaData, Table
+from sqlalchemy.exc import DBAPIError
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from database.type_converters import TypeConverter
+from services.change_journal import sync_base, sync_journal
+from services.sync_service import SYNC_TABLE_BY_NAME
+
 # Load environment variables from .env
 load_dotenv()
 
-print("\n" + "="*70)
-print("DATA MIGRATION: Supabase (PostgreSQL) → SQLite")
-print("="*70)
-
 # Database connections
 POSTGRES_URL = os.getenv('DB_URL')
 SQLITE_PATH = os.getenv('SQLITE_DB_PATH', os.path.expanduser('~/.mj-billing/local.db'))
 SQLITE_URL = f'sqlite:///{SQLITE_PATH}'
 
-if not POSTGRES_URL:
-    print("❌ Error: DB_URL not found in environment")
-    sys.exit(1)
-
-print(f"\n📍 Source: PostgreSQL (Supabase)")
-print(f"📍 Target: SQLite at {SQLITE_PATH}\n")
-
-# Create engines
-pg_engine = create_engine(POSTGRES_URL)
-sqlite_engine = create_engine(SQLITE_URL)
-
 # Tables to migrate (in dependency order)
 TABLES_TO_MIGRATE = [
     ('client_entry', 'client_id'),
@@ -51,95 +64,281 @@ TABLES_TO_MIGRATE = [
     ('permission_sections', 'section_id'),
     ('permissions', 'permission_id'),
     ('user_permissions', 'id'),
-    # Add bills if you want (could be large)
-    # ('gst_billing', 'bill_id'),
-    # ('non_gst_billing', 'bill_id'),
 ]
 
-def migrate_table(table_name, primary_key):
-    """Migrate a single table from PostgreSQL to SQLite"""
-    print(f"📦 Migrating {table_name}...", end=" ")
+# Bill history (--bill-days / --all-bills), filtered on created_at
+BILL_TABLES = [
+    ('gst_billing', 'bill_id'),
+    ('non_gst_billing', 'bill_id'),
+]
+
+# Copied with the bills: the cloud's dashboard rollup covers the full history,
+# so a --bill-days terminal does not rebuild it from its subset of bills
+ROLLUP_TABLES = [
+    ('sales_rollup', 'rollup_id'),
+]
+
+# Reader → writer hand-off: (table_name, columns, rows) messages; the first one
+# (rows []) says the stream is open, rows None = table done
+_DONE = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Copy PostgreSQL (Supabase) data into the local SQLite database")
+    bills = parser.add_mutually_exclusive_group()
+    bills.add_argument('--bill-days', type=int, help="Also copy bills created in the last N days")
+    bills.add_argument('--all-bills', action='store_true', help="Also copy the full bill history")
+    parser.add_argument('--workers', type=int, default=4, help="Tables read in parallel (default 4)")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="Rows per fetch / insert transaction (default 5000)")
+    return parser.parse_args()
+
+
+def create_engines(workers):
+    pg_engine = create_engine(POSTGRES_URL, pool_size=workers, max_overflow=0, pool_pre_ping=True)
+
+    os.makedirs(os.path.dirname(SQLITE_PATH) or '.', exist_ok=True)
+    sqlite_engine = create_engine(SQLITE_URL)
+
+    # Bulk load settings: the file is rebuilt from the cloud if the load is interrupted
+    @event.listens_for(sqlite_engine, "connect")
+    def set_sqlite_pragma(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return pg_engine, sqlite_engine
+
+
+def read_table(pg_engine, table_name, columns, since, chunk_size, out, stop):
+    """Stream one PostgreSQL table into the writer queue as converted chunks (until stop is set)"""
+    pg_table = Table(table_name, MetaData(), autoload_with=pg_engine)
+    pg_columns = [name for name in columns if name in pg_table.c and name != 'synced_at']
+    converter = TypeConverter.compile_to_sqlite(pg_columns, TypeConverter.column_types(pg_table))
+
+    stmt = select(*[pg_table.c[name] for name in pg_columns])
+    if since is not None:
+        stmt = stmt.where(pg_table.c.created_at >= since)
+
+    # Rows came from the cloud: mark them synced so the change journal does not queue them
+    synced_at = None
+    chunk_columns = list(pg_columns)
+    if 'synced_at' in columns:
+        synced_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+        chunk_columns.append('synced_at')
+
+    with pg_engine.connect() as pg_conn:
+        result = pg_conn.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+        out.put((table_name, chunk_columns, []))
+        for partition in result.partitions():
+            if stop.is_set():
+                return
+            rows = converter.convert_rows(partition)
+            if synced_at:
+                rows = [row + (synced_at,) for row in rows]
+            out.put((table_name, chunk_columns, rows))
+
+
+def prepare_table(sqlite_conn, table_name):
+    """Clear a local table and drop its indexes for the bulk load; returns the index DDL to rebuild"""
+    indexes = sqlite_conn.execute(text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"
+    ), {"table": table_name}).all()
+    for name, _ in indexes:
+        sqlite_conn.exec_driver_sql(f'DROP INDEX "{name}"')
+    sqlite_conn.exec_driver_sql(f"DELETE FROM {table_name}")
+    return [sql for _, sql in indexes]
+
+
+def pending_changes(sqlite_engine, table_names):
+    """{table: journal entries not pushed yet} of the tables about to be copied"""
+    if not inspect(sqlite_engine).has_table(sync_journal.name):
+        return {}
+    with sqlite_engine.connect() as sqlite_conn:
+        return dict(sqlite_conn.execute(
+            select(sync_journal.c.table_name, func.count())
+            .where(sync_journal.c.table_name.in_(list(table_names)))
+            .group_by(sync_journal.c.table_name)
+        ).all())
+
 
+def reset_bases(sqlite_conn, table_name):
+    """Copied rows equal the cloud ones: their delta columns start from the copied values"""
+    table = SYNC_TABLE_BY_NAME.get(table_name)
+    if table is None or not table.delta_columns:
+        return
+    sync_base.create(sqlite_conn, checkfirst=True)
+    sqlite_conn.execute(sync_base.delete().where(sync_base.c.table_name == table_name))
+    for name in table.delta_columns:
+        sqlite_conn.execute(text(f"""
+            INSERT INTO sync_base (table_name, row_key, column_name, value)
+            SELECT :table_name, {table.primary_key}, :column_name, {name} FROM {table_name}
+        """), {"table_name": table_name, "column_name": name})
+
+
+def write_chunk(sqlite_engine, table_name, columns, rows):
+    """Insert one chunk in a single transaction; a rejected chunk is retried row by row"""
+    query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
     try:
-        # Read from PostgreSQL
-        with pg_engine.connect() as pg_conn:
-            result = pg_conn.execute(text(f"SELECT * FROM {table_name}"))
-            rows = result.fetchall()
-            columns = result.keys()
-
-        if not rows:
-            print("⚠️  No data to migrate")
-            return 0
-
-        # Clear existing data in SQLite
-        with sqlite_engine.connect() as sqlite_conn:
-            sqlite_conn.execute(text(f"DELETE FROM {table_name}"))
-            sqlite_conn.commit()
-
-        # Insert into SQLite
-        migrated = 0
-        with sqlite_engine.connect() as sqlite_conn:
-            for row in rows:
-                # Build insert query
-                cols = ', '.join(columns)
-                placeholders = ', '.join([f':{col}' for col in columns])
-                query = f"INSERT INTO {table_name} ({cols}) VALUES ({placeholders})"
-
-                # Convert row to dict and handle type conversion
-                row_dict = {}
-                for col, val in zip(columns, row):
-                    if val is None:
-                        row_dict[col] = None
-                    elif hasattr(val, 'hex'):  # UUID object
-                        row_dict[col] = str(val)
-                    elif isinstance(val, dict) or isinstance(val, list):  # JSON
-                        import json
-                        row_dict[col] = json.dumps(val)
-                    else:
-                        # Convert Decimal to float for SQLite
-                        from decimal import Decimal
-                        if isinstance(val, Decimal):
-                            row_dict[col] = float(val)
-                        else:
-                            row_dict[col] = val
-
-                try:
-                    sqlite_conn.execute(text(query), row_dict)
-                    migrated += 1
-                except Exception as e:
-                    print(f"\n  ⚠️  Skipped 1 row: {str(e)[:80]}")
-                    continue
-
-            sqlite_conn.commit()
-
-        print(f"✅ {migrated} rows migrated")
-        return migrated
+        with sqlite_engine.begin() as sqlite_conn:
+            sqlite_conn.exec_driver_sql(query, rows)
+        return len(rows)
+    except DBAPIError:
+        pass
+
+    migrated = 0
+    with sqlite_engine.begin() as sqlite_conn:
+        for row in rows:
+            try:
+                sqlite_conn.exec_driver_sql(query, row)
+                migrated += 1
+            except DBAPIError as e:
+                print(f"\n  ⚠️  Skipped 1 {table_name} row: {str(e.orig)[:80]}")
+    return migrated
+
+
+def migrate(tables, workers, chunk_size):
+    """
+    Copy tables with parallel readers and one SQLite writer.
+
+    Args:
+        tables: (table_name, since) pairs - since limits rows to created_at >= since
+
+    Returns:
+        list: (table_name, rows migrated or None on error, seconds), or None
+              if unpushed local changes would be overwritten
+    """
+    pg_engine, sqlite_engine = create_engines(workers)
+
+    local = inspect(sqlite_engine)
+    plan = []
+    for table_name, table_since in tables:
+        if not local.has_table(table_name):
+            print(f"⚠️  {table_name}: not in the SQLite database - start the app once to create the schema")
+            continue
+        columns = [column['name'] for column in local.get_columns(table_name)]
+        plan.append((table_name, columns, table_since))
+
+    pending = pending_changes(sqlite_engine, [table_name for table_name, _, _ in plan])
+    if pending:
+        print("❌ Local changes not synced yet - copying would overwrite them:")
+        for table_name, count in pending.items():
+            print(f"   {table_name:25} {count:>8} pending")
+        print("   Run a sync with the cloud reachable first, then migrate again.")
+        return None
+
+    chunks = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    failed = {}
+    started = {table_name: time.monotonic() for table_name, _, _ in plan}
+
+    def reader(table_name, columns, table_since):
+        try:
+            read_table(pg_engine, table_name, columns, table_since, chunk_size, chunks, stop)
+        except Exception as e:
+            failed[table_name] = e
+        finally:
+            chunks.put((table_name, None, _DONE))
+
+    # One PostgreSQL connection per reader; the queue bound keeps memory flat
+    executor = ThreadPoolExecutor(max_workers=workers)
+    for item in plan:
+        executor.submit(reader, *item)
+
+    index_sql = {}
+    counts = {table_name: 0 for table_name, _, _ in plan}
+    finished = {}
+    try:
+        while len(finished) < len(plan):
+            table_name, columns, rows = chunks.get()
+            if rows is _DONE:
+                finished[table_name] = time.monotonic() - started[table_name]
+                status = f"❌ {failed[table_name]}" if table_name in failed else f"✅ {counts[table_name]} rows"
+                print(f"📦 {table_name:25} {status}")
+                continue
+            if table_name not in index_sql:
+                # The cloud stream is open: only now is the local copy replaced
+                with sqlite_engine.begin() as sqlite_conn:
+                    index_sql[table_name] = prepare_table(sqlite_conn, table_name)
+            if rows:
+                counts[table_name] += write_chunk(sqlite_engine, table_name, columns, rows)
+    finally:
+        if len(finished) < len(plan):
+            # The writer failed: stop the readers and let them finish
+            stop.set()
+            while len(finished) < len(plan):
+                table_name, _, rows = chunks.get()
+                if rows is _DONE:
+                    failed.setdefault(table_name, RuntimeError("load interrupted"))
+                    finished[table_name] = time.monotonic() - started[table_name]
+        executor.shutdown()
+
+        print("\n🔧 Rebuilding indexes and statistics...")
+        with sqlite_engine.begin() as sqlite_conn:
+            for table_name, statements in index_sql.items():
+                for sql in statements:
+                    sqlite_conn.exec_driver_sql(sql)
+                if table_name not in failed:
+                    reset_bases(sqlite_conn, table_name)
+            sqlite_conn.exec_driver_sql("ANALYZE")
+
+    return [
+        (table_name, None if table_name in failed else counts[table_name], finished[table_name])
+        for table_name, _, _ in plan
+    ]
 
-    except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        return 0
 
 def main():
     """Run the migration"""
-    print("⚙️  Starting migration...\n")
+    args = parse_args()
 
-    total_migrated = 0
-    results = []
+    print("\n" + "="*70)
+    print("DATA MIGRATION: Supabase (PostgreSQL) → SQLite")
+    print("="*70)
 
-    for table_name, primary_key in TABLES_TO_MIGRATE:
-        count = migrate_table(table_name, primary_key)
-        total_migrated += count
-        results.append((table_name, count))
+    if not POSTGRES_URL:
+        print("❌ Error: DB_URL not found in environment")
+        sys.exit(1)
+
+    print(f"\n📍 Source: PostgreSQL (Supabase)")
+    print(f"📍 Target: SQLite at {SQLITE_PATH}")
+
+    tables = [(table_name, None) for table_name, _ in TABLES_TO_MIGRATE]
+    if args.all_bills:
+        tables += [(table_name, None) for table_name, _ in BILL_TABLES]
+        print("📍 Bills: full history")
+    elif args.bill_days:
+        since = datetime.utcnow() - timedelta(days=args.bill_days)
+        tables += [(table_name, since) for table_name, _ in BILL_TABLES]
+        print(f"📍 Bills: created since {since:%Y-%m-%d}")
+    else:
+        print("📍 Bills: not copied (use --bill-days N or --all-bills)")
+    if args.all_bills or args.bill_days:
+        tables += [(table_name, None) for table_name, _ in ROLLUP_TABLES]
+
+    print(f"\n⚙️  Starting migration ({args.workers} workers, {args.chunk_size} rows per chunk)...\n")
+    started = time.monotonic()
+    results = migrate(tables, args.workers, args.chunk_size)
+    if results is None:
+        sys.exit(1)
+    elapsed = time.monotonic() - started
 
     print("\n" + "="*70)
     print("MIGRATION SUMMARY")
     print("="*70)
 
-    for table_name, count in results:
+    total_migrated = 0
+    for table_name, count, seconds in results:
+        if count is None:
+            print(f"❌ {table_name:25} {'failed':>8}")
+            continue
+        total_migrated += count
         status = "✅" if count > 0 else "⚠️ "
-        print(f"{status} {table_name:25} {count:>6} rows")
+        print(f"{status} {table_name:25} {count:>8} rows  {seconds:6.1f}s")
 
-    print(f"\n📊 Total: {total_migrated} rows migrated")
+    print(f"\n📊 Total: {total_migrated} rows migrated in {elapsed:.1f}s")
 
     print("\n" + "="*70)
     print("✅ MIGRATION COMPLETE!")
@@ -0,0 +1,21 @@
+-- Bill number counters (one row per client, advanced per bill or per block)
+-- Used by utils/bill_number_helper.py (same table is created by db.create_all() in offline mode)
+
+CREATE TABLE IF NOT EXISTS bill_number_counters (
+    client_id UUID PRIMARY KEY REFERENCES client_entry(client_id) ON DELETE CASCADE,
+    current_gst_bill_number INTEGER NOT NULL DEFAULT 0,
+    current_non_gst_bill_number INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Seed counters from existing bills so numbering continues where it left off
+INSERT INTO bill_number_counters (client_id, current_gst_bill_number, current_non_gst_bill_number)
+SELECT c.client_id,
+       COALESCE((SELECT MAX(bill_number) FROM gst_billing g WHERE g.client_id = c.client_id), 0),
+       COALESCE((SELECT MAX(bill_number) FROM non_gst_billing n WHERE n.client_id = c.client_id), 0)
+FROM client_entry c
+ON CONFLICT (client_id) DO UPDATE SET
+    current_gst_bill_number = GREATEST(bill_number_counters.current_gst_bill_number, EXCLUDED.current_gst_bill_number),
+    current_non_gst_bill_number = GREATEST(bill_number_counters.current_non_gst_bill_number, EXCLUDED.current_non_gst_bill_number);
+
+SELECT 'bill_number_counters ready' as status;
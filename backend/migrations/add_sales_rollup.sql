@@ -0,0 +1,28 @@
+-- Pre-aggregated sales for the analytics dashboard
+-- Maintained by utils/sales_rollup.py (same table is created by db.create_all() in offline mode)
+-- Existing bills are rolled up lazily per client on the first dashboard request;
+-- bills pushed by the offline sync update it in the same transaction
+
+CREATE TABLE IF NOT EXISTS sales_rollup (
+    rollup_id SERIAL PRIMARY KEY,
+    client_id UUID NOT NULL REFERENCES client_entry(client_id) ON DELETE CASCADE,
+    sale_date DATE NOT NULL,
+    sale_hour INTEGER NOT NULL DEFAULT -1,
+    created_by VARCHAR(36) NOT NULL DEFAULT '',
+    bill_type VARCHAR(10) NOT NULL,
+    dimension VARCHAR(20) NOT NULL,
+    dimension_key VARCHAR(255) NOT NULL DEFAULT '',
+    category VARCHAR(100) NOT NULL DEFAULT '',
+    bill_count INTEGER NOT NULL DEFAULT 0,
+    quantity DOUBLE PRECISION NOT NULL DEFAULT 0,
+    revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_sales_rollup_key UNIQUE (client_id, sale_date, sale_hour, created_by, bill_type, dimension, dimension_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sales_rollup_client_dim_date ON sales_rollup (client_id, dimension, sale_date);
+
+-- Tables created with NUMERIC(10, 2): a busy client's totals outgrow 99,999,999.99
+ALTER TABLE sales_rollup ALTER COLUMN revenue TYPE NUMERIC(14, 2);
+
+SELECT 'sales_rollup ready' as status;
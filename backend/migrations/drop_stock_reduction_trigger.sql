@@ -0,0 +1,13 @@
+-- Drop the PostgreSQL stock reduction trigger
+-- Stock is now reserved by the backend in a single conditional UPDATE
+-- (utils/stock_helpers.reserve_stock), identically on PostgreSQL and SQLite.
+-- Keeping the trigger would decrement stock twice for every bill.
+
+DROP TRIGGER IF EXISTS trigger_reduce_stock_gst_billing ON gst_billing;
+DROP TRIGGER IF EXISTS trigger_reduce_stock_non_gst_billing ON non_gst_billing;
+DROP TRIGGER IF EXISTS trigger_reduce_stock_gst ON gst_billing;
+DROP TRIGGER IF EXISTS trigger_reduce_stock_non_gst ON non_gst_billing;
+DROP FUNCTION IF EXISTS reduce_stock_on_billing() CASCADE;
+
+-- Verify no stock triggers remain
+SELECT 'Stock reduction trigger dropped' as status;
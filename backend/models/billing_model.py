@@ -120,3 +120,21 @@ class NonGSTBilling(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'type': 'non_gst'
         }
+
+
+class BillNumberCounter(db.Model):
+    """Per-client bill number counters (advanced by utils.bill_number_helper)"""
+    __tablename__ = 'bill_number_counters'
+
+    client_id = db.Column(FlexibleUUID, db.ForeignKey('client_entry.client_id'), primary_key=True)
+    current_gst_bill_number = db.Column(db.Integer, nullable=False, default=0)
+    current_non_gst_bill_number = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'client_id': str(self.client_id) if self.client_id else None,
+            'current_gst_bill_number': self.current_gst_bill_number,
+            'current_non_gst_bill_number': self.current_non_gst_bill_number,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
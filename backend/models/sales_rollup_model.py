@@ -0,0 +1,56 @@
+from extensions import db
+from database.flexible_types import FlexibleUUID, FlexibleNumeric
+from datetime import datetime
+
+
+class SalesRollup(db.Model):
+    """
+    Pre-aggregated sales per client/day/hour/creator/bill type, maintained by
+    utils.sales_rollup in the same transaction as bill create/update/cancel/exchange
+    (and as the offline sync pushing bills to the cloud).
+
+    dimension:
+    - 'bill':     one row per hour, dimension_key = ''
+    - 'product':  daily, dimension_key = product name, category kept on the row
+    - 'payment':  daily, dimension_key = payment method (name or payment_type_id)
+    - 'customer': daily, dimension_key = customer name
+    Daily dimensions store sale_hour = -1.
+    """
+    __tablename__ = 'sales_rollup'
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            'client_id', 'sale_date', 'sale_hour', 'created_by', 'bill_type', 'dimension', 'dimension_key',
+            name='uq_sales_rollup_key'
+        ),
+        db.Index('idx_sales_rollup_client_dim_date', 'client_id', 'dimension', 'sale_date'),
+    )
+
+    rollup_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    client_id = db.Column(FlexibleUUID, db.ForeignKey('client_entry.client_id'), nullable=False)
+    sale_date = db.Column(db.Date, nullable=False)
+    sale_hour = db.Column(db.Integer, nullable=False, default=-1)
+    created_by = db.Column(db.String(36), nullable=False, default='')  # '' when bill has no creator
+    bill_type = db.Column(db.String(10), nullable=False)  # 'gst' or 'non_gst'
+    dimension = db.Column(db.String(20), nullable=False)
+    dimension_key = db.Column(db.String(255), nullable=False, default='')
+    category = db.Column(db.String(100), nullable=False, default='')
+    bill_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    revenue = db.Column(FlexibleNumeric, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'client_id': str(self.client_id) if self.client_id else None,
+            'sale_date': self.sale_date.isoformat() if self.sale_date else None,
+            'sale_hour': self.sale_hour,
+            'created_by': self.created_by or None,
+            'bill_type': self.bill_type,
+            'dimension': self.dimension,
+            'dimension_key': self.dimension_key,
+            'category': self.category,
+            'bill_count': self.bill_count,
+            'quantity': self.quantity,
+            'revenue': float(self.revenue) if self.revenue else 0
+        }
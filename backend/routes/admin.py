@@ -4,14 +4,18 @@ from models.user_model import User
 from models.client_model import ClientEntry
 from models.permission_model import Permission, UserPermission, has_permission, get_user_permissions
 from models.audit_model import AuditLog
-from models.billing_model import GSTBilling, NonGSTBilling
+from models.billing_model import GSTBilling, NonGSTBilling, BillNumberCounter
+from models.sales_rollup_model import SalesRollup
 from models.stock_model import StockEntry
 from models.customer_model import Customer
 from models.payment_model import PaymentType
 from models.report_model import Report
 from utils.auth_middleware import authenticate
 from utils.permission_middleware import require_super_admin, require_permission
-import bcrypt
+from utils.session_cache import invalidate_user_sessions, invalidate_client_sessions
+from utils.token_cache import revoke_user_tokens, revoke_client_tokens
+from utils.password_hasher import password_hasher
+from utils.audit_logger import log_action
 from datetime import datetime
 import uuid
 from sqlalchemy import or_, and_, func
@@ -22,24 +26,8 @@ admin_bp = Blueprint('admin', __name__)
 
 # Helper function to log admin actions
 def log_admin_action(action_type, table_name='users', record_id=None, old_data=None, new_data=None):
-    """Log admin actions for audit trail"""
-    try:
-        audit_log = AuditLog(
-            log_id=str(uuid.uuid4()),
-            user_id=g.user['user_id'],
-            client_id=g.user['client_id'],
-            action_type=action_type,
-            table_name=table_name,
-            record_id=record_id,
-            old_data=old_data,
-            new_data=new_data,
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get('User-Agent', '')
-        )
-        db.session.add(audit_log)
-        db.session.commit()
-    except Exception as e:
-        print(f"Error logging admin action: {e}")
+    """Log admin actions for audit trail (written by the background audit writer)"""
+    log_action(action_type, table_name, record_id, old_data, new_data)
 
 @admin_bp.route('/users', methods=['GET'])
 @authenticate
@@ -211,7 +199,7 @@ def create_user():
             return jsonify({'error': 'User with this email already exists'}), 400
 
         # Hash password
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = password_hasher.hash(password)
 
         # Create new user
         new_user = User(
@@ -325,6 +313,7 @@ def update_user(user_id):
         user.updated_by = g.user['user_id']
 
         db.session.commit()
+        invalidate_user_sessions(user_id)
 
         # Log the action
         log_admin_action(
@@ -360,6 +349,8 @@ def delete_user(user_id):
         user.updated_by = g.user['user_id']
 
         db.session.commit()
+        invalidate_user_sessions(user_id)
+        revoke_user_tokens(user_id)
 
         # Log the action
         log_admin_action(
@@ -399,12 +390,13 @@ def reset_user_password(user_id):
             ))
 
         # Hash new password
-        password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = password_hasher.hash(new_password)
         user.password_hash = password_hash
         user.updated_at = datetime.utcnow()
         user.updated_by = g.user['user_id']
 
         db.session.commit()
+        invalidate_user_sessions(user_id)
 
         # Log the action
         log_admin_action(
@@ -448,6 +440,8 @@ def toggle_user_status(user_id):
         user.updated_by = g.user['user_id']
 
         db.session.commit()
+        invalidate_user_sessions(user_id)
+        revoke_user_tokens(user_id)
 
         # Log the action
         log_admin_action(
@@ -520,6 +514,7 @@ def toggle_super_admin(user_id):
                     db.session.add(user_permission)
 
         db.session.commit()
+        invalidate_user_sessions(user_id)
 
         # Log the action
         log_admin_action(
@@ -643,6 +638,9 @@ def bulk_user_operations():
             return jsonify({'error': 'Invalid operation'}), 400
 
         db.session.commit()
+        invalidate_user_sessions(*user_ids)
+        if operation in ('deactivate', 'delete'):
+            revoke_user_tokens(*user_ids)
 
         # Log the bulk action
         log_admin_action(
@@ -1244,7 +1242,7 @@ def create_client():
         db.session.flush()  # Get the client_id before creating user
 
         # Hash password for user
-        password_hash = bcrypt.hashpw(user_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = password_hasher.hash(user_password)
 
         # Create admin user for this client
         new_user = User(
@@ -1368,6 +1366,7 @@ def update_client(client_id):
             client.is_active = data['is_active']
 
         db.session.commit()
+        invalidate_client_sessions(client_id)
 
         # Log the action
         log_admin_action(
@@ -1401,6 +1400,8 @@ def toggle_client_status(client_id):
             User.query.filter_by(client_id=client_id).update({'is_active': False})
 
         db.session.commit()
+        invalidate_client_sessions(client_id)
+        revoke_client_tokens(client_id)
 
         # Log the action
         log_admin_action(
@@ -1458,6 +1459,8 @@ def delete_client(client_id):
         # 3. Delete bills (both GST and Non-GST)
         GSTBilling.query.filter_by(client_id=client_id).delete()
         NonGSTBilling.query.filter_by(client_id=client_id).delete()
+        SalesRollup.query.filter_by(client_id=client_id).delete()
+        BillNumberCounter.query.filter_by(client_id=client_id).delete()
 
         # 4. Delete stock entries
         StockEntry.query.filter_by(client_id=client_id).delete()
@@ -1512,6 +1515,8 @@ def delete_client(client_id):
 
         # Commit all deletions
         db.session.commit()
+        invalidate_client_sessions(client_id)
+        revoke_client_tokens(client_id)
 
         return jsonify({
             'message': f"Client '{client_name}' and all associated data deleted successfully",
@@ -1,11 +1,13 @@
 from flask import Blueprint, jsonify, g, request
 from extensions import db
-from models.billing_model import GSTBilling, NonGSTBilling
+from models.sales_rollup_model import SalesRollup
 from models.stock_model import StockEntry
 from models.payment_model import PaymentType
 from utils.auth_middleware import authenticate
-from utils.cache_helper import get_cache_manager
-from sqlalchemy import func, desc
+from utils.permission_bits import user_has_permission
+from utils.cache_helper import get_cache_manager, cache_tags
+from utils.sales_rollup import ensure_sales_rollup
+from sqlalchemy import func, desc, case, and_, or_
 from datetime import datetime, timedelta
 from collections import defaultdict
 
@@ -37,9 +39,7 @@ def get_dashboard_analytics():
         time_range = request.args.get('range', 'today')
 
         # Check user permissions for filtering
-        user_permissions = g.user.get('permissions', [])
-        is_super_admin = g.user.get('is_super_admin', False)
-        has_view_all = is_super_admin or 'view_all_bills' in user_permissions
+        has_view_all = user_has_permission(g.user, 'view_all_bills')
 
         # Try to get from cache first - include user context in cache key
         cache = get_cache_manager()
@@ -64,119 +64,53 @@ def get_dashboard_analytics():
         month_start = now - timedelta(days=30)
         prev_month_start = now - timedelta(days=60)
 
-        # ==================== SQL AGGREGATIONS (N+1 FIX) ====================
-        # Revenue calculations using SQL instead of loading all records
+        # ==================== ROLLUP AGGREGATIONS ====================
+        # All figures come from the pre-aggregated sales_rollup table (maintained
+        # with every bill write) instead of scanning bills and their items JSON.
+        # Bill windows are hour-granular, product/payment/customer windows day-granular.
         # SECURITY: Apply user-level filtering for view_own_bills permission
+        ensure_sales_rollup(client_id)
 
-        # Today's revenue - GST
-        gst_today_query = db.session.query(func.coalesce(func.sum(GSTBilling.final_amount), 0)).filter(
-            GSTBilling.client_id == client_id,
-            GSTBilling.created_at >= today_start
-        )
+        rollup_filters = [SalesRollup.client_id == client_id]
         if not has_view_all:
-            gst_today_query = gst_today_query.filter(GSTBilling.created_by == user_id)
-        gst_today = gst_today_query.scalar() or 0
-
-        # Today's revenue - Non-GST
-        non_gst_today_query = db.session.query(func.coalesce(func.sum(NonGSTBilling.total_amount), 0)).filter(
-            NonGSTBilling.client_id == client_id,
-            NonGSTBilling.created_at >= today_start
-        )
-        if not has_view_all:
-            non_gst_today_query = non_gst_today_query.filter(NonGSTBilling.created_by == user_id)
-        non_gst_today = non_gst_today_query.scalar() or 0
-
-        revenue_today = float(gst_today) + float(non_gst_today)
-
-        # Week's revenue
-        gst_week_query = db.session.query(func.coalesce(func.sum(GSTBilling.final_amount), 0)).filter(
-            GSTBilling.client_id == client_id,
-            GSTBilling.created_at >= week_start
-        )
-        if not has_view_all:
-            gst_week_query = gst_week_query.filter(GSTBilling.created_by == user_id)
-        gst_week = gst_week_query.scalar() or 0
-
-        non_gst_week_query = db.session.query(func.coalesce(func.sum(NonGSTBilling.total_amount), 0)).filter(
-            NonGSTBilling.client_id == client_id,
-            NonGSTBilling.created_at >= week_start
-        )
-        if not has_view_all:
-            non_gst_week_query = non_gst_week_query.filter(NonGSTBilling.created_by == user_id)
-        non_gst_week = non_gst_week_query.scalar() or 0
-
-        revenue_week = float(gst_week) + float(non_gst_week)
-
-        # Month's revenue
-        gst_month_query = db.session.query(func.coalesce(func.sum(GSTBilling.final_amount), 0)).filter(
-            GSTBilling.client_id == client_id,
-            GSTBilling.created_at >= month_start
-        )
-        if not has_view_all:
-            gst_month_query = gst_month_query.filter(GSTBilling.created_by == user_id)
-        gst_month = gst_month_query.scalar() or 0
-
-        non_gst_month_query = db.session.query(func.coalesce(func.sum(NonGSTBilling.total_amount), 0)).filter(
-            NonGSTBilling.client_id == client_id,
-            NonGSTBilling.created_at >= month_start
-        )
-        if not has_view_all:
-            non_gst_month_query = non_gst_month_query.filter(NonGSTBilling.created_by == user_id)
-        non_gst_month = non_gst_month_query.scalar() or 0
-
-        revenue_month = float(gst_month) + float(non_gst_month)
-
-        # Previous month's revenue (for growth calculation)
-        gst_prev_month_query = db.session.query(func.coalesce(func.sum(GSTBilling.final_amount), 0)).filter(
-            GSTBilling.client_id == client_id,
-            GSTBilling.created_at >= prev_month_start,
-            GSTBilling.created_at < month_start
-        )
-        if not has_view_all:
-            gst_prev_month_query = gst_prev_month_query.filter(GSTBilling.created_by == user_id)
-        gst_prev_month = gst_prev_month_query.scalar() or 0
-
-        non_gst_prev_month_query = db.session.query(func.coalesce(func.sum(NonGSTBilling.total_amount), 0)).filter(
-            NonGSTBilling.client_id == client_id,
-            NonGSTBilling.created_at >= prev_month_start,
-            NonGSTBilling.created_at < month_start
-        )
-        if not has_view_all:
-            non_gst_prev_month_query = non_gst_prev_month_query.filter(NonGSTBilling.created_by == user_id)
-        non_gst_prev_month = non_gst_prev_month_query.scalar() or 0
-
-        revenue_prev_month = float(gst_prev_month) + float(non_gst_prev_month)
-
-        # Bill counts using SQL
-        total_gst_bills_query = db.session.query(func.count(GSTBilling.bill_id)).filter(
-            GSTBilling.client_id == client_id
-        )
-        if not has_view_all:
-            total_gst_bills_query = total_gst_bills_query.filter(GSTBilling.created_by == user_id)
-        total_gst_bills = total_gst_bills_query.scalar() or 0
+            rollup_filters.append(SalesRollup.created_by == str(user_id))
+
+        def since_hour(ts):
+            return or_(
+                SalesRollup.sale_date > ts.date(),
+                and_(SalesRollup.sale_date == ts.date(), SalesRollup.sale_hour >= ts.hour)
+            )
+
+        def sum_if(condition, column):
+            return func.coalesce(func.sum(case((condition, column), else_=0)), 0)
+
+        # Revenue windows and bill counts per bill type in a single pass
+        bill_totals = {
+            row.bill_type: row
+            for row in db.session.query(
+                SalesRollup.bill_type,
+                func.coalesce(func.sum(SalesRollup.bill_count), 0).label('total_count'),
+                sum_if(since_hour(today_start), SalesRollup.bill_count).label('today_count'),
+                sum_if(since_hour(today_start), SalesRollup.revenue).label('today'),
+                sum_if(since_hour(week_start), SalesRollup.revenue).label('week'),
+                sum_if(since_hour(month_start), SalesRollup.revenue).label('month'),
+                sum_if(and_(since_hour(prev_month_start), ~since_hour(month_start)), SalesRollup.revenue).label('prev_month')
+            ).filter(*rollup_filters, SalesRollup.dimension == 'bill').group_by(SalesRollup.bill_type).all()
+        }
 
-        total_non_gst_bills_query = db.session.query(func.count(NonGSTBilling.bill_id)).filter(
-            NonGSTBilling.client_id == client_id
-        )
-        if not has_view_all:
-            total_non_gst_bills_query = total_non_gst_bills_query.filter(NonGSTBilling.created_by == user_id)
-        total_non_gst_bills = total_non_gst_bills_query.scalar() or 0
+        def bill_total(bill_type, field):
+            row = bill_totals.get(bill_type)
+            return getattr(row, field) if row is not None else 0
 
-        today_gst_count_query = db.session.query(func.count(GSTBilling.bill_id)).filter(
-            GSTBilling.client_id == client_id,
-            GSTBilling.created_at >= today_start
-        )
-        if not has_view_all:
-            today_gst_count_query = today_gst_count_query.filter(GSTBilling.created_by == user_id)
-        today_gst_count = today_gst_count_query.scalar() or 0
+        revenue_today = float(bill_total('gst', 'today')) + float(bill_total('non_gst', 'today'))
+        revenue_week = float(bill_total('gst', 'week')) + float(bill_total('non_gst', 'week'))
+        revenue_month = float(bill_total('gst', 'month')) + float(bill_total('non_gst', 'month'))
+        revenue_prev_month = float(bill_total('gst', 'prev_month')) + float(bill_total('non_gst', 'prev_month'))
 
-        today_non_gst_count_query = db.session.query(func.count(NonGSTBilling.bill_id)).filter(
-            NonGSTBilling.client_id == client_id,
-            NonGSTBilling.created_at >= today_start
-        )
-        if not has_view_all:
-            today_non_gst_count_query = today_non_gst_count_query.filter(NonGSTBilling.created_by == user_id)
-        today_non_gst_count = today_non_gst_count_query.scalar() or 0
+        total_gst_bills = int(bill_total('gst', 'total_count'))
+        total_non_gst_bills = int(bill_total('non_gst', 'total_count'))
+        today_gst_count = int(bill_total('gst', 'today_count'))
+        today_non_gst_count = int(bill_total('non_gst', 'today_count'))
 
         # Calculate growth rate
         growth_rate = 0
@@ -187,81 +121,45 @@ def get_dashboard_analytics():
         total_bills = total_gst_bills + total_non_gst_bills
         avg_bill_value = (revenue_month / total_bills) if total_bills > 0 else 0
 
-        # ==================== LOAD ONLY RECENT BILLS FOR PRODUCT ANALYSIS ====================
-        # Only load bills from start_date for product analysis (not ALL historical bills)
-        gst_bills_query = GSTBilling.query.filter(
-            GSTBilling.client_id == client_id,
-            GSTBilling.created_at >= prev_month_start  # Only last 60 days max for product analysis
-        )
-        if not has_view_all:
-            gst_bills_query = gst_bills_query.filter(GSTBilling.created_by == user_id)
-        gst_bills = gst_bills_query.all()
-
-        non_gst_bills_query = NonGSTBilling.query.filter(
-            NonGSTBilling.client_id == client_id,
-            NonGSTBilling.created_at >= prev_month_start  # Only last 60 days max
-        )
-        if not has_view_all:
-            non_gst_bills_query = non_gst_bills_query.filter(NonGSTBilling.created_by == user_id)
-        non_gst_bills = non_gst_bills_query.all()
-
-        # Product performance analysis (ALL TIME)
-        product_sales = defaultdict(lambda: {'quantity': 0, 'revenue': 0.0, 'category': '', 'recent_sales': 0, 'old_sales': 0})
+        # ==================== PRODUCT ANALYSIS (LAST 60 DAYS) ====================
+        trend_old_start = (week_start - timedelta(days=7)).date()
+        product_rows = db.session.query(
+            SalesRollup.dimension_key,
+            func.max(SalesRollup.category).label('category'),
+            func.sum(SalesRollup.quantity).label('quantity'),
+            func.sum(SalesRollup.revenue).label('revenue'),
+            sum_if(SalesRollup.sale_date >= start_date.date(), SalesRollup.quantity).label('filtered_quantity'),
+            sum_if(SalesRollup.sale_date >= start_date.date(), SalesRollup.revenue).label('filtered_revenue'),
+            sum_if(SalesRollup.sale_date >= week_start.date(), SalesRollup.quantity).label('recent_sales'),
+            sum_if(and_(SalesRollup.sale_date >= trend_old_start, SalesRollup.sale_date < week_start.date()),
+                   SalesRollup.quantity).label('old_sales')
+        ).filter(
+            *rollup_filters,
+            SalesRollup.dimension == 'product',
+            SalesRollup.sale_date >= prev_month_start.date()
+        ).group_by(SalesRollup.dimension_key).all()
+
+        # Product performance analysis (last 60 days)
+        product_sales = {}
 
         # Product performance for selected time range
-        product_sales_filtered = defaultdict(lambda: {'quantity': 0, 'revenue': 0.0, 'category': ''})
-
-        # Analyze GST bills
-        for bill in gst_bills:
-            bill_amount = float(bill.final_amount) if bill.final_amount else 0
-            items = bill.items if isinstance(bill.items, list) else []
-
-            for item in items:
-                product_name = item.get('product_name', 'Unknown')
-                quantity = item.get('quantity', 0)
-                rate = float(item.get('rate', 0))
-                category = item.get('category', 'Other')
-
-                product_sales[product_name]['quantity'] += quantity
-                product_sales[product_name]['revenue'] += quantity * rate
-                product_sales[product_name]['category'] = category
-
-                # Track for filtered time range
-                if bill.created_at >= start_date:
-                    product_sales_filtered[product_name]['quantity'] += quantity
-                    product_sales_filtered[product_name]['revenue'] += quantity * rate
-                    product_sales_filtered[product_name]['category'] = category
-
-                # Track recent vs old sales for trending
-                if bill.created_at >= week_start:
-                    product_sales[product_name]['recent_sales'] += quantity
-                elif bill.created_at >= (week_start - timedelta(days=7)):
-                    product_sales[product_name]['old_sales'] += quantity
-
-        # Analyze Non-GST bills
-        for bill in non_gst_bills:
-            items = bill.items if isinstance(bill.items, list) else []
-
-            for item in items:
-                product_name = item.get('product_name', 'Unknown')
-                quantity = item.get('quantity', 0)
-                rate = float(item.get('rate', 0))
-                category = item.get('category', 'Other')
-
-                product_sales[product_name]['quantity'] += quantity
-                product_sales[product_name]['revenue'] += quantity * rate
-                product_sales[product_name]['category'] = category
-
-                # Track for filtered time range
-                if bill.created_at >= start_date:
-                    product_sales_filtered[product_name]['quantity'] += quantity
-                    product_sales_filtered[product_name]['revenue'] += quantity * rate
-                    product_sales_filtered[product_name]['category'] = category
-
-                if bill.created_at >= week_start:
-                    product_sales[product_name]['recent_sales'] += quantity
-                elif bill.created_at >= (week_start - timedelta(days=7)):
-                    product_sales[product_name]['old_sales'] += quantity
+        product_sales_filtered = {}
+
+        for row in product_rows:
+            category = row.category or 'Other'
+            product_sales[row.dimension_key] = {
+                'quantity': float(row.quantity or 0),
+                'revenue': float(row.revenue or 0),
+                'category': category,
+                'recent_sales': float(row.recent_sales or 0),
+                'old_sales': float(row.old_sales or 0)
+            }
+            if row.filtered_quantity or row.filtered_revenue:
+                product_sales_filtered[row.dimension_key] = {
+                    'quantity': float(row.filtered_quantity or 0),
+                    'revenue': float(row.filtered_revenue or 0),
+                    'category': category
+                }
 
         # Sort products by quantity sold
         sorted_products = sorted(product_sales.items(), key=lambda x: x[1]['quantity'], reverse=True)
@@ -319,8 +217,10 @@ def get_dashboard_analytics():
         ]
 
         # Product performance tiers (for column chart with product names)
-        # Get all products from stock
-        all_stock_products = StockEntry.query.filter_by(client_id=client_id).all()
+        # Load stock once: names for non-selling products, cost prices for profit margin
+        all_stock_products = db.session.query(
+            StockEntry.product_name, StockEntry.cost_price, StockEntry.rate
+        ).filter(StockEntry.client_id == client_id).all()
         stock_product_names = {item.product_name for item in all_stock_products}
 
         # Categorize products by performance
@@ -386,133 +286,104 @@ def get_dashboard_analytics():
         ]
 
         # Payment preferences
-        payment_stats = defaultdict(lambda: {'count': 0, 'amount': 0.0})
-
-        for bill in gst_bills:
-            payment_id = str(bill.payment_type) if bill.payment_type else 'Unknown'
-            payment_stats[payment_id]['count'] += 1
-            payment_stats[payment_id]['amount'] += float(bill.final_amount)
-
-        for bill in non_gst_bills:
-            payment_id = str(bill.payment_type) if bill.payment_type else 'Unknown'
-            payment_stats[payment_id]['count'] += 1
-            payment_stats[payment_id]['amount'] += float(bill.total_amount)
-
-        # Get payment type names
+        payment_rows = db.session.query(
+            SalesRollup.dimension_key,
+            func.sum(SalesRollup.bill_count).label('count'),
+            func.sum(SalesRollup.revenue).label('amount')
+        ).filter(
+            *rollup_filters,
+            SalesRollup.dimension == 'payment',
+            SalesRollup.sale_date >= prev_month_start.date()
+        ).group_by(SalesRollup.dimension_key).order_by(desc('amount')).all()
+
+        # Get payment type names (older bills store the payment_type_id)
         payment_types = {str(pt.payment_type_id): pt.payment_name for pt in PaymentType.query.filter_by(client_id=client_id).all()}
 
         payment_preferences = [
             {
-                'method': payment_types.get(payment_id, 'Unknown' if payment_id == 'Unknown' else f'Payment {payment_id[:8]}...'),
-                'count': data['count'],
-                'amount': data['amount']
+                'method': payment_types.get(row.dimension_key, row.dimension_key),
+                'count': int(row.count or 0),
+                'amount': float(row.amount or 0)
             }
-            for payment_id, data in sorted(payment_stats.items(), key=lambda x: x[1]['amount'], reverse=True)
+            for row in payment_rows
         ]
 
         # Peak hours analysis - REAL DATA
-        peak_hours_data = defaultdict(lambda: {'sales': 0.0, 'count': 0})
-
-        for bill in gst_bills:
-            hour = bill.created_at.hour
-            peak_hours_data[hour]['sales'] += float(bill.final_amount)
-            peak_hours_data[hour]['count'] += 1
-
-        for bill in non_gst_bills:
-            hour = bill.created_at.hour
-            peak_hours_data[hour]['sales'] += float(bill.total_amount)
-            peak_hours_data[hour]['count'] += 1
+        peak_hour_rows = db.session.query(
+            SalesRollup.sale_hour,
+            func.sum(SalesRollup.revenue).label('sales'),
+            func.sum(SalesRollup.bill_count).label('count')
+        ).filter(
+            *rollup_filters,
+            SalesRollup.dimension == 'bill',
+            since_hour(prev_month_start)
+        ).group_by(SalesRollup.sale_hour).order_by(SalesRollup.sale_hour).all()
 
         peak_hours = [
             {
-                'hour': hour,
-                'sales': round(peak_hours_data[hour]['sales'], 2),
-                'count': peak_hours_data[hour]['count']
+                'hour': row.sale_hour,
+                'sales': round(float(row.sales or 0), 2),
+                'count': int(row.count or 0)
             }
-            for hour in sorted(peak_hours_data.keys())
+            for row in peak_hour_rows if row.count
         ]
 
         # Revenue trend (daily breakdown for charts)
-        revenue_trend = defaultdict(lambda: {'date': '', 'revenue': 0.0, 'bills': 0})
-
-        for bill in gst_bills:
-            if bill.created_at >= start_date:
-                date_key = bill.created_at.strftime('%Y-%m-%d')
-                revenue_trend[date_key]['date'] = date_key
-                revenue_trend[date_key]['revenue'] += float(bill.final_amount)
-                revenue_trend[date_key]['bills'] += 1
-
-        for bill in non_gst_bills:
-            if bill.created_at >= start_date:
-                date_key = bill.created_at.strftime('%Y-%m-%d')
-                revenue_trend[date_key]['date'] = date_key
-                revenue_trend[date_key]['revenue'] += float(bill.total_amount)
-                revenue_trend[date_key]['bills'] += 1
-
-        revenue_trend_list = sorted(
-            [{'date': data['date'], 'revenue': round(data['revenue'], 2), 'bills': data['bills']}
-             for data in revenue_trend.values()],
-            key=lambda x: x['date']
-        )
-
-        # Customer insights
-        customer_frequency = defaultdict(int)
-        customer_spend = defaultdict(float)
-
-        for bill in gst_bills:
-            customer = bill.customer_name or 'Walk-in'
-            customer_frequency[customer] += 1
-            customer_spend[customer] += float(bill.final_amount)
-
-        for bill in non_gst_bills:
-            customer = bill.customer_name or 'Walk-in'
-            customer_frequency[customer] += 1
-            customer_spend[customer] += float(bill.total_amount)
+        revenue_trend_rows = db.session.query(
+            SalesRollup.sale_date,
+            func.sum(SalesRollup.revenue).label('revenue'),
+            func.sum(SalesRollup.bill_count).label('bills')
+        ).filter(
+            *rollup_filters,
+            SalesRollup.dimension == 'bill',
+            since_hour(start_date)
+        ).group_by(SalesRollup.sale_date).order_by(SalesRollup.sale_date).all()
+
+        revenue_trend_list = [
+            {'date': row.sale_date.strftime('%Y-%m-%d'), 'revenue': round(float(row.revenue or 0), 2), 'bills': int(row.bills or 0)}
+            for row in revenue_trend_rows if row.bills
+        ]
 
         # Top customers by spend
+        customer_rows = db.session.query(
+            SalesRollup.dimension_key,
+            func.sum(SalesRollup.revenue).label('spend'),
+            func.sum(SalesRollup.bill_count).label('visits')
+        ).filter(
+            *rollup_filters,
+            SalesRollup.dimension == 'customer',
+            SalesRollup.sale_date >= prev_month_start.date()
+        ).group_by(SalesRollup.dimension_key).having(
+            func.sum(SalesRollup.bill_count) > 0
+        ).order_by(desc('spend')).limit(10).all()
+
         top_customers = [
             {
-                'name': customer,
-                'total_spend': round(spend, 2),
-                'visit_count': customer_frequency[customer],
-                'avg_spend': round(spend / customer_frequency[customer], 2)
+                'name': row.dimension_key,
+                'total_spend': round(float(row.spend or 0), 2),
+                'visit_count': int(row.visits),
+                'avg_spend': round(float(row.spend or 0) / int(row.visits), 2)
             }
-            for customer, spend in sorted(customer_spend.items(), key=lambda x: x[1], reverse=True)[:10]
+            for row in customer_rows
         ]
 
         # Profit margin analysis (based on cost_price vs selling price)
         total_cost = 0
         total_revenue_for_margin = 0
 
-        # Get all stock with cost prices (use cost_price if available, otherwise estimate 70% of selling price)
+        # Use cost_price if available, otherwise estimate 70% of selling price
         all_stock = {
             item.product_name: float(item.cost_price) if item.cost_price else float(item.rate) * 0.7
-            for item in StockEntry.query.filter_by(client_id=client_id).all()
+            for item in all_stock_products
         }
 
-        for bill in gst_bills:
-            items = bill.items if isinstance(bill.items, list) else []
-            for item in items:
-                product_name = item.get('product_name', '')
-                quantity = item.get('quantity', 0)
-                selling_rate = float(item.get('rate', 0))
-                # Use cost_price from stock if available, otherwise estimate
-                cost_rate = all_stock.get(product_name, selling_rate * 0.7)
-
-                total_cost += quantity * cost_rate
-                total_revenue_for_margin += quantity * selling_rate
-
-        for bill in non_gst_bills:
-            items = bill.items if isinstance(bill.items, list) else []
-            for item in items:
-                product_name = item.get('product_name', '')
-                quantity = item.get('quantity', 0)
-                selling_rate = float(item.get('rate', 0))
-                # Use cost_price from stock if available, otherwise estimate
-                cost_rate = all_stock.get(product_name, selling_rate * 0.7)
-
-                total_cost += quantity * cost_rate
-                total_revenue_for_margin += quantity * selling_rate
+        for name, data in product_sales.items():
+            # Products not in stock: estimate cost from the billed revenue
+            if name in all_stock:
+                total_cost += data['quantity'] * all_stock[name]
+            else:
+                total_cost += data['revenue'] * 0.7
+            total_revenue_for_margin += data['revenue']
 
         profit_margin = 0
         if total_revenue_for_margin > 0:
@@ -556,7 +427,8 @@ def get_dashboard_analytics():
         }
 
         # Cache the response for faster subsequent requests with dynamic timeout
-        cache.set(cache_key, response_data, cache_timeout)
+        cache.set(cache_key, response_data, cache_timeout,
+                  tags=cache_tags(client_id, 'analytics', now.strftime('%Y-%m-%d')))
 
         return jsonify(response_data), 200
 
@@ -1,13 +1,87 @@
+import json
+from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, g
+from sqlalchemy import or_
 from extensions import db
 from models.audit_model import AuditLog
 from models.user_model import User
-from models.permission_model import get_user_permissions
 from utils.auth_middleware import authenticate
+from utils.permission_bits import user_has_permission
+from utils.export_stream import CHUNK_ROWS, stream_rows, csv_export, xlsx_export, export_response
+from services.job_runner import job_handler, wants_async, enqueue_job
 
 audit_bp = Blueprint('audit', __name__)
 
 
+def _audit_log_query(args):
+    """
+    Build the audit log query for the current user (permission rules: see get_audit_logs)
+
+    Args:
+        args: Filters (request.args or job params) - action, date_from, date_to,
+              date (single day), entity_type, search, billing_only
+    """
+    client_id = g.user['client_id']
+    user_id = g.user['user_id']
+
+    # Build query - ALWAYS filter by client_id first (mandatory)
+    query = AuditLog.query.filter_by(client_id=client_id)
+
+    # Permission-based user filtering
+    # Super admin or users with view_all_bills can see all bills
+    # Users with only view_own_bills see only their own bills
+    has_view_all = user_has_permission(g.user, 'view_all_bills')
+
+    if not has_view_all:
+        # User can only see their own audit logs
+        query = query.filter(AuditLog.user_id == user_id)
+
+    # Filter by billing table based on permissions (for billing-related logs)
+    # Determine which billing tables user can see
+    allowed_tables = []
+    if user_has_permission(g.user, 'gst_billing'):
+        allowed_tables.append('gst_billing')
+    if user_has_permission(g.user, 'non_gst_billing'):
+        allowed_tables.append('non_gst_billing')
+
+    # If filtering for billing logs only, apply table filter
+    # Otherwise show all logs (including non-billing actions)
+    billing_only = str(args.get('billing_only', 'false')).lower() == 'true'
+    if billing_only and allowed_tables:
+        query = query.filter(AuditLog.table_name.in_(allowed_tables))
+
+    action = args.get('action')
+    if action:
+        query = query.filter_by(action_type=action)
+
+    entity_type = args.get('entity_type')
+    if entity_type:
+        query = query.filter(AuditLog.table_name == entity_type)
+
+    search = args.get('search')
+    if search:
+        pattern = f'%{search}%'
+        query = query.filter(or_(
+            AuditLog.action_type.ilike(pattern),
+            AuditLog.table_name.ilike(pattern)
+        ))
+
+    date_from = args.get('date_from')
+    date_to = args.get('date_to')
+    day = args.get('date')
+    if day:
+        day_start = datetime.strptime(day, '%Y-%m-%d')
+        query = query.filter(AuditLog.timestamp >= day_start, AuditLog.timestamp < day_start + timedelta(days=1))
+
+    if date_from:
+        query = query.filter(AuditLog.timestamp >= date_from)
+
+    if date_to:
+        query = query.filter(AuditLog.timestamp <= date_to)
+
+    return query
+
+
 @audit_bp.route('/logs', methods=['GET'])
 @authenticate
 def get_audit_logs():
@@ -21,57 +95,11 @@ def get_audit_logs():
     - non_gst_billing: User can see non-GST billing logs
     """
     try:
-        client_id = g.user['client_id']
-        user_id = g.user['user_id']
-        is_super_admin = g.user.get('is_super_admin', False)
-
-        # Get user's permissions
-        user_permissions = g.user.get('permissions', [])
-        if not user_permissions:
-            user_permissions = get_user_permissions(user_id)
-
         # Get query parameters
-        action = request.args.get('action')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 50))
 
-        # Build query - ALWAYS filter by client_id first (mandatory)
-        query = AuditLog.query.filter_by(client_id=client_id)
-
-        # Permission-based user filtering
-        # Super admin or users with view_all_bills can see all bills
-        # Users with only view_own_bills see only their own bills
-        has_view_all = is_super_admin or 'view_all_bills' in user_permissions
-        has_view_own = 'view_own_bills' in user_permissions
-
-        if not has_view_all:
-            # User can only see their own audit logs
-            query = query.filter(AuditLog.user_id == user_id)
-
-        # Filter by billing table based on permissions (for billing-related logs)
-        # Determine which billing tables user can see
-        allowed_tables = []
-        if is_super_admin or 'gst_billing' in user_permissions:
-            allowed_tables.append('gst_billing')
-        if is_super_admin or 'non_gst_billing' in user_permissions:
-            allowed_tables.append('non_gst_billing')
-
-        # If filtering for billing logs only, apply table filter
-        # Otherwise show all logs (including non-billing actions)
-        billing_only = request.args.get('billing_only', 'false').lower() == 'true'
-        if billing_only and allowed_tables:
-            query = query.filter(AuditLog.table_name.in_(allowed_tables))
-
-        if action:
-            query = query.filter_by(action_type=action)
-
-        if date_from:
-            query = query.filter(AuditLog.timestamp >= date_from)
-
-        if date_to:
-            query = query.filter(AuditLog.timestamp <= date_to)
+        query = _audit_log_query(request.args)
 
         # Get total count
         total_records = query.count()
@@ -117,20 +145,89 @@ def get_audit_logs():
 @audit_bp.route('/export', methods=['GET'])
 @authenticate
 def export_audit_logs():
-    """Export audit trail for client_id"""
-    try:
-        client_id = g.user['client_id']
+    """
+    Export audit trail for client_id as CSV (default) or ?format=xlsx
 
-        # Get all logs for this client
-        logs = AuditLog.query.filter_by(client_id=client_id).order_by(AuditLog.timestamp.desc()).all()
+    Accepts the same filters as /logs and streams rows, so memory use does not
+    grow with the size of the audit log; ?async=1 builds the file as a background job.
+    """
+    try:
+        filters = {
+            key: request.args.get(key)
+            for key in EXPORT_FILTERS if request.args.get(key)
+        }
+        file_format = request.args.get('format', 'csv')
 
-        # TODO: Generate CSV/PDF export file
+        if wants_async():
+            return enqueue_job('audit_export', {'filters': filters, 'format': file_format})
 
-        return jsonify({
-            'success': True,
-            'message': 'Audit export functionality coming soon',
-            'total_logs': len(logs)
-        }), 200
+        return export_response(*build_audit_export(filters, file_format))
 
+    except ValueError as e:
+        return jsonify({'error': 'Invalid filter', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Failed to export audit logs', 'message': str(e)}), 500
+
+
+EXPORT_FILTERS = ('action', 'date_from', 'date_to', 'date', 'entity_type', 'search', 'billing_only')
+
+EXPORT_COLUMNS = ['Timestamp', 'Action', 'Entity', 'Record ID', 'User', 'IP Address',
+                  'User Agent', 'Old Data', 'New Data']
+
+
+def _json_cell(value):
+    return json.dumps(value, default=str) if value is not None else ''
+
+
+def build_audit_export(filters, file_format='csv', progress=None):
+    """
+    Build the audit log export, streaming rows from a server-side cursor
+
+    Args:
+        filters: Same filters as /logs (see _audit_log_query)
+        file_format: 'csv' or 'xlsx'
+        progress: Optional callback(percent) for background jobs
+
+    Returns:
+        (body, filename, mimetype) for export_response
+    """
+    query = _audit_log_query(filters)
+    total = query.count() if progress else 0
+
+    # User email joined in SQL instead of one lookup per row
+    stmt = query.outerjoin(User, User.user_id == AuditLog.user_id).with_entities(
+        AuditLog.timestamp, AuditLog.action_type, AuditLog.table_name, AuditLog.record_id,
+        AuditLog.user_id, User.email, AuditLog.ip_address, AuditLog.user_agent,
+        AuditLog.old_data, AuditLog.new_data
+    ).order_by(AuditLog.timestamp.desc()).statement
+
+    def rows():
+        for written, log in enumerate(stream_rows(stmt), 1):
+            yield (
+                log.timestamp.isoformat() if log.timestamp else '',
+                log.action_type,
+                log.table_name or '',
+                log.record_id or '',
+                (log.email or 'Unknown') if log.user_id else 'System',
+                log.ip_address or '',
+                log.user_agent or '',
+                _json_cell(log.old_data),
+                _json_cell(log.new_data)
+            )
+            if progress and written % CHUNK_ROWS == 0:
+                progress(written * 100 // max(total, 1))
+
+    filename = f'audit-logs-{datetime.utcnow().strftime("%Y-%m-%d")}'
+    if file_format == 'xlsx':
+        return xlsx_export(EXPORT_COLUMNS, rows(), f'{filename}.xlsx', sheet_name='Audit Log')
+    return csv_export(EXPORT_COLUMNS, rows(), f'{filename}.csv')
+
+
+@job_handler('audit_export')
+def _run_audit_export(ctx):
+    export = build_audit_export(
+        ctx.params.get('filters', {}),
+        ctx.params.get('format', 'csv'),
+        progress=lambda percent: ctx.set_progress(min(percent, 95), 'Writing audit log')
+    )
+    ctx.write_artifact(*export)
@@ -1,5 +1,5 @@
 import jwt
-import bcrypt
+import time
 import uuid
 from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, g
@@ -9,7 +9,11 @@ from models.client_model import ClientEntry
 from models.permission_model import get_user_permissions
 from utils.auth_middleware import authenticate
 from utils.audit_logger import log_action
-from utils.cache_helper import get_cache_manager
+from utils.session_cache import session_cache, invalidate_user_sessions
+from utils.token_cache import revoke_token
+from utils.permission_bits import permission_mask
+from utils.password_hasher import password_hasher, PasswordHasherBusy
+from utils.login_throttle import login_throttle
 from config import Config
 
 auth_bp = Blueprint('auth', __name__)
@@ -35,20 +39,41 @@ def login():
         if not email or not password:
             return jsonify({'error': 'Email and password required'}), 400
 
+        # Repeated failures from this IP wait before the next attempt (no bcrypt work meanwhile)
+        retry_after = login_throttle.retry_after(email, request.remote_addr)
+        if retry_after:
+            response = jsonify({
+                'error': 'Too many failed login attempts',
+                'message': f'Please try again in {retry_after} seconds'
+            })
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+
         # OPTIMIZED: Single JOIN query to get User + Client together
         result = db.session.query(User, ClientEntry).join(
             ClientEntry, User.client_id == ClientEntry.client_id
         ).filter(User.email == email).first()
 
         if not result:
+            login_throttle.failed(email, request.remote_addr)  # counts towards the IP's limit
             return jsonify({'error': 'Email address not found'}), 401
 
         user, client = result
 
-        # Verify password
-        if not bcrypt.checkpw(password.encode('utf-8'), user.password_hash.encode('utf-8')):
+        # Verify password (in the bcrypt pool, off the request thread)
+        try:
+            password_ok = password_hasher.verify(password, user.password_hash)
+        except PasswordHasherBusy:
+            response = jsonify({'error': 'Server busy', 'message': 'Too many logins at once, please retry'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+
+        if not password_ok:
+            login_throttle.failed(email, request.remote_addr)
             return jsonify({'error': 'Incorrect password'}), 401
 
+        login_throttle.succeeded(email, request.remote_addr)
+
         # Check if user is active
         if not user.is_active:
             return jsonify({'error': 'Account is inactive'}), 401
@@ -68,6 +93,8 @@ def login():
             'role': user.role,
             'is_super_admin': user.is_super_admin,
             'permissions': user_permissions,
+            'iat': time.time(),  # sub-second: a revocation in the same second must not match a newer login
+            'jti': uuid.uuid4().hex,  # lets logout revoke this token alone (utils.token_cache)
             'exp': datetime.utcnow() + timedelta(hours=Config.JWT_EXPIRATION_HOURS)
         }
 
@@ -77,6 +104,11 @@ def login():
         # Update last_login without blocking (will be committed with cache set)
         user.last_login = datetime.utcnow()
 
+        # Rehash to the configured bcrypt cost (committed with last_login)
+        new_hash = password_hasher.upgrade(password, user.password_hash)
+        if new_hash:
+            user.password_hash = new_hash
+
         # Prepare user data for caching
         user_data = {
             'user_id': str(user.user_id),
@@ -100,13 +132,9 @@ def login():
             'gstin': client.gst_number
         }
 
-        # Cache user and client data in Redis
-        cache = get_cache_manager()
-        cache_key = f"user_session:{user.user_id}"
-        cache.set(cache_key, {
-            'user': user_data,
-            'client': client_data
-        }, USER_SESSION_CACHE_TIMEOUT)
+        # Cache user and client data for authenticate, with the compiled permissions
+        permission_mask(user_data)
+        session_cache.put(user.user_id, user.client_id, user_data, client_data, USER_SESSION_CACHE_TIMEOUT)
 
         # OPTIMIZED: Single commit for last_login update (non-blocking)
         try:
@@ -159,7 +187,7 @@ def register():
             return jsonify({'error': 'Invalid client_id'}), 400
 
         # Hash password
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = password_hasher.hash(password)
 
         # Create user
         new_user = User(
@@ -194,8 +222,9 @@ def logout():
         log_action('LOGOUT', 'users', g.user['user_id'])
 
         # Clear user session from cache
-        cache = get_cache_manager()
-        cache.delete(f"user_session:{g.user['user_id']}")
+        invalidate_user_sessions(g.user['user_id'])
+        auth_header = request.headers.get('Authorization', '')
+        revoke_token(auth_header.split(' ')[1] if ' ' in auth_header else auth_header)
 
         return jsonify({
             'success': True,
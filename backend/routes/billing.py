@@ -1,16 +1,25 @@
 import uuid
+import base64
+import heapq
 from datetime import datetime
 from dateutil import parser as date_parser
 from flask import Blueprint, request, jsonify, g
+from sqlalchemy import and_, or_, func
 from extensions import db
 from models.billing_model import GSTBilling, NonGSTBilling
 from models.stock_model import StockEntry
 from utils.auth_middleware import authenticate
 from utils.permission_middleware import require_permission, require_any_permission
+from utils.permission_bits import user_has_permission
 from utils.audit_logger import log_action
 from utils.helpers import calculate_gst_amount, calculate_final_amount, validate_items, title_case
 from utils.cache import cache, invalidate_cache
-from utils.bill_number_helper import get_next_bill_number
+from utils.cache_helper import invalidate_billing_cache, invalidate_stock_cache
+from utils import bill_number_helper
+from utils.stock_helpers import reserve_stock, format_stock_shortfall
+from utils.sales_rollup import bill_rollup_rows, update_sales_rollup
+from utils.export_stream import stream_rows, csv_export, xlsx_export, export_response, format_datetime
+from services.job_runner import job_handler, wants_async, enqueue_job
 
 billing_bp = Blueprint('billing', __name__)
 
@@ -22,7 +31,7 @@ def create_gst_bill():
     """
     Create GST-enabled bill with client_id validation
     MANDATORY: All items must belong to same client_id
-    OPTIMIZED: Uses batch query for product validation
+    OPTIMIZED: Validates and reserves stock in a single conditional UPDATE
     """
     try:
         data = request.get_json()
@@ -39,32 +48,24 @@ def create_gst_bill():
         if not is_valid:
             return jsonify({'error': error_msg}), 400
 
-        # OPTIMIZED: Batch fetch all products in single query (fixes N+1)
-        product_ids = [item['product_id'] for item in data['items']]
-        products = StockEntry.query.filter(
-            StockEntry.product_id.in_(product_ids),
-            StockEntry.client_id == client_id
-        ).all()
-        product_map = {p.product_id: p for p in products}
-
-        # Verify all products and check stock
-        for item in data['items']:
-            product = product_map.get(item['product_id'])
-
-            if not product:
-                return jsonify({'error': f"Product {item['product_name']} not found for your account"}), 404
-
-            # Check stock availability
-            if product.quantity < item['quantity']:
-                return jsonify({'error': f"Insufficient stock for {item['product_name']}. Available: {product.quantity}"}), 400
+        # Phase 0: Get next bill number atomically (prevents race conditions)
+        bill_number = bill_number_helper.get_next_bill_number(client_id, 'gst')
+
+        # OPTIMIZED: Reserve stock for all items in one conditional UPDATE.
+        # Verifies ownership (client_id) and availability atomically - no row locks held.
+        shortfalls = reserve_stock(data['items'], client_id)
+        if shortfalls:
+            db.session.rollback()
+            status_code = 404 if not shortfalls[0]['found'] else 400
+            return jsonify({
+                'error': format_stock_shortfall(shortfalls[0], data['items']),
+                'shortfalls': shortfalls
+            }), status_code
 
         # Calculate GST amount and final amount
         gst_amount = calculate_gst_amount(data['subtotal'], data['gst_percentage'])
         final_amount = calculate_final_amount(data['subtotal'], gst_amount)
 
-        # Phase 0: Get next bill number atomically (prevents race conditions)
-        bill_number = get_next_bill_number(client_id, 'gst')
-
         # Create GST bill (apply title case to customer name)
         new_bill = GSTBilling(
             bill_id=str(uuid.uuid4()),
@@ -84,31 +85,15 @@ def create_gst_bill():
         )
 
         db.session.add(new_bill)
-        db.session.flush()  # Get bill_id before stock reduction
-
-        # Phase 0: Stock reduction in Python (replaces database trigger)
-        # Use row-level locking to prevent overselling
-        for item in data['items']:
-            product = StockEntry.query.filter_by(
-                product_id=item['product_id'],
-                client_id=client_id
-            ).with_for_update().first()
-
-            if not product:
-                raise ValueError(f"Product {item['product_name']} not found")
+        update_sales_rollup(after=bill_rollup_rows(new_bill))
 
-            if product.quantity < item['quantity']:
-                raise ValueError(f"Insufficient stock for {item['product_name']}. Available: {product.quantity}")
-
-            # Reduce stock
-            product.quantity -= item['quantity']
-            product.updated_at = datetime.utcnow()
-
-        # Commit both bill creation and stock reduction atomically
+        # Commit bill creation, stock reduction and rollup atomically
         db.session.commit()
 
         # Invalidate cache for this client's billing data
         invalidate_cache(f"billing:{client_id}")
+        invalidate_billing_cache(client_id)
+        invalidate_stock_cache(client_id)
 
         # Log action
         log_action('CREATE', 'gst_billing', new_bill.bill_id, None, new_bill.to_dict())
@@ -133,7 +118,7 @@ def create_non_gst_bill():
     """
     Create Non-GST bill with client_id validation
     MANDATORY: All items must belong to same client_id
-    OPTIMIZED: Uses batch query for product validation
+    OPTIMIZED: Validates and reserves stock in a single conditional UPDATE
     """
     try:
         data = request.get_json()
@@ -150,27 +135,19 @@ def create_non_gst_bill():
         if not is_valid:
             return jsonify({'error': error_msg}), 400
 
-        # OPTIMIZED: Batch fetch all products in single query (fixes N+1)
-        product_ids = [item['product_id'] for item in data['items']]
-        products = StockEntry.query.filter(
-            StockEntry.product_id.in_(product_ids),
-            StockEntry.client_id == client_id
-        ).all()
-        product_map = {p.product_id: p for p in products}
-
-        # Verify all products and check stock
-        for item in data['items']:
-            product = product_map.get(item['product_id'])
-
-            if not product:
-                return jsonify({'error': f"Product {item['product_name']} not found for your account"}), 404
-
-            # Check stock availability
-            if product.quantity < item['quantity']:
-                return jsonify({'error': f"Insufficient stock for {item['product_name']}. Available: {product.quantity}"}), 400
-
         # Phase 0: Get next bill number atomically (prevents race conditions)
-        bill_number = get_next_bill_number(client_id, 'non_gst')
+        bill_number = bill_number_helper.get_next_bill_number(client_id, 'non_gst')
+
+        # OPTIMIZED: Reserve stock for all items in one conditional UPDATE.
+        # Verifies ownership (client_id) and availability atomically - no row locks held.
+        shortfalls = reserve_stock(data['items'], client_id)
+        if shortfalls:
+            db.session.rollback()
+            status_code = 404 if not shortfalls[0]['found'] else 400
+            return jsonify({
+                'error': format_stock_shortfall(shortfalls[0], data['items']),
+                'shortfalls': shortfalls
+            }), status_code
 
         # Create Non-GST bill (apply title case to customer name)
         new_bill = NonGSTBilling(
@@ -188,31 +165,15 @@ def create_non_gst_bill():
         )
 
         db.session.add(new_bill)
-        db.session.flush()  # Get bill_id before stock reduction
-
-        # Phase 0: Stock reduction in Python (replaces database trigger)
-        # Use row-level locking to prevent overselling
-        for item in data['items']:
-            product = StockEntry.query.filter_by(
-                product_id=item['product_id'],
-                client_id=client_id
-            ).with_for_update().first()
-
-            if not product:
-                raise ValueError(f"Product {item['product_name']} not found")
+        update_sales_rollup(after=bill_rollup_rows(new_bill))
 
-            if product.quantity < item['quantity']:
-                raise ValueError(f"Insufficient stock for {item['product_name']}. Available: {product.quantity}")
-
-            # Reduce stock
-            product.quantity -= item['quantity']
-            product.updated_at = datetime.utcnow()
-
-        # Commit both bill creation and stock reduction atomically
+        # Commit bill creation, stock reduction and rollup atomically
         db.session.commit()
 
         # Invalidate cache for this client's billing data
         invalidate_cache(f"billing:{client_id}")
+        invalidate_billing_cache(client_id)
+        invalidate_stock_cache(client_id)
 
         # Log action
         log_action('CREATE', 'non_gst_billing', new_bill.bill_id, None, new_bill.to_dict())
@@ -240,28 +201,102 @@ def get_next_bill_number():
     try:
         client_id = g.user['client_id']
 
-        # Get max bill number from both tables using SQL MAX (very fast)
-        from sqlalchemy import func
-
-        gst_max = db.session.query(func.max(GSTBilling.bill_number)).filter(
-            GSTBilling.client_id == client_id
-        ).scalar() or 0
-
-        non_gst_max = db.session.query(func.max(NonGSTBilling.bill_number)).filter(
-            NonGSTBilling.client_id == client_id
-        ).scalar() or 0
-
-        next_number = max(gst_max, non_gst_max) + 1
+        # This worker's next number from its block, else the counter + 1
+        # (seeded from MAX(bill_number) for clients without a counter yet)
+        next_gst = bill_number_helper.peek_next_bill_number(client_id, 'gst')
+        next_non_gst = bill_number_helper.peek_next_bill_number(client_id, 'non_gst')
+        next_number = max(next_gst, next_non_gst)
 
         return jsonify({
             'success': True,
-            'next_bill_number': next_number
+            'next_bill_number': next_number,
+            'next_gst_bill_number': next_gst,
+            'next_non_gst_bill_number': next_non_gst
         }), 200
 
     except Exception as e:
         return jsonify({'error': 'Failed to get next bill number', 'message': str(e)}), 500
 
 
+def _encode_bill_cursor(bill):
+    """Opaque keyset cursor for the (created_at, bill_id) position of a bill"""
+    raw = f"{bill.created_at.isoformat()}|{bill.bill_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_bill_cursor(cursor):
+    """Decode a cursor from _encode_bill_cursor, raises ValueError if malformed"""
+    try:
+        created_at, bill_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return datetime.fromisoformat(created_at), bill_id
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def _filter_bills(query, model, client_id, created_by, date_from, date_to):
+    """Apply client, view_own_bills and date range filters to a bill query"""
+    query = query.filter(model.client_id == client_id)
+    if created_by:
+        query = query.filter(model.created_by == created_by)
+    if date_from:
+        query = query.filter(model.created_at >= date_from)
+    if date_to:
+        query = query.filter(model.created_at <= date_to)
+    return query
+
+
+def _get_bills_by_cursor(bill_type, client_id, created_by, date_from, date_to, after, limit):
+    """
+    One page of bills in (created_at DESC, bill_id DESC) order after a keyset cursor.
+
+    Each table is read with a seek predicate on (created_at, bill_id) and LIMIT
+    limit + 1, then the two descending streams are heap-merged. A deep page costs
+    the same as the first one - no OFFSET scan and no Python sort of
+    limit + offset rows. total_records is only computed for the first page.
+    """
+    models = {'gst': [GSTBilling], 'non-gst': [NonGSTBilling]}.get(bill_type, [GSTBilling, NonGSTBilling])
+
+    streams = []
+    for model in models:
+        query = _filter_bills(model.query, model, client_id, created_by, date_from, date_to)
+        if after:
+            after_created_at, after_bill_id = after
+            query = query.filter(or_(
+                model.created_at < after_created_at,
+                and_(model.created_at == after_created_at, model.bill_id < after_bill_id)
+            ))
+        streams.append(
+            query.order_by(model.created_at.desc(), model.bill_id.desc()).limit(limit + 1).all()
+        )
+
+    merged = heapq.merge(*streams, key=lambda bill: (bill.created_at, str(bill.bill_id)), reverse=True)
+    bills = [bill for _, bill in zip(range(limit + 1), merged)]
+
+    has_more = len(bills) > limit
+    bills = bills[:limit]
+
+    pagination = {
+        'limit': limit,
+        'has_more': has_more,
+        'next_cursor': _encode_bill_cursor(bills[-1]) if has_more else None
+    }
+
+    if not after:
+        pagination['total_records'] = sum(
+            _filter_bills(
+                db.session.query(func.count(model.bill_id)), model,
+                client_id, created_by, date_from, date_to
+            ).scalar() or 0
+            for model in models
+        )
+
+    return {
+        'success': True,
+        'bills': [bill.to_dict() for bill in bills],
+        'pagination': pagination
+    }
+
+
 @billing_bp.route('/list', methods=['GET'])
 @authenticate
 @require_any_permission('view_all_bills', 'view_own_bills')
@@ -271,6 +306,11 @@ def get_bills():
     OPTIMIZED: Uses SQL UNION and LIMIT/OFFSET for pagination + caching
     PERFORMANCE FIX: Uses deferred loading and optimized queries
 
+    Pagination:
+    - ?page=N: offset pagination (legacy, cost grows with page depth)
+    - ?cursor=: keyset pagination, pass pagination.next_cursor to get the next page;
+      every page costs the same (recommended for scrolling bill history)
+
     Permission-based filtering:
     - view_all_bills: User can see all bills from all staff in their client
     - view_own_bills: User can only see bills they created (filtered by created_by)
@@ -279,12 +319,8 @@ def get_bills():
         client_id = g.user['client_id']
         user_id = g.user['user_id']
 
-        # Check user permissions for filtering
-        user_permissions = g.user.get('permissions', [])
-        is_super_admin = g.user.get('is_super_admin', False)
-
         # Determine if user can view all bills or only their own
-        has_view_all = is_super_admin or 'view_all_bills' in user_permissions
+        has_view_all = user_has_permission(g.user, 'view_all_bills')
 
         # Get query parameters
         bill_type = request.args.get('type', 'all')  # gst, non-gst, all
@@ -293,15 +329,33 @@ def get_bills():
         page = int(request.args.get('page', 1))
         limit = min(int(request.args.get('limit', 50)), 100)  # Cap at 100 for performance
 
+        # Keyset pagination: ?cursor= (empty for the first page), then pagination.next_cursor
+        use_cursor = 'cursor' in request.args
+        cursor = request.args.get('cursor') or ''
+
         # Generate cache key - include user context to prevent cache leaks
         user_context = 'all' if has_view_all else user_id
-        cache_key = f"billing:list:{client_id}:{user_context}:{bill_type}:{date_from}:{date_to}:{page}:{limit}"
+        page_key = f"cursor={cursor}" if use_cursor else page
+        cache_key = f"billing:list:{client_id}:{user_context}:{bill_type}:{date_from}:{date_to}:{page_key}:{limit}"
 
         # Try cache first
         cached_result = cache.get(cache_key)
         if cached_result is not None:
             return jsonify(cached_result), 200
 
+        if use_cursor:
+            try:
+                after = _decode_bill_cursor(cursor) if cursor else None
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+
+            result = _get_bills_by_cursor(
+                bill_type, client_id, None if has_view_all else user_id,
+                date_from, date_to, after, limit
+            )
+            cache.set(cache_key, result, ttl_seconds=120, tags=[f"billing:{client_id}"])
+            return jsonify(result), 200
+
         # Calculate offset
         offset = (page - 1) * limit
 
@@ -410,7 +464,7 @@ def get_bills():
         }
 
         # Cache for 2 minutes
-        cache.set(cache_key, result, ttl_seconds=120)
+        cache.set(cache_key, result, ttl_seconds=120, tags=[f"billing:{client_id}"])
 
         return jsonify(result), 200
 
@@ -418,6 +472,108 @@ def get_bills():
         return jsonify({'error': 'Failed to fetch bills', 'message': str(e)}), 500
 
 
+@billing_bp.route('/export', methods=['GET'])
+@authenticate
+@require_any_permission('view_all_bills', 'view_own_bills')
+def export_bills():
+    """
+    Export bills (GST + Non-GST) as CSV (default) or ?format=xlsx
+
+    Same type / date_from / date_to filters and view_own_bills rule as /list.
+    Rows are streamed from server-side cursors (both tables merged by date),
+    so memory use does not grow with the number of bills; ?async=1 builds the
+    file as a background job.
+    """
+    try:
+        params = {
+            'format': request.args.get('format', 'csv'),
+            'type': request.args.get('type', 'all'),
+            'date_from': request.args.get('date_from'),
+            'date_to': request.args.get('date_to')
+        }
+
+        if wants_async():
+            return enqueue_job('bills_export', params)
+
+        return export_response(*build_bills_export(params))
+
+    except Exception as e:
+        return jsonify({'error': 'Failed to export bills', 'message': str(e)}), 500
+
+
+BILL_EXPORT_COLUMNS = [
+    'Bill Type', 'Bill Number', 'Date', 'Customer', 'Phone', 'GSTIN', 'Items',
+    'Subtotal', 'GST %', 'GST Amount', 'Discount', 'Total', 'Payment', 'Status'
+]
+
+
+def _bill_export_rows(model, client_id, created_by, date_from, date_to):
+    """Export rows of one bill table, newest first, with the sort key in front"""
+    is_gst = model is GSTBilling
+    columns = [
+        model.created_at, model.bill_number, model.customer_name, model.customer_phone,
+        model.customer_gstin, model.items, model.discount_amount, model.payment_type, model.status
+    ]
+    if is_gst:
+        columns += [model.subtotal, model.gst_percentage, model.gst_amount, model.final_amount]
+    else:
+        columns += [model.total_amount]
+
+    stmt = _filter_bills(
+        db.session.query(*columns), model, client_id, created_by, date_from, date_to
+    ).order_by(model.created_at.desc(), model.bill_id.desc()).statement
+
+    for row in stream_rows(stmt):
+        total = row.final_amount if is_gst else row.total_amount
+        yield row.created_at or datetime.min, (
+            'GST' if is_gst else 'Non-GST',
+            row.bill_number,
+            format_datetime(row.created_at),
+            row.customer_name or '',
+            row.customer_phone or '',
+            row.customer_gstin or '',
+            len(row.items) if isinstance(row.items, list) else 0,
+            row.subtotal if is_gst else total,
+            row.gst_percentage if is_gst else 0,
+            row.gst_amount if is_gst else 0,
+            row.discount_amount or 0,
+            total,
+            row.payment_type or '',
+            row.status or ''
+        )
+
+
+def build_bills_export(params):
+    """
+    Build the bills export for the current user
+
+    Returns:
+        (body, filename, mimetype) for export_response
+    """
+    client_id = g.user['client_id']
+    has_view_all = user_has_permission(g.user, 'view_all_bills')
+    created_by = None if has_view_all else g.user['user_id']
+
+    bill_type = params.get('type', 'all')
+    models = {'gst': [GSTBilling], 'non-gst': [NonGSTBilling]}.get(bill_type, [GSTBilling, NonGSTBilling])
+    streams = [
+        _bill_export_rows(model, client_id, created_by, params.get('date_from'), params.get('date_to'))
+        for model in models
+    ]
+    rows = (row for _, row in heapq.merge(*streams, key=lambda item: item[0], reverse=True))
+
+    filename = f'bills-{datetime.utcnow().strftime("%Y-%m-%d")}'
+    if params.get('format') == 'xlsx':
+        return xlsx_export(BILL_EXPORT_COLUMNS, rows, f'{filename}.xlsx', sheet_name='Bills')
+    return csv_export(BILL_EXPORT_COLUMNS, rows, f'{filename}.csv')
+
+
+@job_handler('bills_export')
+def _run_bills_export(ctx):
+    ctx.set_progress(10, 'Writing bills')
+    ctx.write_artifact(*build_bills_export(ctx.params))
+
+
 @billing_bp.route('/<bill_id>', methods=['GET'])
 @authenticate
 def get_bill_details(bill_id):
@@ -500,11 +656,8 @@ def create_unified_bill():
                 return jsonify({'error': 'Invalid bill date format'}), 400
 
         # Check user permissions for billing
-        user_permissions = g.user.get('permissions', [])
-        is_super_admin = g.user.get('is_super_admin', False)
-
-        has_gst_permission = is_super_admin or 'gst_billing' in user_permissions
-        has_non_gst_permission = is_super_admin or 'non_gst_billing' in user_permissions
+        has_gst_permission = user_has_permission(g.user, 'gst_billing')
+        has_non_gst_permission = user_has_permission(g.user, 'non_gst_billing')
 
         # Determine billing mode based on permissions
         gst_only = has_gst_permission and not has_non_gst_permission
@@ -646,6 +799,19 @@ def create_unified_bill():
         # Calculate effective GST percentage (weighted average based on subtotal)
         effective_gst_percentage = (total_gst_amount / subtotal * 100) if subtotal > 0 else 0
 
+        # Route to appropriate billing table based on permission and GST presence
+        # Permission-based routing:
+        # - gst_only: Always GST bill (even if no GST items)
+        # - non_gst_only: Always Non-GST bill (GST already forced to 0 above)
+        # - both permissions: Smart detection based on has_gst_items
+        should_create_gst_bill = gst_only or (not non_gst_only and has_gst_items)
+
+        # Phase 0: Get next bill number from the client's counter, in this transaction
+        # (a rollback below gives the number back, so the series has no gaps).
+        bill_number = bill_number_helper.get_next_bill_number(
+            client_id, 'gst' if should_create_gst_bill else 'non_gst'
+        )
+
         # Create new products in stock_entry table BEFORE creating bill
         for new_product_data, new_product_id in new_products_to_create:
             new_stock_entry = StockEntry(
@@ -667,18 +833,20 @@ def create_unified_bill():
         if new_products_to_create:
             db.session.flush()
 
-        # Route to appropriate billing table based on permission and GST presence
-        # Permission-based routing:
-        # - gst_only: Always GST bill (even if no GST items)
-        # - non_gst_only: Always Non-GST bill (GST already forced to 0 above)
-        # - both permissions: Smart detection based on has_gst_items
-        should_create_gst_bill = gst_only or (not non_gst_only and has_gst_items)
+        # Phase 0: Stock reduction in Python (replaces database trigger)
+        # OPTIMIZED: All line items decremented in one conditional UPDATE.
+        # New products are included so they keep the +10 buffer, quick sales are skipped.
+        shortfalls = reserve_stock(processed_items, client_id)
+        if shortfalls:
+            db.session.rollback()
+            status_code = 404 if not shortfalls[0]['found'] else 400
+            return jsonify({
+                'error': format_stock_shortfall(shortfalls[0], processed_items),
+                'shortfalls': shortfalls
+            }), status_code
 
         if should_create_gst_bill:
             # Create GST Bill
-            last_bill = GSTBilling.query.filter_by(client_id=client_id).order_by(GSTBilling.bill_number.desc()).first()
-            bill_number = (last_bill.bill_number + 1) if last_bill else 1
-
             # Calculate discount amount or negotiable amount BEFORE creating bill object
             discount_amount = 0
             negotiable_amount = data.get('negotiable_amount')
@@ -718,14 +886,15 @@ def create_unified_bill():
             )
 
             db.session.add(new_bill)
+            update_sales_rollup(after=bill_rollup_rows(new_bill))
             # Log action BEFORE commit so it's part of the same transaction (performance optimization)
             log_action('CREATE', 'gst_billing', new_bill.bill_id, None, new_bill.to_dict())
             db.session.commit()
 
             # Invalidate caches after bill creation - including analytics for real-time dashboard updates
             invalidate_cache(f"billing:{client_id}")
-            invalidate_cache(f"stock:{client_id}")
-            invalidate_cache(f"analytics:{client_id}")
+            invalidate_billing_cache(client_id)
+            invalidate_stock_cache(client_id)
 
             # Calculate CGST and SGST (half of total GST each)
             cgst = round(total_gst_amount / 2, 2)
@@ -767,9 +936,6 @@ def create_unified_bill():
 
         else:
             # Create Non-GST Bill
-            last_bill = NonGSTBilling.query.filter_by(client_id=client_id).order_by(NonGSTBilling.bill_number.desc()).first()
-            bill_number = (last_bill.bill_number + 1) if last_bill else 1
-
             # Calculate discount amount or negotiable amount for non-GST bills
             discount_amount = 0
             negotiable_amount = data.get('negotiable_amount')
@@ -804,14 +970,15 @@ def create_unified_bill():
             )
 
             db.session.add(new_bill)
+            update_sales_rollup(after=bill_rollup_rows(new_bill))
             # Log action BEFORE commit so it's part of the same transaction (performance optimization)
             log_action('CREATE', 'non_gst_billing', new_bill.bill_id, None, new_bill.to_dict())
             db.session.commit()
 
             # Invalidate caches after bill creation - including analytics for real-time dashboard updates
             invalidate_cache(f"billing:{client_id}")
-            invalidate_cache(f"stock:{client_id}")
-            invalidate_cache(f"analytics:{client_id}")
+            invalidate_billing_cache(client_id)
+            invalidate_stock_cache(client_id)
 
             # Return complete bill data for direct printing (no need for additional fetch)
             return jsonify({
@@ -879,6 +1046,7 @@ def update_bill(bill_id):
             return jsonify({'error': 'Cannot edit a cancelled bill'}), 400
 
         old_bill_data = existing_bill.to_dict()
+        old_rollup = bill_rollup_rows(existing_bill)
 
         # Get old items for stock reversal
         old_items = existing_bill.items
@@ -950,12 +1118,14 @@ def update_bill(bill_id):
             # Update Non-GST total
             existing_bill.total_amount = data.get('total_amount', existing_bill.total_amount)
 
+        update_sales_rollup(old_rollup, bill_rollup_rows(existing_bill))
+
         db.session.commit()
 
         # Invalidate caches after bill update - for real-time data consistency
         invalidate_cache(f"billing:{client_id}")
-        invalidate_cache(f"stock:{client_id}")
-        invalidate_cache(f"analytics:{client_id}")
+        invalidate_billing_cache(client_id)
+        invalidate_stock_cache(client_id)
 
         # Log the update action
         log_action('UPDATE',
@@ -1002,6 +1172,8 @@ def exchange_bill(bill_id):
         if bill.status == 'cancelled':
             return jsonify({'error': 'Cannot exchange a cancelled bill'}), 400
 
+        old_rollup = bill_rollup_rows(bill)
+
         returned_items = data.get('returned_items', [])
         new_items = data.get('new_items', [])
 
@@ -1126,12 +1298,14 @@ def exchange_bill(bill_id):
         else:
             bill.total_amount = round(new_subtotal, 2)
 
+        update_sales_rollup(old_rollup, bill_rollup_rows(bill))
+
         db.session.commit()
 
         # Invalidate caches after bill exchange - for real-time data consistency
         invalidate_cache(f"billing:{client_id}")
-        invalidate_cache(f"stock:{client_id}")
-        invalidate_cache(f"analytics:{client_id}")
+        invalidate_billing_cache(client_id)
+        invalidate_stock_cache(client_id)
 
         # Log the exchange
         log_action(
@@ -1211,9 +1385,11 @@ def cancel_bill(bill_id):
             if product:
                 product.quantity += item['quantity']
 
-        # Update bill status
+        # Update bill status and remove it from the sales rollup
+        old_rollup = bill_rollup_rows(bill)
         bill.status = 'cancelled'
         bill.updated_at = datetime.utcnow()
+        update_sales_rollup(old_rollup)
 
         db.session.commit()
 
@@ -1221,8 +1397,8 @@ def cancel_bill(bill_id):
         try:
             # Invalidate caches after bill cancellation - for real-time data consistency
             invalidate_cache(f"billing:{client_id}")
-            invalidate_cache(f"stock:{client_id}")
-            invalidate_cache(f"analytics:{client_id}")
+            invalidate_billing_cache(client_id)
+            invalidate_stock_cache(client_id)
 
             # Log the cancellation
             log_action(
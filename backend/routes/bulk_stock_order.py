@@ -7,6 +7,7 @@ from models.stock_model import StockEntry
 from utils.auth_middleware import authenticate
 from utils.permission_middleware import require_permission
 from utils.audit_logger import log_action
+from utils.cache_helper import invalidate_stock_cache
 from utils.helpers import title_case
 
 bulk_order_bp = Blueprint('bulk_stock_order', __name__)
@@ -362,6 +363,9 @@ def receive_bulk_order(order_id):
 
         db.session.commit()
 
+        # Received quantities / new products change stock lookups
+        invalidate_stock_cache(client_id)
+
         # Log action
         log_action('UPDATE', 'bulk_stock_order', order_id, old_data, order.to_dict())
 
@@ -6,6 +6,7 @@ from models.client_model import ClientEntry
 from utils.auth_middleware import authenticate, require_role
 from utils.permission_middleware import require_super_admin
 from utils.audit_logger import log_action
+from utils.session_cache import invalidate_client_sessions
 from utils.supabase_storage import upload_logo, delete_logo, replace_logo
 
 client_bp = Blueprint('client', __name__)
@@ -119,6 +120,7 @@ def update_client(client_id):
             client.phone = data['phone']
 
         db.session.commit()
+        invalidate_client_sessions(client_id)
 
         # Log action
         log_action('UPDATE', 'client_entry', client_id, old_data, client.to_dict())
@@ -176,6 +178,7 @@ def upload_client_logo(client_id):
         # Update database
         client.logo_url = new_url
         db.session.commit()
+        invalidate_client_sessions(client_id)
 
         # Log action
         log_action('UPDATE', 'client_entry', client_id, old_data, client.to_dict())
@@ -225,6 +228,7 @@ def delete_client_logo(client_id):
         # Update database
         client.logo_url = None
         db.session.commit()
+        invalidate_client_sessions(client_id)
 
         # Log action
         log_action('UPDATE', 'client_entry', client_id, old_data, client.to_dict())
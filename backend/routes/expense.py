@@ -115,7 +115,7 @@ def list_expenses():
         }
 
         # Cache for 2 minutes (reports typically switch between periods quickly)
-        cache.set(cache_key, result, ttl_seconds=120)
+        cache.set(cache_key, result, ttl_seconds=120, tags=[f"expenses:{client_id}"])
 
         return jsonify(result), 200
 
@@ -348,7 +348,7 @@ def get_expense_summary():
         }
 
         # Cache for 2 minutes
-        cache.set(cache_key, result, ttl_seconds=120)
+        cache.set(cache_key, result, ttl_seconds=120, tags=[f"expenses:{client_id}"])
 
         return jsonify(result), 200
 
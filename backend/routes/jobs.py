@@ -0,0 +1,76 @@
+import os
+from flask import Blueprint, request, jsonify, g, send_file
+from utils.auth_middleware import authenticate
+from services.job_runner import job_runner
+
+jobs_bp = Blueprint('jobs', __name__)
+
+
+def _get_visible_job(job_id, include_internal=False):
+    """Job of the current client; non-admins only see jobs they started"""
+    job = job_runner.get(job_id, include_internal=include_internal)
+    if not job or job['client_id'] != str(g.user['client_id']):
+        return None
+    if not g.user.get('is_super_admin', False) and job['user_id'] != str(g.user['user_id']):
+        return None
+    return job
+
+
+@jobs_bp.route('', methods=['GET'])
+@authenticate
+def list_jobs():
+    """List recent background jobs (imports, exports, PDFs)"""
+    try:
+        limit = min(int(request.args.get('limit', 20)), 100)
+        user_id = None if g.user.get('is_super_admin', False) else g.user['user_id']
+        jobs = job_runner.list(g.user['client_id'], user_id=user_id, limit=limit)
+
+        return jsonify({'success': True, 'jobs': jobs}), 200
+
+    except Exception as e:
+        return jsonify({'error': 'Failed to fetch jobs', 'message': str(e)}), 500
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+@authenticate
+def get_job(job_id):
+    """Job status, progress and result (e.g. the import summary)"""
+    try:
+        job = _get_visible_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+
+        if job['has_artifact']:
+            job['download_url'] = f"/api/jobs/{job_id}/download"
+
+        return jsonify({'success': True, 'job': job}), 200
+
+    except Exception as e:
+        return jsonify({'error': 'Failed to fetch job', 'message': str(e)}), 500
+
+
+@jobs_bp.route('/<job_id>/download', methods=['GET'])
+@authenticate
+def download_job_artifact(job_id):
+    """Download the file produced by a finished job"""
+    try:
+        job = _get_visible_job(job_id, include_internal=True)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+
+        if job['status'] != 'succeeded':
+            return jsonify({'error': f"Job is {job['status']}", 'job_id': job_id}), 409
+
+        artifact_path = job['artifact_path']
+        if not artifact_path or not os.path.exists(artifact_path):
+            return jsonify({'error': 'Job has no downloadable file'}), 404
+
+        return send_file(
+            artifact_path,
+            mimetype=job['mimetype'],
+            as_attachment=True,
+            download_name=job['artifact_name']
+        )
+
+    except Exception as e:
+        return jsonify({'error': 'Failed to download job result', 'message': str(e)}), 500
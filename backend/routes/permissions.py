@@ -9,6 +9,7 @@ from models.permission_model import (
 )
 from utils.auth_middleware import authenticate
 from utils.audit_logger import log_action
+from utils.session_cache import invalidate_user_sessions
 
 permissions_bp = Blueprint('permissions', __name__)
 
@@ -138,6 +139,8 @@ def grant_permission_route():
         granted = grant_permission(user_id, permission_name, g.user['user_id'])
 
         if granted:
+            invalidate_user_sessions(user_id)
+
             # Log action
             log_action('GRANT_PERMISSION', 'user_permissions', user_id,
                       {'permission': permission_name, 'granted_to': user.email})
@@ -183,6 +186,8 @@ def revoke_permission_route():
         revoked = revoke_permission(user_id, permission_name)
 
         if revoked:
+            invalidate_user_sessions(user_id)
+
             # Log action
             log_action('REVOKE_PERMISSION', 'user_permissions', user_id,
                       {'permission': permission_name, 'revoked_from': user.email})
@@ -226,6 +231,7 @@ def bulk_update_permissions_route():
 
         # Update permissions
         result = bulk_update_permissions(user_id, permission_names, g.user['user_id'])
+        invalidate_user_sessions(user_id)
 
         # Log action (wrapped in try-except to prevent audit log errors from failing the request)
         try:
@@ -3,7 +3,6 @@ Profile routes for user self-management
 Allows users to view/edit their own profile and change password
 """
 
-import bcrypt
 from datetime import datetime
 from flask import Blueprint, request, jsonify, g
 from extensions import db
@@ -13,7 +12,8 @@ from models.audit_model import AuditLog
 from models.permission_model import get_user_permissions
 from utils.auth_middleware import authenticate
 from utils.audit_logger import log_action
-from utils.cache_helper import get_cache_manager
+from utils.session_cache import invalidate_user_sessions
+from utils.password_hasher import password_hasher
 
 profile_bp = Blueprint('profile', __name__)
 
@@ -86,8 +86,7 @@ def update_profile():
         db.session.commit()
 
         # Invalidate cache
-        cache = get_cache_manager()
-        cache.delete(f"user_session:{user_id}")
+        invalidate_user_sessions(user_id)
 
         # Log action
         log_action('UPDATE', 'users', user_id, old_data, user.to_dict())
@@ -129,12 +128,11 @@ def change_password():
             return jsonify({'error': 'User not found'}), 404
 
         # Verify current password
-        if not bcrypt.checkpw(current_password.encode('utf-8'), user.password_hash.encode('utf-8')):
+        if not password_hasher.verify(current_password, user.password_hash, shed=False):
             return jsonify({'error': 'Current password is incorrect'}), 401
 
         # Hash new password
-        salt = bcrypt.gensalt()
-        new_password_hash = bcrypt.hashpw(new_password.encode('utf-8'), salt).decode('utf-8')
+        new_password_hash = password_hasher.hash(new_password)
 
         user.password_hash = new_password_hash
         user.updated_at = datetime.utcnow()
@@ -143,8 +141,7 @@ def change_password():
         db.session.commit()
 
         # Invalidate cache
-        cache = get_cache_manager()
-        cache.delete(f"user_session:{user_id}")
+        invalidate_user_sessions(user_id)
 
         # Log action (don't store passwords)
         log_action('PASSWORD_CHANGE', 'users', user_id, None, {'changed_at': datetime.utcnow().isoformat()})
@@ -8,7 +8,9 @@ from models.report_model import Report
 from models.billing_model import GSTBilling, NonGSTBilling
 from models.payment_model import PaymentType
 from utils.auth_middleware import authenticate
+from utils.permission_bits import user_has_permission
 from utils.audit_logger import log_action
+from services.job_runner import job_handler, wants_async, enqueue_job
 
 report_bp = Blueprint('report', __name__)
 
@@ -30,9 +32,7 @@ def generate_report():
         user_id = g.user['user_id']
 
         # Check user permissions for filtering
-        user_permissions = g.user.get('permissions', [])
-        is_super_admin = g.user.get('is_super_admin', False)
-        has_view_all = is_super_admin or 'view_all_bills' in user_permissions
+        has_view_all = user_has_permission(g.user, 'view_all_bills')
 
         # Validate required fields
         required_fields = ['start_date', 'end_date']
@@ -180,56 +180,84 @@ def get_report_details(report_id):
 def export_pdf():
     """
     Generate professional PDF report for GST bills with business header and logo watermark
+
+    Large reports can be built in the background with ?async=1 (or 'Prefer: respond-async')
     """
     try:
-        from reportlab.lib import colors
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch, cm, mm
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, HRFlowable, Image
-        from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-        from reportlab.pdfgen import canvas
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-        import urllib.request
-        import tempfile
-        import os
-
-        data = request.get_json()
+        data = request.get_json() or {}
         bills = data.get('bills', [])
         start_date = data.get('start_date', '')
         end_date = data.get('end_date', '')
 
-        # Get client and user info from g object (populated by auth middleware from Redis cache)
-        client_info = {
-            'client_name': g.client.get('client_name', ''),
-            'address': g.client.get('address', ''),
-            'phone': g.client.get('phone', ''),
-            'email': g.client.get('email', ''),
-            'gstin': g.client.get('gstin', '')
-        }
+        if not bills:
+            return jsonify({'error': 'No bills to export'}), 400
 
-        # Get logo URL for watermark
-        logo_url = g.client.get('logo_url', '')
+        if wants_async():
+            return enqueue_job('bills_pdf', {'bills': bills, 'start_date': start_date, 'end_date': end_date})
 
-        # Get user info for footer
-        user_full_name = g.user.get('full_name', g.user.get('email', 'User'))
+        buffer, filename, mimetype = build_bills_pdf(bills, start_date, end_date)
 
-        if not bills:
-            return jsonify({'error': 'No bills to export'}), 400
+        return send_file(
+            buffer,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=filename
+        )
+
+    except ImportError as e:
+        return jsonify({'error': 'PDF generation library not installed', 'message': str(e)}), 500
+    except Exception as e:
+        return jsonify({'error': 'Failed to generate PDF', 'message': str(e)}), 500
 
-        # Create PDF buffer
-        buffer = io.BytesIO()
 
-        # Download logo if available for watermark
-        logo_temp_path = None
-        if logo_url:
-            try:
-                logo_temp_path = tempfile.NamedTemporaryFile(delete=False, suffix='.png').name
-                urllib.request.urlretrieve(logo_url, logo_temp_path)
-            except Exception as e:
-                logo_temp_path = None
+def build_bills_pdf(bills, start_date='', end_date=''):
+    """
+    Render the GST bills PDF for the current client (g.client / g.user)
+
+    Returns:
+        (BytesIO, filename, mimetype)
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch, cm, mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, HRFlowable, Image
+    from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    import urllib.request
+    import tempfile
+    import os
+
+    # Get client and user info from g object (populated by auth middleware from Redis cache)
+    client_info = {
+        'client_name': g.client.get('client_name', ''),
+        'address': g.client.get('address', ''),
+        'phone': g.client.get('phone', ''),
+        'email': g.client.get('email', ''),
+        'gstin': g.client.get('gstin', '')
+    }
+
+    # Get logo URL for watermark
+    logo_url = g.client.get('logo_url', '')
+
+    # Get user info for footer
+    user_full_name = g.user.get('full_name', g.user.get('email', 'User'))
+
+    # Create PDF buffer
+    buffer = io.BytesIO()
+
+    # Download logo if available for watermark
+    logo_temp_path = None
+    if logo_url:
+        try:
+            logo_temp_path = tempfile.NamedTemporaryFile(delete=False, suffix='.png').name
+            urllib.request.urlretrieve(logo_url, logo_temp_path)
+        except Exception as e:
+            logo_temp_path = None
 
+    try:
         # Custom canvas class to add logo watermark on each page
         class WatermarkCanvas(canvas.Canvas):
             def __init__(self, *args, **kwargs):
@@ -498,30 +526,22 @@ def export_pdf():
 
         doc.build(elements, canvasmaker=canvas_maker)
 
-        # Cleanup temp logo file
-        if logo_temp_path and os.path.exists(logo_temp_path):
-            try:
-                os.unlink(logo_temp_path)
-            except:
-                pass
-
         # Get PDF bytes
         buffer.seek(0)
 
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'GST_Bills_{start_date}_to_{end_date}.pdf'
-        )
+        return buffer, f'GST_Bills_{start_date}_to_{end_date}.pdf', 'application/pdf'
 
-    except ImportError as e:
-        return jsonify({'error': 'PDF generation library not installed', 'message': str(e)}), 500
-    except Exception as e:
-        # Cleanup temp logo file on error
-        if 'logo_temp_path' in locals() and logo_temp_path and os.path.exists(logo_temp_path):
+    finally:
+        # Cleanup temp logo file
+        if logo_temp_path and os.path.exists(logo_temp_path):
             try:
                 os.unlink(logo_temp_path)
             except:
                 pass
-        return jsonify({'error': 'Failed to generate PDF', 'message': str(e)}), 500
+
+
+@job_handler('bills_pdf')
+def _run_bills_pdf(ctx):
+    ctx.set_progress(10, 'Rendering PDF')
+    params = ctx.params
+    ctx.write_artifact(*build_bills_pdf(params['bills'], params.get('start_date', ''), params.get('end_date', '')))
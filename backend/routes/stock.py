@@ -5,13 +5,18 @@ from datetime import datetime
 from flask import Blueprint, request, jsonify, g, send_file
 from werkzeug.utils import secure_filename
 import pandas as pd
+from sqlalchemy import select
 from extensions import db
 from models.stock_model import StockEntry
 from utils.auth_middleware import authenticate
 from utils.permission_middleware import require_permission
 from utils.audit_logger import log_action
-from utils.cache_helper import get_cache_manager, invalidate_stock_cache
+from utils.cache_helper import get_cache_manager, invalidate_stock_cache, cache_tags
 from utils.helpers import title_case
+from utils.stock_import import REQUIRED_COLUMNS, read_import_file, import_stock_frame
+from utils.product_index import product_index
+from utils.export_stream import stream_rows, csv_export, xlsx_export, export_response, format_datetime
+from services.job_runner import job_handler, wants_async, enqueue_job
 
 stock_bp = Blueprint('stock', __name__)
 
@@ -240,7 +245,7 @@ def get_stock():
 
         # Cache full list for future requests
         if not category and not search and not limit:
-            cache.set(f"stock:list:{client_id}", stock_data, STOCK_CACHE_TIMEOUT)
+            cache.set(f"stock:list:{client_id}", stock_data, STOCK_CACHE_TIMEOUT, tags=cache_tags(client_id, 'stock'))
 
         return jsonify({
             'success': True,
@@ -344,6 +349,9 @@ def update_stock(product_id):
 
         db.session.commit()
 
+        # Invalidate stock cache (codes, name or quantity may have changed)
+        invalidate_stock_cache(client_id)
+
         # Log action
         log_action('UPDATE', 'stock_entry', product_id, old_data, product.to_dict())
 
@@ -380,6 +388,9 @@ def delete_stock(product_id):
         db.session.delete(product)
         db.session.commit()
 
+        # Invalidate stock cache (deleted products need a full lookup index reload)
+        invalidate_stock_cache(client_id, reindex=True)
+
         # Log action
         log_action('DELETE', 'stock_entry', product_id, old_data, None)
 
@@ -399,6 +410,9 @@ def bulk_import_stock():
     """
     Bulk import stock from CSV or Excel file
     Supports both create new and update existing products
+
+    Large files can be processed in the background with ?async=1
+    (or 'Prefer: respond-async'); poll /api/jobs/<job_id> for the summary.
     """
     try:
         client_id = g.user['client_id']
@@ -419,154 +433,32 @@ def bulk_import_stock():
         if file_ext not in ['csv', 'xlsx', 'xls']:
             return jsonify({'error': 'Invalid file format. Only CSV, XLSX, XLS files are allowed'}), 400
 
+        if wants_async():
+            return enqueue_job('stock_import', {'filename': filename, 'file_ext': file_ext},
+                               files={filename: file})
+
         # Read file based on extension
         try:
-            if file_ext == 'csv':
-                df = pd.read_csv(file)
-            else:
-                df = pd.read_excel(file)
+            df = read_import_file(file, file_ext)
         except Exception as e:
             return jsonify({'error': 'Failed to read file', 'message': str(e)}), 400
 
         # Validate required columns
-        required_columns = ['product_name', 'quantity', 'rate']
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
 
         if missing_columns:
             return jsonify({
                 'error': f'Missing required columns: {", ".join(missing_columns)}',
-                'required_columns': required_columns,
+                'required_columns': REQUIRED_COLUMNS,
                 'found_columns': list(df.columns)
             }), 400
 
-        # Process each row
-        success_count = 0
-        error_count = 0
-        updated_count = 0
-        created_count = 0
-        errors = []
-
-        for index, row in df.iterrows():
-            try:
-                # Skip rows with missing required fields
-                if pd.isna(row['product_name']) or pd.isna(row['quantity']) or pd.isna(row['rate']):
-                    error_count += 1
-                    errors.append(f"Row {index + 2}: Missing required fields")
-                    continue
-
-                product_name = title_case(str(row['product_name']).strip())
-                quantity = int(row['quantity'])
-                rate = float(row['rate'])
-                category = title_case(str(row['category']).strip()) if 'category' in row and not pd.isna(row['category']) else 'Other'
-                unit = str(row['unit']).strip() if 'unit' in row and not pd.isna(row['unit']) else 'pcs'
-                low_stock_alert = int(row['low_stock_alert']) if 'low_stock_alert' in row and not pd.isna(row['low_stock_alert']) else 10
-                # Support both 'purchase_price' and 'cost_price' column names (purchase_price takes priority)
-                cost_price = None
-                if 'purchase_price' in row and not pd.isna(row['purchase_price']):
-                    cost_price = float(row['purchase_price'])
-                elif 'cost_price' in row and not pd.isna(row['cost_price']):
-                    cost_price = float(row['cost_price'])
-                mrp = float(row['mrp']) if 'mrp' in row and not pd.isna(row['mrp']) else None
-
-                # Handle item_code - auto-generate if not provided
-                item_code = str(row['item_code']).strip() if 'item_code' in row and not pd.isna(row['item_code']) else ''
-                if not item_code:
-                    item_code = generate_item_code(client_id, product_name)
-
-                # Handle barcode - set to None if empty
-                barcode = str(row['barcode']).strip() if 'barcode' in row and not pd.isna(row['barcode']) else ''
-                barcode = barcode if barcode else None
-
-                # Handle GST percentage and HSN code
-                gst_percentage = float(row['gst_percentage']) if 'gst_percentage' in row and not pd.isna(row['gst_percentage']) else 0
-                hsn_code = str(row['hsn_code']).strip() if 'hsn_code' in row and not pd.isna(row['hsn_code']) else ''
-
-                # Validate quantity and rate
-                if quantity < 0 or rate < 0:
-                    error_count += 1
-                    errors.append(f"Row {index + 2}: Quantity and rate must be positive")
-                    continue
-
-                # Check if product already exists
-                existing_product = StockEntry.query.filter_by(
-                    client_id=client_id,
-                    product_name=product_name
-                ).first()
-
-                if existing_product:
-                    # Update existing product (auto-sum quantity)
-                    old_data = existing_product.to_dict()
-                    existing_product.quantity += quantity
-                    existing_product.rate = rate
-                    existing_product.cost_price = cost_price if cost_price is not None else existing_product.cost_price
-                    existing_product.mrp = mrp if mrp is not None else existing_product.mrp
-                    existing_product.category = category
-                    existing_product.unit = unit
-                    existing_product.low_stock_alert = low_stock_alert
-                    existing_product.gst_percentage = gst_percentage
-                    existing_product.hsn_code = hsn_code
-
-                    # Auto-generate item_code if existing product doesn't have one
-                    if not existing_product.item_code:
-                        existing_product.item_code = item_code
-
-                    # Update barcode if provided and existing doesn't have one
-                    if barcode and not existing_product.barcode:
-                        existing_product.barcode = barcode
-
-                    existing_product.updated_at = datetime.utcnow()
-
-                    # Log action
-                    log_action('UPDATE', 'stock_entry', existing_product.product_id, old_data, existing_product.to_dict())
-
-                    updated_count += 1
-                else:
-                    # Create new product
-                    new_product = StockEntry(
-                        product_id=str(uuid.uuid4()),
-                        client_id=client_id,
-                        product_name=product_name,
-                        category=category,
-                        quantity=quantity,
-                        rate=rate,
-                        cost_price=cost_price,
-                        mrp=mrp,
-                        unit=unit,
-                        low_stock_alert=low_stock_alert,
-                        item_code=item_code,
-                        barcode=barcode,
-                        gst_percentage=gst_percentage,
-                        hsn_code=hsn_code,
-                        created_at=datetime.utcnow()
-                    )
-
-                    db.session.add(new_product)
-
-                    # Log action
-                    log_action('CREATE', 'stock_entry', new_product.product_id, None, new_product.to_dict())
-
-                    created_count += 1
-
-                success_count += 1
-
-            except Exception as e:
-                error_count += 1
-                errors.append(f"Row {index + 2}: {str(e)}")
-
-        # Commit all changes
-        db.session.commit()
+        summary = _import_stock(client_id, df, filename)
 
         return jsonify({
             'success': True,
             'message': 'Bulk import completed',
-            'summary': {
-                'total_rows': len(df),
-                'success_count': success_count,
-                'created_count': created_count,
-                'updated_count': updated_count,
-                'error_count': error_count,
-                'errors': errors[:10] if errors else []  # Return first 10 errors
-            }
+            'summary': summary
         }), 200
 
     except Exception as e:
@@ -574,6 +466,44 @@ def bulk_import_stock():
         return jsonify({'error': 'Failed to import stock', 'message': str(e)}), 500
 
 
+def _import_stock(client_id, df, filename):
+    """Import a validated frame, write one audit record and commit (shared by the sync and job paths)"""
+    # Validate, merge and write all rows with batched statements
+    summary, audit_data = import_stock_frame(client_id, df)
+
+    # Single audit record for the whole import
+    audit_data['filename'] = filename
+    log_action('STOCK_IMPORT', 'stock_entry', None, None, audit_data)
+
+    # Commit all changes
+    db.session.commit()
+
+    # Invalidate stock cache (full lookup index reload - a long import can outlast the delta window)
+    invalidate_stock_cache(client_id, reindex=True)
+
+    return summary
+
+
+@job_handler('stock_import')
+def _run_stock_import(ctx):
+    """Background bulk import - the uploaded file was saved in the job directory"""
+    filename = ctx.params['filename']
+    ctx.set_progress(10, 'Reading file')
+    with open(ctx.path(filename), 'rb') as file:
+        df = read_import_file(file, ctx.params['file_ext'])
+
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f'Missing required columns: {", ".join(missing_columns)}')
+
+    ctx.set_progress(30, f'Importing {len(df)} rows')
+    try:
+        return _import_stock(g.user['client_id'], df, filename)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
 @stock_bp.route('/download-template', methods=['POST'])
 @authenticate
 def download_template():
@@ -649,58 +579,63 @@ def download_template():
 @stock_bp.route('/bulk-export', methods=['POST'])
 @authenticate
 def bulk_export_stock():
-    """Export all stock data to CSV or Excel"""
+    """Export all stock data to CSV or Excel (?async=1 to build it as a background job)"""
     try:
         client_id = g.user['client_id']
         data = request.get_json() or {}
         file_format = data.get('format', 'csv')
 
-        # Get all stock entries
-        stock_entries = StockEntry.query.filter_by(client_id=client_id).order_by(StockEntry.product_name).all()
+        if wants_async():
+            return enqueue_job('stock_export', {'format': file_format})
 
-        if not stock_entries:
+        export = build_stock_export(client_id, file_format)
+        if export is None:
             return jsonify({'error': 'No stock data to export'}), 404
 
-        # Convert to DataFrame
-        data = []
-        for stock in stock_entries:
-            data.append({
-                'product_name': stock.product_name,
-                'quantity': stock.quantity,
-                'rate': stock.rate,
-                'category': stock.category,
-                'unit': stock.unit,
-                'low_stock_alert': stock.low_stock_alert,
-                'created_at': stock.created_at.strftime('%Y-%m-%d %H:%M:%S') if stock.created_at else ''
-            })
+        return export_response(*export)
 
-        df = pd.DataFrame(data)
+    except Exception as e:
+        return jsonify({'error': 'Failed to export stock', 'message': str(e)}), 500
 
-        # Create in-memory file
-        output = io.BytesIO()
 
-        if file_format == 'csv':
-            df.to_csv(output, index=False)
-            output.seek(0)
-            return send_file(
-                output,
-                mimetype='text/csv',
-                as_attachment=True,
-                download_name='stock_export.csv'
-            )
-        else:  # xlsx
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Stock')
-            output.seek(0)
-            return send_file(
-                output,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                as_attachment=True,
-                download_name='stock_export.xlsx'
-            )
+STOCK_EXPORT_COLUMNS = ['product_name', 'quantity', 'rate', 'category', 'unit', 'low_stock_alert', 'created_at']
 
-    except Exception as e:
-        return jsonify({'error': 'Failed to export stock', 'message': str(e)}), 500
+
+def build_stock_export(client_id, file_format='csv'):
+    """
+    Build the stock export, streaming rows from a server-side cursor
+
+    Returns:
+        (body, filename, mimetype) for export_response - a CSV chunk generator or
+        an XLSX temporary file - or None when the client has no stock
+    """
+    has_stock = db.session.query(StockEntry.query.filter_by(client_id=client_id).exists()).scalar()
+    if not has_stock:
+        return None
+
+    stmt = select(
+        StockEntry.product_name, StockEntry.quantity, StockEntry.rate, StockEntry.category,
+        StockEntry.unit, StockEntry.low_stock_alert, StockEntry.created_at
+    ).where(StockEntry.client_id == client_id).order_by(StockEntry.product_name)
+
+    rows = (
+        (*row[:-1], format_datetime(row.created_at))
+        for row in stream_rows(stmt)
+    )
+
+    if file_format == 'csv':
+        return csv_export(STOCK_EXPORT_COLUMNS, rows, 'stock_export.csv')
+    else:  # xlsx
+        return xlsx_export(STOCK_EXPORT_COLUMNS, rows, 'stock_export.xlsx', sheet_name='Stock')
+
+
+@job_handler('stock_export')
+def _run_stock_export(ctx):
+    ctx.set_progress(10, 'Building stock export')
+    export = build_stock_export(g.user['client_id'], ctx.params.get('format', 'csv'))
+    if export is None:
+        raise ValueError('No stock data to export')
+    ctx.write_artifact(*export)
 
 
 @stock_bp.route('/lookup/<code>', methods=['GET'])
@@ -723,34 +658,13 @@ def lookup_product(code):
                 'message': 'Empty search code provided'
             }), 404
 
-        # Search by barcode first (most common for scanner)
-        product = StockEntry.query.filter_by(
-            client_id=client_id,
-            barcode=normalized_code
-        ).first()
-
-        # Try barcode without spaces (some scanners add spaces)
-        if not product:
-            code_no_spaces = normalized_code.replace(' ', '')
-            if code_no_spaces != normalized_code:
-                product = StockEntry.query.filter_by(
-                    client_id=client_id,
-                    barcode=code_no_spaces
-                ).first()
-
-        # If not found by barcode, try item_code
-        if not product:
-            product = StockEntry.query.filter_by(
-                client_id=client_id,
-                item_code=normalized_code
-            ).first()
-
-        # If still not found, try exact product name match
-        if not product:
-            product = StockEntry.query.filter(
-                StockEntry.client_id == client_id,
-                StockEntry.product_name.ilike(normalized_code)
-            ).first()
+        # Answer from the in-process index; fall back to the database on a miss (or when disabled)
+        product = product_index.lookup(client_id, normalized_code)
+        if product is None:
+            entry = _lookup_product_in_db(client_id, normalized_code)
+            if entry:
+                product_index.add(client_id, entry)
+                product = entry.to_dict()
 
         if not product:
             return jsonify({
@@ -760,164 +674,216 @@ def lookup_product(code):
 
         # Check stock availability (null-safe check for low_stock_alert)
         stock_status = 'available'
-        if product.quantity == 0:
+        if product['quantity'] == 0:
             stock_status = 'out_of_stock'
-        elif product.low_stock_alert and product.quantity <= product.low_stock_alert:
+        elif product['low_stock_alert'] and product['quantity'] <= product['low_stock_alert']:
             stock_status = 'low_stock'
 
         return jsonify({
             'success': True,
-            'product': product.to_dict(),
+            'product': product,
             'stock_status': stock_status,
-            'available_quantity': product.quantity
+            'available_quantity': product['quantity']
         }), 200
 
     except Exception as e:
         return jsonify({'error': 'Failed to lookup product', 'message': str(e)}), 500
 
 
+def _lookup_product_in_db(client_id, normalized_code):
+    """Sequential barcode / item code / name queries (index miss fallback)"""
+    # Search by barcode first (most common for scanner)
+    product = StockEntry.query.filter_by(
+        client_id=client_id,
+        barcode=normalized_code
+    ).first()
+
+    # Try barcode without spaces (some scanners add spaces)
+    if not product:
+        code_no_spaces = normalized_code.replace(' ', '')
+        if code_no_spaces != normalized_code:
+            product = StockEntry.query.filter_by(
+                client_id=client_id,
+                barcode=code_no_spaces
+            ).first()
+
+    # If not found by barcode, try item_code
+    if not product:
+        product = StockEntry.query.filter_by(
+            client_id=client_id,
+            item_code=normalized_code
+        ).first()
+
+    # If still not found, try exact product name match
+    if not product:
+        product = StockEntry.query.filter(
+            StockEntry.client_id == client_id,
+            StockEntry.product_name.ilike(normalized_code)
+        ).first()
+
+    return product
+
+
 @stock_bp.route('/export-low-stock', methods=['POST'])
 @authenticate
 def export_low_stock():
-    """Export low stock items to PDF or Excel for easy ordering"""
+    """Export low stock items to PDF or Excel for easy ordering (?async=1 for a background job)"""
     try:
         client_id = g.user['client_id']
         data = request.get_json() or {}
         file_format = data.get('format', 'xlsx')
 
-        # Get low stock items
-        low_stock = StockEntry.query.filter(
-            StockEntry.client_id == client_id,
-            StockEntry.quantity <= StockEntry.low_stock_alert
-        ).order_by(StockEntry.quantity).all()
+        if wants_async():
+            return enqueue_job('low_stock_export', {'format': file_format})
 
-        if not low_stock:
+        export = build_low_stock_export(client_id, file_format)
+        if export is None:
             return jsonify({'error': 'No low stock items to export'}), 404
 
-        # Prepare data for export
-        export_data = []
-        total_cost = 0
-        for item in low_stock:
-            need_to_order = max(0, item.low_stock_alert - item.quantity)
-            estimated_cost = need_to_order * float(item.rate)
-            total_cost += estimated_cost
-
-            export_data.append({
-                'Product Name': item.product_name,
-                'Category': item.category or '-',
-                'Current Stock': f"{item.quantity} {item.unit}",
-                'Min. Required': f"{item.low_stock_alert} {item.unit}",
-                'Need to Order': f"{need_to_order} {item.unit}",
-                'Rate per Unit': f"₹{float(item.rate):.2f}",
-                'Estimated Cost': f"₹{estimated_cost:.2f}"
-            })
-
-        df = pd.DataFrame(export_data)
-
-        # Add total row
-        total_row = {
-            'Product Name': 'TOTAL',
-            'Category': '',
-            'Current Stock': '',
-            'Min. Required': '',
-            'Need to Order': '',
-            'Rate per Unit': '',
-            'Estimated Cost': f"₹{total_cost:.2f}"
-        }
-        df = pd.concat([df, pd.DataFrame([total_row])], ignore_index=True)
-
-        output = io.BytesIO()
+        return export_response(*export)
 
-        if file_format == 'pdf':
-            # For PDF, we'll create a simple HTML and convert it
-            # You can use libraries like reportlab or weasyprint for better PDF generation
-            html_content = f"""
-            <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                    h1 {{ color: #dc2626; }}
-                    table {{ border-collapse: collapse; width: 100%; margin-top: 20px; }}
-                    th, td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
-                    th {{ background-color: #fee; color: #991b1b; font-weight: bold; }}
-                    .total-row {{ background-color: #f0f0f0; font-weight: bold; }}
-                    .header {{ margin-bottom: 20px; }}
-                    .alert {{ background-color: #fee; padding: 15px; border-left: 4px solid #dc2626; margin-bottom: 20px; }}
-                </style>
-            </head>
-            <body>
-                <div class="header">
-                    <h1>[WARNING] Low Stock Report - Order Required</h1>
-                    <p><strong>Generated on:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                    <p><strong>Total Items:</strong> {len(low_stock)}</p>
-                </div>
-                <div class="alert">
-                    <p><strong>Action Required:</strong> These items need immediate restocking to maintain inventory levels.</p>
-                </div>
-                {df.to_html(index=False, classes='table', escape=False)}
-                <p style="margin-top: 20px;"><em>This is an automatically generated report from your billing system.</em></p>
-            </body>
-            </html>
-            """
-
-            # Simple HTML to PDF conversion (basic approach)
-            # For production, use proper PDF libraries
-            output.write(html_content.encode('utf-8'))
-            output.seek(0)
+    except Exception as e:
+        return jsonify({'error': 'Failed to export low stock report', 'message': str(e)}), 500
 
-            return send_file(
-                output,
-                mimetype='text/html',  # Change to 'application/pdf' with proper PDF library
-                as_attachment=True,
-                download_name=f'low_stock_report_{datetime.now().strftime("%Y%m%d")}.html'
-            )
-        else:  # Excel
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Low Stock Report')
-
-                # Get workbook and worksheet
-                workbook = writer.book
-                worksheet = writer.sheets['Low Stock Report']
-
-                # Style the header
-                from openpyxl.styles import Font, PatternFill, Alignment
-                header_fill = PatternFill(start_color='FEE2E2', end_color='FEE2E2', fill_type='solid')
-                header_font = Font(bold=True, color='991B1B')
-
-                for cell in worksheet[1]:
-                    cell.fill = header_fill
-                    cell.font = header_font
-                    cell.alignment = Alignment(horizontal='left')
-
-                # Style the total row
-                last_row = worksheet.max_row
-                total_fill = PatternFill(start_color='F3F4F6', end_color='F3F4F6', fill_type='solid')
-                total_font = Font(bold=True)
-
-                for cell in worksheet[last_row]:
-                    cell.fill = total_fill
-                    cell.font = total_font
-
-                # Adjust column widths
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
 
-            output.seek(0)
-            return send_file(
-                output,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                as_attachment=True,
-                download_name=f'low_stock_report_{datetime.now().strftime("%Y%m%d")}.xlsx'
-            )
+def build_low_stock_export(client_id, file_format='xlsx'):
+    """
+    Build the low stock report
 
-    except Exception as e:
-        return jsonify({'error': 'Failed to export low stock report', 'message': str(e)}), 500
+    Returns:
+        (BytesIO, filename, mimetype), or None when nothing is below its alert level
+    """
+    # Get low stock items
+    low_stock = StockEntry.query.filter(
+        StockEntry.client_id == client_id,
+        StockEntry.quantity <= StockEntry.low_stock_alert
+    ).order_by(StockEntry.quantity).all()
+
+    if not low_stock:
+        return None
+
+    # Prepare data for export
+    export_data = []
+    total_cost = 0
+    for item in low_stock:
+        need_to_order = max(0, item.low_stock_alert - item.quantity)
+        estimated_cost = need_to_order * float(item.rate)
+        total_cost += estimated_cost
+
+        export_data.append({
+            'Product Name': item.product_name,
+            'Category': item.category or '-',
+            'Current Stock': f"{item.quantity} {item.unit}",
+            'Min. Required': f"{item.low_stock_alert} {item.unit}",
+            'Need to Order': f"{need_to_order} {item.unit}",
+            'Rate per Unit': f"₹{float(item.rate):.2f}",
+            'Estimated Cost': f"₹{estimated_cost:.2f}"
+        })
+
+    df = pd.DataFrame(export_data)
+
+    # Add total row
+    total_row = {
+        'Product Name': 'TOTAL',
+        'Category': '',
+        'Current Stock': '',
+        'Min. Required': '',
+        'Need to Order': '',
+        'Rate per Unit': '',
+        'Estimated Cost': f"₹{total_cost:.2f}"
+    }
+    df = pd.concat([df, pd.DataFrame([total_row])], ignore_index=True)
+
+    output = io.BytesIO()
+
+    if file_format == 'pdf':
+        # For PDF, we'll create a simple HTML and convert it
+        # You can use libraries like reportlab or weasyprint for better PDF generation
+        html_content = f"""
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 20px; }}
+                h1 {{ color: #dc2626; }}
+                table {{ border-collapse: collapse; width: 100%; margin-top: 20px; }}
+                th, td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
+                th {{ background-color: #fee; color: #991b1b; font-weight: bold; }}
+                .total-row {{ background-color: #f0f0f0; font-weight: bold; }}
+                .header {{ margin-bottom: 20px; }}
+                .alert {{ background-color: #fee; padding: 15px; border-left: 4px solid #dc2626; margin-bottom: 20px; }}
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h1>[WARNING] Low Stock Report - Order Required</h1>
+                <p><strong>Generated on:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
+                <p><strong>Total Items:</strong> {len(low_stock)}</p>
+            </div>
+            <div class="alert">
+                <p><strong>Action Required:</strong> These items need immediate restocking to maintain inventory levels.</p>
+            </div>
+            {df.to_html(index=False, classes='table', escape=False)}
+            <p style="margin-top: 20px;"><em>This is an automatically generated report from your billing system.</em></p>
+        </body>
+        </html>
+        """
+
+        # Simple HTML to PDF conversion (basic approach)
+        # For production, use proper PDF libraries
+        output.write(html_content.encode('utf-8'))
+        output.seek(0)
+
+        # Change mimetype to 'application/pdf' with proper PDF library
+        return output, f'low_stock_report_{datetime.now().strftime("%Y%m%d")}.html', 'text/html'
+    else:  # Excel
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            df.to_excel(writer, index=False, sheet_name='Low Stock Report')
+
+            # Get workbook and worksheet
+            workbook = writer.book
+            worksheet = writer.sheets['Low Stock Report']
+
+            # Style the header
+            from openpyxl.styles import Font, PatternFill, Alignment
+            header_fill = PatternFill(start_color='FEE2E2', end_color='FEE2E2', fill_type='solid')
+            header_font = Font(bold=True, color='991B1B')
+
+            for cell in worksheet[1]:
+                cell.fill = header_fill
+                cell.font = header_font
+                cell.alignment = Alignment(horizontal='left')
+
+            # Style the total row
+            last_row = worksheet.max_row
+            total_fill = PatternFill(start_color='F3F4F6', end_color='F3F4F6', fill_type='solid')
+            total_font = Font(bold=True)
+
+            for cell in worksheet[last_row]:
+                cell.fill = total_fill
+                cell.font = total_font
+
+            # Adjust column widths
+            for column in worksheet.columns:
+                max_length = 0
+                column_letter = column[0].column_letter
+                for cell in column:
+                    try:
+                        if len(str(cell.value)) > max_length:
+                            max_length = len(str(cell.value))
+                    except:
+                        pass
+                adjusted_width = min(max_length + 2, 50)
+                worksheet.column_dimensions[column_letter].width = adjusted_width
+
+        output.seek(0)
+        return (output, f'low_stock_report_{datetime.now().strftime("%Y%m%d")}.xlsx',
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+
+@job_handler('low_stock_export')
+def _run_low_stock_export(ctx):
+    ctx.set_progress(10, 'Building low stock report')
+    export = build_low_stock_export(g.user['client_id'], ctx.params.get('format', 'xlsx'))
+    if export is None:
+        raise ValueError('No low stock items to export')
+    ctx.write_artifact(*export)
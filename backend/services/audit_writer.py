@@ -0,0 +1,273 @@
+"""
+Audit Writer - audit_log rows written in batches off the request path
+
+log_action() hands compact events (changed fields only for updates) to this
+writer instead of adding an AuditLog row to the request's transaction:
+
+    request threads --enqueue--> buffer + spool segment --every AUDIT_FLUSH_SECONDS
+                                                          or AUDIT_BATCH_SIZE events--> one INSERT batch
+
+Durability: every event is appended to the process's current spool segment
+(AUDIT_SPOOL_DIR/audit-<pid>-<n>.jsonl) and flushed to the OS before enqueue()
+returns, so it survives the process crashing. A flush (every flush cycle and at
+shutdown) fsyncs and closes the segment, so after a power cut or OS crash at
+most the events of the open segment are lost. It then inserts the segment's
+events in one transaction and deletes the file; if the insert
+fails the segment is kept and retried. Segments left by a process that died
+(untouched for STALE_SEGMENT_SECONDS) are replayed by any other process.
+Inserts ignore log_ids already present, so a replayed or retried event is
+never written twice. Rows rejected by the database (e.g. a client deleted
+meanwhile) are dropped one by one without failing the batch.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'audit-'
+SEGMENT_SUFFIX = '.jsonl'
+REPLAY_SUFFIX = '.replay'
+# A segment this old belongs to a process that is gone (live ones rotate every flush)
+STALE_SEGMENT_SECONDS = 120
+# Longest retry delay while the database rejects batches
+RETRY_MAX_SECONDS = 60
+
+
+def _insert_statement(engine):
+    """INSERT into audit_log that skips log_ids already present"""
+    from models.audit_model import AuditLog
+
+    if engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(AuditLog.__table__).on_conflict_do_nothing(index_elements=['log_id'])
+
+
+def _row(event: Dict) -> Dict:
+    row = dict(event)
+    if isinstance(row.get('timestamp'), str):
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    return row
+
+
+class AuditWriter:
+    """Per-process audit buffer with a spool on disk and a background flush thread"""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.getenv(
+            'AUDIT_SPOOL_DIR', os.path.expanduser('~/.mj-billing/audit_spool')
+        )
+        self.flush_seconds = float(os.getenv('AUDIT_FLUSH_SECONDS', '1'))
+        self.batch_size = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+        self.app = None
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time (thread or shutdown)
+        self._wake = threading.Event()
+        self._pid = None
+        self._buffer = []
+        self._segment = None
+        self._segment_path = None
+        self._segment_seq = 0
+        self._failed = []  # (path, events) of segments whose insert failed
+        self._retry_at = 0.0
+        self._retry_delay = 1.0
+        self._replayed_at = 0.0
+
+        self.stats = {'events': 0, 'written': 0, 'batches': 0, 'rejected': 0, 'replayed': 0, 'retries': 0}
+
+    def init_app(self, app):
+        self.app = app
+        os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.app is not None
+
+    def _ensure_started(self):
+        """Start the flush thread lazily in each worker process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # State copied from the parent by fork belongs to the parent's spool
+            self._buffer = []
+            self._segment = None
+            self._segment_path = None
+            self._failed = []
+            self._pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='audit-writer', daemon=True).start()
+
+    def enqueue(self, events: List[Dict]):
+        """Spool and buffer events"""
+        if not events:
+            return
+        self._ensure_started()
+        lines = ''.join(json.dumps(event, separators=(',', ':'), default=str) + '\n' for event in events)
+
+        with self._lock:
+            if self._segment is None:
+                self._segment_seq += 1
+                self._segment_path = os.path.join(
+                    self.directory, f"{SEGMENT_PREFIX}{os.getpid()}-{self._segment_seq}{SEGMENT_SUFFIX}"
+                )
+                self._segment = open(self._segment_path, 'a', encoding='utf-8')
+            self._segment.write(lines)
+            self._segment.flush()
+            self._buffer.extend(events)
+            self.stats['events'] += len(events)
+            full = len(self._buffer) >= self.batch_size
+
+        if full:
+            self._wake.set()
+
+    def _rotate(self):
+        """Close the current segment (on disk: fsync'd); returns (path, events) to write"""
+        with self._lock:
+            if self._segment is None:
+                return None, []
+            segment, path, events = self._segment, self._segment_path, self._buffer
+            self._segment, self._segment_path, self._buffer = None, None, []
+
+        # Outside the lock: enqueue() carries on with a new segment meanwhile
+        try:
+            os.fsync(segment.fileno())
+        except OSError as e:
+            logger.warning(f"[AuditWriter] fsync of {path} failed: {e}")
+        segment.close()
+        return path, events
+
+    def flush(self):
+        """Write buffered events now (also retries failed segments)"""
+        with self._flush_lock:
+            if self._failed and time.monotonic() >= self._retry_at:
+                failed, self._failed = self._failed, []
+                for path, events in failed:
+                    self.stats['retries'] += 1
+                    self._write_segment(path, events)
+
+            path, events = self._rotate()
+            if events:
+                self._write_segment(path, events)
+
+            if time.monotonic() - self._replayed_at >= STALE_SEGMENT_SECONDS:
+                self._replayed_at = time.monotonic()
+                self._replay_stale()
+
+    def _write_segment(self, path, events):
+        try:
+            self._write(events)
+        except Exception as e:
+            logger.error(f"[AuditWriter] Writing {len(events)} audit events failed, kept for retry: {e}")
+            self._failed.append((path, events))
+            self._retry_at = time.monotonic() + self._retry_delay
+            self._retry_delay = min(self._retry_delay * 2, RETRY_MAX_SECONDS)
+            return False
+
+        self._retry_delay = 1.0
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _write(self, events):
+        from extensions import db
+
+        rows = [_row(event) for event in events]
+        with self.app.app_context():
+            engine = db.engine
+            stmt = _insert_statement(engine)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(stmt, rows)
+                self.stats['written'] += len(rows)
+            except IntegrityError:
+                # One bad row must not lose the batch: write row by row, drop the rejected ones
+                with engine.connect() as conn:
+                    for row in rows:
+                        try:
+                            with conn.begin():
+                                conn.execute(stmt, row)
+                            self.stats['written'] += 1
+                        except IntegrityError as e:
+                            self.stats['rejected'] += 1
+                            logger.warning(
+                                f"[AuditWriter] Dropped audit event {row.get('action_type')} on "
+                                f"{row.get('table_name')} ({row.get('record_id')}): {str(e.orig)[:120]}"
+                            )
+            self.stats['batches'] += 1
+
+    def _replay_stale(self):
+        """Write segments left behind by processes that stopped"""
+        own = {path for path, _ in self._failed}
+        now = time.time()
+        for name in os.listdir(self.directory):
+            # Spool segments, or segments claimed by a replay that did not finish
+            if not name.startswith(SEGMENT_PREFIX) or not name.endswith((SEGMENT_SUFFIX, REPLAY_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if path in own or now - os.path.getmtime(path) < STALE_SEGMENT_SECONDS:
+                    continue
+                # Claim it: only one process wins the rename
+                base = name[:name.index(SEGMENT_SUFFIX) + len(SEGMENT_SUFFIX)]
+                claimed = os.path.join(self.directory, f"{base}.{os.getpid()}{REPLAY_SUFFIX}")
+                os.replace(path, claimed)
+            except OSError:
+                continue
+
+            events = []
+            with open(claimed, encoding='utf-8') as segment:
+                for line in segment:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        pass  # line cut short by the crash
+            if events and self._write_segment(claimed, events):
+                self.stats['replayed'] += len(events)
+                logger.info(f"[AuditWriter] Replayed {len(events)} audit events from {name}")
+            elif not events:
+                os.remove(claimed)
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[AuditWriter] Flush failed: {e}")
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats, buffered=len(self._buffer), failed_segments=len(self._failed))
+
+
+# Global writer instance (app attached in app.py)
+audit_writer = AuditWriter()
+
+
+def init_audit_writer(app):
+    """Attach the Flask app and flush the buffer when the process exits"""
+    audit_writer.init_app(app)
+
+    import atexit
+    def on_shutdown():
+        if audit_writer._pid == os.getpid():
+            audit_writer.flush()
+
+    atexit.register(on_shutdown)
+    logger.info(f"[AuditWriter] Ready - flushing every {audit_writer.flush_seconds:g}s, spool at {audit_writer.directory}")
+    return audit_writer
+
+
+__all__ = ['audit_writer', 'AuditWriter', 'init_audit_writer']
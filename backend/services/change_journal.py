@@ -0,0 +1,237 @@
+"""
+Change Journal - local change-data-capture for the offline sync
+
+Every write to a synced table in the local SQLite database appends a row to
+sync_journal in the same transaction:
+
+    seq | table_name | row_key | operation | client_id | recorded_at
+
+seq is strictly increasing (AUTOINCREMENT, never reused), so SyncService only
+ships the entries after the last acknowledged sequence and the cost of a sync
+cycle follows the number of changes, not the size of the tables. Entries hold
+keys only - the current row is read at sync time, which is why superseded
+entries for the same row can be compacted away.
+
+ORM writes (add / modify / delete through db.session) are captured by an
+after_flush listener. Core statements bypass the ORM, so code writing synced
+tables with insert() / update() calls record_changes() with the affected keys.
+"""
+import logging
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, event, text
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Tables whose writes are journaled (and pushed by SyncService), in foreign key order
+JOURNALED_TABLES = (
+    'payment_type',
+    'customer',
+    'stock_entry',
+    'gst_billing',
+    'non_gst_billing',
+    'expense',
+)
+
+# Kept out of db.metadata: the journal only exists in the local SQLite database
+journal_metadata = MetaData()
+
+sync_journal = Table(
+    'sync_journal', journal_metadata,
+    Column('seq', Integer, primary_key=True, autoincrement=True),
+    Column('table_name', String(64), nullable=False),
+    Column('row_key', String(64), nullable=False),
+    Column('operation', String(10), nullable=False),  # 'insert', 'update' or 'delete'
+    Column('client_id', String(64)),
+    Column('recorded_at', DateTime, nullable=False, default=datetime.utcnow),
+    Index('ix_sync_journal_row', 'table_name', 'row_key'),
+    sqlite_autoincrement=True
+)
+
+# Cloud value of a delta column (stock quantity) already folded into the local
+# row, and the push batch that last set it: local - value = changes made here
+# that the cloud has not seen yet
+sync_base = Table(
+    'sync_base', journal_metadata,
+    Column('table_name', String(64), primary_key=True),
+    Column('row_key', String(64), primary_key=True),
+    Column('column_name', String(64), primary_key=True),
+    Column('value', Integer),
+    Column('stamp', String(32)),
+)
+
+_enabled = False
+
+
+def _entry(obj, operation):
+    table_name = getattr(obj, '__tablename__', None)
+    if table_name not in JOURNALED_TABLES:
+        return None
+
+    row_key = sa_inspect(obj).mapper.primary_key_from_instance(obj)[0]
+    if row_key is None:
+        return None
+
+    client_id = getattr(obj, 'client_id', None)
+    return {
+        'table_name': table_name,
+        'row_key': str(row_key),
+        'operation': operation,
+        'client_id': str(client_id) if client_id else None,
+        'recorded_at': datetime.utcnow()
+    }
+
+
+@event.listens_for(Session, 'after_flush')
+def _journal_flush(session, flush_context):
+    """Append journal entries for the rows written by this flush (same transaction)"""
+    if not _enabled:
+        return
+
+    entries = [_entry(obj, 'insert') for obj in session.new]
+    entries += [
+        _entry(obj, 'update') for obj in session.dirty
+        if session.is_modified(obj, include_collections=False)
+    ]
+    entries += [_entry(obj, 'delete') for obj in session.deleted]
+    entries = [entry for entry in entries if entry]
+
+    if entries:
+        session.connection().execute(sync_journal.insert(), entries)
+
+
+def record_changes(table_name: str, keys: Iterable, operation: str = 'update',
+                   client_id: Optional[str] = None, session=None):
+    """
+    Journal rows written with Core statements (caller's transaction, caller commits).
+
+    Example:
+        db.session.execute(update(stock).where(...).returning(stock.c.product_id))
+        record_changes('stock_entry', reserved_ids, client_id=client_id)
+    """
+    if not _enabled or table_name not in JOURNALED_TABLES:
+        return
+
+    if session is None:
+        from extensions import db
+        session = db.session
+
+    now = datetime.utcnow()
+    entries = [
+        {
+            'table_name': table_name,
+            'row_key': str(key),
+            'operation': operation,
+            'client_id': str(client_id) if client_id else None,
+            'recorded_at': now
+        }
+        for key in keys
+    ]
+    if entries:
+        session.execute(sync_journal.insert(), entries)
+
+
+def create_journal(engine):
+    """
+    Create the journal table if missing (local database only), and sync_base.
+
+    When the journal is new, rows written before it existed are queued once:
+    rows never pushed (synced_at IS NULL) and every row of tables that had no
+    sync tracking. Pushing is an upsert, so re-sending a row is harmless.
+
+    Returns:
+        bool: True if the journal was created
+    """
+    if sa_inspect(engine).has_table(sync_journal.name):
+        sync_base.create(engine, checkfirst=True)
+        return False
+
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        journal_metadata.create_all(conn)
+        inspector = sa_inspect(conn)
+
+        for name in JOURNALED_TABLES:
+            if not inspector.has_table(name):
+                continue
+
+            key = inspector.get_pk_constraint(name)['constrained_columns'][0]
+            columns = {column['name'] for column in inspector.get_columns(name)}
+            where = "WHERE synced_at IS NULL" if 'synced_at' in columns else ""
+            conn.execute(text(f"""
+                INSERT INTO sync_journal (table_name, row_key, operation, client_id, recorded_at)
+                SELECT :table_name, {key}, 'insert', client_id, :now FROM {name}
+                {where} ORDER BY created_at
+            """), {"table_name": name, "now": now})
+
+    return True
+
+
+def compact_journal(conn, table_name: Optional[str] = None):
+    """
+    Collapse several pending entries for the same row into one.
+
+    The earliest entry is kept (so a row still ships before rows written after
+    it, e.g. a customer before that customer's bills) and takes the operation
+    of the latest entry.
+
+    Args:
+        table_name: Only compact this table's entries (all tables if None)
+
+    Returns:
+        int: Number of entries removed
+    """
+    scope = "AND table_name = :table_name" if table_name else ""
+    params = {"table_name": table_name} if table_name else {}
+
+    conn.execute(text(f"""
+        UPDATE sync_journal SET operation = (
+            SELECT latest.operation FROM sync_journal latest
+            WHERE latest.table_name = sync_journal.table_name
+              AND latest.row_key = sync_journal.row_key
+            ORDER BY latest.seq DESC LIMIT 1
+        )
+        WHERE seq IN (
+            SELECT MIN(seq) FROM sync_journal WHERE 1 = 1 {scope}
+            GROUP BY table_name, row_key HAVING COUNT(*) > 1
+        )
+    """), params)
+    result = conn.execute(text(f"""
+        DELETE FROM sync_journal WHERE 1 = 1 {scope} AND seq NOT IN (
+            SELECT MIN(seq) FROM sync_journal WHERE 1 = 1 {scope} GROUP BY table_name, row_key
+        )
+    """), params)
+    return result.rowcount
+
+
+def init_change_journal(app):
+    """Start journaling ORM writes (offline mode only - online writes go straight to PostgreSQL)"""
+    global _enabled
+
+    if app.config.get('DB_MODE') != 'offline':
+        logger.info("[ChangeJournal] Not in offline mode - journal disabled")
+        return False
+
+    from extensions import db
+
+    with app.app_context():
+        create_journal(db.engine)
+
+    _enabled = True
+    logger.info("[ChangeJournal] Journaling writes to synced tables")
+    return True
+
+
+__all__ = [
+    'JOURNALED_TABLES',
+    'sync_journal',
+    'sync_base',
+    'record_changes',
+    'create_journal',
+    'compact_journal',
+    'init_change_journal',
+]
@@ -0,0 +1,417 @@
+"""
+Background Job Runner - Imports, exports and PDF generation off the request path
+
+Jobs are persisted in a SQLite job table (JOBS_DB_PATH) shared by all gunicorn
+workers on the machine, so any worker can report status or serve the artifact.
+Each worker runs a small thread pool (JOB_WORKERS, default 2); a job is claimed
+with an atomic UPDATE so it runs exactly once even if several workers see it.
+
+Usage in a route:
+    @job_handler('stock_export')
+    def _run_stock_export(ctx):
+        ctx.set_progress(50, 'Building file')
+        ctx.write_artifact(output, 'stock_export.csv', 'text/csv')
+
+    if wants_async():
+        return enqueue_job('stock_export', {'format': 'csv'})
+
+Handlers run inside a request context rebuilt from the enqueuing request, so
+g.user / g.client and log_action() work exactly as in the route. Only the
+job's user_id / client_id are stored; the worker reloads the user and client
+(session cache or DB) when the job starts, and fails the job if either has
+been deactivated meanwhile.
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+
+class JobContext:
+    """Passed to job handlers: parameters, progress reporting and artifact output"""
+
+    def __init__(self, runner, job):
+        self._runner = runner
+        self.job_id = job['job_id']
+        self.job_type = job['job_type']
+        self.params = job['params']
+        self.work_dir = runner.work_dir(self.job_id)
+
+    def path(self, filename):
+        """Path of a file in the job's working directory (uploads, artifacts)"""
+        return os.path.join(self.work_dir, os.path.basename(filename))
+
+    def set_progress(self, progress, message=None):
+        """Report progress (0-100)"""
+        self._runner._update(self.job_id, progress=int(progress), message=message, heartbeat_at=time.time())
+
+    def write_artifact(self, data, filename, mimetype):
+        """Store the downloadable result (bytes, a file-like object or an iterator of bytes chunks)"""
+        path = self.path(filename)
+        with open(path, 'wb') as f:
+            if isinstance(data, (bytes, bytearray)):
+                f.write(data)
+            elif hasattr(data, 'read'):
+                data.seek(0)
+                shutil.copyfileobj(data, f)
+            else:
+                for chunk in data:
+                    f.write(chunk)
+        self._runner._update(self.job_id, artifact_path=path, artifact_name=filename, mimetype=mimetype)
+
+
+class JobRunner:
+    """Durable job table + per-process thread pool"""
+
+    POLL_INTERVAL = 5  # seconds between scans for orphaned queued jobs
+    HEARTBEAT_INTERVAL = 30  # running jobs of a live worker refresh heartbeat_at this often
+    STALE_AFTER = 600  # running job without heartbeat for this long is marked failed (its worker died)
+    RETENTION_HOURS = 24  # finished jobs and their artifacts are purged after this
+
+    def __init__(self):
+        base_dir = os.path.expanduser('~/.mj-billing')
+        self.db_path = os.getenv('JOBS_DB_PATH', os.path.join(base_dir, 'jobs.db'))
+        self.jobs_dir = os.getenv('JOBS_DIR', os.path.join(base_dir, 'jobs'))
+        self.max_workers = max(1, int(os.getenv('JOB_WORKERS', '2')))
+        self.app = None
+        self.handlers = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._active = 0
+        self._running = set()  # job_ids executing in this process (heartbeat by the poller)
+        self._schema_ready = False
+
+    # ------------------------------------------------------------------ setup
+
+    def init_app(self, app):
+        self.app = app
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self._connection()
+
+    def register(self, job_type, handler):
+        self.handlers[job_type] = handler
+
+    def _connection(self):
+        # One connection per thread and process (gunicorn forks after preload)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            if not self._schema_ready:
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        job_id TEXT PRIMARY KEY,
+                        job_type TEXT NOT NULL,
+                        client_id TEXT NOT NULL,
+                        user_id TEXT,
+                        status TEXT NOT NULL DEFAULT 'queued',
+                        progress INTEGER NOT NULL DEFAULT 0,
+                        message TEXT,
+                        params TEXT,
+                        request_meta TEXT,
+                        result TEXT,
+                        error TEXT,
+                        artifact_path TEXT,
+                        artifact_name TEXT,
+                        mimetype TEXT,
+                        worker_pid INTEGER,
+                        created_at REAL NOT NULL,
+                        started_at REAL,
+                        finished_at REAL,
+                        heartbeat_at REAL
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+                    CREATE INDEX IF NOT EXISTS idx_jobs_client_created ON jobs (client_id, created_at);
+                """)
+                self._schema_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_started(self):
+        """Start the pool and the poller lazily in each worker process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+            self._active = 0
+            self._running = set()
+            self._pid = os.getpid()
+            threading.Thread(target=self._poll_loop, daemon=True).start()
+
+    def work_dir(self, job_id):
+        path = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    # --------------------------------------------------------------- enqueue
+
+    def submit(self, job_type, params=None, files=None):
+        """
+        Persist a job and start it in this worker's pool.
+
+        Must be called inside an authenticated request: the user, client and
+        request metadata are stored so the handler runs with the same g.user.
+
+        Args:
+            job_type: Registered handler name
+            params: JSON-serialisable handler parameters
+            files: Optional {filename: FileStorage} saved into the job directory
+
+        Returns:
+            str: job_id
+        """
+        from flask import g, request
+
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+
+        job_id = str(uuid.uuid4())
+        work_dir = self.work_dir(job_id)
+        for filename, storage in (files or {}).items():
+            storage.save(os.path.join(work_dir, os.path.basename(filename)))
+
+        request_meta = {
+            'remote_addr': request.remote_addr,
+            'user_agent': request.user_agent.string,
+        }
+        self._connection().execute(
+            "INSERT INTO jobs (job_id, job_type, client_id, user_id, status, params, request_meta, created_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, job_type, str(g.user['client_id']), str(g.user['user_id']),
+             json.dumps(params or {}, default=str), json.dumps(request_meta, default=str), time.time())
+        )
+
+        self._ensure_started()
+        self._dispatch(job_id)
+        return job_id
+
+    def _dispatch(self, job_id):
+        with self._lock:
+            self._active += 1
+        self._executor.submit(self._run, job_id)
+
+    # ---------------------------------------------------------------- execute
+
+    def _claim(self, job_id):
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, worker_pid = ? "
+            "WHERE job_id = ? AND status = 'queued'",
+            (time.time(), time.time(), os.getpid(), job_id)
+        )
+        return cursor.rowcount == 1
+
+    def _run(self, job_id):
+        try:
+            if not self._claim(job_id):
+                return  # Another worker took it
+            with self._lock:
+                self._running.add(job_id)
+            self._execute(job_id)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._running.discard(job_id)
+
+    def _execute(self, job_id):
+        from flask import g
+
+        job = self.get(job_id, include_internal=True)
+        handler = self.handlers.get(job['job_type'])
+        meta = job.pop('request_meta') or {}
+
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job type: {job['job_type']}")
+            if self.app is None:
+                raise RuntimeError("Job runner not initialised")
+
+            with self.app.test_request_context(
+                '/',
+                environ_base={'REMOTE_ADDR': meta.get('remote_addr') or '127.0.0.1'},
+                headers={'User-Agent': meta.get('user_agent') or 'job-runner'}
+            ):
+                from extensions import db
+                from utils.auth_middleware import load_identity
+                try:
+                    g.user, g.client = load_identity(job['user_id'], job['client_id'])
+                    if g.user is None or g.client is None:
+                        raise PermissionError("User or client not found or inactive")
+                    result = handler(JobContext(self, job))
+                finally:
+                    db.session.remove()
+
+            self._update(job_id, status='succeeded', progress=100, finished_at=time.time(),
+                         result=json.dumps(result, default=str) if result is not None else None)
+            logger.info(f"[JobRunner] {job['job_type']} {job_id} succeeded")
+        except Exception as e:
+            logger.error(f"[JobRunner] {job['job_type']} {job_id} failed: {e}", exc_info=True)
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._connection().execute(
+            f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+            (*fields.values(), job_id)
+        )
+
+    def _heartbeat(self, conn, now):
+        """Keep this process's running jobs alive, however long a handler goes without set_progress()"""
+        with self._lock:
+            running = list(self._running)
+        if running:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' "
+                f"AND job_id IN ({', '.join('?' * len(running))})",
+                (now, *running)
+            )
+
+    def _poll_loop(self):
+        """Heartbeat own jobs, pick up queued jobs left by recycled workers, fail stale ones, purge old ones"""
+        last_purge = 0
+        last_heartbeat = 0
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            try:
+                conn = self._connection()
+                now = time.time()
+
+                if now - last_heartbeat >= self.HEARTBEAT_INTERVAL:
+                    self._heartbeat(conn, now)
+                    last_heartbeat = now
+
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'Job interrupted (worker stopped)', finished_at = ? "
+                    "WHERE status = 'running' AND heartbeat_at < ?",
+                    (now, now - self.STALE_AFTER)
+                )
+
+                free = self.max_workers - self._active
+                if free > 0:
+                    rows = conn.execute(
+                        "SELECT job_id FROM jobs WHERE status = 'queued' AND created_at < ? "
+                        "ORDER BY created_at LIMIT ?",
+                        (now - self.POLL_INTERVAL, free)
+                    ).fetchall()
+                    for row in rows:
+                        self._dispatch(row['job_id'])
+
+                if now - last_purge > 3600:
+                    self._purge(now - self.RETENTION_HOURS * 3600)
+                    last_purge = now
+            except Exception as e:
+                logger.error(f"[JobRunner] Poll error: {e}")
+
+    def _purge(self, before):
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT job_id FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+            (before,)
+        ).fetchall()
+        for row in rows:
+            shutil.rmtree(os.path.join(self.jobs_dir, row['job_id']), ignore_errors=True)
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (row['job_id'],))
+
+    # ------------------------------------------------------------------ query
+
+    def _to_dict(self, row, include_internal=False):
+        job = {
+            'job_id': row['job_id'],
+            'job_type': row['job_type'],
+            'client_id': row['client_id'],
+            'user_id': row['user_id'],
+            'status': row['status'],
+            'progress': row['progress'],
+            'message': row['message'],
+            'params': json.loads(row['params']) if row['params'] else {},
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'artifact_name': row['artifact_name'],
+            'has_artifact': bool(row['artifact_path']),
+            'created_at': self._isoformat(row['created_at']),
+            'started_at': self._isoformat(row['started_at']),
+            'finished_at': self._isoformat(row['finished_at']),
+        }
+        if include_internal:
+            job['request_meta'] = json.loads(row['request_meta']) if row['request_meta'] else None
+            job['artifact_path'] = row['artifact_path']
+            job['mimetype'] = row['mimetype']
+        return job
+
+    @staticmethod
+    def _isoformat(timestamp):
+        return datetime.utcfromtimestamp(timestamp).isoformat() if timestamp else None
+
+    def get(self, job_id, include_internal=False):
+        row = self._connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row, include_internal) if row else None
+
+    def list(self, client_id, user_id=None, limit=20):
+        query = "SELECT * FROM jobs WHERE client_id = ?"
+        params = [str(client_id)]
+        if user_id:
+            query += " AND user_id = ?"
+            params.append(str(user_id))
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [self._to_dict(row) for row in self._connection().execute(query, params).fetchall()]
+
+
+# Global runner instance (handlers register at import, app attached in app.py)
+job_runner = JobRunner()
+
+
+def job_handler(job_type):
+    """Decorator registering a job handler: handler(ctx: JobContext) -> JSON result or None"""
+    def decorator(func):
+        job_runner.register(job_type, func)
+        return func
+    return decorator
+
+
+def wants_async():
+    """Client asked for background processing (?async=1 or 'Prefer: respond-async')"""
+    from flask import request
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+def enqueue_job(job_type, params=None, files=None):
+    """Submit a job and build the 202 Accepted response pointing at the status endpoint"""
+    from flask import jsonify
+
+    job_id = job_runner.submit(job_type, params, files)
+    status_url = f"/api/jobs/{job_id}"
+    response = jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': status_url,
+        'download_url': f"{status_url}/download"
+    })
+    response.headers['Location'] = status_url
+    return response, 202
+
+
+def init_job_runner(app):
+    """Attach the Flask app to the global job runner"""
+    job_runner.init_app(app)
+    logger.info(f"[JobRunner] Ready - {job_runner.max_workers} workers per process, jobs at {job_runner.db_path}")
+    return job_runner
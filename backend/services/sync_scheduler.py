@@ -1,28 +1,90 @@
 """
-Background Sync Scheduler - Runs sync every 2 hours
+Background Sync Scheduler - change-triggered sync with backoff
+
+Every SYNC_CHECK_SECONDS the scheduler reads the size and age of the local
+change journal (one SQLite query, no network) and runs a sync when:
+- SYNC_PENDING_THRESHOLD or more changes are pending, or
+- the oldest pending change is older than SYNC_MAX_PENDING_AGE seconds, or
+- changes are pending and the last sync is SYNC_INTERVAL_HOURS old
+- the last pull of cloud-side changes is SYNC_PULL_SECONDS old
+
+Idle shops only make the periodic pull, busy ones reach the cloud within
+minutes. Before a sync the database host is probed with a plain TCP connect
+(SYNC_PROBE_TIMEOUT); when it is unreachable or the sync loses its connection,
+the next attempt waits an exponentially growing, jittered delay (up to
+SYNC_BACKOFF_MAX seconds). The final sync on shutdown is bounded by
+SYNC_SHUTDOWN_SECONDS - anything left over stays in the journal for next start.
 """
 import os
 import logging
+import random
+import socket
 import threading
 import time
 from datetime import datetime, timedelta
 
+from sqlalchemy.engine import make_url
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_PORTS = {'postgresql': 5432}
+
+# First retry delay after a connectivity failure (doubles per failure)
+BACKOFF_BASE_SECONDS = 30
+
+
+def probe_database(db_url, timeout):
+    """
+    Cheap reachability check: TCP connect to the database host, no login.
+
+    Returns:
+        bool: True if the host accepts connections (or cannot be probed, e.g. a file URL)
+    """
+    try:
+        url = make_url(db_url)
+    except Exception:
+        return False
+
+    if not url.host:
+        return True
+
+    port = url.port or DEFAULT_PORTS.get(url.get_backend_name(), 5432)
+    try:
+        with socket.create_connection((url.host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
 
 class SyncScheduler:
     """
-    Runs background sync on a fixed interval (default: 2 hours).
+    Runs background sync when local changes call for it.
 
-    Uses threading to run in background without blocking Flask.
+    Uses a background thread woken by an Event, so stop() and
+    trigger_sync_now() never wait for a sleep slice to end.
     """
 
     def __init__(self, sync_service):
         self.sync_service = sync_service
-        self.interval_hours = int(os.getenv('SYNC_INTERVAL_HOURS', '2'))
+        self.interval_hours = float(os.getenv('SYNC_INTERVAL_HOURS', '2'))
+        self.check_seconds = float(os.getenv('SYNC_CHECK_SECONDS', '15'))
+        self.pending_threshold = int(os.getenv('SYNC_PENDING_THRESHOLD', '200'))
+        self.max_pending_age = float(os.getenv('SYNC_MAX_PENDING_AGE', '300'))
+        self.pull_seconds = float(os.getenv('SYNC_PULL_SECONDS', '300'))
+        self.backoff_max = float(os.getenv('SYNC_BACKOFF_MAX', '1800'))
+        self.probe_timeout = float(os.getenv('SYNC_PROBE_TIMEOUT', '3'))
+        self.shutdown_seconds = float(os.getenv('SYNC_SHUTDOWN_SECONDS', '10'))
+
         self.running = False
         self.thread = None
         self.next_sync_time = None
+        self.failures = 0
+        self.retry_at = None
+        self.last_result = None
+        self.last_trigger = None
+
+        self._wake = threading.Event()
+        self._sync_lock = threading.Lock()
 
     def start(self):
         """Start the background sync scheduler"""
@@ -30,69 +92,209 @@ class SyncScheduler:
             logger.warning("[SyncScheduler] Already running")
             return
 
-        # Initialize sync service
-        if not self.sync_service.initialize():
-            logger.warning("[SyncScheduler] Sync service initialization failed - scheduler disabled")
+        if not os.getenv('DB_URL'):
+            logger.warning("[SyncScheduler] No DB_URL found - scheduler disabled")
             return
 
+        try:
+            self.sync_service.initialize_local()
+        except Exception as e:
+            logger.warning(f"[SyncScheduler] Local sync tables unavailable - scheduler disabled: {e}")
+            return
+
+        # PostgreSQL is connected by the loop once it is reachable, so starting
+        # offline does not disable sync for the whole session
         self.running = True
         self.thread = threading.Thread(target=self._run_loop, daemon=True)
         self.thread.start()
 
-        logger.info(f"[SyncScheduler] Started - syncing every {self.interval_hours} hours")
+        logger.info(
+            f"[SyncScheduler] Started - syncing at {self.pending_threshold} pending changes, "
+            f"changes older than {self.max_pending_age:.0f}s or every {self.interval_hours} hours"
+        )
 
     def stop(self):
         """Stop the background sync scheduler"""
         self.running = False
+        self._wake.set()
         if self.thread:
             self.thread.join(timeout=5)
         logger.info("[SyncScheduler] Stopped")
 
     def trigger_sync_now(self):
-        """Manually trigger a sync (useful for testing or on app close)"""
+        """Manually trigger a sync (ignores thresholds and backoff)"""
         logger.info("[SyncScheduler] Manual sync triggered")
         try:
-            return self.sync_service.sync_all()
+            return self._sync('manual')
         except Exception as e:
             logger.error(f"[SyncScheduler] Manual sync failed: {e}")
             return {"status": "failed", "error": str(e)}
 
-    def _run_loop(self):
-        """Background loop that runs sync every N hours"""
-        # Run first sync after 1 minute (give app time to fully start)
-        logger.info("[SyncScheduler] First sync in 1 minute...")
-        time.sleep(60)
+    def shutdown(self):
+        """
+        Final sync on app close, bounded by SYNC_SHUTDOWN_SECONDS.
 
-        while self.running:
-            try:
-                # Calculate next sync time
-                self.next_sync_time = datetime.now() + timedelta(hours=self.interval_hours)
+        The sync runs in a daemon thread; if it does not finish in time the app
+        exits anyway and the unacknowledged changes are sent on next start.
+        """
+        self.running = False
+        self._wake.set()
+
+        deadline = time.monotonic() + self.shutdown_seconds
+        if self.thread:
+            self.thread.join(timeout=max(0.0, deadline - time.monotonic()))
 
-                # Run sync
-                logger.info(f"[SyncScheduler] Running scheduled sync (next sync at {self.next_sync_time})")
-                result = self.sync_service.sync_all()
+        if not self.sync_service.sqlite_engine or not self._pending()["count"]:
+            return
+        if not self._probe():
+            logger.info("[SyncScheduler] Database unreachable - changes stay queued for next start")
+            return
 
-                logger.info(f"[SyncScheduler] Sync result: {result.get('status', 'unknown')}")
+        worker = threading.Thread(target=self._sync, args=('shutdown',), daemon=True)
+        worker.start()
+        worker.join(timeout=max(0.0, deadline - time.monotonic()))
+        if worker.is_alive():
+            logger.warning(
+                f"[SyncScheduler] Final sync did not finish within {self.shutdown_seconds:.0f}s - "
+                "remaining changes will sync on next start"
+            )
 
-                # Sleep for interval (check every minute if we should stop)
-                sleep_seconds = self.interval_hours * 3600
-                for _ in range(int(sleep_seconds / 60)):
-                    if not self.running:
-                        break
-                    time.sleep(60)
+    # ------------------------------------------------------------------- loop
 
+    def _run_loop(self):
+        """Check the journal every check_seconds and sync when a threshold is crossed"""
+        while self.running:
+            try:
+                reason = self._due()
+                if reason:
+                    self._attempt(reason)
             except Exception as e:
                 logger.error(f"[SyncScheduler] Error in sync loop: {e}")
-                # Wait 5 minutes before retrying on error
-                time.sleep(300)
+                self._record_failure()
+
+            self._wake.wait(self._sleep_seconds())
+            self._wake.clear()
+
+    def _due(self):
+        """Reason to sync now, or None"""
+        now = datetime.utcnow()
+        if self.retry_at and now < self.retry_at:
+            return None
+
+        if self.sync_service.postgres_engine is None:
+            # Not connected yet (started offline): connect once the database is reachable
+            return 'connect'
+
+        last_pull = self.sync_service.last_pull_time
+        pull_deadline = last_pull + timedelta(seconds=self.pull_seconds) if last_pull else now
+        pull_reason = 'pull' if now >= pull_deadline else None
+
+        pending = self._pending()
+        if not pending["count"]:
+            self.next_sync_time = pull_deadline
+            return pull_reason
+
+        if pending["count"] >= self.pending_threshold:
+            return 'volume'
+
+        oldest = pending["oldest"]
+        if oldest and (now - oldest).total_seconds() >= self.max_pending_age:
+            return 'age'
+
+        last_sync = self.sync_service.last_sync_time
+        if last_sync is None or now - last_sync >= timedelta(hours=self.interval_hours):
+            return 'interval'
+
+        if pull_reason:
+            return pull_reason
+
+        # Whichever threshold will be crossed first, assuming no more changes
+        deadlines = [last_sync + timedelta(hours=self.interval_hours), pull_deadline]
+        if oldest:
+            deadlines.append(oldest + timedelta(seconds=self.max_pending_age))
+        self.next_sync_time = min(deadlines)
+        return None
+
+    def _attempt(self, reason):
+        if not self._probe():
+            logger.info("[SyncScheduler] Database unreachable - backing off")
+            self._record_failure()
+            return
+
+        if self.sync_service.postgres_engine is None:
+            if not self.sync_service.initialize():
+                self._record_failure()
+                return
+            if not self._pending()["count"]:
+                self._record_success()
+                return
+            reason = 'backlog'
+
+        logger.info(f"[SyncScheduler] Running sync ({reason})")
+        result = self._sync(reason)
+        logger.info(f"[SyncScheduler] Sync result: {result.get('status', 'unknown')}")
+
+        if result.get('status') == 'failed' or result.get('interrupted'):
+            self._record_failure()
+        else:
+            self._record_success()
+
+    def _sync(self, reason):
+        with self._sync_lock:
+            if self.sync_service.postgres_engine is None and not self.sync_service.initialize():
+                return {"status": "skipped", "reason": "not_initialized"}
+
+            self.last_trigger = reason
+            self.last_result = self.sync_service.sync_all()
+            return self.last_result
+
+    def _pending(self):
+        try:
+            return self.sync_service.pending_summary()
+        except Exception as e:
+            logger.error(f"[SyncScheduler] Could not read the change journal: {e}")
+            return {"count": 0, "oldest": None}
+
+    def _probe(self):
+        return probe_database(os.getenv('DB_URL', ''), self.probe_timeout)
+
+    def _record_failure(self):
+        """Exponential backoff with jitter: wait U(check, min(max, base * 2^(failures-1)))"""
+        self.failures += 1
+        ceiling = min(self.backoff_max, BACKOFF_BASE_SECONDS * 2 ** (self.failures - 1))
+        delay = random.uniform(self.check_seconds, max(self.check_seconds, ceiling))
+        self.retry_at = datetime.utcnow() + timedelta(seconds=delay)
+        self.next_sync_time = self.retry_at
+
+    def _record_success(self):
+        self.failures = 0
+        self.retry_at = None
+
+    def _sleep_seconds(self):
+        if self.retry_at:
+            return max(1.0, min(self.check_seconds, (self.retry_at - datetime.utcnow()).total_seconds()))
+        return self.check_seconds
 
     def get_status(self):
         """Get scheduler status for API endpoint"""
+        last_sync = self.sync_service.last_sync_time
+        pending = self._pending() if self.sync_service.sqlite_engine else {"count": None, "oldest": None}
         return {
             "running": self.running,
+            "connected": self.sync_service.postgres_engine is not None,
             "interval_hours": self.interval_hours,
+            "pending_threshold": self.pending_threshold,
+            "max_pending_age_seconds": self.max_pending_age,
+            "pending_changes": pending["count"],
+            "oldest_pending": pending["oldest"].isoformat() if pending["oldest"] else None,
+            "consecutive_failures": self.failures,
+            "retry_at": self.retry_at.isoformat() if self.retry_at else None,
             "next_sync": self.next_sync_time.isoformat() if self.next_sync_time else None,
-            "last_sync": self.sync_service.last_sync_time.isoformat() if self.sync_service.last_sync_time else None
+            "last_sync": last_sync.isoformat() if last_sync else None,
+            "pull_seconds": self.pull_seconds,
+            "last_pull": self.sync_service.last_pull_time.isoformat() if self.sync_service.last_pull_time else None,
+            "last_trigger": self.last_trigger,
+            "last_status": self.last_result.get('status') if self.last_result else None
         }
 
 
@@ -119,8 +321,7 @@ def init_sync_scheduler(app):
     def on_shutdown():
         logger.info("[SyncScheduler] App shutting down - running final sync...")
         if sync_scheduler:
-            sync_scheduler.trigger_sync_now()
-            sync_scheduler.stop()
+            sync_scheduler.shutdown()
 
     atexit.register(on_shutdown)
 
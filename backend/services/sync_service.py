@@ -1,39 +1,196 @@
 """
 Background Sync Service - SQLite → Supabase (PostgreSQL)
-Syncs local data to cloud every 2 hours automatically
+Pushes local changes to the cloud and pulls centrally edited data back
+
+What to push comes from the local change journal (services/change_journal.py):
+every write to a synced table appends (seq, table, key, operation). A cycle
+reads each table's entries after its last acknowledged sequence in batches of
+SYNC_BATCH_SIZE, loads the current version of those rows and sends them as one
+multi-row INSERT ... ON CONFLICT DO UPDATE per table (executemany through
+SQLAlchemy's insertmanyvalues); deleted rows are deleted in PostgreSQL. Each
+batch is spooled to disk (services/sync_spool.py) before upload and
+acknowledged locally once committed in PostgreSQL, so a dropped link or a
+restart only re-sends the spooled batch in flight. Stock quantity is a delta
+column: the push adds this till's change since its last sync to the cloud
+value instead of overwriting it (see SyncTable). Tables are synced in parallel
+(SYNC_WORKERS threads, one PostgreSQL connection each), level by level in
+foreign key order.
+
+After pushing, master data edited in the cloud (users, permissions, payment
+types, stock) is pulled back incrementally - see PullTable for the watermark
+and conflict rules.
 """
 import os
 import logging
-from datetime import datetime
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from database.type_converters import TypeConverter, BILLING_COLUMN_TYPES, STOCK_COLUMN_TYPES, CUSTOMER_COLUMN_TYPES
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, text, select, func, MetaData, Table, bindparam
+from sqlalchemy import inspect as sa_inspect, table as sa_table, column as sa_column
+from sqlalchemy.exc import IntegrityError, DataError, OperationalError, InterfaceError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database.type_converters import TypeConverter
+from services.change_journal import JOURNALED_TABLES, sync_journal, sync_base, create_journal, compact_journal
+from services.sync_spool import SyncSpool
 
 logger = logging.getLogger(__name__)
 
 
+class SyncTable:
+    """
+    A table pushed to PostgreSQL (result_key: counter in the sync_all() "synced" section)
+
+    rollup: bill table - the cloud sales_rollup of the days a pushed batch
+    touches is recomputed in the batch's transaction
+    delta_columns: integer counters changed on several tills (stock quantity).
+    sync_base holds the cloud value each local row last incorporated; the push
+    writes cloud + (local - base) under a row lock, then moves the local row
+    and its base to the new cloud value. A row without a base (never pushed
+    since the upgrade) is sent as is.
+    """
+
+    def __init__(self, name, primary_key, result_key, rollup=False, delta_columns=()):
+        self.name = name
+        self.primary_key = primary_key
+        self.result_key = result_key
+        self.rollup = rollup
+        self.delta_columns = tuple(delta_columns)
+
+
+# Tables pushed to the cloud (dependency order comes from the PostgreSQL foreign keys)
+SYNC_TABLES = [
+    SyncTable('payment_type', 'payment_type_id', 'payment_types'),
+    SyncTable('customer', 'customer_id', 'customers'),
+    SyncTable('stock_entry', 'product_id', 'stock', delta_columns=('quantity',)),
+    SyncTable('gst_billing', 'bill_id', 'bills', rollup=True),
+    SyncTable('non_gst_billing', 'bill_id', 'bills', rollup=True),
+    SyncTable('expense', 'expense_id', 'expenses'),
+]
+
+class PullTable:
+    """
+    A table pulled from PostgreSQL into the local database.
+
+    mode:
+        'watermark' - rows whose change_column moved past the stored watermark
+                      (inserts and updates; hard deletes are not seen)
+        'snapshot'  - the whole (small) table in scope; local rows missing in
+                      the cloud are deleted
+    scope:
+        'client' - rows of the clients present locally
+        'user'   - rows of the users of those clients
+        'global' - every row
+    conflict:
+        'cloud'  - the cloud row replaces the local one (tables the till never
+                   pushes), except columns in keep_local
+        'local'  - rows with unpushed local changes are left alone, the push
+                   sends them to the cloud next
+        'newer'  - the newer updated_at wins; when the local row still has
+                   unpushed changes, the columns in keep_local stay local
+    delta_columns: merged whatever the conflict rule says - the local value
+        becomes cloud + (local - base), so sales made on this till are not
+        undone and those of other tills are not lost (see SyncTable)
+    """
+
+    def __init__(self, name, primary_key, mode='watermark', change_column='updated_at',
+                 scope='client', conflict='cloud', keep_local=(), delta_columns=()):
+        self.name = name
+        self.primary_key = primary_key
+        self.mode = mode
+        self.change_column = change_column
+        self.scope = scope
+        self.conflict = conflict
+        self.keep_local = set(keep_local)
+        self.delta_columns = tuple(delta_columns)
+
+
+SYNC_TABLE_BY_NAME = {table.name: table for table in SYNC_TABLES}
+
+# Tables pulled from the cloud (master data edited centrally), in foreign key order
+PULL_TABLES = [
+    PullTable('users', 'user_id', change_column='COALESCE(updated_at, created_at)',
+              keep_local=('last_login',)),
+    PullTable('permission_sections', 'section_id', change_column='created_at', scope='global'),
+    PullTable('permissions', 'permission_id', change_column='created_at', scope='global'),
+    PullTable('user_permissions', 'id', mode='snapshot', scope='user'),
+    PullTable('payment_type', 'payment_type_id', mode='snapshot', conflict='local'),
+    PullTable('stock_entry', 'product_id', conflict='newer', delta_columns=('quantity',)),
+]
+
+# Pulls re-read this many seconds before the watermark, covering cloud
+# transactions that set their timestamp before the last pull but committed after it
+PULL_OVERLAP_SECONDS = 60
+
+# Local bookkeeping columns that are never pushed
+LOCAL_ONLY_COLUMNS = {'synced_at'}
+
+# sync_state rows '<JOURNAL_STATE>:<table>' hold each table's last acknowledged
+# journal sequence (a bare JOURNAL_STATE row is the former journal-wide value)
+JOURNAL_STATE = 'sync_journal'
+
+# Errors that mean PostgreSQL is unreachable: stop the cycle, nothing is acknowledged
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+
 class SyncService:
     """
     Handles background synchronization from SQLite (local) to PostgreSQL (Supabase).
 
-    Strategy:
-    1. Read unsynced records from SQLite
-    2. Convert data types (SQLite → PostgreSQL)
-    3. Bulk insert to Supabase
-    4. Mark records as synced
+    Strategy (per table, tables in parallel by dependency level):
+    1. Read a batch of the table's journal entries after its acknowledged sequence
+    2. Load the current rows and convert data types (SQLite → PostgreSQL)
+    3. Upsert / delete them in Supabase in one statement each, and commit
+    4. Acknowledge the batch sequence, repeat until the table is drained
     """
 
     def __init__(self):
         self.sqlite_engine = None
         self.postgres_engine = None
         self.last_sync_time = None
+        self.last_pull_time = None
+        self.batch_size = int(os.getenv('SYNC_BATCH_SIZE', '500'))
+        self.workers = max(1, int(os.getenv('SYNC_WORKERS', '4')))
+        self._pg_tables = {}
+        self._local_tables = {}
+        self._cloud_rollup = None
+        self._reflect_lock = threading.Lock()
+        self._spool = None
+
+    @property
+    def spool(self):
+        """Outgoing batch spool (created on first use, SYNC_SPOOL_DIR)"""
+        if self._spool is None:
+            self._spool = SyncSpool()
+        return self._spool
+
+    def initialize_local(self):
+        """Open the local database and create the sync bookkeeping tables (no network)"""
+        if self.sqlite_engine is not None:
+            return
+
+        sqlite_path = os.getenv('SQLITE_DB_PATH', os.path.expanduser('~/.mj-billing/local.db'))
+        sqlite_engine = create_engine(f'sqlite:///{sqlite_path}', connect_args={'timeout': 10})
+
+        create_journal(sqlite_engine)
+        with sqlite_engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    table_name TEXT PRIMARY KEY,
+                    last_value TEXT,
+                    last_key TEXT,
+                    updated_at TEXT
+                )
+            """))
+
+        self.sqlite_engine = sqlite_engine
 
     def initialize(self):
         """Initialize database connections for sync"""
         try:
             # SQLite connection (local database)
-            sqlite_path = os.getenv('SQLITE_DB_PATH', os.path.expanduser('~/.mj-billing/local.db'))
-            self.sqlite_engine = create_engine(f'sqlite:///{sqlite_path}')
+            self.initialize_local()
 
             # PostgreSQL connection (Supabase)
             db_url = os.getenv('DB_URL')
@@ -41,19 +198,23 @@ class SyncService:
                 logger.warning("[SyncService] No DB_URL found - sync disabled")
                 return False
 
-            self.postgres_engine = create_engine(
+            # One connection per sync worker; a worker waits rather than
+            # opening extra connections over a slow link
+            postgres_engine = create_engine(
                 db_url,
+                pool_size=self.workers,
+                max_overflow=0,
+                pool_timeout=60,
                 pool_pre_ping=True,
+                insertmanyvalues_page_size=self.batch_size,
                 connect_args={'connect_timeout': 10}
             )
 
-            # Test connections
-            with self.sqlite_engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
-
-            with self.postgres_engine.connect() as conn:
+            # Test connection
+            with postgres_engine.connect() as conn:
                 conn.execute(text("SELECT 1"))
 
+            self.postgres_engine = postgres_engine
             logger.info("[SyncService] Initialized successfully")
             return True
 
@@ -63,7 +224,11 @@ class SyncService:
 
     def sync_all(self):
         """
-        Sync all unsynced data to Supabase.
+        Sync all journaled changes to Supabase, then pull cloud-side changes.
+
+        Tables are synced concurrently on up to SYNC_WORKERS threads, one
+        dependency level at a time (a table starts once the tables it
+        references in PostgreSQL are done).
 
         Returns:
             dict: Sync results with counts
@@ -74,6 +239,7 @@ class SyncService:
 
         try:
             logger.info("[SyncService] Starting background sync...")
+            started = time.monotonic()
 
             results = {
                 "status": "success",
@@ -81,47 +247,36 @@ class SyncService:
                 "synced": {
                     "bills": 0,
                     "stock": 0,
-                    "customers": 0
+                    "customers": 0,
+                    "expenses": 0,
+                    "payment_types": 0
                 },
+                "tables": {},
+                "journal": {"compacted": 0, "resumed": 0},
+                "interrupted": False,
                 "errors": []
             }
 
-            # Sync GST bills
-            try:
-                gst_count = self._sync_gst_bills()
-                results["synced"]["bills"] += gst_count
-                logger.info(f"[SyncService] Synced {gst_count} GST bills")
-            except Exception as e:
-                logger.error(f"[SyncService] GST bill sync failed: {e}")
-                results["errors"].append(f"GST bills: {str(e)}")
+            for name, stats in self._run_levels(SYNC_TABLES, self._drain_table):
+                table = SYNC_TABLE_BY_NAME[name]
+                results["tables"][name] = stats
+                results["synced"][table.result_key] += stats["rows"]
+                results["journal"]["compacted"] += stats.pop("compacted")
+                results["journal"]["resumed"] += stats["resumed"]
+                results["errors"] += stats.pop("errors")
+                results["interrupted"] = results["interrupted"] or stats.pop("interrupted")
 
-            # Sync non-GST bills
-            try:
-                non_gst_count = self._sync_non_gst_bills()
-                results["synced"]["bills"] += non_gst_count
-                logger.info(f"[SyncService] Synced {non_gst_count} non-GST bills")
-            except Exception as e:
-                logger.error(f"[SyncService] Non-GST bill sync failed: {e}")
-                results["errors"].append(f"Non-GST bills: {str(e)}")
+            results["journal"]["pending"] = self.pending_summary()["count"]
+            results["journal"]["spool"] = self.spool.get_stats()
 
-            # Sync stock updates
-            try:
-                stock_count = self._sync_stock()
-                results["synced"]["stock"] = stock_count
-                logger.info(f"[SyncService] Synced {stock_count} stock updates")
-            except Exception as e:
-                logger.error(f"[SyncService] Stock sync failed: {e}")
-                results["errors"].append(f"Stock: {str(e)}")
+            # Pull after pushing: rows changed on both sides are already in the cloud
+            if not results["interrupted"]:
+                results["pulled"] = self.pull_all(results["errors"])
 
-            # Sync customers
-            try:
-                customer_count = self._sync_customers()
-                results["synced"]["customers"] = customer_count
-                logger.info(f"[SyncService] Synced {customer_count} customers")
-            except Exception as e:
-                logger.error(f"[SyncService] Customer sync failed: {e}")
-                results["errors"].append(f"Customers: {str(e)}")
+            if results["errors"]:
+                results["status"] = "partial"
 
+            results["seconds"] = round(time.monotonic() - started, 3)
             self.last_sync_time = datetime.utcnow()
             logger.info(f"[SyncService] Sync complete: {results}")
 
@@ -135,81 +290,818 @@ class SyncService:
                 "timestamp": datetime.utcnow().isoformat()
             }
 
-    def _sync_gst_bills(self):
-        """Sync GST bills from SQLite to PostgreSQL"""
-        # Get unsynced bills from SQLite
-        with self.sqlite_engine.connect() as sqlite_conn:
-            result = sqlite_conn.execute(text("""
-                SELECT * FROM gst_billing
-                WHERE synced_at IS NULL
-                ORDER BY created_at
-                LIMIT 1000
-            """))
+    def pending_summary(self):
+        """
+        Journal entries not yet acknowledged (local query only, no network).
+
+        Acknowledged entries are deleted in the same transaction, so every
+        entry left in the journal is pending.
+
+        Returns:
+            dict: count and oldest (recorded_at of the oldest pending entry, or None)
+        """
+        with self.sqlite_engine.connect() as conn:
+            count, oldest = conn.execute(
+                select(func.count(), func.min(sync_journal.c.recorded_at))
+            ).one()
+        return {"count": count, "oldest": oldest}
+
+    # ------------------------------------------------------------- scheduling
+
+    def _dependency_levels(self, tables):
+        """
+        Group tables into levels using the foreign keys of the PostgreSQL schema:
+        a table is placed after every table of the group it references.
+        """
+        names = {table.name for table in tables}
+        depends = {}
+        for table in tables:
+            try:
+                referenced = {fk.column.table.name for fk in self._pg_table(table.name).foreign_keys}
+            except CONNECTION_ERRORS:
+                raise
+            except Exception:
+                referenced = set()  # reported when the table itself is synced
+            depends[table.name] = (referenced & names) - {table.name}
+
+        levels = []
+        done = set()
+        remaining = list(tables)
+        while remaining:
+            level = [table for table in remaining if depends[table.name] <= done]
+            if not level:
+                level = remaining  # reference cycle: run the rest together
+            levels.append(level)
+            done.update(table.name for table in level)
+            remaining = [table for table in remaining if table not in level]
+        return levels
+
+    def _run_levels(self, tables, work):
+        """
+        Run work(table) for every table, concurrently within a dependency level.
+
+        Yields:
+            (table name, result) in table order; stops before the next level
+            once a result reports a lost connection
+        """
+        for level in self._dependency_levels(tables):
+            if len(level) == 1 or self.workers == 1:
+                outcomes = [work(table) for table in level]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.workers, len(level)),
+                                        thread_name_prefix='sync') as pool:
+                    outcomes = list(pool.map(work, level))
+
+            interrupted = False
+            for table, outcome in zip(level, outcomes):
+                interrupted = interrupted or outcome.get("interrupted", False)
+                yield table.name, outcome
+            if interrupted:
+                return
+
+    # ----------------------------------------------------------------- journal
+
+    def _drain_table(self, table):
+        """
+        Push the pending journal entries of one table, batch by batch.
+
+        Batches spooled by an interrupted cycle are uploaded first, before the
+        table's journal is compacted (compaction must not fold newer changes
+        into entries a spooled batch will acknowledge). Entries journaled while
+        the table is being drained (including failed rows re-queued by it)
+        wait for the next cycle.
+
+        Returns:
+            dict: rows, deleted, batches, resumed, seconds, rows_per_second,
+                  lag_seconds (age of the oldest entry at start), pending,
+                  compacted, errors, interrupted
+        """
+        started = time.monotonic()
+        stats = {"rows": 0, "deleted": 0, "batches": 0, "resumed": 0, "compacted": 0,
+                 "lag_seconds": 0.0, "errors": [], "interrupted": False}
+
+        with self.sqlite_engine.connect() as conn:
+            acked = self._load_acked_seq(conn, table.name)
+            oldest = conn.execute(
+                select(func.min(sync_journal.c.recorded_at)).where(sync_journal.c.table_name == table.name)
+            ).scalar()
+        if oldest is not None:
+            stats["lag_seconds"] = round((datetime.utcnow() - oldest).total_seconds(), 1)
+
+        try:
+            for path in self.spool.batches(table.name):
+                if self.spool.last_seq(path) <= acked:
+                    self.spool.remove(path)  # acknowledged, the process stopped before removing it
+                    continue
+                batch = self.spool.read(path)
+                if batch is None:
+                    continue
+
+                retry = self._upload_batch(table, batch["entries"], batch["rows"], stats, batch.get("stamp"))
+                acked = batch["last_seq"]
+                self._acknowledge(table, acked, retry)
+                self.spool.remove(path)
+                stats["batches"] += 1
+                stats["resumed"] += 1
+
+            with self.sqlite_engine.begin() as conn:
+                stats["compacted"] = compact_journal(conn, table.name)
+                last_seq = conn.execute(
+                    select(func.max(sync_journal.c.seq)).where(sync_journal.c.table_name == table.name)
+                ).scalar()
+
+            while last_seq is not None and acked < last_seq:
+                entries = self._read_journal(table, acked, last_seq)
+                if not entries:
+                    break
+
+                rows = self._load_rows(table, [
+                    entry["row_key"] for entry in entries if entry["operation"] != 'delete'
+                ])
+                stamp = datetime.utcnow().isoformat()
+                path = self.spool.write(table.name, entries, rows, stamp)
+
+                retry = self._upload_batch(table, entries, rows, stats, stamp)
+                acked = entries[-1]["seq"]
+                self._acknowledge(table, acked, retry)
+                self.spool.remove(path)
+                stats["batches"] += 1
+
+        except CONNECTION_ERRORS as e:
+            # The batch in flight stays spooled and is uploaded first next cycle
+            logger.error(f"[SyncService] Connection lost while syncing {table.name}: {e}")
+            stats["errors"].append(f"connection: {str(e)}")
+            stats["interrupted"] = True
+
+        seconds = time.monotonic() - started
+        stats["seconds"] = round(seconds, 3)
+        stats["rows_per_second"] = round(stats["rows"] / seconds, 1) if stats["rows"] and seconds else 0.0
+        with self.sqlite_engine.connect() as conn:
+            stats["pending"] = conn.execute(
+                select(func.count()).where(sync_journal.c.table_name == table.name)
+            ).scalar()
+
+        if stats["rows"] or stats["deleted"]:
+            logger.info(
+                f"[SyncService] Synced {stats['rows']} rows of {table.name} "
+                f"({stats['rows_per_second']} rows/s, lag {stats['lag_seconds']}s)"
+            )
+        return stats
+
+    def _read_journal(self, table, acked, last_seq):
+        with self.sqlite_engine.connect() as conn:
+            result = conn.execute(
+                sync_journal.select()
+                .where(
+                    sync_journal.c.table_name == table.name,
+                    sync_journal.c.seq > acked,
+                    sync_journal.c.seq <= last_seq
+                )
+                .order_by(sync_journal.c.seq)
+                .limit(self.batch_size)
+            )
+            return [dict(row._mapping) for row in result]
+
+    @staticmethod
+    def _load_acked_seq(conn, table_name):
+        """Last acknowledged sequence of a table (falls back to the former journal-wide value)"""
+        rows = dict(conn.execute(
+            text("SELECT table_name, last_value FROM sync_state WHERE table_name IN (:table, :journal)"),
+            {"table": f"{JOURNAL_STATE}:{table_name}", "journal": JOURNAL_STATE}
+        ).all())
+        value = rows.get(f"{JOURNAL_STATE}:{table_name}") or rows.get(JOURNAL_STATE)
+        return int(value) if value else 0
+
+    def _acknowledge(self, table, seq, retry):
+        """
+        Record that the table's entries up to seq are in PostgreSQL and drop them.
+
+        Rows that failed are journaled again (new sequence) so they are retried
+        next cycle without holding back the acknowledged sequence.
+        """
+        now = datetime.utcnow()
+        with self.sqlite_engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO sync_state (table_name, last_value, updated_at)
+                VALUES (:name, :seq, :updated_at)
+                ON CONFLICT (table_name) DO UPDATE SET
+                    last_value = excluded.last_value,
+                    updated_at = excluded.updated_at
+            """), {"name": f"{JOURNAL_STATE}:{table.name}", "seq": str(seq), "updated_at": now.isoformat()})
+            conn.execute(sync_journal.delete().where(
+                sync_journal.c.table_name == table.name,
+                sync_journal.c.seq <= seq
+            ))
+            if retry:
+                conn.execute(sync_journal.insert(), [
+                    {
+                        "table_name": entry["table_name"],
+                        "row_key": entry["row_key"],
+                        "operation": entry["operation"],
+                        "client_id": entry["client_id"],
+                        "recorded_at": now
+                    }
+                    for entry in retry
+                ])
+
+    # ------------------------------------------------------------------ tables
+
+    def _pg_table(self, name):
+        """Reflected PostgreSQL table (cached) - the cloud schema decides which columns are pushed"""
+        table = self._pg_tables.get(name)
+        if table is None:
+            with self._reflect_lock:
+                table = self._pg_tables.get(name)
+                if table is None:
+                    table = Table(name, MetaData(), autoload_with=self.postgres_engine)
+                    self._pg_tables[name] = table
+        return table
+
+    def _upload_batch(self, table, entries, rows, stats, stamp=None):
+        """
+        Push one journal batch of a table: upserts, then deletes.
+
+        Several entries for one row collapse into its last operation. rows are
+        the local rows read when the batch was prepared (a key without a row
+        was deleted locally in the meantime). Re-uploading the same batch is
+        harmless: upserts and deletes are idempotent, and delta columns skip
+        rows already carrying the batch stamp (ISO text, the synced_at written).
+
+        Returns:
+            list: Entries to retry next cycle
+        """
+        latest = {}
+        for entry in entries:
+            latest[entry["row_key"]] = entry
+
+        upserts = [entry for entry in latest.values() if entry["operation"] != 'delete' and entry["row_key"] in rows]
+        deletes = [entry for entry in latest.values() if entry["operation"] == 'delete' or entry["row_key"] not in rows]
+        retry = []
+
+        try:
+            if upserts:
+                batch_rows = [rows[entry["row_key"]] for entry in upserts]
+                pushed = self._push_batch(self._pg_table(table.name), table, batch_rows, stamp)
+                failed = {entry["row_key"] for entry in upserts} - {str(row[table.primary_key]) for row in pushed}
+                retry += [entry for entry in upserts if entry["row_key"] in failed]
+                stats["rows"] += len(pushed)
+
+            if deletes:
+                self._delete(table, [entry["row_key"] for entry in deletes])
+                stats["deleted"] += len(deletes)
+        except CONNECTION_ERRORS:
+            raise
+        except Exception as e:
+            logger.error(f"[SyncService] {table.name} sync failed: {e}")
+            stats["errors"].append(f"{table.name}: {str(e)}")
+            return list(latest.values())
+
+        return retry
+
+    def _load_rows(self, table, keys):
+        """Current local rows by key (missing keys were deleted)"""
+        if not keys:
+            return {}
+        with self.sqlite_engine.connect() as conn:
+            result = conn.execute(
+                text(f"SELECT * FROM {table.name} WHERE {table.primary_key} IN :keys")
+                .bindparams(bindparam("keys", expanding=True)),
+                {"keys": keys}
+            )
+            return {str(row._mapping[table.primary_key]): dict(row._mapping) for row in result}
+
+    def _push_batch(self, pg_table, table, rows, stamp=None):
+        """
+        Upsert rows into PostgreSQL with one multi-row statement and commit.
+
+        If the batch is rejected because of bad data, rows are retried one by
+        one so a single bad row does not block the others. Connection errors
+        propagate (the batch is retried next cycle).
 
-            bills = [dict(row._mapping) for row in result]
-
-        if not bills:
-            return 0
-
-        # Convert types and upload to PostgreSQL
-        synced_count = 0
-        with self.postgres_engine.connect() as pg_conn:
-            for bill in bills:
-                try:
-                    # Convert SQLite types to PostgreSQL types
-                    converted = TypeConverter.convert_dict_from_sqlite(bill, BILLING_COLUMN_TYPES)
-
-                    # Insert to PostgreSQL
-                    pg_conn.execute(text("""
-                        INSERT INTO gst_billing (
-                            bill_id, client_id, bill_number, customer_name, customer_phone,
-                            customer_address, items, subtotal, gst_amount, final_amount,
-                            created_by, created_at
-                        ) VALUES (
-                            :bill_id::UUID, :client_id::UUID, :bill_number, :customer_name, :customer_phone,
-                            :customer_address, :items::JSONB, :subtotal, :gst_amount, :final_amount,
-                            :created_by::UUID, :created_at
+        Returns:
+            list: Rows that are now in PostgreSQL
+        """
+        if not rows:
+            return []
+
+        pg_columns = set(pg_table.columns.keys())
+        columns = [name for name in rows[0] if name in pg_columns and name not in LOCAL_ONLY_COLUMNS]
+        column_types = TypeConverter.column_types(pg_table)
+        converter = TypeConverter.compile_from_sqlite(columns, column_types)
+        stamp_synced = 'synced_at' in pg_columns
+        stamp = stamp or datetime.utcnow().isoformat()
+        now = datetime.fromisoformat(stamp)
+        bases = self._load_bases(table, [str(row[table.primary_key]) for row in rows])
+
+        def to_records(batch):
+            records = converter.records(batch)
+            if stamp_synced:
+                for record in records:
+                    record['synced_at'] = now
+            return records
+
+        try:
+            self._upsert(pg_table, table, to_records(rows), stamp, bases)
+            return rows
+        except (IntegrityError, DataError, ValueError) as e:
+            logger.warning(f"[SyncService] {table.name} batch rejected, retrying row by row: {e}")
+
+        pushed = []
+        for row in rows:
+            try:
+                self._upsert(pg_table, table, to_records([row]), stamp, bases)
+                pushed.append(row)
+            except (IntegrityError, DataError, ValueError) as e:
+                logger.error(f"[SyncService] Failed to sync {table.name} {row.get(table.primary_key)}: {e}")
+        return pushed
+
+    def _upsert(self, pg_table, table, records, stamp=None, bases=None):
+        stmt = pg_insert(pg_table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.primary_key],
+            set_={name: stmt.excluded[name] for name in records[0] if name != table.primary_key}
+        )
+        keys = [record[table.primary_key] for record in records]
+
+        with self.postgres_engine.begin() as pg_conn:
+            rollup = self._rollup_days(pg_conn, pg_table, table, keys)
+            applied = self._apply_deltas(pg_conn, pg_table, table, records, stamp, bases or {})
+            pg_conn.execute(stmt, records)
+            self._update_rollup(pg_conn, pg_table, table, keys, rollup)
+
+        if applied:
+            self._rebase_local(table, applied, stamp)
+
+    def _load_bases(self, table, keys):
+        """{(row_key, column): (base value, stamp)} of a table's delta columns"""
+        if not table.delta_columns or not keys:
+            return {}
+        bases = {}
+        with self.sqlite_engine.connect() as conn:
+            for start in range(0, len(keys), self.batch_size):
+                result = conn.execute(
+                    select(sync_base.c.row_key, sync_base.c.column_name, sync_base.c.value, sync_base.c.stamp)
+                    .where(sync_base.c.table_name == table.name,
+                           sync_base.c.row_key.in_(keys[start:start + self.batch_size]))
+                )
+                for row_key, column_name, value, stamp in result:
+                    bases[(row_key, column_name)] = (value, stamp)
+        return bases
+
+    def _apply_deltas(self, pg_conn, pg_table, table, records, stamp, bases):
+        """
+        Turn the local delta columns of records into cloud + (local - base).
+
+        The cloud rows are locked until the upsert commits, so two tills
+        pushing the same product add up instead of overwriting each other.
+        A row already carrying this batch (its base has this stamp or a later
+        one, or the cloud synced_at is this stamp) keeps the cloud value: a
+        replayed batch adds nothing.
+
+        Returns:
+            dict: {row_key: {column: (pushed local value, new cloud value)}}
+        """
+        if not table.delta_columns:
+            return {}
+
+        key_column = pg_table.c[table.primary_key]
+        columns = [pg_table.c[name] for name in table.delta_columns]
+        if 'synced_at' in pg_table.c:
+            columns.append(pg_table.c.synced_at)
+        cloud = {
+            str(row._mapping[table.primary_key]): row._mapping
+            for row in pg_conn.execute(
+                select(key_column, *columns)
+                .where(key_column.in_([record[table.primary_key] for record in records]))
+                .with_for_update()
+            )
+        }
+        replayed_at = datetime.fromisoformat(stamp) if stamp else None
+
+        applied = {}
+        for record in records:
+            key = str(record[table.primary_key])
+            current = cloud.get(key)
+            values = applied.setdefault(key, {})
+            for name in table.delta_columns:
+                local = record.get(name)
+                if local is None:
+                    continue
+                base, base_stamp = bases.get((key, name), (None, None))
+                if current is None or current[name] is None:
+                    pass  # new in the cloud: the local value
+                elif _stamp_applied(base_stamp, stamp) or (
+                        replayed_at is not None and _naive_utc(current.get('synced_at')) == replayed_at):
+                    record[name] = current[name]
+                elif base is not None:
+                    record[name] = current[name] + (local - base)
+                values[name] = (local, record[name])
+        return applied
+
+    def _rebase_local(self, table, applied, stamp):
+        """
+        After a push: move local delta columns by what other tills changed in
+        the cloud (new cloud value - pushed value) and record the new bases.
+
+        Sales made here since the batch was read are kept (the column is
+        shifted, not overwritten). Skipped for rows whose base already has
+        this stamp or a later one, so a replayed batch does not shift them twice.
+        """
+        local_table = self._local_table(table.name)
+        key_column = local_table.c[table.primary_key]
+        keys = list(applied)
+        bases = self._load_bases(table, keys)
+        shifted = set()
+
+        with self.sqlite_engine.begin() as conn:
+            for key, values in applied.items():
+                for name, (pushed, cloud_value) in values.items():
+                    if _stamp_applied(bases.get((key, name), (None, None))[1], stamp):
+                        continue
+                    if cloud_value != pushed:
+                        conn.execute(
+                            local_table.update().where(key_column == key)
+                            .values({name: local_table.c[name] + (cloud_value - pushed)})
                         )
-                        ON CONFLICT (bill_id) DO UPDATE SET
-                            synced_at = CURRENT_TIMESTAMP
-                    """), converted)
+                        shifted.add(key)
+                    self._store_base(conn, table, key, name, cloud_value, stamp)
+
+            clients = set()
+            if shifted and 'client_id' in local_table.c:
+                clients = {
+                    str(value) for value in conn.execute(
+                        select(local_table.c.client_id).where(key_column.in_(list(shifted)))
+                    ).scalars() if value
+                }
+
+        if clients:
+            self._invalidate_pulled({'stock_clients': clients, 'users': set()})
+
+    @staticmethod
+    def _store_base(conn, table, key, name, value, stamp=None):
+        """Set a base; without a stamp (pull) the stamp of the last push is kept"""
+        stmt = sqlite_insert(sync_base).values(
+            table_name=table.name, row_key=key, column_name=name, value=value, stamp=stamp
+        )
+        set_ = {'value': stmt.excluded.value}
+        if stamp is not None:
+            set_['stamp'] = stmt.excluded.stamp
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=['table_name', 'row_key', 'column_name'], set_=set_
+        ))
+
+    def _delete(self, table, keys):
+        pg_table = self._pg_table(table.name)
+        key_type = TypeConverter.type_name(pg_table.c[table.primary_key].type)
+        keys = [TypeConverter.from_sqlite(key, key_type) if key_type else key for key in keys]
+
+        with self.postgres_engine.begin() as pg_conn:
+            rollup = self._rollup_days(pg_conn, pg_table, table, keys)
+            pg_conn.execute(pg_table.delete().where(pg_table.c[table.primary_key].in_(keys)))
+            self._update_rollup(pg_conn, pg_table, table, [], rollup)
+
+    def _has_rollup(self):
+        """True if the cloud has the sales_rollup table (migrations/add_sales_rollup.sql)"""
+        if self._cloud_rollup is None:
+            self._cloud_rollup = sa_inspect(self.postgres_engine).has_table('sales_rollup')
+        return self._cloud_rollup
+
+    def _rollup_days(self, pg_conn, pg_table, table, keys, client_days=None):
+        """
+        {client_id: {sale date}} of the given bills as stored in PostgreSQL.
+
+        Returns:
+            dict or None: None for tables without a rollup
+        """
+        if not table.rollup or not self._has_rollup():
+            return None
+        client_days = client_days if client_days is not None else {}
+        if keys:
+            result = pg_conn.execute(
+                select(pg_table.c.client_id, pg_table.c.created_at)
+                .where(pg_table.c[table.primary_key].in_(keys))
+            )
+            for client_id, created_at in result:
+                if created_at is not None:
+                    client_days.setdefault(str(client_id), set()).add(created_at.date())
+        return client_days
+
+    def _update_rollup(self, pg_conn, pg_table, table, keys, client_days):
+        """
+        Recompute the cloud sales_rollup days touched by a pushed bill batch.
+
+        client_days holds the days of the bills before the write; the days
+        after it are added here (an edit may move a bill to another day).
+        """
+        if client_days is None:
+            return
+        from utils.sales_rollup import recompute_sales_rollup_days
+
+        self._rollup_days(pg_conn, pg_table, table, keys, client_days)
+        recompute_sales_rollup_days(pg_conn, client_days)
+
+
+    # -------------------------------------------------------------------- pull
+
+    def pull_all(self, errors=None):
+        """
+        Pull master data changed in the cloud into the local database.
+
+        Local writes go through Core statements, so they are not journaled
+        (and never pushed back). Caches of pulled stock and users are invalidated.
+
+        Returns:
+            dict: rows applied and seconds per table
+        """
+        errors = errors if errors is not None else []
+        pulled = {}
+        changed = {'stock_clients': set(), 'users': set()}
+        changed_lock = threading.Lock()
 
-                    synced_count += 1
+        with self.sqlite_engine.connect() as conn:
+            client_ids = [str(row[0]) for row in conn.execute(text("SELECT client_id FROM client_entry"))]
 
-                except Exception as e:
-                    logger.error(f"[SyncService] Failed to sync bill {bill.get('bill_id')}: {e}")
+        def pull(table):
+            started = time.monotonic()
+            outcome = {"rows": 0, "errors": [], "interrupted": False}
+            try:
+                table_changed = {'stock_clients': set(), 'users': set()}
+                outcome["rows"] = self._pull_table(table, client_ids, table_changed)
+                with changed_lock:
+                    for name, values in table_changed.items():
+                        changed[name].update(values)
+            except CONNECTION_ERRORS as e:
+                logger.error(f"[SyncService] Connection lost while pulling {table.name}: {e}")
+                outcome["errors"].append(f"connection: {str(e)}")
+                outcome["interrupted"] = True
+            except Exception as e:
+                logger.error(f"[SyncService] Pull of {table.name} failed: {e}")
+                outcome["errors"].append(f"pull {table.name}: {str(e)}")
+            outcome["seconds"] = round(time.monotonic() - started, 3)
+            return outcome
+
+        tables = [table for table in PULL_TABLES if table.scope == 'global' or client_ids]
+        for name, outcome in self._run_levels(tables, pull):
+            errors += outcome.pop("errors")
+            outcome.pop("interrupted")
+            pulled[name] = outcome
+
+        self._invalidate_pulled(changed)
+        self.last_pull_time = datetime.utcnow()
+        return pulled
+
+    def _local_table(self, name):
+        """Untyped local table: values are already converted to SQLite form by TypeConverter"""
+        table = self._local_tables.get(name)
+        if table is None:
+            columns = [column['name'] for column in sa_inspect(self.sqlite_engine).get_columns(name)]
+            table = sa_table(name, *[sa_column(column) for column in columns])
+            self._local_tables[name] = table
+        return table
+
+    @staticmethod
+    def _scope_condition(table):
+        if table.scope == 'client':
+            return "client_id IN :client_ids"
+        if table.scope == 'user':
+            return "user_id IN (SELECT user_id FROM users WHERE client_id IN :client_ids)"
+        return "1 = 1"
+
+    def _pull_table(self, table, client_ids, changed):
+        pg_table = self._pg_table(table.name)
+        column_types = TypeConverter.column_types(pg_table)
+        scope = self._scope_condition(table)
+        params = {"client_ids": client_ids} if table.scope != 'global' else {}
+
+        def fetch(sql, extra):
+            stmt = text(sql)
+            if table.scope != 'global':
+                stmt = stmt.bindparams(bindparam("client_ids", expanding=True))
+            with self.postgres_engine.connect() as pg_conn:
+                return [dict(row._mapping) for row in pg_conn.execute(stmt, {**params, **extra})]
+
+        if table.mode == 'snapshot':
+            rows = fetch(f"SELECT * FROM {table.name} WHERE {scope}", {})
+            return self._merge_rows(table, rows, column_types, changed, snapshot=True, client_ids=client_ids)
+
+        state_key = f"pull:{table.name}"
+        with self.sqlite_engine.connect() as conn:
+            watermark = conn.execute(
+                text("SELECT last_value FROM sync_state WHERE table_name = :name"), {"name": state_key}
+            ).scalar()
+
+        applied = 0
+        since = datetime.fromisoformat(watermark) - timedelta(seconds=PULL_OVERLAP_SECONDS) if watermark else None
+        cursor = None
+        newest = since
+
+        while True:
+            order = f"{table.change_column}, {table.primary_key}"
+            if cursor is not None:
+                condition = f"({table.change_column}, {table.primary_key}) > (:last_value, :last_key)"
+                extra = {"last_value": cursor[0], "last_key": cursor[1]}
+            elif since is not None:
+                condition, extra = f"{table.change_column} >= :since", {"since": since}
+            else:
+                condition, extra = "1 = 1", {}
+
+            rows = fetch(
+                f"SELECT *, {table.change_column} AS _changed_at FROM {table.name} "
+                f"WHERE {scope} AND {condition} ORDER BY {order} LIMIT {self.batch_size}",
+                extra
+            )
+            if not rows:
+                break
+
+            cursor = (rows[-1]["_changed_at"], rows[-1][table.primary_key])
+            for row in rows:
+                changed_at = _naive_utc(_as_datetime(row.pop("_changed_at")))
+                if changed_at is not None and (newest is None or changed_at > newest):
+                    newest = changed_at
+
+            applied += self._merge_rows(table, rows, column_types, changed)
+            if len(rows) < self.batch_size:
+                break
+
+        if newest is not None and newest != since:
+            with self.sqlite_engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO sync_state (table_name, last_value, updated_at)
+                    VALUES (:name, :value, :updated_at)
+                    ON CONFLICT (table_name) DO UPDATE SET
+                        last_value = excluded.last_value,
+                        updated_at = excluded.updated_at
+                """), {"name": state_key, "value": newest.isoformat(), "updated_at": datetime.utcnow().isoformat()})
+
+        return applied
+
+    def _merge_rows(self, table, rows, column_types, changed, snapshot=False, client_ids=None):
+        """
+        Apply cloud rows to the local table following the table's conflict rule.
+
+        Returns:
+            int: Rows inserted, updated or deleted locally
+        """
+        local_table = self._local_table(table.name)
+        key_column = local_table.c[table.primary_key]
+        local_columns = set(local_table.columns.keys())
+        keys = [str(row[table.primary_key]) for row in rows]
+
+        with self.sqlite_engine.begin() as conn:
+            pending = set()
+            if table.name in JOURNALED_TABLES:
+                pending = {
+                    str(key) for key in conn.execute(
+                        select(sync_journal.c.row_key).where(sync_journal.c.table_name == table.name)
+                    ).scalars()
+                }
+
+            local_rows = {}
+            for start in range(0, len(keys), self.batch_size):
+                chunk = keys[start:start + self.batch_size]
+                for row in conn.execute(text(
+                    f"SELECT * FROM {table.name} WHERE {table.primary_key} IN :keys"
+                ).bindparams(bindparam("keys", expanding=True)), {"keys": chunk}):
+                    local_rows[str(row._mapping[table.primary_key])] = dict(row._mapping)
+            bases = self._load_bases(table, keys)
+            new_bases = []
+
+            converter = TypeConverter.compile_to_sqlite(
+                [name for name in rows[0] if name in local_columns] if rows else [], column_types
+            )
+            records = []
+            for key, record in zip(keys, converter.records(rows)):
+                local = local_rows.get(key)
+                cloud_values = {name: record[name] for name in table.delta_columns if record.get(name) is not None}
+                if local is None:
+                    new_bases += [(key, name, value) for name, value in cloud_values.items()]
+                else:
+                    merged = self._resolve(table, dict(record), local, key in pending)
+                    if cloud_values:
+                        merged = self._merge_deltas(
+                            key, record, merged, cloud_values, local, key in pending, bases, new_bases
+                        )
+                    if merged is None or all(local.get(name) == value for name, value in merged.items()):
+                        continue
+                    record = merged
+                records.append(record)
+
+            applied = 0
+            if snapshot:
+                # Local rows that no longer exist in the cloud (unless changed locally)
+                scope = self._scope_condition(table)
+                stmt = text(f"SELECT {table.primary_key} FROM {table.name} WHERE {scope}")
+                if table.scope != 'global':
+                    stmt = stmt.bindparams(bindparam("client_ids", expanding=True))
+                local_keys = {str(value) for value in conn.execute(stmt, {"client_ids": client_ids}).scalars()}
+                removed = local_keys - set(keys) - pending
+                if removed:
+                    conn.execute(local_table.delete().where(key_column.in_(list(removed))))
+                    applied += len(removed)
+
+            if records:
+                stmt = sqlite_insert(local_table)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.primary_key],
+                    set_={name: stmt.excluded[name] for name in records[0] if name != table.primary_key}
+                )
+                for start in range(0, len(records), self.batch_size):
+                    conn.execute(stmt, records[start:start + self.batch_size])
+                applied += len(records)
+
+            for key, name, value in new_bases:
+                self._store_base(conn, table, key, name, value)
+
+        if table.name == 'stock_entry':
+            changed['stock_clients'].update(str(record['client_id']) for record in records if record.get('client_id'))
+        if table.name in ('users', 'user_permissions'):
+            changed['users'].update(str(record['user_id']) for record in records if record.get('user_id'))
+
+        return applied
+
+    @staticmethod
+    def _resolve(table, record, local, pending):
+        """Merged record to write for a row present on both sides, or None to keep the local row"""
+        if table.conflict == 'cloud':
+            for name in table.keep_local:
+                if name in local:
+                    record[name] = local[name]
+            return record
+
+        if table.conflict == 'local':
+            return None if pending else record
+
+        # 'newer': compare updated_at (missing counts as oldest); ties keep the local row
+        remote_at = _as_datetime(record.get('updated_at'))
+        local_at = _as_datetime(local.get('updated_at'))
+        if local_at is not None and (remote_at is None or remote_at <= local_at):
+            return None
+        if pending:
+            for name in table.keep_local:
+                if name in local:
+                    record[name] = local[name]
+        return record
+
+    @staticmethod
+    def _merge_deltas(key, record, merged, cloud_values, local, pending, bases, new_bases):
+        """
+        Apply the cloud's delta columns to the record resolved for a local row.
+
+        Without unpushed local changes the cloud value is taken; with them the
+        local value becomes cloud + (local - base). A pending row without a
+        base keeps its value (its first push sends it as is). New bases are
+        appended to new_bases as (key, column, cloud value).
+        """
+        for name, cloud_value in cloud_values.items():
+            base = bases.get((key, name), (None, None))[0]
+            if pending and base is None:
+                value = local.get(name)
+            else:
+                value = local[name] + (cloud_value - base) if pending else cloud_value
+                new_bases.append((key, name, cloud_value))
+
+            if merged is None:
+                if value == local.get(name):
                     continue
+                # The rest of the row stays local (conflict rule), only the counter moves
+                merged = {column: local.get(column) for column in record}
+            merged[name] = value
+        return merged
+
+    @staticmethod
+    def _invalidate_pulled(changed):
+        if not changed['stock_clients'] and not changed['users']:
+            return
+        try:
+            from utils.cache_helper import invalidate_stock_cache
+            from utils.session_cache import session_cache
+
+            for client_id in changed['stock_clients']:
+                invalidate_stock_cache(client_id)
+
+            session_cache.invalidate_users(changed['users'])
+        except Exception as e:
+            logger.warning(f"[SyncService] Cache invalidation after pull failed: {e}")
+
+
+def _stamp_applied(base_stamp, stamp):
+    """True if a push batch stamped `stamp` is already in a base stamped base_stamp (ISO text sorts by time)"""
+    return base_stamp is not None and stamp is not None and stamp <= base_stamp
+
+
+def _naive_utc(value):
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 
-            pg_conn.commit()
-
-        # Mark as synced in SQLite
-        if synced_count > 0:
-            bill_ids = [bill['bill_id'] for bill in bills[:synced_count]]
-            with self.sqlite_engine.connect() as sqlite_conn:
-                sqlite_conn.execute(text("""
-                    UPDATE gst_billing
-                    SET synced_at = :synced_at
-                    WHERE bill_id IN :bill_ids
-                """), {"synced_at": datetime.utcnow().isoformat(), "bill_ids": tuple(bill_ids)})
-                sqlite_conn.commit()
-
-        return synced_count
-
-    def _sync_non_gst_bills(self):
-        """Sync non-GST bills from SQLite to PostgreSQL"""
-        # Similar to _sync_gst_bills but for non_gst_billing table
-        # TODO: Implement when needed
-        return 0
-
-    def _sync_stock(self):
-        """Sync stock updates from SQLite to PostgreSQL"""
-        # TODO: Implement stock sync
-        return 0
-
-    def _sync_customers(self):
-        """Sync customers from SQLite to PostgreSQL"""
-        # TODO: Implement customer sync
-        return 0
+def _as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
 
 
 # Global sync service instance
@@ -0,0 +1,128 @@
+"""
+Sync Spool - outgoing sync batches persisted on disk until acknowledged
+
+Before a batch is uploaded it is written to SYNC_SPOOL_DIR as one gzip file:
+
+    <table>-<first_seq>-<last_seq>.batch.gz
+        line 1: sha256 of the payload
+        line 2: payload (JSON: journal entries, the local rows as read and the
+                batch stamp - the synced_at the upload writes)
+
+Rows are stored in their SQLite form (text / numbers), so the file needs no
+custom serialisation; TypeConverter runs when the batch is uploaded. Files are
+written to a temporary name, fsynced and renamed, so a crash leaves either a
+complete batch or none. After a dropped connection or a restart the spooled
+batch is uploaded again exactly as prepared (upserts and deletes are
+idempotent, and the stamp lets delta columns recognise a batch already
+applied) before any new entries are read; a file failing its checksum is
+discarded - its journal entries are still unacknowledged and get re-read.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SUFFIX = '.batch.gz'
+_FILE_PATTERN = re.compile(r'^(?P<table>[a-z_]+)-(?P<first>\d+)-(?P<last>\d+)\.batch\.gz$')
+
+
+class SyncSpool:
+    """Directory of spooled batches, one file per (table, sequence range)"""
+
+    def __init__(self, directory: Optional[str] = None, compresslevel: int = 6):
+        self.directory = directory or os.getenv(
+            'SYNC_SPOOL_DIR', os.path.expanduser('~/.mj-billing/sync_spool')
+        )
+        self.compresslevel = compresslevel
+        os.makedirs(self.directory, exist_ok=True)
+
+    def write(self, table_name: str, entries: List[Dict], rows: Dict[str, Dict],
+              stamp: Optional[str] = None) -> str:
+        """
+        Persist a batch before it is uploaded.
+
+        Args:
+            entries: Journal entries of the batch (seq, row_key, operation, client_id)
+            rows: Local rows by key for the entries that are upserts
+            stamp: ISO time the upload stamps the rows with (same on every attempt)
+
+        Returns:
+            str: Path of the spool file
+        """
+        first_seq, last_seq = entries[0]['seq'], entries[-1]['seq']
+        payload = json.dumps({
+            'table': table_name,
+            'first_seq': first_seq,
+            'last_seq': last_seq,
+            'entries': [
+                {
+                    'seq': entry['seq'],
+                    'table_name': entry['table_name'],
+                    'row_key': entry['row_key'],
+                    'operation': entry['operation'],
+                    'client_id': entry['client_id'],
+                }
+                for entry in entries
+            ],
+            'rows': rows,
+            'stamp': stamp,
+        }, separators=(',', ':'), default=str).encode('utf-8')
+        checksum = hashlib.sha256(payload).hexdigest().encode('ascii')
+
+        path = os.path.join(self.directory, f"{table_name}-{first_seq}-{last_seq}{SPOOL_SUFFIX}")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.compresslevel) as spool_file:
+                spool_file.write(checksum + b'\n' + payload)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp_path, path)
+        return path
+
+    def read(self, path: str) -> Optional[Dict]:
+        """Load a spooled batch, or None (file removed) if it is truncated or fails its checksum"""
+        try:
+            with gzip.open(path, 'rb') as spool_file:
+                checksum, payload = spool_file.read().split(b'\n', 1)
+            if hashlib.sha256(payload).hexdigest().encode('ascii') != checksum:
+                raise ValueError('checksum mismatch')
+            return json.loads(payload)
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning(f"[SyncSpool] Discarding unreadable batch {os.path.basename(path)}: {e}")
+            self.remove(path)
+            return None
+
+    def batches(self, table_name: str) -> List[str]:
+        """Spooled batch files of a table, oldest first"""
+        found = []
+        for name in os.listdir(self.directory):
+            match = _FILE_PATTERN.match(name)
+            if match and match.group('table') == table_name:
+                found.append((int(match.group('first')), os.path.join(self.directory, name)))
+        return [path for _, path in sorted(found)]
+
+    @staticmethod
+    def last_seq(path: str) -> int:
+        return int(_FILE_PATTERN.match(os.path.basename(path)).group('last'))
+
+    @staticmethod
+    def remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get_stats(self) -> Dict:
+        files = [name for name in os.listdir(self.directory) if name.endswith(SPOOL_SUFFIX)]
+        return {
+            'batches': len(files),
+            'bytes': sum(os.path.getsize(os.path.join(self.directory, name)) for name in files),
+        }
+
+
+__all__ = ['SyncSpool']
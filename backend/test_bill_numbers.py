@@ -0,0 +1,204 @@
+"""
+Bill number allocator tests (utils.bill_number_helper)
+Runs against a throwaway SQLite database in offline mode
+
+Usage:
+    python test_bill_numbers.py
+    python -m pytest test_bill_numbers.py
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+# Force offline mode on a temporary database (before the db modules read the environment)
+os.environ['DB_MODE'] = 'offline'
+os.environ['SQLITE_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'bill_numbers.db')
+
+# Set up path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import importlib
+import pkgutil
+from datetime import datetime
+
+from flask import Flask
+
+import models
+from database.manager import db_manager
+from extensions import db, init_db_safely
+from models.billing_model import GSTBilling
+from models.client_model import ClientEntry
+from utils import bill_number_helper
+
+app = Flask(__name__)
+init_db_safely(app)
+
+with app.app_context():
+    # Load every model so foreign keys resolve
+    for module in pkgutil.iter_modules(models.__path__):
+        importlib.import_module(f'models.{module.name}')
+    db.create_all()
+
+
+def _client():
+    """A registered client (the writer enforces foreign keys)"""
+    client_id = str(uuid.uuid4())
+    with app.app_context():
+        db.session.add(ClientEntry(client_id=client_id, client_name='Test shop', email=f'{client_id}@example.com'))
+        db.session.commit()
+    return client_id
+
+
+def _add_gst_bill(client_id, bill_number):
+    db.session.add(GSTBilling(
+        bill_id=str(uuid.uuid4()), client_id=client_id, bill_number=bill_number,
+        items=[], subtotal=0, gst_percentage=0, gst_amount=0, final_amount=0,
+        created_at=datetime.utcnow()
+    ))
+
+
+# Block size from the environment (restored after each test)
+DEFAULT_BLOCK_SIZE = bill_number_helper.BLOCK_SIZE
+
+
+def _set_block_size(size):
+    bill_number_helper.BLOCK_SIZE = size
+    bill_number_helper._blocks.clear()
+
+
+def test_sequential_numbers_seeded_from_existing_bills():
+    """First allocation continues after MAX(bill_number); both types count separately"""
+    _set_block_size(1)
+    client_id = _client()
+    with app.app_context():
+        _add_gst_bill(client_id, 41)
+        db.session.commit()
+
+        assert bill_number_helper.get_current_bill_number(client_id, 'gst') == 41
+        assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 42
+        assert bill_number_helper.get_next_bill_number(client_id, 'non_gst') == 1
+        db.session.commit()
+        assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 43
+        db.session.commit()
+        assert bill_number_helper.get_current_bill_number(client_id, 'gst') == 43
+
+
+def test_rollback_gives_number_back():
+    """A bill that rolls back leaves no gap"""
+    _set_block_size(1)
+    client_id = _client()
+    with app.app_context():
+        assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 1
+        db.session.commit()
+
+        assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 2
+        db.session.rollback()
+        assert bill_number_helper.get_current_bill_number(client_id, 'gst') == 1
+        assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 2
+        db.session.commit()
+
+
+def test_block_refill():
+    """Blocks: numbers come from memory, the counter moves once per block"""
+    _set_block_size(3)
+    client_id = _client()
+    try:
+        with app.app_context():
+            numbers = []
+            for _ in range(4):
+                numbers.append(bill_number_helper.get_next_bill_number(client_id, 'gst'))
+                db.session.commit()
+            assert numbers == [1, 2, 3, 4]
+            # Second block reserved: 4..6
+            assert bill_number_helper.get_current_bill_number(client_id, 'gst') == 6
+    finally:
+        _set_block_size(DEFAULT_BLOCK_SIZE)
+
+
+def test_block_rollback_release():
+    """Blocks: a rolled back number is reused by the next bill"""
+    _set_block_size(5)
+    client_id = _client()
+    try:
+        with app.app_context():
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 1
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 2
+            db.session.rollback()
+
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 1
+            db.session.commit()
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 2
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 3
+            db.session.commit()
+    finally:
+        _set_block_size(DEFAULT_BLOCK_SIZE)
+
+
+def test_block_refill_while_session_holds_writer():
+    """Blocks: an empty block is not refilled in a second transaction while the session writes"""
+    _set_block_size(2)
+    client_id = _client()
+    try:
+        with app.app_context():
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 1
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 2
+            db.session.commit()
+
+            # The session has written: the single writer connection is checked out
+            _add_gst_bill(client_id, 2)
+            db.session.flush()
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 3
+            db.session.rollback()
+
+            assert bill_number_helper.get_current_bill_number(client_id, 'gst') == 2
+            assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 3
+            db.session.commit()
+    finally:
+        _set_block_size(DEFAULT_BLOCK_SIZE)
+
+
+def test_default_blocks_keep_counter_out_of_bill_transaction():
+    """Default: numbers come from a block; the bill's transaction never takes the writer for them"""
+    _set_block_size(DEFAULT_BLOCK_SIZE)
+    client_id = _client()
+    with app.app_context():
+        assert bill_number_helper.BLOCK_SIZE > 1
+        first = bill_number_helper.get_next_bill_number(client_id, 'gst')
+        assert first == 1
+        assert not db_manager.holds_writer(db.session())
+        # The whole block is reserved at once; the preview shows this process's next number
+        assert bill_number_helper.get_current_bill_number(client_id, 'gst') == DEFAULT_BLOCK_SIZE
+        assert bill_number_helper.peek_next_bill_number(client_id, 'gst') == 2
+        _add_gst_bill(client_id, first)
+        db.session.commit()
+        assert bill_number_helper.get_next_bill_number(client_id, 'gst') == 2
+        db.session.rollback()
+        assert bill_number_helper.peek_next_bill_number(client_id, 'gst') == 2
+
+
+def main():
+    """Run all tests"""
+    tests = [
+        test_sequential_numbers_seeded_from_existing_bills,
+        test_rollback_gives_number_back,
+        test_block_refill,
+        test_block_rollback_release,
+        test_block_refill_while_session_holds_writer,
+        test_default_blocks_keep_counter_out_of_bill_transaction,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ PASSED: {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e!r}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Offline read/write routing tests (database.manager RoutingSession, holds_writer)
+Runs against a throwaway SQLite file; the SQLITE_READERS=0 setup is checked by
+running this file again in a child process with that setting
+
+Usage:
+    python test_db_routing.py
+    python -m pytest test_db_routing.py
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+# Offline mode on a temporary database (before the db modules read the environment)
+os.environ['DB_MODE'] = 'offline'
+os.environ['SQLITE_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'routing.db')
+os.environ.setdefault('SQLITE_READERS', '2')
+
+# Set up path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy import column, select, table, text
+from sqlalchemy.exc import IntegrityError
+
+from database.manager import db_manager
+from extensions import db, init_db_safely
+
+app = Flask(__name__)
+init_db_safely(app)
+
+READERS = int(os.environ['SQLITE_READERS'])
+
+with app.app_context():
+    with db.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE route_parent (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("""
+            CREATE TABLE route_child (
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER NOT NULL REFERENCES route_parent (id)
+            )
+        """))
+        conn.execute(text("INSERT INTO route_parent (id) VALUES (1)"))
+
+route_parent = table('route_parent', column('id'))
+
+
+def test_plain_read_leaves_writer_free():
+    """A SELECT goes to the reader pool; with SQLITE_READERS=0 the one engine serves it"""
+    with app.app_context():
+        session = db.session()
+        session.execute(text("SELECT id FROM route_parent"))
+        if READERS:
+            assert db_manager.reader_engine is not None
+            assert not db_manager.holds_writer(session)
+        else:
+            assert db_manager.reader_engine is None
+            assert db_manager.holds_writer(session)
+        session.commit()
+        assert not db_manager.holds_writer(session)
+        db.session.remove()
+
+
+def test_write_holds_writer_until_commit():
+    """After a write the transaction stays on the writer, reads included, until it ends"""
+    with app.app_context():
+        session = db.session()
+        session.execute(text("INSERT INTO route_parent (id) VALUES (2)"))
+        assert db_manager.holds_writer(session)
+
+        # Read-your-writes: the read after the write uses the writer
+        assert session.execute(text("SELECT count(*) FROM route_parent WHERE id = 2")).scalar() == 1
+        assert db_manager.holds_writer(session)
+
+        session.commit()
+        assert not db_manager.holds_writer(session)
+        db.session.remove()
+
+
+def test_rollback_releases_writer():
+    with app.app_context():
+        session = db.session()
+        session.execute(text("INSERT INTO route_parent (id) VALUES (3)"))
+        assert db_manager.holds_writer(session)
+        session.rollback()
+        assert not db_manager.holds_writer(session)
+        assert session.execute(text("SELECT count(*) FROM route_parent WHERE id = 3")).scalar() == 0
+        db.session.remove()
+
+
+def test_select_for_update_holds_writer():
+    """SELECT ... FOR UPDATE locks rows: it is routed like a write"""
+    with app.app_context():
+        session = db.session()
+        session.execute(select(route_parent).with_for_update())
+        assert db_manager.holds_writer(session)
+        session.rollback()
+        db.session.remove()
+
+
+def test_writer_enforces_foreign_keys():
+    """The writer connection runs with PRAGMA foreign_keys=ON"""
+    with app.app_context():
+        session = db.session()
+        try:
+            session.execute(text("INSERT INTO route_child (id, parent_id) VALUES (1, 999)"))
+            session.flush()
+            raise AssertionError("insert referencing a missing parent was accepted")
+        except IntegrityError:
+            session.rollback()
+        finally:
+            db.session.remove()
+
+
+def test_readers_disabled():
+    """The same checks pass with SQLITE_READERS=0 (one engine, no routing)"""
+    if not READERS:
+        return
+    env = dict(os.environ, SQLITE_READERS='0')
+    env.pop('SQLITE_DB_PATH')
+    result = subprocess.run([sys.executable, os.path.abspath(__file__)], env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+def main():
+    """Run all tests"""
+    tests = [
+        test_plain_read_leaves_writer_free,
+        test_write_holds_writer_until_commit,
+        test_rollback_releases_writer,
+        test_select_for_update_holds_writer,
+        test_writer_enforces_foreign_keys,
+        test_readers_disabled,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ PASSED: {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e!r}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed (SQLITE_READERS={READERS})")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Group commit tests (database.group_commit, database.manager.RoutingSession)
+Runs threads against a throwaway SQLite file in offline mode with
+SQLITE_GROUP_COMMIT_MS set, so concurrent sessions share one batch
+
+Usage:
+    python test_group_commit.py
+    python -m pytest test_group_commit.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Offline mode with group commit on a temporary database (before the db modules read the environment)
+os.environ['DB_MODE'] = 'offline'
+os.environ['SQLITE_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'group_commit.db')
+os.environ['SQLITE_GROUP_COMMIT_MS'] = '300'
+os.environ['SQLITE_GROUP_COMMIT_MAX'] = '50'
+
+# Set up path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+from database.manager import db_manager
+from extensions import db, init_db_safely
+
+app = Flask(__name__)
+init_db_safely(app)
+group = db_manager.group_commit
+
+with app.app_context():
+    with db.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE gc_item (name TEXT PRIMARY KEY)"))
+
+# Separate connection: sees only what is committed to the file
+observer = create_engine(f"sqlite:///{os.environ['SQLITE_DB_PATH']}")
+
+# after_commit calls per thread (listener order: RoutingSession's wait runs first)
+_after_commit = []
+
+
+@event.listens_for(Session, 'after_commit')
+def _record_after_commit(session):
+    _after_commit.append(threading.current_thread().name)
+
+
+def _committed_names():
+    with observer.connect() as conn:
+        return {name for (name,) in conn.execute(text("SELECT name FROM gc_item"))}
+
+
+def _member(name, outcome, rollback=False):
+    """One request: insert a row, then commit or roll back"""
+    with app.app_context():
+        try:
+            db.session.execute(text("INSERT INTO gc_item (name) VALUES (:name)"), {"name": name})
+            if rollback:
+                db.session.rollback()
+                outcome[name] = 'rolled back'
+                return
+            db.session.commit()
+            # commit() only returns once the batch is in the file
+            outcome[name] = 'visible' if name in _committed_names() else 'not visible'
+        except Exception as e:
+            outcome[name] = e
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def _wait_done_writing(started, outcome):
+    """Wait until every started member has committed into the batch or finished"""
+    deadline = time.monotonic() + 5
+    while group._members + len(outcome) < started and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def _run_members(members):
+    """
+    Run (name, rollback) members in threads, in the given order.
+
+    A session holds the writer from its first write until its transaction
+    ends, so each member is started once the previous one has let go of it.
+    """
+    outcome = {}
+    threads = []
+    for name, rollback in members:
+        thread = threading.Thread(target=_member, name=name, args=(name, outcome, rollback))
+        thread.start()
+        threads.append(thread)
+        _wait_done_writing(len(threads), outcome)
+    for thread in threads:
+        thread.join(timeout=30)
+    return outcome
+
+
+def test_rollback_leaves_other_members_intact():
+    """One member rolls back its savepoint; the others commit in the same batch"""
+    before = dict(group.stats)
+    _after_commit.clear()
+    outcome = _run_members([('a1', False), ('b1', True), ('c1', False)])
+
+    assert outcome == {'a1': 'visible', 'b1': 'rolled back', 'c1': 'visible'}, outcome
+    assert {'a1', 'c1'} <= _committed_names()
+    assert 'b1' not in _committed_names()
+    assert sorted(_after_commit) == ['a1', 'c1'], _after_commit
+    assert group.stats['commits'] - before['commits'] == 2
+    assert group.stats['batches'] - before['batches'] == 1
+
+
+class _FailingTransaction:
+    """Stands in for the batch transaction: COMMIT fails (disk full, I/O error)"""
+
+    def __init__(self, transaction):
+        self.transaction = transaction
+
+    def commit(self):
+        self.transaction.rollback()
+        raise RuntimeError('database or disk is full')
+
+    def rollback(self):
+        pass
+
+
+def test_failed_batch_raises_in_every_member_before_after_commit():
+    """A failed COMMIT reaches every member's commit(); no after_commit listener runs for them"""
+    finish = group._finish
+
+    def failing_finish():
+        group._transaction = _FailingTransaction(group._transaction)
+        group._finish = finish
+        finish()
+
+    group._finish = failing_finish
+    _after_commit.clear()
+    try:
+        outcome = _run_members([('a2', False), ('b2', False)])
+    finally:
+        group._finish = finish
+
+    assert all(isinstance(result, RuntimeError) for result in outcome.values()), outcome
+    assert set(outcome) == {'a2', 'b2'}
+    assert not {'a2', 'b2'} & set(_after_commit), _after_commit
+    assert not {'a2', 'b2'} & _committed_names()
+
+    # The sessions are usable again and the next batch commits normally
+    assert _run_members([('a2', False)]) == {'a2': 'visible'}
+
+
+def test_window_expiry_commits_lone_member():
+    """A single member is committed by its own wait once the window has passed"""
+    before = dict(group.stats)
+    started = time.monotonic()
+    outcome = _run_members([('a3', False)])
+    elapsed = time.monotonic() - started
+
+    assert outcome == {'a3': 'visible'}, outcome
+    assert elapsed >= group.window * 0.9, elapsed
+    assert group.stats['batches'] - before['batches'] == 1
+    assert group._transaction is None  # nothing left open
+
+
+def main():
+    """Run all tests"""
+    tests = [
+        test_rollback_leaves_other_members_intact,
+        test_failed_batch_raises_in_every_member_before_after_commit,
+        test_window_expiry_commits_lone_member,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ PASSED: {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e!r}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
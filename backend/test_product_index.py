@@ -0,0 +1,198 @@
+"""
+Product lookup index tests (utils.product_index)
+Runs against a throwaway SQLite database in offline mode with the shared cache
+in a throwaway file; two ProductLookupIndex instances stand in for two workers
+
+Usage:
+    python test_product_index.py
+    python -m pytest test_product_index.py
+"""
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+# Offline mode and the shared cache in temporary files (before the modules read the environment)
+WORK_DIR = tempfile.mkdtemp()
+os.environ['DB_MODE'] = 'offline'
+os.environ['SQLITE_DB_PATH'] = os.path.join(WORK_DIR, 'product_index.db')
+os.environ['CACHE_BACKEND'] = 'shared'
+os.environ['CACHE_DB_PATH'] = os.path.join(WORK_DIR, 'cache.db')
+
+# Set up path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import importlib
+import pkgutil
+
+from flask import Flask
+
+import models
+from extensions import db, init_db_safely
+from models.client_model import ClientEntry
+from models.stock_model import StockEntry
+from utils import cache as cache_module
+from utils import product_index as product_index_module
+from utils.product_index import DELTA_OVERLAP, ProductLookupIndex
+
+app = Flask(__name__)
+init_db_safely(app)
+
+with app.app_context():
+    # Load every model so foreign keys resolve
+    for module in pkgutil.iter_modules(models.__path__):
+        importlib.import_module(f'models.{module.name}')
+    db.create_all()
+
+
+def _client():
+    """A registered client (the writer enforces foreign keys)"""
+    client_id = str(uuid.uuid4())
+    with app.app_context():
+        db.session.add(ClientEntry(client_id=client_id, client_name='Test shop', email=f'{client_id}@example.com'))
+        db.session.commit()
+    return client_id
+
+
+def _add_product(client_id, name, quantity=10, barcode=None, updated_at=None):
+    product_id = str(uuid.uuid4())
+    db.session.add(StockEntry(
+        product_id=product_id, client_id=client_id, product_name=name, quantity=quantity,
+        rate=10, barcode=barcode or f'89{uuid.uuid4().int % 10 ** 11:011d}', updated_at=updated_at
+    ))
+    db.session.commit()
+    return product_id
+
+
+def _sell(product_id, count):
+    """A sale as the billing route writes it: quantity and updated_at in one UPDATE"""
+    StockEntry.query.filter_by(product_id=product_id).update({
+        'quantity': StockEntry.quantity - count,
+        'updated_at': datetime.utcnow()
+    })
+    db.session.commit()
+
+
+def _workers():
+    return ProductLookupIndex(), ProductLookupIndex()
+
+
+def test_lookup_sees_other_workers_stock_update():
+    """Worker A sells and signals; worker B's next scan shows the new quantity from a delta refresh"""
+    client_id = _client()
+    worker_a, worker_b = _workers()
+    with app.app_context():
+        product_id = _add_product(client_id, 'Soap', quantity=10, barcode='8900000000011')
+        worker_a.mark_changed(client_id)
+        assert worker_a.lookup(client_id, '8900000000011')['quantity'] == 10
+        assert worker_b.lookup(client_id, '8900000000011')['quantity'] == 10
+
+        _sell(product_id, 3)
+        worker_a.mark_changed(client_id)
+
+        assert worker_b.lookup(client_id, '8900000000011')['quantity'] == 7
+        assert worker_b.lookup(client_id, 'soap')['quantity'] == 7
+        assert worker_b.reloads == 1  # the refresh re-read the changed row only
+
+        # No change signalled: the scan is answered from memory, even if the database moved
+        StockEntry.query.filter_by(product_id=product_id).update({'quantity': 1})
+        db.session.commit()
+        assert worker_b.lookup(client_id, '8900000000011')['quantity'] == 7
+
+
+def test_delta_refresh_covers_overlap():
+    """A row committed after B's load with an earlier updated_at is found if within DELTA_OVERLAP"""
+    client_id = _client()
+    worker_a, worker_b = _workers()
+    with app.app_context():
+        _add_product(client_id, 'Rice')
+        worker_a.mark_changed(client_id)
+        assert worker_b.lookup(client_id, 'rice') is not None
+        loaded_at = worker_b._clients[client_id].loaded_at
+
+        # Transactions that stamped updated_at before B loaded, committed after
+        inside = loaded_at - DELTA_OVERLAP + timedelta(seconds=5)
+        outside = loaded_at - DELTA_OVERLAP - timedelta(seconds=5)
+        _add_product(client_id, 'Dal', barcode='8900000000028', updated_at=inside)
+        _add_product(client_id, 'Salt', barcode='8900000000035', updated_at=outside)
+        worker_a.mark_changed(client_id)
+
+        assert worker_b.lookup(client_id, '8900000000028')['product_name'] == 'Dal'
+        # Older than the overlap: only a full reload (reset signal or MAX_AGE) picks it up
+        assert worker_b.lookup(client_id, '8900000000035') is None
+        assert worker_b.reloads == 1
+
+
+def test_reset_token_after_delete_forces_reload():
+    """Deletes are invisible to a delta refresh; the reset token makes every worker reload"""
+    client_id = _client()
+    worker_a, worker_b = _workers()
+    with app.app_context():
+        product_id = _add_product(client_id, 'Oil', barcode='8900000000042')
+        _add_product(client_id, 'Ghee', barcode='8900000000059')
+        worker_a.mark_changed(client_id)
+        assert worker_b.lookup(client_id, '8900000000042') is not None
+        _, reset_token = worker_a._read_stamp(client_id)
+
+        StockEntry.query.filter_by(product_id=product_id).delete()
+        db.session.commit()
+        worker_a.mark_changed(client_id, reset=True)
+
+        _, new_token = worker_a._read_stamp(client_id)
+        assert new_token != reset_token
+        assert worker_b.lookup(client_id, '8900000000042') is None
+        assert worker_b.lookup(client_id, '8900000000059') is not None
+        assert worker_b.reloads == 2
+
+        # Plain changes keep the reset token: no further full reloads
+        worker_a.mark_changed(client_id)
+        assert worker_a._read_stamp(client_id)[1] == new_token
+        assert worker_b.lookup(client_id, '8900000000059') is not None
+        assert worker_b.reloads == 2
+
+
+def test_disabled_with_memory_cache():
+    """CACHE_BACKEND=memory: stamps are per process, so the index stays off and lookups miss"""
+    client_id = _client()
+    os.environ['CACHE_BACKEND'] = 'memory'
+    shared = product_index_module.cache
+    try:
+        product_index_module.cache = cache_module._create_cache()
+        worker = ProductLookupIndex()
+        with app.app_context():
+            _add_product(client_id, 'Tea', barcode='8900000000066')
+            worker.mark_changed(client_id)
+
+            assert not worker.enabled
+            assert worker.lookup(client_id, '8900000000066') is None  # caller queries the database
+            assert worker.reloads == 0
+            assert worker.get_stats()['clients'] == 0
+    finally:
+        product_index_module.cache = shared
+        os.environ['CACHE_BACKEND'] = 'shared'
+
+
+def main():
+    """Run all tests"""
+    tests = [
+        test_lookup_sees_other_workers_stock_update,
+        test_delta_refresh_covers_overlap,
+        test_reset_token_after_delete_forces_reload,
+        test_disabled_with_memory_cache,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ PASSED: {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e!r}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
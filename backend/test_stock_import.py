@@ -0,0 +1,180 @@
+"""
+Bulk stock import tests (utils.stock_import)
+Runs against a throwaway SQLite database in offline mode
+
+Usage:
+    python test_stock_import.py
+    python -m pytest test_stock_import.py
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+# Force offline mode on a temporary database (before the db modules read the environment)
+os.environ['DB_MODE'] = 'offline'
+os.environ['SQLITE_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'stock_import.db')
+
+# Set up path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import importlib
+import pkgutil
+
+import pandas as pd
+from flask import Flask
+
+import models
+from extensions import db, init_db_safely
+from models.client_model import ClientEntry
+from models.stock_model import StockEntry
+from utils.stock_import import allocate_item_codes, import_stock_frame
+
+app = Flask(__name__)
+init_db_safely(app)
+
+with app.app_context():
+    # Load every model so foreign keys resolve
+    for module in pkgutil.iter_modules(models.__path__):
+        importlib.import_module(f'models.{module.name}')
+    db.create_all()
+
+
+def _client():
+    """A registered client (the writer enforces foreign keys)"""
+    client_id = str(uuid.uuid4())
+    with app.app_context():
+        db.session.add(ClientEntry(client_id=client_id, client_name='Test shop', email=f'{client_id}@example.com'))
+        db.session.commit()
+    return client_id
+
+
+def _add_product(client_id, name, quantity=0, item_code=None, barcode=None):
+    db.session.add(StockEntry(
+        product_id=str(uuid.uuid4()), client_id=client_id, product_name=name,
+        quantity=quantity, rate=10, item_code=item_code, barcode=barcode
+    ))
+    db.session.commit()
+
+
+def _import(client_id, rows):
+    """Import rows (dicts) as read from a file: every cell is text or missing"""
+    summary, audit_data = import_stock_frame(client_id, pd.DataFrame(rows, dtype=object))
+    db.session.commit()
+    return summary
+
+
+def _products(client_id):
+    return {
+        product.product_name: product
+        for product in StockEntry.query.filter_by(client_id=client_id).all()
+    }
+
+
+def test_rows_for_one_product_are_merged():
+    """Same name (any case): quantities summed, last rate wins, existing stock incremented"""
+    client_id = _client()
+    with app.app_context():
+        _add_product(client_id, 'Rice 1Kg', quantity=5)
+        summary = _import(client_id, [
+            {'product_name': 'soap', 'quantity': '2', 'rate': '30'},
+            {'product_name': 'rice 1kg', 'quantity': '10', 'rate': '60'},
+            {'product_name': 'SOAP', 'quantity': '3', 'rate': '35', 'category': 'bath'},
+            {'product_name': 'Oil', 'quantity': 'two', 'rate': '100'},
+        ])
+
+        assert summary['total_rows'] == 4
+        assert summary['created_count'] == 1
+        assert summary['updated_count'] == 2  # second soap row, rice row
+        assert summary['error_count'] == 1
+        assert summary['row_errors'] == [{'row': 5, 'error': 'Quantity and rate must be numbers'}]
+
+        products = _products(client_id)
+        assert set(products) == {'Soap', 'Rice 1Kg'}
+        assert products['Soap'].quantity == 5
+        assert float(products['Soap'].rate) == 35
+        assert products['Soap'].category == 'Bath'
+        assert products['Rice 1Kg'].quantity == 15
+
+
+def test_barcode_collisions_are_rejected():
+    """A barcode owned by another product, or repeated in the file, skips the product"""
+    client_id = _client()
+    with app.app_context():
+        taken = f'890{uuid.uuid4().int % 10 ** 10:010d}'
+        own = f'891{uuid.uuid4().int % 10 ** 10:010d}'
+        repeated = f'892{uuid.uuid4().int % 10 ** 10:010d}'
+        _add_product(client_id, 'Tea', barcode=taken)
+        _add_product(client_id, 'Coffee', barcode=own)
+
+        summary = _import(client_id, [
+            {'product_name': 'Sugar', 'quantity': '1', 'rate': '40', 'barcode': taken},
+            {'product_name': 'Sugar', 'quantity': '1', 'rate': '40'},
+            {'product_name': 'Coffee', 'quantity': '4', 'rate': '90', 'barcode': own},
+            {'product_name': 'Salt', 'quantity': '1', 'rate': '20', 'barcode': repeated},
+            {'product_name': 'Pepper', 'quantity': '1', 'rate': '50', 'barcode': repeated},
+        ])
+
+        assert summary['created_count'] == 1  # Salt
+        assert summary['updated_count'] == 1  # Coffee keeps its own barcode
+        assert summary['error_count'] == 3
+        assert summary['barcode_conflict_count'] == 3  # both Sugar rows, Pepper
+        assert [error['row'] for error in summary['row_errors']] == [2, 6]
+        assert all('already used' in error['error'] for error in summary['row_errors'])
+
+        products = _products(client_id)
+        assert 'Sugar' not in products and 'Pepper' not in products
+        assert products['Salt'].barcode == repeated
+        assert products['Coffee'].quantity == 4
+
+
+def test_item_codes_allocated_for_new_products():
+    """File codes are kept, existing codes are not overwritten, missing ones are allocated around taken ones"""
+    client_id = _client()
+    prefix = client_id[:3].upper()
+    with app.app_context():
+        _add_product(client_id, 'Milk', item_code='MILK-01')
+        _add_product(client_id, 'Butter')
+        # Sequences continue from the product count: 3 products -> 004 first, already used here
+        _add_product(client_id, 'Old Stock', item_code=f'JAM-{prefix}-004')
+
+        _import(client_id, [
+            {'product_name': 'Milk', 'quantity': '1', 'rate': '30', 'item_code': 'MILK-99'},
+            {'product_name': 'Bread', 'quantity': '1', 'rate': '40', 'item_code': 'BRD-1'},
+            {'product_name': 'Jam', 'quantity': '1', 'rate': '90'},
+            {'product_name': 'Butter', 'quantity': '1', 'rate': '50'},
+        ])
+
+        products = _products(client_id)
+        assert products['Milk'].item_code == 'MILK-01'
+        assert products['Bread'].item_code == 'BRD-1'
+        assert products['Jam'].item_code == f'JAM-{prefix}-005'
+        assert products['Butter'].item_code == f'BUT-{prefix}-006'
+
+        # 5 products now -> 006; codes reserved by the caller are skipped too
+        codes = allocate_item_codes(client_id, ['Jam', '##'], reserved={f'JAM-{prefix}-006'})
+        assert codes == [f'JAM-{prefix}-007', f'ITM-{prefix}-008']
+
+
+def main():
+    """Run all tests"""
+    tests = [
+        test_rows_for_one_product_are_merged,
+        test_barcode_collisions_are_rejected,
+        test_item_codes_allocated_for_new_products,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ PASSED: {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e!r}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Offline sync tests (services.sync_service, services.sync_spool)
+Runs against throwaway SQLite files: one local database and one standing in
+for the cloud (the upsert and row-lock statements the push sends to
+PostgreSQL also run on SQLite, FOR UPDATE is ignored there)
+
+Usage:
+    python test_sync.py
+    python -m pytest test_sync.py
+"""
+import gzip
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ['SYNC_SPOOL_DIR'] = os.path.join(WORK_DIR, 'spool')
+
+# Set up path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from database.type_converters import TypeConverter
+from services.change_journal import sync_journal
+from services.sync_service import SyncService, SYNC_TABLE_BY_NAME, PULL_TABLES
+from services.sync_spool import SyncSpool
+
+STOCK = SYNC_TABLE_BY_NAME['stock_entry']
+STOCK_PULL = next(table for table in PULL_TABLES if table.name == 'stock_entry')
+
+_databases = 0
+
+
+def _service():
+    """SyncService on a fresh local database and a fresh 'cloud' database"""
+    global _databases
+    _databases += 1
+    os.environ['SQLITE_DB_PATH'] = os.path.join(WORK_DIR, f'local{_databases}.db')
+    local = create_engine(f"sqlite:///{os.environ['SQLITE_DB_PATH']}")
+    cloud = create_engine(f"sqlite:///{os.path.join(WORK_DIR, f'cloud{_databases}.db')}")
+
+    with local.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE stock_entry (
+                product_id TEXT PRIMARY KEY, client_id TEXT, product_name TEXT,
+                quantity INTEGER, created_at TEXT, updated_at TEXT, synced_at TEXT
+            )
+        """))
+    with cloud.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE stock_entry (
+                product_id TEXT PRIMARY KEY, client_id TEXT, product_name TEXT,
+                quantity INTEGER, created_at DATETIME, updated_at DATETIME, synced_at DATETIME
+            )
+        """))
+
+    service = SyncService()
+    service.initialize_local()  # journal, sync_base and sync_state
+    service.postgres_engine = cloud
+    return service
+
+
+def _add_product(engine, product_id, quantity, name='Soap', updated_at='2026-01-01 10:00:00'):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO stock_entry (product_id, client_id, product_name, quantity, created_at, updated_at)
+            VALUES (:product_id, 'client-1', :name, :quantity, '2026-01-01 10:00:00', :updated_at)
+        """), {"product_id": product_id, "name": name, "quantity": quantity, "updated_at": updated_at})
+
+
+def _sell_locally(service, product_id, count):
+    """A local sale: quantity down, journaled like reserve_stock does"""
+    with service.sqlite_engine.begin() as conn:
+        conn.execute(text("UPDATE stock_entry SET quantity = quantity - :count WHERE product_id = :product_id"),
+                     {"count": count, "product_id": product_id})
+        conn.execute(sync_journal.insert().values(
+            table_name='stock_entry', row_key=product_id, operation='update',
+            client_id='client-1', recorded_at=datetime.utcnow()
+        ))
+
+
+def _quantity(engine, product_id):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT quantity FROM stock_entry WHERE product_id = :product_id"),
+                            {"product_id": product_id}).scalar()
+
+
+def _set_base(service, product_id, value):
+    with service.sqlite_engine.begin() as conn:
+        service._store_base(conn, STOCK, product_id, 'quantity', value)
+
+
+def test_replayed_push_does_not_double_apply_stock_delta():
+    """The cloud commit succeeds, the local side fails: the spooled batch is replayed once"""
+    service = _service()
+    _add_product(service.sqlite_engine, 'p1', 100)
+    _add_product(service.postgres_engine, 'p1', 100)
+    _set_base(service, 'p1', 100)
+
+    _sell_locally(service, 'p1', 3)
+    with service.postgres_engine.begin() as conn:
+        conn.execute(text("UPDATE stock_entry SET quantity = 95 WHERE product_id = 'p1'"))  # another till sold 5
+
+    # Fail right after the cloud transaction committed (as a dropped link would)
+    rebase = service._rebase_local
+
+    def fail_once(*args, **kwargs):
+        service._rebase_local = rebase
+        raise OperationalError("UPDATE stock_entry", {}, Exception("disk I/O error"))
+
+    service._rebase_local = fail_once
+    stats = service._drain_table(STOCK)
+    assert stats["interrupted"]
+    assert _quantity(service.postgres_engine, 'p1') == 92
+    [path] = service.spool.batches('stock_entry')
+    batch = service.spool.read(path)
+
+    # Replay: the cloud already has the batch, nothing is added again
+    _sell_locally(service, 'p1', 1)  # sold here meanwhile, pushed next
+    stats = service._drain_table(STOCK)
+    assert not stats["interrupted"], stats
+    assert stats["resumed"] == 1
+    assert service.spool.batches('stock_entry') == []
+    assert _quantity(service.postgres_engine, 'p1') == 91
+    assert _quantity(service.sqlite_engine, 'p1') == 91
+
+    # Uploading the same batch once more changes nothing on either side
+    stats = {"rows": 0, "deleted": 0, "errors": []}
+    assert service._upload_batch(STOCK, batch["entries"], batch["rows"], stats, batch["stamp"]) == []
+    assert stats["rows"] == 1
+    assert _quantity(service.postgres_engine, 'p1') == 91
+    assert _quantity(service.sqlite_engine, 'p1') == 91
+
+
+def test_two_tills_add_up():
+    """Pushes from two tills against one cloud row subtract both sales"""
+    service = _service()
+    _add_product(service.sqlite_engine, 'p1', 50)
+    _add_product(service.postgres_engine, 'p1', 50)
+    _set_base(service, 'p1', 50)
+
+    _sell_locally(service, 'p1', 4)
+    with service.postgres_engine.begin() as conn:
+        conn.execute(text("UPDATE stock_entry SET quantity = 40 WHERE product_id = 'p1'"))  # other till: -10
+
+    service._drain_table(STOCK)
+    assert _quantity(service.postgres_engine, 'p1') == 36
+    assert _quantity(service.sqlite_engine, 'p1') == 36
+
+
+def test_corrupted_spool_batch_rejected():
+    """A spooled batch failing its checksum, or cut short, is discarded"""
+    spool = SyncSpool(os.path.join(WORK_DIR, 'spool-check'))
+    entries = [{'seq': 1, 'table_name': 'stock_entry', 'row_key': 'p1', 'operation': 'update', 'client_id': None}]
+    rows = {'p1': {'product_id': 'p1', 'quantity': 7}}
+
+    path = spool.write('stock_entry', entries, rows, '2026-01-01T10:00:00')
+    batch = spool.read(path)
+    assert batch['rows'] == rows and batch['stamp'] == '2026-01-01T10:00:00'
+
+    # Payload altered behind an intact gzip stream
+    with gzip.open(path, 'rb') as spool_file:
+        content = spool_file.read()
+    with gzip.open(path, 'wb') as spool_file:
+        spool_file.write(content.replace(b'"quantity":7', b'"quantity":9'))
+    assert spool.read(path) is None
+    assert not os.path.exists(path)
+
+    # Truncated file (crash while copying it, disk full)
+    path = spool.write('stock_entry', entries, rows)
+    with open(path, 'rb') as raw:
+        data = raw.read()
+    with open(path, 'wb') as raw:
+        raw.write(data[:len(data) // 2])
+    assert spool.read(path) is None
+    assert spool.batches('stock_entry') == []
+
+
+def test_pull_conflict_keeps_local_row():
+    """'newer' rule: a pending local row newer than the cloud keeps its columns; quantity merges"""
+    service = _service()
+    _add_product(service.sqlite_engine, 'p1', 20, name='Soap 100g', updated_at='2026-03-01 10:00:00')
+    _add_product(service.sqlite_engine, 'p2', 10, name='Shampoo', updated_at='2026-01-01 10:00:00')
+    _set_base(service, 'p1', 20)
+    _set_base(service, 'p2', 10)
+    _sell_locally(service, 'p1', 2)
+
+    _add_product(service.postgres_engine, 'p1', 15, name='Soap (old name)', updated_at='2026-02-01 10:00:00')
+    _add_product(service.postgres_engine, 'p2', 8, name='Shampoo 200ml', updated_at='2026-02-01 10:00:00')
+
+    pg_table = service._pg_table('stock_entry')
+    with service.postgres_engine.connect() as conn:
+        rows = [dict(row._mapping) for row in conn.execute(text("SELECT * FROM stock_entry ORDER BY product_id"))]
+    changed = {'stock_clients': set(), 'users': set()}
+    service._merge_rows(STOCK_PULL, rows, TypeConverter.column_types(pg_table), changed)
+
+    with service.sqlite_engine.connect() as conn:
+        local = {row.product_id: row for row in conn.execute(text("SELECT * FROM stock_entry"))}
+    # p1: local edit is newer and unpushed - name stays, the other till's -5 is added to the local -2
+    assert local['p1'].product_name == 'Soap 100g'
+    assert local['p1'].quantity == 13
+    # p2: cloud is newer and nothing is pending - the cloud row wins
+    assert local['p2'].product_name == 'Shampoo 200ml'
+    assert local['p2'].quantity == 8
+    assert changed['stock_clients'] == {'client-1'}
+
+
+def main():
+    """Run all tests"""
+    tests = [
+        test_replayed_push_does_not_double_apply_stock_delta,
+        test_two_tills_add_up,
+        test_corrupted_spool_batch_rejected,
+        test_pull_conflict_keeps_local_row,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ PASSED: {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e!r}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
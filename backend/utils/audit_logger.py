@@ -1,14 +1,20 @@
 import uuid
-import json
 import logging
 from datetime import datetime
 from decimal import Decimal
 from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from extensions import db
 from models.audit_model import AuditLog
+from services.audit_writer import audit_writer
 
 logger = logging.getLogger(__name__)
 
+# session.info keys: events waiting for the transaction to commit, and whether it has flushed writes
+_PENDING_KEY = 'audit_pending'
+_FLUSHED_KEY = 'audit_flushed'
+
 def _serialize_for_json(obj):
     """
     Convert non-JSON-serializable objects to JSON-serializable format
@@ -37,14 +43,55 @@ def _serialize_for_json(obj):
         except Exception:
             return f"<Unserializable: {type(obj).__name__}>"
 
+def _diff(old_data, new_data):
+    """Changed top-level fields only: ({field: old}, {field: new})"""
+    changed = [key for key in new_data if old_data.get(key) != new_data.get(key)]
+    changed += [key for key in old_data if key not in new_data]
+    return (
+        {key: _serialize_for_json(old_data.get(key)) for key in changed},
+        {key: _serialize_for_json(new_data.get(key)) for key in changed}
+    )
+
+
+def _has_pending_writes(session):
+    return bool(session.new or session.dirty or session.deleted or session.info.get(_FLUSHED_KEY))
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_flushed(session, flush_context):
+    session.info[_FLUSHED_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _enqueue_committed(session):
+    """Audit events of a committed transaction go to the writer"""
+    session.info.pop(_FLUSHED_KEY, None)
+    events = session.info.pop(_PENDING_KEY, None)
+    if events:
+        try:
+            audit_writer.enqueue(events)
+        except Exception as e:
+            logger.error(f"Audit log error: {len(events)} events not spooled: {str(e)}", exc_info=True)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _drop_uncommitted(session, transaction):
+    """Events of a rolled back (or abandoned) transaction are discarded with it"""
+    if transaction.parent is None:
+        session.info.pop(_FLUSHED_KEY, None)
+        session.info.pop(_PENDING_KEY, None)
+
+
 def log_action(action_type, table_name=None, record_id=None, old_data=None, new_data=None, auto_commit=False):
     """
     Log action to audit_log table with client_id
     MUST be called after any CREATE, UPDATE, DELETE operation
 
-    Note: By default, audit logs are added to the session but NOT committed.
-    The calling code should commit as part of its transaction.
-    Set auto_commit=True only if you need a standalone audit log.
+    Note: The event is written by the background audit writer (services.audit_writer),
+    not in the request's transaction. Called while the session has uncommitted
+    writes, it is queued when that transaction commits (and dropped on rollback);
+    otherwise it is queued immediately. auto_commit=True always queues immediately.
+    Updates store only the fields that changed.
     """
     try:
         # Get client_id from g.user (set by authenticate decorator)
@@ -55,29 +102,37 @@ def log_action(action_type, table_name=None, record_id=None, old_data=None, new_
         user_id = g.user.get('user_id')
 
         # Serialize data to ensure JSON compatibility (handles UUID, datetime, Decimal)
-        serialized_old_data = _serialize_for_json(old_data) if old_data else None
-        serialized_new_data = _serialize_for_json(new_data) if new_data else None
-
-        # Create audit log entry
-        audit_entry = AuditLog(
-            log_id=str(uuid.uuid4()),
-            client_id=client_id,
-            user_id=user_id,
-            action_type=action_type,
-            table_name=table_name,
-            record_id=record_id,
-            old_data=serialized_old_data,
-            new_data=serialized_new_data,
-            ip_address=request.remote_addr,
-            user_agent=request.user_agent.string,
-            timestamp=datetime.utcnow()
-        )
+        if isinstance(old_data, dict) and isinstance(new_data, dict):
+            serialized_old_data, serialized_new_data = _diff(old_data, new_data)
+        else:
+            serialized_old_data = _serialize_for_json(old_data) if old_data else None
+            serialized_new_data = _serialize_for_json(new_data) if new_data else None
+
+        audit_event = {
+            'log_id': str(uuid.uuid4()),
+            'client_id': str(client_id) if client_id else None,
+            'user_id': str(user_id) if user_id else None,
+            'action_type': action_type,
+            'table_name': table_name,
+            'record_id': str(record_id) if record_id else None,
+            'old_data': serialized_old_data,
+            'new_data': serialized_new_data,
+            'ip_address': request.remote_addr,
+            'user_agent': request.user_agent.string,
+            'timestamp': datetime.utcnow().isoformat()
+        }
 
-        db.session.add(audit_entry)
+        if not audit_writer.enabled:
+            # No writer (scripts, tests): add the row to the caller's transaction as before
+            db.session.add(AuditLog(**dict(audit_event, timestamp=datetime.fromisoformat(audit_event['timestamp']))))
+            if auto_commit:
+                db.session.commit()
+            return
 
-        # Only commit if explicitly requested (for performance - avoid extra round trips)
-        if auto_commit:
-            db.session.commit()
+        if not auto_commit and _has_pending_writes(db.session()):
+            db.session.info.setdefault(_PENDING_KEY, []).append(audit_event)
+        else:
+            audit_writer.enqueue([audit_event])
 
     except Exception as e:
         # Don't fail the main operation if audit logging fails
@@ -85,5 +140,5 @@ def log_action(action_type, table_name=None, record_id=None, old_data=None, new_
             f"Audit log error for {action_type} on {table_name} (record: {record_id}): {str(e)}",
             exc_info=True  # Includes full traceback for debugging
         )
-        if auto_commit:
+        if auto_commit and not audit_writer.enabled:
             db.session.rollback()
@@ -1,15 +1,17 @@
 import jwt
 from functools import wraps
 from flask import request, jsonify, g
-from config import Config
 from models.user_model import User
 from models.client_model import ClientEntry
-from utils.cache_helper import get_cache_manager
+from models.permission_model import get_user_permissions
+from utils.permission_bits import permission_mask
+from utils.session_cache import session_cache
+from utils.token_cache import token_cache
 
 def get_client_id_from_token(token):
     """Extract and validate client_id from JWT token"""
     try:
-        decoded = jwt.decode(token, Config.JWT_SECRET, algorithms=[Config.JWT_ALGORITHM])
+        decoded = token_cache.decode(token)
         client_id = decoded.get('client_id')
 
         if not client_id:
@@ -22,11 +24,93 @@ def get_client_id_from_token(token):
         return None
 
 
+def load_identity(user_id, client_id):
+    """
+    The g.user / g.client dicts of a user, from the two-tier session cache
+    (utils.session_cache) or, on a miss, from the DB (then cached)
+
+    Returns:
+        Tuple (user, client); (None, None) if the user is missing or inactive,
+        client None if the client is
+    """
+    # Try the session cache first (in-process, then Redis / shared cache)
+    cached_data = session_cache.get(user_id)
+
+    if cached_data:
+        # Use cached data - no DB query needed
+        cached_user = cached_data.get('user', {})
+        cached_client = cached_data.get('client', {})
+        mask = permission_mask(cached_user)  # compiled once per session
+
+        user_data = {
+            'user_id': user_id,
+            'client_id': client_id,
+            'email': cached_user.get('email', ''),
+            'full_name': cached_user.get('full_name', ''),
+            'phone': cached_user.get('phone', ''),
+            'department': cached_user.get('department', ''),
+            'role': cached_user.get('role', 'staff'),
+            'is_super_admin': cached_user.get('is_super_admin', False),
+            'permissions': cached_user.get('permissions', []),
+            'permission_mask': mask,
+            'permission_catalog': cached_user['permission_catalog']
+        }
+
+        client_data = {
+            'client_id': client_id,
+            'client_name': cached_client.get('client_name', ''),
+            'logo_url': cached_client.get('logo_url', ''),
+            'address': cached_client.get('address', ''),
+            'phone': cached_client.get('phone', ''),
+            'email': cached_client.get('email', ''),
+            'gstin': cached_client.get('gstin', '')
+        }
+    else:
+        # Cache miss - query DB and cache the result
+        user = User.query.filter_by(user_id=user_id, is_active=True).first()
+        if not user:
+            return None, None
+
+        # Permissions as of now, so grants and revokes apply without a new token
+        user_data = {
+            'user_id': user_id,
+            'client_id': client_id,
+            'email': user.email,
+            'full_name': user.full_name or user.email.split('@')[0],
+            'phone': user.phone,
+            'department': user.department,
+            'role': user.role,
+            'is_super_admin': bool(user.is_super_admin),
+            'permissions': get_user_permissions(user_id)
+        }
+        permission_mask(user_data)
+
+        client = ClientEntry.query.filter_by(client_id=client_id, is_active=True).first()
+        if not client:
+            return user_data, None
+
+        client_data = {
+            'client_id': client_id,
+            'client_name': client.client_name,
+            'logo_url': client.logo_url,
+            'address': client.address,
+            'phone': client.phone,
+            'email': client.email,
+            'gstin': client.gst_number
+        }
+
+        # Cache the data for future requests (24 hours)
+        session_cache.put(user_id, client_id, dict(user_data), dict(client_data))
+
+    return user_data, client_data
+
+
 def authenticate(f):
     """
     Authentication decorator - MUST be used on ALL protected routes
     Extracts client_id from JWT token and stores in g.user
-    Uses Redis cache for user/client data to reduce DB queries
+    User/client data comes from the two-tier session cache (utils.session_cache)
+    and is only queried from the DB on a miss
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -40,8 +124,8 @@ def authenticate(f):
             # Extract token (format: "Bearer <token>")
             token = auth_header.split(' ')[1] if ' ' in auth_header else auth_header
 
-            # Decode JWT token
-            decoded = jwt.decode(token, Config.JWT_SECRET, algorithms=[Config.JWT_ALGORITHM])
+            # Decode JWT token (verified once, then served from the token cache until exp)
+            decoded = token_cache.decode(token)
 
             # Extract user info
             user_id = decoded.get('user_id')
@@ -50,75 +134,11 @@ def authenticate(f):
             if not user_id or not client_id:
                 return jsonify({'error': 'Invalid token payload'}), 401
 
-            # Try to get user/client data from Redis cache first
-            cache = get_cache_manager()
-            cache_key = f"user_session:{user_id}"
-            cached_data = cache.get(cache_key)
-
-            if cached_data:
-                # Use cached data - no DB query needed
-                user_data = cached_data.get('user', {})
-                client_data = cached_data.get('client', {})
-
-                g.user = {
-                    'user_id': user_id,
-                    'client_id': client_id,
-                    'email': user_data.get('email', ''),
-                    'full_name': user_data.get('full_name', ''),
-                    'phone': user_data.get('phone', ''),
-                    'department': user_data.get('department', ''),
-                    'role': user_data.get('role', 'staff'),
-                    'is_super_admin': user_data.get('is_super_admin', False),
-                    'permissions': user_data.get('permissions', [])
-                }
-
-                g.client = {
-                    'client_id': client_id,
-                    'client_name': client_data.get('client_name', ''),
-                    'logo_url': client_data.get('logo_url', ''),
-                    'address': client_data.get('address', ''),
-                    'phone': client_data.get('phone', ''),
-                    'email': client_data.get('email', ''),
-                    'gstin': client_data.get('gstin', '')
-                }
-            else:
-                # Cache miss - query DB and cache the result
-                user = User.query.filter_by(user_id=user_id, is_active=True).first()
-                if not user:
-                    return jsonify({'error': 'User not found or inactive'}), 401
-
-                client = ClientEntry.query.filter_by(client_id=client_id, is_active=True).first()
-                if not client:
-                    return jsonify({'error': 'Client not found or inactive'}), 401
-
-                # Store user and client info in g object
-                g.user = {
-                    'user_id': user_id,
-                    'client_id': client_id,
-                    'email': user.email,
-                    'full_name': user.full_name or user.email.split('@')[0],
-                    'phone': user.phone,
-                    'department': user.department,
-                    'role': user.role,
-                    'is_super_admin': decoded.get('is_super_admin', False),
-                    'permissions': decoded.get('permissions', [])
-                }
-
-                g.client = {
-                    'client_id': client_id,
-                    'client_name': client.client_name,
-                    'logo_url': client.logo_url,
-                    'address': client.address,
-                    'phone': client.phone,
-                    'email': client.email,
-                    'gstin': client.gst_number
-                }
-
-                # Cache the data for future requests (24 hours)
-                cache.set(cache_key, {
-                    'user': g.user,
-                    'client': g.client
-                }, 86400)
+            g.user, g.client = load_identity(user_id, client_id)
+            if g.user is None:
+                return jsonify({'error': 'User not found or inactive'}), 401
+            if g.client is None:
+                return jsonify({'error': 'Client not found or inactive'}), 401
 
             return f(*args, **kwargs)
 
@@ -1,29 +1,213 @@
 """
-Bill Number Helper - Atomic Bill Number Generation
+Bill Number Helper - Counter-Based Bill Number Allocation
 Phase 0: Offline Desktop App Implementation
 
-This module provides atomic bill number generation using database-level
-atomic increment to prevent race conditions and duplicate bill numbers.
+Bill numbers come from the per-client, per-type bill_number_counters row.
+
+Default (BILL_NUMBER_BLOCK_SIZE=20): each process reserves a block of numbers
+in a separate short transaction (one UPDATE ... RETURNING) and hands them out
+from memory, so a bill's own transaction never touches the counter row and
+bills of one client are not serialised on it. Gaps and ordering:
+- numbers of rolled-back bills go back to the block and are reused by the
+  next bill in this process
+- on a clean exit (atexit) the unused tail of each block is given back to
+  the counter, if no other process has reserved a block since; otherwise it
+  stays a gap
+- a process killed without running atexit (SIGKILL, OOM, power loss) loses
+  the rest of its blocks as a permanent gap in the series
+- with several gunicorn workers, blocks interleave: bill 41 can be saved
+  before bill 23 (numbers are unique, not in creation order)
+
+BILL_NUMBER_BLOCK_SIZE=1 advances the counter inside the bill's own
+transaction instead: no gaps and numbers in commit order across workers,
+but the counter row stays locked until the bill commits, so bills of one
+client are numbered one at a time.
+
+Works identically on PostgreSQL and SQLite (no dialect-specific SQL or casts).
 """
 
-from sqlalchemy import text
+import atexit
+import heapq
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database.manager import db_manager
 from extensions import db
+from models.billing_model import BillNumberCounter, GSTBilling, NonGSTBilling
+
+
+BILL_TYPES = {
+    'gst': ('current_gst_bill_number', GSTBilling),
+    'non_gst': ('current_non_gst_bill_number', NonGSTBilling),
+}
+
+# Numbers reserved per counter round trip (1 = allocate in the bill's transaction, no blocks)
+BLOCK_SIZE = max(1, int(os.getenv('BILL_NUMBER_BLOCK_SIZE', '20')))
+
+# session.info key holding numbers handed out in the current transaction
+_PENDING_KEY = 'pending_bill_numbers'
+
+
+class _NumberBlock:
+    """Reserved range [next_number, end] plus numbers returned by rolled-back bills"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_number = 1
+        self.end = 0
+        self.returned = []
+        self.engine = None
+
+    def take(self):
+        if self.returned:
+            return heapq.heappop(self.returned)
+        if self.next_number <= self.end:
+            number = self.next_number
+            self.next_number += 1
+            return number
+        return None
+
+    def peek(self):
+        """Number take() would return, without taking it (None if the block is empty)"""
+        if self.returned:
+            return self.returned[0]
+        return self.next_number if self.next_number <= self.end else None
+
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def _validate_bill_type(bill_type):
+    if bill_type not in BILL_TYPES:
+        raise ValueError("bill_type must be 'gst' or 'non_gst'")
+
+
+def _get_block(client_id, bill_type):
+    key = (str(client_id), bill_type)
+    block = _blocks.get(key)
+    if block is None:
+        with _blocks_lock:
+            block = _blocks.setdefault(key, _NumberBlock())
+    return block
+
+
+def _seed_values(executor, client_id):
+    """Counter values for a client without a counter row: MAX(bill_number) per type"""
+    return {
+        column_name: executor.execute(
+            select(func.max(model.bill_number)).where(model.client_id == client_id)
+        ).scalar() or 0
+        for column_name, model in BILL_TYPES.values()
+    }
+
+
+def _advance_counter(executor, client_id, column_name, size):
+    """UPDATE ... RETURNING the counter advanced by `size` (None if the client has no row)"""
+    counters = BillNumberCounter.__table__
+    column = counters.c[column_name]
+    return executor.execute(
+        update(counters)
+        .where(counters.c.client_id == client_id)
+        .values({column_name: column + size, 'updated_at': datetime.utcnow()})
+        .returning(column)
+    ).scalar()
+
+
+def _insert_counter(executor, client_id, seeds):
+    executor.execute(insert(BillNumberCounter.__table__).values(
+        client_id=client_id,
+        updated_at=datetime.utcnow(),
+        **seeds
+    ))
+
+
+def _reserve_block(engine, client_id, bill_type, size):
+    """
+    Atomically advance the counter by `size` in a separate transaction.
+
+    Seeds a missing counter row from MAX(bill_number) of both billing tables so
+    existing clients continue their numbering.
+
+    Returns:
+        tuple: (first, last) numbers of the reserved block
+    """
+    column_name, _ = BILL_TYPES[bill_type]
+
+    for _ in range(3):
+        with engine.begin() as conn:
+            last = _advance_counter(conn, client_id, column_name, size)
+            if last is not None:
+                return last - size + 1, last
+
+        # First allocation for this client: seed from existing bills
+        with engine.connect() as conn:
+            seeds = _seed_values(conn, client_id)
+        seeds[column_name] += size
+        try:
+            with engine.begin() as conn:
+                _insert_counter(conn, client_id, seeds)
+            return seeds[column_name] - size + 1, seeds[column_name]
+        except IntegrityError:
+            # Another worker created the row concurrently - retry the UPDATE
+            continue
+
+    raise Exception(f"Could not reserve bill numbers for client {client_id}")
+
+
+def _allocate_in_session(session, client_id, bill_type):
+    """
+    Advance the counter by one in the session's transaction.
+
+    The UPDATE is undone if the session rolls back, so the number needs no
+    tracking. A missing counter row is seeded from MAX(bill_number) in a
+    savepoint, so a concurrent insert by another worker only retries.
+    """
+    column_name, _ = BILL_TYPES[bill_type]
+
+    for _ in range(3):
+        number = _advance_counter(session, client_id, column_name, 1)
+        if number is not None:
+            return number
+
+        seeds = _seed_values(session, client_id)
+        seeds[column_name] += 1
+        try:
+            with session.begin_nested():
+                _insert_counter(session, client_id, seeds)
+            return seeds[column_name]
+        except IntegrityError:
+            continue
+
+    raise Exception(f"Could not allocate a bill number for client {client_id}")
 
 
 def get_next_bill_number(client_id, bill_type='gst'):
     """
-    Get next sequential bill number for a client using atomic database increment.
+    Get next sequential bill number for a client.
 
-    This function uses PostgreSQL's INSERT ... ON CONFLICT DO UPDATE to atomically
-    increment and return the next bill number. This prevents race conditions that
-    can occur with the previous approach of querying max(bill_number) + 1.
+    By default the number comes from the in-process block and the database
+    is only touched when the block is exhausted, in its own short
+    transaction. The number is tracked on the current db.session: if that
+    session rolls back the number is returned to the block, on commit it is
+    consumed. If the session already holds the SQLite writer the refill would
+    wait on it, so the number is then taken from the counter in the session
+    instead.
+
+    With BILL_NUMBER_BLOCK_SIZE=1 the counter is advanced in the current
+    db.session transaction: call this in the transaction that saves the bill,
+    and a rollback gives the number back.
 
     Args:
         client_id (str): The client ID
         bill_type (str): Either 'gst' or 'non_gst'
 
     Returns:
-        int: The next sequential bill number
+        int: The next bill number
 
     Raises:
         ValueError: If bill_type is not 'gst' or 'non_gst'
@@ -33,48 +217,75 @@ def get_next_bill_number(client_id, bill_type='gst'):
         >>> bill_number = get_next_bill_number('client-123', 'gst')
         >>> print(bill_number)  # 101
 
-    Thread-safe: Yes (uses database-level atomic operation)
-    SQLite compatible: Yes (uses standard SQL)
+    Thread-safe: Yes (counter advanced atomically in the database, per-block lock)
+    SQLite compatible: Yes
     """
-    if bill_type not in ['gst', 'non_gst']:
-        raise ValueError("bill_type must be 'gst' or 'non_gst'")
+    _validate_bill_type(bill_type)
 
+    session = db.session()
     try:
-        # Determine column name based on bill type
-        column_name = f'current_{bill_type}_bill_number'
-
-        # PostgreSQL: Atomic increment using INSERT ... ON CONFLICT
-        # Note: Cast client_id to UUID for PostgreSQL compatibility
-        sql = text(f"""
-            INSERT INTO bill_number_counters (client_id, {column_name})
-            VALUES (:client_id::UUID, 1)
-            ON CONFLICT (client_id)
-            DO UPDATE SET
-                {column_name} = bill_number_counters.{column_name} + 1,
-                updated_at = CURRENT_TIMESTAMP
-            RETURNING {column_name}
-        """)
-
-        result = db.session.execute(sql, {"client_id": client_id})
-        bill_number = result.scalar()
-
-        # Commit the transaction to ensure the counter is updated
-        db.session.commit()
-
-        return bill_number
-
+        if BLOCK_SIZE == 1:
+            return _allocate_in_session(session, client_id, bill_type)
+
+        block = _get_block(client_id, bill_type)
+        with block.lock:
+            number = block.take()
+            if number is None and not db_manager.holds_writer(session):
+                engine = db.engine
+                first, last = _reserve_block(engine, client_id, bill_type, BLOCK_SIZE)
+                block.engine = engine
+                block.next_number, block.end = first + 1, last
+                number = first
+        if number is None:
+            # Refilling would wait for the writer this session holds
+            return _allocate_in_session(session, client_id, bill_type)
     except Exception as e:
-        db.session.rollback()
-        # Log error for debugging
         print(f"Error generating bill number for client {client_id}, type {bill_type}: {str(e)}")
         raise Exception(f"Failed to generate bill number: {str(e)}")
 
+    # Make sure a session transaction exists so its commit/rollback settles the number
+    # (begin() is lazy - no connection is checked out until the next statement)
+    if not session.in_transaction():
+        session.begin()
+    session.info.setdefault(_PENDING_KEY, []).append((str(client_id), bill_type, number))
+    return number
+
+
+def release_bill_number(client_id, bill_type, bill_number):
+    """
+    Return an unused bill number to the in-process block so it is reused.
+
+    Called automatically when the session that took the number rolls back.
+    """
+    _validate_bill_type(bill_type)
+    block = _get_block(client_id, bill_type)
+    with block.lock:
+        if bill_number not in block.returned:
+            heapq.heappush(block.returned, bill_number)
+
+
+@event.listens_for(Session, 'after_commit')
+def _consume_pending_numbers(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _release_pending_numbers(session, transaction):
+    # Top-level transaction ended without commit (rollback or close)
+    if transaction.parent is not None:
+        return
+    for client_id, bill_type, number in session.info.pop(_PENDING_KEY, None) or []:
+        release_bill_number(client_id, bill_type, number)
+
 
 def get_current_bill_number(client_id, bill_type='gst'):
     """
-    Get the current (last used) bill number for a client without incrementing.
+    Get the current (last issued) bill number for a client without incrementing.
 
-    Useful for displaying "Next bill number will be: X" in UI.
+    Useful for displaying "Next bill number will be: X" in UI. With blocks,
+    numbers still unused in another process's block are counted as issued.
+    A client without a counter row yet reports MAX(bill_number), which is
+    where its first allocation continues from.
 
     Args:
         client_id (str): The client ID
@@ -83,28 +294,43 @@ def get_current_bill_number(client_id, bill_type='gst'):
     Returns:
         int: The current bill number (0 if no bills created yet)
     """
-    if bill_type not in ['gst', 'non_gst']:
-        raise ValueError("bill_type must be 'gst' or 'non_gst'")
+    _validate_bill_type(bill_type)
 
     try:
-        column_name = f'current_{bill_type}_bill_number'
+        column_name, _ = BILL_TYPES[bill_type]
+        counters = BillNumberCounter.__table__
 
-        sql = text(f"""
-            SELECT {column_name}
-            FROM bill_number_counters
-            WHERE client_id = :client_id::UUID
-        """)
+        bill_number = db.session.execute(
+            select(counters.c[column_name]).where(counters.c.client_id == client_id)
+        ).scalar()
+        if bill_number is None:
+            bill_number = _seed_values(db.session, client_id)[column_name]
 
-        result = db.session.execute(sql, {"client_id": client_id})
-        bill_number = result.scalar()
-
-        return bill_number if bill_number is not None else 0
+        return bill_number
 
     except Exception as e:
         print(f"Error getting current bill number for client {client_id}, type {bill_type}: {str(e)}")
         return 0
 
 
+def peek_next_bill_number(client_id, bill_type='gst'):
+    """
+    Number the next bill of this process will most likely get (for display).
+
+    With blocks that is the lowest number left in this process's block; when
+    the block is empty, or with BILL_NUMBER_BLOCK_SIZE=1, the counter + 1.
+    Other workers may issue numbers in between.
+    """
+    _validate_bill_type(bill_type)
+    block = _blocks.get((str(client_id), bill_type))
+    if block is not None:
+        with block.lock:
+            number = block.peek()
+        if number is not None:
+            return number
+    return get_current_bill_number(client_id, bill_type) + 1
+
+
 def reset_bill_number(client_id, bill_type='gst', new_value=0):
     """
     Reset bill number counter to a specific value.
@@ -114,6 +340,9 @@ def reset_bill_number(client_id, bill_type='gst', new_value=0):
     - Fixing corrupted counters
     - Admin operations
 
+    With blocks, only this process's cached block is discarded; other
+    workers keep numbering from their current block until it runs out.
+
     Args:
         client_id (str): The client ID
         bill_type (str): Either 'gst' or 'non_gst'
@@ -124,27 +353,62 @@ def reset_bill_number(client_id, bill_type='gst', new_value=0):
 
     Requires: Admin permission (should be checked before calling)
     """
-    if bill_type not in ['gst', 'non_gst']:
-        raise ValueError("bill_type must be 'gst' or 'non_gst'")
+    _validate_bill_type(bill_type)
 
     try:
-        column_name = f'current_{bill_type}_bill_number'
-
-        sql = text(f"""
-            INSERT INTO bill_number_counters (client_id, {column_name})
-            VALUES (:client_id::UUID, :new_value)
-            ON CONFLICT (client_id)
-            DO UPDATE SET
-                {column_name} = :new_value,
-                updated_at = CURRENT_TIMESTAMP
-        """)
-
-        db.session.execute(sql, {"client_id": client_id, "new_value": new_value})
+        column_name, _ = BILL_TYPES[bill_type]
+        counters = BillNumberCounter.__table__
+
+        result = db.session.execute(
+            update(counters)
+            .where(counters.c.client_id == client_id)
+            .values({column_name: new_value, 'updated_at': datetime.utcnow()})
+        )
+        if result.rowcount == 0:
+            db.session.execute(insert(counters).values(
+                client_id=client_id,
+                updated_at=datetime.utcnow(),
+                **{column_name: new_value}
+            ))
         db.session.commit()
 
+        with _blocks_lock:
+            _blocks.pop((str(client_id), bill_type), None)
+
         return True
 
     except Exception as e:
         db.session.rollback()
         print(f"Error resetting bill number for client {client_id}, type {bill_type}: {str(e)}")
         raise Exception(f"Failed to reset bill number: {str(e)}")
+
+
+@atexit.register
+def _return_unused_blocks():
+    """Give the unused tail of each block back if no later block was reserved"""
+    counters = BillNumberCounter.__table__
+    for (client_id, bill_type), block in list(_blocks.items()):
+        if block.engine is None:
+            continue
+
+        # Returned numbers directly below the unused range extend the tail
+        first_unused = block.next_number
+        returned = set(block.returned)
+        while first_unused - 1 in returned:
+            first_unused -= 1
+        if first_unused > block.end:
+            continue
+
+        column_name, _ = BILL_TYPES[bill_type]
+        try:
+            with block.engine.begin() as conn:
+                conn.execute(
+                    update(counters)
+                    .where(
+                        counters.c.client_id == client_id,
+                        counters.c[column_name] == block.end
+                    )
+                    .values({column_name: first_unused - 1})
+                )
+        except Exception as e:
+            print(f"Warning: could not return unused bill numbers for client {client_id}: {str(e)}")
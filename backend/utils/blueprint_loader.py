@@ -31,6 +31,7 @@ BLUEPRINT_CONFIG: List[Dict] = [
     {"name": "bulk_orders", "module": "routes.bulk_stock_order", "blueprint": "bulk_order_bp", "prefix": "/api/bulk-orders"},
     {"name": "expense", "module": "routes.expense", "blueprint": "expense_bp", "prefix": "/api/expense"},
     {"name": "profile", "module": "routes.profile", "blueprint": "profile_bp", "prefix": "/api/profile"},
+    {"name": "jobs", "module": "routes.jobs", "blueprint": "jobs_bp", "prefix": "/api/jobs"},
 ]
 
 
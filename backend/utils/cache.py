@@ -1,88 +1,315 @@
 """
-RYX Billing - Simple In-Memory Cache for Reports
+RYX Billing - Cache for Reports and Listings
 Provides fast caching for frequently accessed report data
+
+Backends (CACHE_BACKEND env var):
+- 'shared' (default): SQLite file shared by all gunicorn workers on the machine,
+  so an invalidation in one worker is seen by every worker. No Redis needed.
+- 'memory': per-process in-memory cache (previous behaviour)
+
+Both backends support TTL, LRU eviction, tag-based invalidation and counters:
+    cache.set(key, value, ttl_seconds=120, tags=[f"billing:{client_id}"])
+    invalidate_cache(f"billing:{client_id}")   # drops everything tagged with it
+    cache.incr(key, ttl_seconds=900)           # atomic +1 (created at 1), TTL restarted
+
+The shared backend stores values as JSON (never pickle: the file is writable by
+any local process). datetime, date, Decimal and UUID values are tagged and
+restored explicitly; other non-JSON values are not cached.
 """
-from datetime import datetime, timedelta
-from typing import Any, Optional, Callable
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Optional, Callable, Iterable
 import hashlib
 import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
 from functools import wraps
 
+# Marker key of an explicitly serialised non-JSON value: {"__cache_type__": name, "value": str}
+_TYPE_KEY = '__cache_type__'
+_DECODERS = {
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'decimal': Decimal,
+    'uuid': uuid.UUID,
+}
+
+
+def _encode_value(value):
+    """json.dumps default= hook for the non-JSON values the app caches"""
+    if isinstance(value, datetime):
+        return {_TYPE_KEY: 'datetime', 'value': value.isoformat()}
+    if isinstance(value, date):
+        return {_TYPE_KEY: 'date', 'value': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {_TYPE_KEY: 'decimal', 'value': str(value)}
+    if isinstance(value, uuid.UUID):
+        return {_TYPE_KEY: 'uuid', 'value': str(value)}
+    raise TypeError(f"{type(value).__name__} values cannot be cached")
+
+
+def _decode_value(obj):
+    decoder = _DECODERS.get(obj.get(_TYPE_KEY)) if len(obj) == 2 else None
+    return decoder(obj['value']) if decoder else obj
+
+
+def _dumps(value: Any) -> str:
+    """Serialise a value for the shared cache"""
+    return json.dumps(value, default=_encode_value, separators=(',', ':'))
+
+
+def _loads(data) -> Any:
+    """Inverse of _dumps()"""
+    return json.loads(data, object_hook=_decode_value)
+
 
 class SimpleCache:
-    """Simple in-memory cache with TTL support and max size limit"""
+    """Simple in-memory cache with TTL support, O(1) LRU eviction and tags"""
 
     def __init__(self, max_size: int = 1000):
-        self._cache = {}
-        self._ttl = {}
+        self._cache = OrderedDict()  # key -> (value, expires_at), least recently used first
+        self._tags = {}  # tag -> set of keys
+        self._key_tags = {}  # key -> tuple of tags
         self._max_size = max_size
-        self._access_order = []  # Track access order for LRU eviction
-
-    def _is_expired(self, key: str) -> bool:
-        """Check if cache entry is expired"""
-        if key not in self._ttl:
-            return True
-        return datetime.now() > self._ttl[key]
+        self._lock = threading.RLock()
 
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache"""
-        if key in self._cache and not self._is_expired(key):
-            return self._cache[key]
-        return None
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.time() > entry[1]:
+                self.delete(key)
+                return None
+            self._cache.move_to_end(key)
+            return entry[0]
 
-    def set(self, key: str, value: Any, ttl_seconds: int = 300):
+    def set(self, key: str, value: Any, ttl_seconds: int = 300, tags: Iterable[str] = ()):
         """Set value in cache with TTL (default 5 minutes)"""
-        # Evict oldest entries if cache is full (LRU eviction)
-        if len(self._cache) >= self._max_size and key not in self._cache:
-            self._evict_oldest()
-
-        self._cache[key] = value
-        self._ttl[key] = datetime.now() + timedelta(seconds=ttl_seconds)
-
-        # Update access order
-        if key in self._access_order:
-            self._access_order.remove(key)
-        self._access_order.append(key)
-
-    def _evict_oldest(self):
-        """Evict oldest/expired entries to make room"""
-        # First, remove expired entries
-        expired_keys = [k for k in self._cache.keys() if self._is_expired(k)]
-        for key in expired_keys:
+        with self._lock:
             self.delete(key)
 
-        # If still too full, remove oldest accessed entries (LRU)
-        while len(self._cache) >= self._max_size and self._access_order:
-            oldest_key = self._access_order.pop(0)
-            if oldest_key in self._cache:
-                del self._cache[oldest_key]
-            if oldest_key in self._ttl:
-                del self._ttl[oldest_key]
+            # Evict least recently used entries if cache is full
+            while len(self._cache) >= self._max_size:
+                oldest_key = next(iter(self._cache))
+                self.delete(oldest_key)
+
+            self._cache[key] = (value, time.time() + ttl_seconds)
+            tags = tuple(tags)
+            if tags:
+                self._key_tags[key] = tags
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add(key)
+
+    def incr(self, key: str, ttl_seconds: int = 300) -> int:
+        """Atomically add 1 to a counter (created at 1) and restart its TTL"""
+        with self._lock:
+            count = (self.get(key) or 0) + 1
+            self.set(key, count, ttl_seconds)
+            return count
 
     def delete(self, key: str):
         """Delete value from cache"""
-        if key in self._cache:
-            del self._cache[key]
-        if key in self._ttl:
-            del self._ttl[key]
-        if key in self._access_order:
-            self._access_order.remove(key)
+        with self._lock:
+            self._cache.pop(key, None)
+            for tag in self._key_tags.pop(key, ()):
+                keys = self._tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tags[tag]
 
     def clear(self):
         """Clear all cache"""
-        self._cache.clear()
-        self._ttl.clear()
-        self._access_order.clear()
-
-    def invalidate_pattern(self, pattern: str):
-        """Invalidate all keys matching pattern"""
-        keys_to_delete = [k for k in self._cache.keys() if pattern in k]
-        for key in keys_to_delete:
-            self.delete(key)
+        with self._lock:
+            self._cache.clear()
+            self._tags.clear()
+            self._key_tags.clear()
+
+    def invalidate_tags(self, tags: Iterable[str]):
+        """Invalidate all keys carrying any of the tags"""
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self.delete(key)
+
+
+
+class SharedCache:
+    """
+    Cache stored in a SQLite file, shared by every worker process on the machine.
+
+    - Values are stored as JSON (_dumps / _loads); a cache error never fails the
+      request (get returns None).
+    - LRU via an indexed accessed_at column (touched at most once per second per
+      key so reads stay read-only), trimmed every EVICT_EVERY sets.
+    - WAL mode + synchronous=OFF: readers never block, losing the cache on a
+      crash is harmless.
+    """
+
+    EVICT_EVERY = 64
+    TOUCH_INTERVAL = 1.0
+
+    def __init__(self, path: str, max_size: int = 1000):
+        self._path = path
+        self._max_size = max_size
+        self._local = threading.local()
+        self._sets = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection()  # fail early (caller falls back to memory)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process (gunicorn forks after preload)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=2, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at);
+                CREATE TABLE IF NOT EXISTS cache_tags (
+                    tag TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (tag, key)
+                );
+                CREATE INDEX IF NOT EXISTS idx_cache_tags_key ON cache_tags (key);
+            """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get value from cache"""
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now > row[1]:
+                return None
+            if now - row[2] > self.TOUCH_INTERVAL:
+                conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+            return _loads(row[0])
+        except ValueError:
+            return None  # not JSON (e.g. written by an older version) - a miss
+        except Exception as e:
+            print(f"Warning: shared cache get failed for {key}: {str(e)}")
+            return None
+
+    def set(self, key: str, value: Any, ttl_seconds: int = 300, tags: Iterable[str] = ()):
+        """Set value in cache with TTL (default 5 minutes)"""
+        try:
+            data = _dumps(value)
+            now = time.time()
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, data, now + ttl_seconds, now)
+                )
+                conn.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)",
+                    [(tag, key) for tag in tags]
+                )
+
+            self._sets += 1
+            if self._sets % self.EVICT_EVERY == 0:
+                self._evict()
+        except Exception as e:
+            print(f"Warning: shared cache set failed for {key}: {str(e)}")
+
+    def incr(self, key: str, ttl_seconds: int = 300) -> Optional[int]:
+        """Atomically add 1 to a counter (created at 1) and restart its TTL, across processes"""
+        try:
+            now = time.time()
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")  # the write lock: no other process reads in between
+                row = conn.execute(
+                    "SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)
+                ).fetchone()
+                count = (_loads(row[0]) if row is not None and now <= row[1] else 0) + 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, _dumps(count), now + ttl_seconds, now)
+                )
+            return count
+        except Exception as e:
+            print(f"Warning: shared cache incr failed for {key}: {str(e)}")
+            return None
+
+    def _evict(self):
+        """Drop expired entries, then least recently used entries beyond max_size"""
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (time.time(),))
+            overflow = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] - self._max_size
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM cache_entries WHERE key IN "
+                    "(SELECT key FROM cache_entries ORDER BY accessed_at LIMIT ?)",
+                    (overflow,)
+                )
+            conn.execute("DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)")
+
+    def delete(self, key: str):
+        """Delete value from cache"""
+        self._delete_where("key = ?", (key,))
+
+    def clear(self):
+        """Clear all cache"""
+        self._delete_where("1 = 1", ())
+
+    def invalidate_tags(self, tags: Iterable[str]):
+        """Invalidate all keys carrying any of the tags"""
+        tags = list(tags)
+        if tags:
+            placeholders = ', '.join('?' * len(tags))
+            self._delete_where(f"key IN (SELECT key FROM cache_tags WHERE tag IN ({placeholders}))", tags)
+
+    def _delete_where(self, condition: str, params):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                keys = conn.execute(f"SELECT key FROM cache_entries WHERE {condition}", params).fetchall()
+                conn.executemany("DELETE FROM cache_entries WHERE key = ?", keys)
+                conn.executemany("DELETE FROM cache_tags WHERE key = ?", keys)
+        except Exception as e:
+            print(f"Warning: shared cache invalidation failed: {str(e)}")
+
+
+def _create_cache():
+    """Create the configured cache backend, falling back to in-memory"""
+    max_size = int(os.getenv('CACHE_MAX_ENTRIES', '1000'))
+    if os.getenv('CACHE_BACKEND', 'shared').lower() == 'shared':
+        path = os.getenv('CACHE_DB_PATH', os.path.expanduser('~/.mj-billing/cache.db'))
+        try:
+            return SharedCache(path, max_size=max_size)
+        except Exception as e:
+            print(f"Warning: shared cache unavailable at {path} ({str(e)}), using in-memory cache")
+    return SimpleCache(max_size=max_size)
 
 
 # Global cache instance
-cache = SimpleCache()
+cache = _create_cache()
 
 
 def generate_cache_key(*args, **kwargs) -> str:
@@ -114,20 +341,20 @@ def cached(ttl_seconds: int = 300, key_prefix: str = ""):
 
             # Execute function and cache result
             result = func(*args, **kwargs)
-            cache.set(cache_key, result, ttl_seconds)
+            cache.set(cache_key, result, ttl_seconds, tags=[key_prefix] if key_prefix else ())
             return result
 
         return wrapper
     return decorator
 
 
-def invalidate_cache(pattern: str = ""):
-    """Invalidate cache by pattern"""
-    if pattern:
-        cache.invalidate_pattern(pattern)
+def invalidate_cache(tag: str = ""):
+    """Invalidate every entry set with the tag, or everything (all processes with the shared backend)"""
+    if tag:
+        cache.invalidate_tags([tag])
     else:
         cache.clear()
 
 
 # Export
-__all__ = ['cache', 'cached', 'invalidate_cache', 'generate_cache_key']
+__all__ = ['cache', 'cached', 'invalidate_cache', 'generate_cache_key', 'SimpleCache', 'SharedCache']
@@ -6,13 +6,50 @@ import json
 import hashlib
 import functools
 import logging
-from typing import Any, Optional, Callable
+import threading
+from typing import Any, Optional, Callable, Iterable, List
 from flask import g, request
 import redis
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Tag index: Redis set "tag:<tag>" holds the keys cached under that tag
+TAG_KEY_PREFIX = "tag:"
+TAG_TTL = 86400  # Refreshed on every tagged set; stale members are harmless
+
+# Deletes every key in the given tag sets plus the sets themselves, atomically
+# (a key tagged concurrently is either deleted or lands in a fresh set)
+_INVALIDATE_TAGS_SCRIPT = """
+local deleted = 0
+for _, tag_key in ipairs(KEYS) do
+    local members = redis.call('SMEMBERS', tag_key)
+    for i = 1, #members, 500 do
+        deleted = deleted + redis.call('DEL', unpack(members, i, math.min(i + 499, #members)))
+    end
+    redis.call('DEL', tag_key)
+end
+return deleted
+"""
+
+
+def cache_tags(client_id: str, entity: Optional[str] = None, day: Optional[str] = None) -> List[str]:
+    """
+    Build invalidation tags for a cache entry
+
+    Tags: client (everything of a tenant), entity type per client, optional date bucket.
+
+    Usage:
+        cache.set(key, data, 300, tags=cache_tags(client_id, 'analytics', '2024-01-31'))
+        cache.invalidate_tags([f"analytics:{client_id}"])
+    """
+    tags = [f"client:{client_id}"]
+    if entity:
+        tags.append(f"{entity}:{client_id}")
+        if day:
+            tags.append(f"{entity}:{client_id}:{day}")
+    return tags
+
 
 class CacheManager:
     """Centralized cache management with Redis"""
@@ -39,6 +76,17 @@ class CacheManager:
             logger.warning(f"Redis cache not available: {e}. Running without cache.")
             self.enabled = False
 
+        self._invalidate_script = self.redis_client.register_script(_INVALIDATE_TAGS_SCRIPT) if self.enabled else None
+
+        # Invalidation metrics (per process)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'invalidations': 0,
+            'keys_invalidated': 0,
+            'max_keys_per_invalidation': 0,
+            'last_invalidation': None
+        }
+
     def _make_cache_key(self, prefix: str, *args, **kwargs) -> str:
         """Generate a unique cache key"""
         # Include client_id from g.user if available
@@ -74,18 +122,41 @@ class CacheManager:
 
         return None
 
-    def set(self, key: str, value: Any, timeout: int = 300) -> bool:
-        """Set value in cache with timeout in seconds"""
+    def set(self, key: str, value: Any, timeout: int = 300, tags: Optional[Iterable[str]] = None) -> bool:
+        """Set value in cache with timeout in seconds, registered under tags for invalidation"""
         if not self.enabled:
             return False
 
         try:
             json_value = json.dumps(value, default=str)
-            return self.redis_client.setex(key, timeout, json_value)
+            if not tags:
+                return self.redis_client.setex(key, timeout, json_value)
+
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(key, timeout, json_value)
+            for tag in tags:
+                tag_key = f"{TAG_KEY_PREFIX}{tag}"
+                pipe.sadd(tag_key, key)
+                pipe.expire(tag_key, max(TAG_TTL, timeout))
+            return bool(pipe.execute()[0])
         except Exception as e:
             logger.error(f"Cache set error: {e}")
             return False
 
+    def incr(self, key: str, timeout: int = 300) -> Optional[int]:
+        """Atomically add 1 to a counter (created at 1) and restart its timeout"""
+        if not self.enabled:
+            return None
+
+        try:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.incr(key)
+            pipe.expire(key, timeout)
+            return pipe.execute()[0]
+        except Exception as e:
+            logger.error(f"Cache incr error: {e}")
+            return None
+
     def delete(self, key: str) -> bool:
         """Delete key from cache"""
         if not self.enabled:
@@ -98,31 +169,71 @@ class CacheManager:
             return False
 
     def delete_pattern(self, pattern: str) -> int:
-        """Delete all keys matching pattern"""
+        """
+        Delete all keys matching pattern
+
+        Uses incremental SCAN (does not block Redis like KEYS) but still walks the
+        whole keyspace - prefer tags + invalidate_tags() for anything on a hot path.
+        """
         if not self.enabled:
             return 0
 
         try:
-            keys = self.redis_client.keys(pattern)
-            if keys:
-                return self.redis_client.delete(*keys)
-            return 0
+            deleted = 0
+            batch = []
+            for key in self.redis_client.scan_iter(match=pattern, count=1000):
+                batch.append(key)
+                if len(batch) >= 500:
+                    deleted += self.redis_client.delete(*batch)
+                    batch = []
+            if batch:
+                deleted += self.redis_client.delete(*batch)
+            return deleted
         except Exception as e:
             logger.error(f"Cache delete pattern error: {e}")
             return 0
 
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Delete exactly the keys registered under any of the tags"""
+        if not self.enabled:
+            return 0
+
+        tags = list(tags)
+        if not tags:
+            return 0
+
+        try:
+            deleted = self._invalidate_script(keys=[f"{TAG_KEY_PREFIX}{tag}" for tag in tags])
+        except Exception as e:
+            logger.error(f"Cache tag invalidation error: {e}")
+            return 0
+
+        with self._stats_lock:
+            self.stats['invalidations'] += 1
+            self.stats['keys_invalidated'] += deleted
+            self.stats['max_keys_per_invalidation'] = max(self.stats['max_keys_per_invalidation'], deleted)
+            self.stats['last_invalidation'] = {
+                'tags': tags,
+                'keys': deleted,
+                'at': datetime.utcnow().isoformat()
+            }
+        logger.debug(f"Invalidated {deleted} cache keys for tags {tags}")
+        return deleted
+
+    def get_stats(self) -> dict:
+        """Cache status and invalidation metrics for this process"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['enabled'] = self.enabled
+        return stats
+
     def invalidate_client_cache(self, client_id: str):
         """Invalidate all cache for a specific client"""
         if not self.enabled:
             return
 
-        try:
-            # Delete all keys for this client
-            pattern = f"*:{client_id}:*"
-            deleted = self.delete_pattern(pattern)
-            logger.info(f"Invalidated {deleted} cache keys for client {client_id}")
-        except Exception as e:
-            logger.error(f"Cache invalidation error: {e}")
+        deleted = self.invalidate_tags([f"client:{client_id}"])
+        logger.info(f"Invalidated {deleted} cache keys for client {client_id}")
 
 
 # Global cache instance
@@ -175,8 +286,9 @@ def cache_result(timeout: int = 300, key_prefix: str = ""):
             logger.debug(f"Cache miss: {cache_key}")
             result = func(*args, **kwargs)
 
-            # Cache the result
-            cache.set(cache_key, result, timeout)
+            # Cache the result (tagged with the client for invalidate_client_cache)
+            client_id = g.user.get('client_id') if hasattr(g, 'user') and g.user else None
+            cache.set(cache_key, result, timeout, tags=cache_tags(client_id) if client_id else None)
 
             return result
 
@@ -207,6 +319,9 @@ def cache_route(timeout: int = 60):
             query_string = request.query_string.decode('utf-8')
 
             cache_key = f"route:{client_id}:{url_path}:{query_string}"
+            # Entity tag from the blueprint path, e.g. /api/stock/... -> stock
+            path_parts = url_path.strip('/').split('/')
+            entity = path_parts[1] if len(path_parts) > 1 and path_parts[0] == 'api' else path_parts[0]
 
             # Try to get from cache
             cached_response = cache.get(cache_key)
@@ -222,7 +337,7 @@ def cache_route(timeout: int = 60):
             if isinstance(result, tuple):
                 response_data, status_code = result
                 if status_code == 200:
-                    cache.set(cache_key, result, timeout)
+                    cache.set(cache_key, result, timeout, tags=cache_tags(client_id, entity))
 
             return result
 
@@ -230,29 +345,38 @@ def cache_route(timeout: int = 60):
     return decorator
 
 
-def invalidate_stock_cache(client_id: str):
-    """Invalidate all stock-related cache for a client"""
+def invalidate_stock_cache(client_id: str, reindex: bool = False):
+    """
+    Invalidate all stock-related cache for a client (call after commit)
+
+    Also signals the in-process barcode lookup index of every worker;
+    reindex forces a full index reload instead of a delta refresh (deletes, bulk imports).
+    """
+    from utils.product_index import mark_stock_changed
+
     cache = get_cache_manager()
-    cache.delete_pattern(f"*stock*:{client_id}:*")
-    cache.delete_pattern(f"route:{client_id}:/api/stock*")
-    logger.info(f"Invalidated stock cache for client {client_id}")
+    deleted = cache.invalidate_tags([f"stock:{client_id}"])
+    logger.info(f"Invalidated {deleted} stock cache keys for client {client_id}")
+    mark_stock_changed(client_id, reset=reindex)
 
 
-def invalidate_billing_cache(client_id: str):
-    """Invalidate all billing-related cache for a client"""
+def invalidate_billing_cache(client_id: str, day: Optional[str] = None):
+    """
+    Invalidate all billing-related cache for a client (includes analytics)
+
+    With day (YYYY-MM-DD) only analytics cached under that date bucket is dropped.
+    """
     cache = get_cache_manager()
-    cache.delete_pattern(f"*bill*:{client_id}:*")
-    cache.delete_pattern(f"route:{client_id}:/api/billing*")
-    cache.delete_pattern(f"*analytics*:{client_id}:*")
-    logger.info(f"Invalidated billing cache for client {client_id}")
+    analytics_tag = f"analytics:{client_id}:{day}" if day else f"analytics:{client_id}"
+    deleted = cache.invalidate_tags([f"billing:{client_id}", analytics_tag])
+    logger.info(f"Invalidated {deleted} billing cache keys for client {client_id}")
 
 
-def invalidate_analytics_cache(client_id: str):
+def invalidate_analytics_cache(client_id: str, day: Optional[str] = None):
     """Invalidate all analytics-related cache for a client - for real-time updates"""
     cache = get_cache_manager()
-    cache.delete_pattern(f"analytics:dashboard:{client_id}:*")
-    cache.delete_pattern(f"*analytics*:{client_id}:*")
-    logger.info(f"Invalidated analytics cache for client {client_id}")
+    deleted = cache.invalidate_tags([f"analytics:{client_id}:{day}" if day else f"analytics:{client_id}"])
+    logger.info(f"Invalidated {deleted} analytics cache keys for client {client_id}")
 
 
 def warm_cache(client_id: str):
@@ -266,12 +390,12 @@ def warm_cache(client_id: str):
         # Pre-cache stock list
         stock_entries = StockEntry.query.filter_by(client_id=client_id).all()
         stock_data = [entry.to_dict() for entry in stock_entries]
-        cache.set(f"stock_list:{client_id}:all", stock_data, 300)
+        cache.set(f"stock_list:{client_id}:all", stock_data, 300, tags=cache_tags(client_id, 'stock'))
 
         # Pre-cache low stock items
         low_stock = [e for e in stock_entries if e.quantity <= e.low_stock_alert]
         low_stock_data = [entry.to_dict() for entry in low_stock]
-        cache.set(f"stock_alerts:{client_id}", low_stock_data, 600)
+        cache.set(f"stock_alerts:{client_id}", low_stock_data, 600, tags=cache_tags(client_id, 'stock'))
 
         logger.info(f"Cache warmed for client {client_id}")
 
@@ -0,0 +1,119 @@
+"""
+RYX Billing - Streaming Exports
+Builds CSV / XLSX exports from a server-side cursor in constant memory, so
+exporting millions of rows never materialises ORM objects, DataFrames or the
+whole file in the worker.
+
+Usage:
+    rows = stream_rows(select(StockEntry.product_name, StockEntry.quantity).where(...))
+    return export_response(*csv_export(['Product', 'Quantity'], rows, 'stock.csv'))
+
+- CSV is produced by a generator and streamed straight into the response.
+- XLSX is written by an openpyxl write-only workbook into a temporary file on
+  disk (rows never accumulate in memory) and sent from there.
+"""
+import csv
+import io
+import tempfile
+from typing import Iterable, Iterator, Optional, Sequence
+
+from flask import Response, send_file, stream_with_context
+from extensions import db
+
+CHUNK_ROWS = 1000
+
+CSV_MIMETYPE = 'text/csv'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def stream_rows(stmt, chunk_size: int = CHUNK_ROWS) -> Iterator:
+    """
+    Iterate result rows of a select() chunk_size at a time.
+
+    yield_per enables stream_results, i.e. a server-side (named) cursor on
+    PostgreSQL and incremental fetchmany() on SQLite.
+    """
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        yield from partition
+
+
+def csv_chunks(header: Sequence, rows: Iterable[Sequence], chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """Encode rows as CSV, yielding one bytes chunk per chunk_rows rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    yield buffer.getvalue().encode('utf-8')
+
+
+def xlsx_file(header: Sequence, rows: Iterable[Sequence], sheet_name: str = 'Sheet1'):
+    """Write rows to a write-only workbook in a temporary file, returned rewound"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    worksheet.append(list(header))
+    for row in rows:
+        worksheet.append(list(row))
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def csv_export(header: Sequence, rows: Iterable[Sequence], filename: str):
+    """(chunk generator, filename, mimetype) for export_response / job artifacts"""
+    return csv_chunks(header, rows), filename, CSV_MIMETYPE
+
+
+def xlsx_export(header: Sequence, rows: Iterable[Sequence], filename: str, sheet_name: str = 'Sheet1'):
+    """(temporary file, filename, mimetype) for export_response / job artifacts"""
+    return xlsx_file(header, rows, sheet_name), filename, XLSX_MIMETYPE
+
+
+def export_response(body, filename: str, mimetype: str) -> Response:
+    """
+    Download response for an export body.
+
+    body is a file object (sent as is), bytes, or an iterator of bytes chunks
+    (streamed with the request context kept alive, so the DB cursor stays open).
+    """
+    if isinstance(body, (bytes, bytearray)):
+        body = io.BytesIO(body)
+
+    if hasattr(body, 'read'):
+        return send_file(body, mimetype=mimetype, as_attachment=True, download_name=filename)
+
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def format_datetime(value, fmt: str = '%Y-%m-%d %H:%M:%S') -> Optional[str]:
+    return value.strftime(fmt) if value else ''
+
+
+__all__ = [
+    'CHUNK_ROWS',
+    'CSV_MIMETYPE',
+    'XLSX_MIMETYPE',
+    'stream_rows',
+    'csv_chunks',
+    'xlsx_file',
+    'csv_export',
+    'xlsx_export',
+    'export_response',
+    'format_datetime',
+]
@@ -0,0 +1,88 @@
+"""
+RYX Billing - Login Attempt Shaping
+After LOGIN_FREE_ATTEMPTS failed logins for an account from one client IP,
+that IP has to wait before its next attempt on the account: 2s, 4s, 8s ... up
+to LOGIN_MAX_DELAY. Attempts made while waiting are answered with 429 before
+any query or bcrypt work, so repeated wrong passwords cannot tie up the
+password pool. A successful login, or LOGIN_WINDOW seconds without failures,
+resets the account for that IP.
+
+Counters are keyed on (email, client IP), so guessing from one machine cannot
+lock the owner out from another. A second, looser limit counts every failure
+from an IP across all accounts (LOGIN_IP_FREE_ATTEMPTS), so spraying many
+emails from one address is slowed down too; it is not reset by a success.
+
+Counters live in Redis when enabled, otherwise in the machine-wide cache
+(utils.cache, 'shared' backend), so every gunicorn worker sees the same count.
+Failures are counted with the store's atomic incr().
+"""
+import os
+import time
+
+from utils.cache import cache
+from utils.cache_helper import get_cache_manager
+
+ACCOUNT_KEY = 'login_attempts:{ip}:{account}'
+IP_KEY = 'login_attempts:{ip}'
+
+LOGIN_FREE_ATTEMPTS = int(os.getenv('LOGIN_FREE_ATTEMPTS', '5'))
+LOGIN_IP_FREE_ATTEMPTS = int(os.getenv('LOGIN_IP_FREE_ATTEMPTS', '50'))
+LOGIN_MAX_DELAY = int(os.getenv('LOGIN_MAX_DELAY', '300'))
+LOGIN_WINDOW = 900
+
+
+class LoginThrottle:
+    """Failed-attempt counters per (account, client IP) and per client IP"""
+
+    @staticmethod
+    def _limits(account: str, ip: str):
+        """(counter key, free attempts) of each limit the attempt falls under"""
+        ip = ip or 'unknown'
+        return [
+            (ACCOUNT_KEY.format(ip=ip, account=account.strip().lower()), LOGIN_FREE_ATTEMPTS),
+            (IP_KEY.format(ip=ip), LOGIN_IP_FREE_ATTEMPTS),
+        ]
+
+    @staticmethod
+    def _store():
+        manager = get_cache_manager()
+        return manager if manager.enabled else cache
+
+    @staticmethod
+    def _delay(failures: int, free_attempts: int) -> int:
+        if failures < free_attempts:
+            return 0
+        return min(2 ** (failures - free_attempts + 1), LOGIN_MAX_DELAY)
+
+    def retry_after(self, account: str, ip: str) -> int:
+        """Seconds this IP must still wait before trying the account again (0 = allowed)"""
+        store = self._store()
+        wait = 0
+        for key, free_attempts in self._limits(account, ip):
+            failures = store.get(key)
+            last = store.get(f'{key}:last') if failures else None
+            if last:
+                remaining = last + self._delay(failures, free_attempts) - time.time()
+                wait = max(wait, int(remaining + 0.999))
+        return wait
+
+    def failed(self, account: str, ip: str):
+        store = self._store()
+        ttl = max(LOGIN_WINDOW, LOGIN_MAX_DELAY)
+        now = time.time()
+        for key, _ in self._limits(account, ip):
+            store.incr(key, ttl)
+            store.set(f'{key}:last', now, ttl)
+
+    def succeeded(self, account: str, ip: str):
+        store = self._store()
+        key, _ = self._limits(account, ip)[0]
+        store.delete(key)
+        store.delete(f'{key}:last')
+
+
+# Global throttle instance
+login_throttle = LoginThrottle()
+
+
+__all__ = ['login_throttle', 'LoginThrottle']
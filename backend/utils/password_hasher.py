@@ -0,0 +1,148 @@
+"""
+RYX Billing - Password Hashing off the Request Thread
+bcrypt is deliberately slow (~250ms of CPU at cost 12). Run inline, a burst of
+logins at shift change keeps every thread of a worker busy hashing and billing
+requests on that worker wait behind them.
+
+- Hashes are checked / created in a small per-worker process pool
+  (PASSWORD_WORKERS processes), so at most that many cores per worker are
+  spent on bcrypt and request threads only wait on a future.
+- Logins beyond PASSWORD_QUEUE_MAX checks in flight are shed with
+  PasswordHasherBusy (the route answers 503 + Retry-After) instead of queueing.
+- New hashes use BCRYPT_ROUNDS; login rehashes older hashes to that cost.
+
+The pool is created after gunicorn forks the worker (gunicorn_config.post_fork)
+so it is never forked from a threaded process. Where fork is not the start
+method (Windows desktop) a thread pool is used instead - bcrypt releases the
+GIL, so hashing still runs beside the request threads. PASSWORD_WORKERS=0
+hashes inline.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', '1'))
+PASSWORD_QUEUE_MAX = int(os.getenv('PASSWORD_QUEUE_MAX', '8'))
+# Longest wait for a hash (well under the gunicorn worker timeout)
+PASSWORD_TIMEOUT = 15
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password checks in flight - retry shortly"""
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def _hashpw(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _warm():
+    return True
+
+
+class PasswordHasher:
+    """Bounded bcrypt pool of one worker process"""
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_queue: int = PASSWORD_QUEUE_MAX,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max(max_queue, 1))
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self.stats = {'checks': 0, 'hashes': 0, 'shed': 0, 'rehashed': 0}
+
+    def start(self):
+        """Create the pool now (call after fork, before request threads start)"""
+        if self.workers > 0:
+            self._executor().submit(_warm).result(timeout=PASSWORD_TIMEOUT)
+
+    def _executor(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    if multiprocessing.get_start_method(allow_none=True) in (None, 'fork') \
+                            and 'fork' in multiprocessing.get_all_start_methods():
+                        self._pool = ProcessPoolExecutor(
+                            max_workers=self.workers, mp_context=multiprocessing.get_context('fork')
+                        )
+                    else:
+                        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        try:
+            return self._executor().submit(fn, *args).result(timeout=PASSWORD_TIMEOUT)
+        except BrokenProcessPool:
+            # A pool process died (e.g. killed): start a new pool for the next call
+            with self._lock:
+                self._pool = None
+            return fn(*args)
+
+    def verify(self, password: str, password_hash: str, shed: bool = True) -> bool:
+        """
+        bcrypt.checkpw in the pool
+
+        Raises:
+            PasswordHasherBusy: shed=True and PASSWORD_QUEUE_MAX checks are already in flight
+        """
+        if not self._slots.acquire(blocking=not shed):
+            self.stats['shed'] += 1
+            raise PasswordHasherBusy()
+        try:
+            self.stats['checks'] += 1
+            return self._run(_checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str, shed: bool = False) -> str:
+        """bcrypt.hashpw at BCRYPT_ROUNDS in the pool"""
+        if not self._slots.acquire(blocking=not shed):
+            self.stats['shed'] += 1
+            raise PasswordHasherBusy()
+        try:
+            self.stats['hashes'] += 1
+            return self._run(_hashpw, password.encode('utf-8'), self.rounds).decode('utf-8')
+        finally:
+            self._slots.release()
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True if the hash was made with a different cost than BCRYPT_ROUNDS"""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def upgrade(self, password: str, password_hash: str) -> Optional[str]:
+        """New hash for a verified password whose hash has another cost (None if current or busy)"""
+        if not self.needs_rehash(password_hash):
+            return None
+        try:
+            new_hash = self.hash(password, shed=True)
+        except PasswordHasherBusy:
+            return None  # next login
+        self.stats['rehashed'] += 1
+        return new_hash
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats, workers=self.workers, rounds=self.rounds)
+
+
+# Global hasher instance (one pool per gunicorn worker)
+password_hasher = PasswordHasher()
+
+
+__all__ = ['password_hasher', 'PasswordHasher', 'PasswordHasherBusy', 'BCRYPT_ROUNDS']
@@ -0,0 +1,105 @@
+"""
+RYX Billing - Compiled Permission Bitsets
+Permission checks test one bit of an integer instead of scanning the user's
+permission-name list and querying the database when the name is missing.
+
+- The catalogue numbers the rows of the permissions table by permission_id
+  (bit i = i-th permission) and is cached per process, reloaded every
+  CATALOG_MAX_AGE seconds. Its version is a digest of that ordering.
+- A session carries permission_mask and the catalogue version it was
+  compiled against (done at login and when authenticate loads a session).
+  A session compiled against another version is recompiled from its
+  permission names - in memory, no query.
+- The names list stays in g.user['permissions'] for API responses.
+"""
+import hashlib
+import threading
+import time
+from typing import Dict, Iterable
+
+from extensions import db
+from models.permission_model import Permission
+
+# Reload the catalogue even without a change signal (e.g. permissions pulled by the sync)
+CATALOG_MAX_AGE = 300
+
+
+class PermissionCatalog:
+    """Permission name -> bit, in stable permission_id order"""
+
+    def __init__(self):
+        self._bits = {}  # permission_name -> 1 << index
+        self.version = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        names = [name for (name,) in db.session.query(Permission.permission_name)
+                 .order_by(Permission.permission_id).all()]
+        self._bits = {name: 1 << index for index, name in enumerate(names)}
+        self.version = hashlib.sha1('\n'.join(names).encode('utf-8')).hexdigest()[:16]
+        self._loaded_at = time.monotonic()
+
+    def current_version(self) -> str:
+        if self.version is None or time.monotonic() - self._loaded_at >= CATALOG_MAX_AGE:
+            with self._lock:
+                if self.version is None or time.monotonic() - self._loaded_at >= CATALOG_MAX_AGE:
+                    self._load()
+        return self.version
+
+    def compile(self, names: Iterable[str]) -> int:
+        """Bitset of the given permission names (unknown names are ignored)"""
+        self.current_version()
+        mask = 0
+        for name in names:
+            mask |= self._bits.get(name, 0)
+        return mask
+
+    def bit(self, name: str) -> int:
+        """Bit of a permission, 0 if the catalogue does not know it"""
+        return self._bits.get(name, 0)
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+    def get_stats(self) -> Dict:
+        return {'permissions': len(self._bits), 'version': self.version}
+
+
+# Global catalogue instance
+permission_catalog = PermissionCatalog()
+
+
+def permission_mask(user: Dict) -> int:
+    """
+    Compiled permissions of a session / g.user dict
+
+    Compiles (and stores in the dict) when the dict has no mask yet or one
+    built against an older catalogue.
+    """
+    version = permission_catalog.current_version()
+    if user.get('permission_catalog') != version or 'permission_mask' not in user:
+        user['permission_mask'] = permission_catalog.compile(user.get('permissions') or [])
+        user['permission_catalog'] = version
+    return user['permission_mask']
+
+
+def user_has_permission(user: Dict, *names: str, require_all: bool = False) -> bool:
+    """
+    Check permissions of a session without touching the database
+
+    Usage:
+        has_view_all = user_has_permission(g.user, 'view_all_bills')
+        user_has_permission(g.user, 'view_reports', 'manage_reports', require_all=True)
+    """
+    if user.get('is_super_admin', False):
+        return True
+
+    mask = permission_mask(user)
+    bits = [permission_catalog.bit(name) for name in names]
+    if require_all:
+        return all(bit and mask & bit for bit in bits)
+    return any(mask & bit for bit in bits)
+
+
+__all__ = ['permission_catalog', 'PermissionCatalog', 'permission_mask', 'user_has_permission']
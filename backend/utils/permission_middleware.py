@@ -3,7 +3,7 @@ Permission middleware for checking user permissions
 """
 from functools import wraps
 from flask import jsonify, g
-from models.permission_model import has_permission
+from utils.permission_bits import user_has_permission
 
 
 def require_permission(permission_name):
@@ -18,19 +18,13 @@ def require_permission(permission_name):
             if not g.user:
                 return jsonify({'error': 'Authentication required'}), 401
 
-            # Super admins have all permissions
-            if g.user.get('is_super_admin', False):
-                return f(*args, **kwargs)
-
-            # Check if user has the specific permission
-            user_permissions = g.user.get('permissions', [])
-            if permission_name not in user_permissions:
-                # Double-check in database if not in token
-                if not has_permission(g.user['user_id'], permission_name):
-                    return jsonify({
-                        'error': 'Access denied',
-                        'message': f'Permission "{permission_name}" required'
-                    }), 403
+            # Super admins have all permissions; others are checked against the
+            # session's compiled permissions (loaded from the DB with the session)
+            if not user_has_permission(g.user, permission_name):
+                return jsonify({
+                    'error': 'Access denied',
+                    'message': f'Permission "{permission_name}" required'
+                }), 403
 
             return f(*args, **kwargs)
         return decorated_function
@@ -71,26 +65,12 @@ def require_any_permission(*permission_names):
             if not g.user:
                 return jsonify({'error': 'Authentication required'}), 401
 
-            # Super admins have all permissions
-            if g.user.get('is_super_admin', False):
-                return f(*args, **kwargs)
-
-            # Check if user has any of the permissions
-            user_permissions = g.user.get('permissions', [])
-            has_any = any(perm in user_permissions for perm in permission_names)
-
-            if not has_any:
-                # Double-check in database
-                has_any = any(
-                    has_permission(g.user['user_id'], perm)
-                    for perm in permission_names
-                )
-
-                if not has_any:
-                    return jsonify({
-                        'error': 'Access denied',
-                        'message': f'One of these permissions required: {", ".join(permission_names)}'
-                    }), 403
+            # Check if user has any of the permissions (super admins have all)
+            if not user_has_permission(g.user, *permission_names):
+                return jsonify({
+                    'error': 'Access denied',
+                    'message': f'One of these permissions required: {", ".join(permission_names)}'
+                }), 403
 
             return f(*args, **kwargs)
         return decorated_function
@@ -109,27 +89,13 @@ def require_all_permissions(*permission_names):
             if not g.user:
                 return jsonify({'error': 'Authentication required'}), 401
 
-            # Super admins have all permissions
-            if g.user.get('is_super_admin', False):
-                return f(*args, **kwargs)
-
-            # Check if user has all permissions
-            user_permissions = g.user.get('permissions', [])
-            has_all = all(perm in user_permissions for perm in permission_names)
-
-            if not has_all:
-                # Double-check in database
-                has_all = all(
-                    has_permission(g.user['user_id'], perm)
-                    for perm in permission_names
-                )
-
-                if not has_all:
-                    missing = [p for p in permission_names if p not in user_permissions]
-                    return jsonify({
-                        'error': 'Access denied',
-                        'message': f'Missing permissions: {", ".join(missing)}'
-                    }), 403
+            # Check if user has all permissions (super admins have all)
+            if not user_has_permission(g.user, *permission_names, require_all=True):
+                missing = [p for p in permission_names if not user_has_permission(g.user, p)]
+                return jsonify({
+                    'error': 'Access denied',
+                    'message': f'Missing permissions: {", ".join(missing)}'
+                }), 403
 
             return f(*args, **kwargs)
         return decorated_function
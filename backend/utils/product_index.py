@@ -0,0 +1,225 @@
+"""
+RYX Billing - In-process Product Lookup Index
+Answers barcode scanner lookups (/api/stock/lookup/<code>) from memory instead
+of up to four sequential stock_entry queries per scan.
+
+Per client the index maps barcode, item code and lower-cased product name to a product snapshot (StockEntry.to_dict()).
+
+Freshness across gunicorn workers:
+- Stock writers call mark_stock_changed(client_id) after commit (done by
+  invalidate_stock_cache); this bumps a version stamp in the shared cache.
+- On the next lookup a worker whose index is older re-reads only the rows
+  whose updated_at moved (one indexed query), or reloads the client fully
+  after deletes / bulk imports (reset=True) or every MAX_AGE seconds.
+- Scans with no stock change in between never touch the database.
+
+The stamp must be visible to every worker, so the index needs the shared cache
+backend (utils.cache, CACHE_BACKEND=shared). With CACHE_BACKEND=memory each
+worker would only see its own stamps and serve other workers' stock changes
+(quantities included) late, so the index is disabled and every lookup queries
+the database.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from models.stock_model import StockEntry
+from utils.cache import SimpleCache, cache
+
+STAMP_KEY = 'product_index:{client_id}'
+STAMP_TTL = 86400
+
+# Clients kept in memory per process (least recently used are dropped)
+MAX_CLIENTS = 64
+# Full reload even without a change signal (e.g. rows edited outside the app)
+MAX_AGE = 300
+# Delta refresh re-reads rows updated this long before the last load, covering
+# transactions that set updated_at before our load but committed after it
+DELTA_OVERLAP = timedelta(seconds=60)
+
+
+class _ClientIndex:
+    """Lookup maps of a single client"""
+
+    def __init__(self, version, reset):
+        self.version = version
+        self.reset = reset
+        self.loaded_at = None  # DB time (utc) of the last full or delta load
+        self.built_at = time.time()
+        self.products = {}  # product_id -> snapshot dict
+        self.keys = {}  # product_id -> [(map, key), ...] for removal on update
+        self.by_barcode = {}
+        self.by_item_code = {}
+        self.by_name = {}
+
+    def put(self, product: StockEntry):
+        product_id = str(product.product_id)
+        self.remove(product_id)
+
+        entries = []
+        if product.barcode:
+            entries.append((self.by_barcode, product.barcode.strip()))
+        if product.item_code:
+            entries.append((self.by_item_code, product.item_code.strip()))
+        if product.product_name:
+            entries.append((self.by_name, product.product_name.strip().lower()))
+
+        # First product wins on duplicate codes/names (like the old .first() queries)
+        owned = []
+        for mapping, key in entries:
+            if key not in mapping:
+                mapping[key] = product_id
+                owned.append((mapping, key))
+
+        self.products[product_id] = product.to_dict()
+        self.keys[product_id] = owned
+
+    def remove(self, product_id: str):
+        self.products.pop(product_id, None)
+        for mapping, key in self.keys.pop(product_id, ()):
+            if mapping.get(key) == product_id:
+                del mapping[key]
+
+    def find(self, code: str) -> Optional[Dict]:
+        compact = code.replace(' ', '')
+        product_id = (
+            self.by_barcode.get(code)
+            or (self.by_barcode.get(compact) if compact != code else None)
+            or self.by_item_code.get(code)
+            or self.by_name.get(code.lower())
+        )
+        return self.products.get(product_id) if product_id else None
+
+
+class ProductLookupIndex:
+    """Per-process, per-client product lookup index"""
+
+    def __init__(self, max_clients: int = MAX_CLIENTS):
+        self._clients = OrderedDict()  # client_id -> _ClientIndex, least recently used first
+        self._max_clients = max_clients
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Only with a cache shared by all workers (see module docstring)"""
+        return not isinstance(cache, SimpleCache)
+
+    @staticmethod
+    def _read_stamp(client_id: str):
+        stamp = cache.get(STAMP_KEY.format(client_id=client_id)) or {}
+        return stamp.get('version'), stamp.get('reset')
+
+    def mark_changed(self, client_id: str, reset: bool = False):
+        """Signal a committed stock change to every worker (reset: products were removed)"""
+        client_id = str(client_id)
+        _, reset_token = self._read_stamp(client_id)
+        stamp = {
+            'version': uuid.uuid4().hex,
+            'reset': uuid.uuid4().hex if reset or reset_token is None else reset_token
+        }
+        cache.set(STAMP_KEY.format(client_id=client_id), stamp, ttl_seconds=STAMP_TTL)
+
+    def _load(self, client_id: str, version, reset) -> _ClientIndex:
+        index = _ClientIndex(version, reset)
+        index.loaded_at = datetime.utcnow()
+        for product in StockEntry.query.filter_by(client_id=client_id).yield_per(1000):
+            index.put(product)
+        self.reloads += 1
+        return index
+
+    def _refresh(self, index: _ClientIndex, client_id: str, version):
+        since = index.loaded_at - DELTA_OVERLAP
+        index.loaded_at = datetime.utcnow()
+        changed = StockEntry.query.filter(
+            StockEntry.client_id == client_id,
+            StockEntry.updated_at >= since
+        ).all()
+        for product in changed:
+            index.put(product)
+        index.version = version
+
+    def _get_index(self, client_id: str) -> _ClientIndex:
+        version, reset = self._read_stamp(client_id)
+        index = self._clients.get(client_id)
+
+        if index is not None and index.version == version and index.reset == reset \
+                and time.time() - index.built_at < MAX_AGE:
+            return index
+
+        with self._lock:
+            index = self._clients.get(client_id)
+            if index is None or index.reset != reset or time.time() - index.built_at >= MAX_AGE:
+                index = self._load(client_id, version, reset)
+            elif index.version != version:
+                self._refresh(index, client_id, version)
+
+            self._clients[client_id] = index
+            self._clients.move_to_end(client_id)
+            while len(self._clients) > self._max_clients:
+                self._clients.popitem(last=False)
+            return index
+
+    def lookup(self, client_id: str, code: str) -> Optional[Dict]:
+        """
+        Find a product by barcode, barcode without spaces, item code or name (case-insensitive)
+
+        Returns:
+            Product snapshot dict (StockEntry.to_dict()), or None if not found
+            (always None when the index is disabled)
+        """
+        if not self.enabled:
+            return None
+
+        client_id = str(client_id)
+        product = self._get_index(client_id).find(code)
+        if product is not None:
+            self.hits += 1
+            return dict(product)
+
+        self.misses += 1
+        return None
+
+    def add(self, client_id: str, product: StockEntry):
+        """Add a product found by the database fallback to the index"""
+        index = self._clients.get(str(client_id))
+        if index is not None:
+            with self._lock:
+                index.put(product)
+
+    def clear(self, client_id: Optional[str] = None):
+        with self._lock:
+            if client_id is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(str(client_id), None)
+
+    def get_stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'clients': len(self._clients),
+            'products': sum(len(index.products) for index in list(self._clients.values())),
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads
+        }
+
+
+# Global index instance
+product_index = ProductLookupIndex()
+
+
+def mark_stock_changed(client_id: str, reset: bool = False):
+    """Call after committing stock changes (reset=True after deleting products)"""
+    try:
+        product_index.mark_changed(client_id, reset=reset)
+    except Exception as e:
+        print(f"Warning: product index invalidation failed for {client_id}: {str(e)}")
+
+
+__all__ = ['product_index', 'ProductLookupIndex', 'mark_stock_changed']
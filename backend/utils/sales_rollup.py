@@ -0,0 +1,305 @@
+"""
+RYX Billing - Sales Rollup Maintenance
+Keeps the sales_rollup table in step with bills so the analytics dashboard reads
+pre-aggregated rows instead of loading bills and walking their items JSON.
+
+Usage (same transaction as the bill change):
+    before = bill_rollup_rows(bill)      # snapshot before mutating (None for new bills)
+    ... create / edit / cancel / exchange the bill ...
+    update_sales_rollup(before, bill_rollup_rows(bill))
+    db.session.commit()
+
+Bills written outside the bill routes (the offline sync pushing a till's bills
+to PostgreSQL) recompute the rollup of the days they touch with
+recompute_sales_rollup_days() in the transaction that writes them.
+
+On PostgreSQL every rollup write of a client holds the client's advisory lock
+until commit, so a bill saved while its client is being backfilled is counted
+exactly once.
+"""
+import json
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from typing import Dict, Optional, Tuple, List
+
+from sqlalchemy import case, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from extensions import db
+from models.billing_model import GSTBilling, NonGSTBilling
+from models.sales_rollup_model import SalesRollup
+
+KEY_COLUMNS = ['client_id', 'sale_date', 'sale_hour', 'created_by', 'bill_type', 'dimension', 'dimension_key']
+
+# Marker row written once the historical bills of a client have been rolled up
+BACKFILL_DIMENSION = 'backfill'
+
+UPSERT_BATCH_SIZE = 500
+
+# Billing columns the rollup is computed from (plus final_amount / total_amount)
+BILL_COLUMNS = ('client_id', 'created_at', 'created_by', 'status', 'customer_name', 'payment_type', 'items')
+
+_backfilled_clients = set()
+_backfill_lock = threading.Lock()
+
+
+def _payment_splits(payment_type, amount: float) -> List[Tuple[str, float]]:
+    """
+    Attribute a bill amount to its payment methods.
+
+    payment_type is either a single method (name or payment_type_id) or a JSON
+    string of splits ([{"payment_type": "Cash", "amount": 100}, ...]).
+    """
+    if not payment_type:
+        return [('Unknown', amount)]
+
+    splits = None
+    try:
+        parsed = json.loads(payment_type) if isinstance(payment_type, str) else payment_type
+        if isinstance(parsed, list):
+            splits = [
+                (str(split.get('payment_type') or 'Unknown'), float(split.get('amount') or 0))
+                for split in parsed if isinstance(split, dict)
+            ]
+    except (ValueError, TypeError):
+        pass
+
+    if not splits:
+        return [(str(payment_type), amount)]
+
+    # Scale split amounts to the bill amount (splits may include change / overpayment)
+    split_total = sum(split_amount for _, split_amount in splits)
+    if split_total > 0:
+        return [(method, amount * split_amount / split_total) for method, split_amount in splits]
+    return [(method, amount / len(splits)) for method, _ in splits]
+
+
+def bill_rollup_rows(bill) -> Dict[tuple, list]:
+    """
+    Rollup contributions of a single bill.
+
+    Cancelled bills contribute nothing, so cancelling a bill removes it from the rollup.
+
+    Returns:
+        Dict mapping rollup key tuple (KEY_COLUMNS order) to
+        [bill_count, quantity, revenue, category]
+    """
+    if bill is None:
+        return {}
+    return _rollup_rows(bill, 'gst' if isinstance(bill, GSTBilling) else 'non_gst')
+
+
+def _rollup_rows(bill, bill_type: str) -> Dict[tuple, list]:
+    """bill_rollup_rows() for a bill model or a result row of a billing table"""
+    if bill.status == 'cancelled':
+        return {}
+
+    amount = float((bill.final_amount if bill_type == 'gst' else bill.total_amount) or 0)
+    created_at = bill.created_at or datetime.utcnow()
+    sale_date = created_at.date()
+    client_id = str(bill.client_id)
+    created_by = str(bill.created_by) if bill.created_by else ''
+
+    rows = defaultdict(lambda: [0, 0.0, 0.0, ''])
+
+    def add(hour, dimension, key, bill_count=0, quantity=0.0, revenue=0.0, category=''):
+        row = rows[(client_id, sale_date, hour, created_by, bill_type, dimension, str(key)[:255])]
+        row[0] += bill_count
+        row[1] += quantity
+        row[2] += revenue
+        if category:
+            row[3] = category[:100]
+
+    add(created_at.hour, 'bill', '', bill_count=1, revenue=amount)
+    add(-1, 'customer', bill.customer_name or 'Walk-in', bill_count=1, revenue=amount)
+    for method, share in _payment_splits(bill.payment_type, amount):
+        add(-1, 'payment', method, bill_count=1, revenue=share)
+
+    items = bill.items if isinstance(bill.items, list) else []
+    for item in items:
+        quantity = item.get('quantity', 0) or 0
+        rate = float(item.get('rate', 0) or 0)
+        add(-1, 'product', item.get('product_name') or 'Unknown',
+            quantity=quantity, revenue=quantity * rate, category=item.get('category') or 'Other')
+
+    return dict(rows)
+
+
+def _add_rows(totals: Dict[tuple, list], rows: Dict[tuple, list]):
+    for key, (bill_count, quantity, revenue, category) in rows.items():
+        total = totals.setdefault(key, [0, 0.0, 0.0, ''])
+        total[0] += bill_count
+        total[1] += quantity
+        total[2] += revenue
+        if category:
+            total[3] = category
+
+
+def _lock_clients(executor, dialect_name: str, client_ids):
+    """Hold the clients' rollup advisory locks until commit (PostgreSQL; sorted to avoid deadlocks)"""
+    if dialect_name != 'postgresql':
+        return
+    for client_id in sorted({str(client_id) for client_id in client_ids}):
+        executor.execute(text("SELECT pg_advisory_xact_lock(hashtext(:client_id))"), {'client_id': client_id})
+
+
+def _upsert(executor, dialect_name: str, deltas: Dict[tuple, list]):
+    """Add deltas to rollup rows with INSERT ... ON CONFLICT DO UPDATE (PostgreSQL and SQLite)"""
+    table = SalesRollup.__table__
+    insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+    now = datetime.utcnow()
+
+    rows = [
+        dict(zip(KEY_COLUMNS, key), category=category, bill_count=bill_count,
+             quantity=round(quantity, 3), revenue=round(revenue, 2), updated_at=now)
+        for key, (bill_count, quantity, revenue, category) in deltas.items()
+    ]
+
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        stmt = insert(table).values(rows[start:start + UPSERT_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=KEY_COLUMNS,
+            set_={
+                'bill_count': table.c.bill_count + stmt.excluded.bill_count,
+                'quantity': table.c.quantity + stmt.excluded.quantity,
+                'revenue': table.c.revenue + stmt.excluded.revenue,
+                'category': case((stmt.excluded.category != '', stmt.excluded.category), else_=table.c.category),
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        executor.execute(stmt)
+
+
+def update_sales_rollup(before: Optional[Dict] = None, after: Optional[Dict] = None):
+    """
+    Apply the difference between two bill_rollup_rows() snapshots.
+
+    Runs in the caller's transaction (one multi-row upsert), so the rollup is
+    committed or rolled back together with the bill.
+    """
+    deltas = {key: list(values) for key, values in (after or {}).items()}
+    for key, (bill_count, quantity, revenue, category) in (before or {}).items():
+        delta = deltas.setdefault(key, [0, 0.0, 0.0, category])
+        delta[0] -= bill_count
+        delta[1] -= quantity
+        delta[2] -= revenue
+
+    changed = {
+        key: delta for key, delta in deltas.items()
+        if delta[0] or abs(delta[1]) > 1e-9 or abs(delta[2]) > 0.005
+    }
+    if changed:
+        dialect_name = db.engine.dialect.name
+        _lock_clients(db.session, dialect_name, (key[0] for key in changed))
+        _upsert(db.session, dialect_name, changed)
+
+
+def rebuild_sales_rollup(client_id: str):
+    """
+    Recompute all rollup rows of a client from its bills (caller commits).
+
+    Used to backfill bills created before the rollup existed.
+    """
+    dialect_name = db.engine.dialect.name
+    # Serialize with other rollup writes of the same client across workers
+    _lock_clients(db.session, dialect_name, [client_id])
+
+    SalesRollup.query.filter_by(client_id=client_id).delete(synchronize_session=False)
+
+    totals = {}
+    for model in (GSTBilling, NonGSTBilling):
+        bills = model.query.filter(
+            model.client_id == client_id,
+            model.status != 'cancelled'
+        ).yield_per(500)
+        for bill in bills:
+            _add_rows(totals, bill_rollup_rows(bill))
+
+    today = datetime.utcnow().date()
+    totals[(str(client_id), today, -1, '', '', BACKFILL_DIMENSION, '')] = [0, 0.0, 0.0, '']
+    _upsert(db.session, dialect_name, totals)
+
+
+def recompute_sales_rollup_days(conn, client_days: Dict[str, set]):
+    """
+    Rebuild the rollup rows of whole days from the billing tables.
+
+    For writers outside the bill routes that change bills in bulk (the sync
+    upserting / deleting a till's bills in PostgreSQL). Runs on the caller's
+    Core connection, in its transaction, after the bills were written.
+    Clients not backfilled yet are skipped - their backfill counts the bills.
+
+    Args:
+        conn: Connection in the transaction that wrote the bills
+        client_days: {client_id: {sale_date, ...}} days whose bills changed
+    """
+    dialect_name = conn.dialect.name
+    rollup = SalesRollup.__table__
+    _lock_clients(conn, dialect_name, client_days)
+
+    for client_id in sorted(client_days, key=str):
+        days = sorted(client_days[client_id])
+        backfilled = conn.execute(
+            select(rollup.c.rollup_id)
+            .where(rollup.c.client_id == client_id, rollup.c.dimension == BACKFILL_DIMENSION)
+            .limit(1)
+        ).first()
+        if not days or backfilled is None:
+            continue
+
+        conn.execute(rollup.delete().where(
+            rollup.c.client_id == client_id,
+            rollup.c.sale_date.in_(days),
+            rollup.c.dimension != BACKFILL_DIMENSION
+        ))
+
+        totals = {}
+        for model, bill_type, amount_column in ((GSTBilling, 'gst', 'final_amount'),
+                                                (NonGSTBilling, 'non_gst', 'total_amount')):
+            bills = model.__table__
+            columns = [bills.c[name] for name in BILL_COLUMNS + (amount_column,)]
+            for day in days:
+                start = datetime.combine(day, time.min)
+                result = conn.execute(select(*columns).where(
+                    bills.c.client_id == client_id,
+                    bills.c.created_at >= start,
+                    bills.c.created_at < start + timedelta(days=1)
+                ))
+                for bill in result:
+                    _add_rows(totals, _rollup_rows(bill, bill_type))
+        if totals:
+            _upsert(conn, dialect_name, totals)
+
+
+def ensure_sales_rollup(client_id: str):
+    """Backfill a client's rollup on first use (once per process after the marker row exists)"""
+    client_key = str(client_id)
+    if client_key in _backfilled_clients:
+        return
+
+    with _backfill_lock:
+        if client_key in _backfilled_clients:
+            return
+
+        has_marker = db.session.query(
+            SalesRollup.query.filter_by(client_id=client_id, dimension=BACKFILL_DIMENSION).exists()
+        ).scalar()
+
+        if not has_marker:
+            try:
+                rebuild_sales_rollup(client_id)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        _backfilled_clients.add(client_key)
+
+
+__all__ = [
+    'bill_rollup_rows',
+    'update_sales_rollup',
+    'rebuild_sales_rollup',
+    'recompute_sales_rollup_days',
+    'ensure_sales_rollup',
+]
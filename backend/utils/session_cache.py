@@ -0,0 +1,176 @@
+"""
+RYX Billing - Two-tier Session Cache for authenticate
+Serves the user/client session of a request from memory instead of a Redis
+GET + json.loads (or two DB queries without Redis) on every API call.
+
+Tiers:
+- L1: per-process LRU of SESSION_L1_SIZE sessions, trusted without any I/O for
+  SESSION_L1_TTL seconds after it was last checked.
+- L2: shared store - Redis when enabled, otherwise the machine-wide cache
+  (utils.cache, 'shared' backend). Key user_session:{user_id}, tagged
+  session_client:{client_id}.
+
+Versioned invalidation:
+- Every L2 entry carries a version (uuid) that the L1 copy remembers.
+- Writers call invalidate_users() / invalidate_client() after commit; this
+  deletes the L2 entries (by key or client tag) and the local L1 copies.
+- Once its TTL is up, an L1 entry is revalidated with one L2 read: same
+  version -> trusted for another TTL, otherwise replaced (or reloaded from the
+  database when the L2 entry is gone). Other workers therefore see a change
+  within SESSION_L1_TTL seconds.
+- With the per-process 'memory' cache backend there is no shared L2, so L1
+  entries are simply dropped after their TTL.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from utils.cache import SimpleCache, cache
+from utils.cache_helper import get_cache_manager
+
+SESSION_KEY = 'user_session:{user_id}'
+CLIENT_TAG = 'session_client:{client_id}'
+SESSION_TTL = 86400
+
+# Sessions kept in memory per process (least recently used are dropped)
+L1_SIZE = int(os.getenv('SESSION_L1_SIZE', '512'))
+# Seconds an L1 entry is used before it is checked against L2 again
+L1_TTL = float(os.getenv('SESSION_L1_TTL', '5'))
+
+
+class SessionCache:
+    """Per-process L1 in front of the shared session store"""
+
+    def __init__(self, max_size: int = L1_SIZE, ttl: float = L1_TTL):
+        self._sessions = OrderedDict()  # user_id -> (session, version, checked_at), least recently used first
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.l2_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _store():
+        """Shared (L2) store, or None when sessions can only live in this process"""
+        manager = get_cache_manager()
+        if manager.enabled:
+            return manager
+        if isinstance(cache, SimpleCache):
+            return None
+        return cache
+
+    def _remember(self, user_id: str, session: Dict, version):
+        with self._lock:
+            self._sessions[user_id] = (session, version, time.monotonic())
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > self._max_size:
+                self._sessions.popitem(last=False)
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        """
+        Cached session of a user
+
+        Returns:
+            {'user': {...}, 'client': {...}} or None (load from the database and put())
+        """
+        user_id = str(user_id)
+        entry = self._sessions.get(user_id)
+        if entry is not None and time.monotonic() - entry[2] < self._ttl:
+            self.hits += 1
+            return entry[0]
+
+        store = self._store()
+        stored = store.get(SESSION_KEY.format(user_id=user_id)) if store is not None else None
+        if not stored or 'user' not in stored:
+            with self._lock:
+                self._sessions.pop(user_id, None)
+            self.misses += 1
+            return None
+
+        version = stored.get('version')
+        if entry is not None and version is not None and entry[1] == version:
+            self.revalidated += 1
+            session = entry[0]
+        else:
+            self.l2_hits += 1
+            session = {'user': stored['user'], 'client': stored.get('client', {})}
+        self._remember(user_id, session, version)
+        return session
+
+    def put(self, user_id: str, client_id: str, user: Dict, client: Dict, timeout: int = SESSION_TTL):
+        """Cache a session loaded from the database (both tiers)"""
+        user_id = str(user_id)
+        session = {'user': user, 'client': client}
+        version = uuid.uuid4().hex
+
+        store = self._store()
+        if store is not None:
+            store.set(
+                SESSION_KEY.format(user_id=user_id),
+                {'user': user, 'client': client, 'version': version},
+                timeout,
+                tags=[CLIENT_TAG.format(client_id=client_id)]
+            )
+        self._remember(user_id, session, version)
+
+    def invalidate_users(self, user_ids: Iterable):
+        """Drop the sessions of users whose account or permissions changed (call after commit)"""
+        user_ids = [str(user_id) for user_id in user_ids]
+        store = self._store()
+        for user_id in user_ids:
+            if store is not None:
+                store.delete(SESSION_KEY.format(user_id=user_id))
+            with self._lock:
+                self._sessions.pop(user_id, None)
+
+    def invalidate_client(self, client_id: str):
+        """Drop the sessions of every user of a client (client details or status changed)"""
+        client_id = str(client_id)
+        store = self._store()
+        if store is not None:
+            store.invalidate_tags([CLIENT_TAG.format(client_id=client_id)])
+        with self._lock:
+            for user_id in [user_id for user_id, entry in self._sessions.items()
+                            if str(entry[0]['client'].get('client_id')) == client_id]:
+                del self._sessions[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def get_stats(self) -> Dict:
+        return {
+            'sessions': len(self._sessions),
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'l2_hits': self.l2_hits,
+            'misses': self.misses
+        }
+
+
+# Global session cache instance
+session_cache = SessionCache()
+
+
+def invalidate_user_sessions(*user_ids):
+    """Call after committing changes to users or their permissions"""
+    try:
+        session_cache.invalidate_users(user_ids)
+    except Exception as e:
+        print(f"Warning: session invalidation failed for {user_ids}: {str(e)}")
+
+
+def invalidate_client_sessions(client_id: str):
+    """Call after committing changes to a client (name, logo, status...)"""
+    try:
+        session_cache.invalidate_client(client_id)
+    except Exception as e:
+        print(f"Warning: session invalidation failed for client {client_id}: {str(e)}")
+
+
+__all__ = ['session_cache', 'SessionCache', 'invalidate_user_sessions', 'invalidate_client_sessions']
@@ -2,8 +2,12 @@
 RYX Billing - Stock Validation Helpers
 Provides batch product validation to avoid N+1 queries in billing operations
 """
+from datetime import datetime
 from typing import List, Dict, Tuple, Optional, Set
+from sqlalchemy import case, select, update
+from extensions import db
 from models.stock_model import StockEntry
+from services.change_journal import record_changes
 
 
 def batch_validate_products(
@@ -145,6 +149,119 @@ def validate_billing_items_stock(
     return True, None, products_dict
 
 
+def _requested_quantities(items: List[Dict]) -> Dict[str, int]:
+    """Sum requested quantities per stock product, skipping temp-/nosave- items"""
+    requested = {}
+    for item in items:
+        product_id = str(item.get('product_id', '') or '')
+        if not product_id or product_id.startswith('temp-') or product_id.startswith('nosave-'):
+            continue
+        requested[product_id] = requested.get(product_id, 0) + item.get('quantity', 0)
+    return requested
+
+
+def reserve_stock(items: List[Dict], client_id: str) -> List[Dict]:
+    """
+    Decrement stock for all billing items in one conditional UPDATE.
+
+    Every line item is folded into a single ``UPDATE ... SET quantity = quantity - CASE ...``
+    guarded by ``quantity >= requested``, with RETURNING reporting which rows were
+    decremented (PostgreSQL and SQLite 3.35+). No rows are locked up front and no
+    per-item queries are issued; the guard makes concurrent counters safe because a
+    row is only decremented if it still has enough stock at write time.
+
+    Runs inside the caller's transaction. When shortfalls are returned the other
+    rows HAVE been decremented, so the caller must roll back.
+
+    Args:
+        items: List of billing items with product_id and quantity
+        client_id: Client ID for filtering
+
+    Returns:
+        List of shortfall dicts (empty if every item was reserved), each with
+        product_id, product_name, available, requested and found
+
+    Example:
+        shortfalls = reserve_stock(data['items'], client_id)
+        if shortfalls:
+            db.session.rollback()
+            return jsonify({'error': format_stock_shortfall(shortfalls[0], items)}), 400
+    """
+    requested = _requested_quantities(items)
+    if not requested:
+        return []
+
+    stock = StockEntry.__table__
+    wanted = case(
+        *[(stock.c.product_id == product_id, quantity) for product_id, quantity in requested.items()],
+        else_=0
+    )
+
+    # Single round trip: decrement every row that still has enough stock
+    result = db.session.execute(
+        update(stock)
+        .where(
+            stock.c.client_id == client_id,
+            stock.c.product_id.in_(list(requested.keys())),
+            stock.c.quantity >= wanted
+        )
+        .values(quantity=stock.c.quantity - wanted, updated_at=datetime.utcnow())
+        .returning(stock.c.product_id)
+    )
+    reserved = {str(row[0]) for row in result}
+    record_changes('stock_entry', reserved, client_id=client_id)
+
+    short_ids = [product_id for product_id in requested if product_id not in reserved]
+    if not short_ids:
+        return []
+
+    # Failure path only: read current availability of the rows that were not updated
+    rows = db.session.execute(
+        select(stock.c.product_id, stock.c.product_name, stock.c.quantity).where(
+            stock.c.client_id == client_id,
+            stock.c.product_id.in_(short_ids)
+        )
+    ).all()
+    available = {str(row.product_id): row for row in rows}
+
+    shortfalls = []
+    for product_id in short_ids:
+        row = available.get(product_id)
+        shortfalls.append({
+            'product_id': product_id,
+            'product_name': row.product_name if row else None,
+            'available': row.quantity if row else 0,
+            'requested': requested[product_id],
+            'found': row is not None
+        })
+    return shortfalls
+
+
+def format_stock_shortfall(shortfall: Dict, items: Optional[List[Dict]] = None) -> str:
+    """
+    Build the user-facing error message for a reserve_stock() shortfall.
+
+    Args:
+        shortfall: One entry returned by reserve_stock()
+        items: Original billing items, used to recover the name of missing products
+
+    Returns:
+        Error message string
+    """
+    if not shortfall['found']:
+        name = next(
+            (item.get('product_name') for item in (items or [])
+             if str(item.get('product_id')) == shortfall['product_id']),
+            'Unknown'
+        )
+        return f"Product '{name}' not found for your account"
+
+    return (
+        f"Insufficient stock for {shortfall['product_name']}. "
+        f"Available: {shortfall['available']}, Requested: {shortfall['requested']}"
+    )
+
+
 # ============================================================================
 # EXPORTS
 # ============================================================================
@@ -153,4 +270,6 @@ __all__ = [
     'batch_validate_products',
     'get_products_by_ids',
     'validate_billing_items_stock',
+    'reserve_stock',
+    'format_stock_shortfall',
 ]
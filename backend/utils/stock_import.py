@@ -0,0 +1,350 @@
+"""
+RYX Billing - Bulk Stock Import Engine
+Validates and normalises a whole import file with pandas column operations, resolves
+existing products with one keyed lookup per chunk and writes with batched
+INSERT / UPDATE statements (used by routes/stock.bulk_import_stock).
+
+Row semantics match the previous row-by-row import:
+- Rows are matched to existing products by (title-cased) product name
+- Quantities are added to existing stock; other fields are overwritten
+- Several rows for the same product are merged (quantities summed, last value wins)
+- item_code / barcode are only filled in when the product does not have one yet
+"""
+import re
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import bindparam, func, insert, update
+from extensions import db
+from models.stock_model import StockEntry
+from services.change_journal import record_changes
+
+REQUIRED_COLUMNS = ['product_name', 'quantity', 'rate']
+
+# Read as text so codes keep leading zeros and don't turn into floats ("8901234567890.0")
+TEXT_COLUMNS = {'item_code': str, 'barcode': str, 'hsn_code': str}
+
+# Optional numeric columns: (column, error message)
+OPTIONAL_NUMBER_COLUMNS = [
+    ('low_stock_alert', 'Invalid low_stock_alert'),
+    ('purchase_price', 'Invalid purchase_price'),
+    ('cost_price', 'Invalid cost_price'),
+    ('mrp', 'Invalid mrp'),
+    ('gst_percentage', 'Invalid gst_percentage'),
+]
+
+LOOKUP_CHUNK_SIZE = 500
+WRITE_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 500
+
+
+def read_import_file(file, file_ext: str) -> pd.DataFrame:
+    """Read an uploaded CSV/XLSX/XLS file into a DataFrame"""
+    if file_ext == 'csv':
+        return pd.read_csv(file, dtype=TEXT_COLUMNS)
+    return pd.read_excel(file, dtype=TEXT_COLUMNS)
+
+
+def _text(df: pd.DataFrame, column: str) -> pd.Series:
+    """Stripped text column, missing/blank values as None"""
+    if column not in df.columns:
+        return pd.Series(None, index=df.index, dtype=object)
+    values = df[column].astype('string').str.strip()
+    present = (values.notna() & (values != '')).fillna(False).astype(bool)
+    return values.astype(object).where(present, None)
+
+
+def _number(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df.columns:
+        return pd.Series(float('nan'), index=df.index)
+    return pd.to_numeric(df[column], errors='coerce')
+
+
+def prepare_stock_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Validate and normalise all rows at once.
+
+    Returns:
+        DataFrame with one normalised row per input row, 'row' (spreadsheet row
+        number) and 'error' (None for valid rows)
+    """
+    error = pd.Series(None, index=df.index, dtype=object)
+
+    def flag(mask, message):
+        nonlocal error
+        error = error.mask(mask & error.isna(), message)
+
+    product_name = _text(df, 'product_name')
+    quantity = _number(df, 'quantity')
+    rate = _number(df, 'rate')
+
+    flag(product_name.isna() | df['quantity'].isna() | df['rate'].isna(), 'Missing required fields')
+    flag(quantity.isna() | rate.isna(), 'Quantity and rate must be numbers')
+
+    numbers = {}
+    for column, message in OPTIONAL_NUMBER_COLUMNS:
+        numbers[column] = _number(df, column)
+        if column in df.columns:
+            flag(df[column].notna() & numbers[column].isna(), message)
+
+    flag((quantity < 0) | (rate < 0), 'Quantity and rate must be positive')
+
+    category = _text(df, 'category')
+    unit = _text(df, 'unit')
+
+    rows = pd.DataFrame({
+        'row': df.index + 2,  # header row + 1-based
+        'product_name': product_name.str.title(),
+        'quantity': quantity.fillna(0).astype('int64'),
+        'rate': rate,
+        'category': category.str.title().where(category.notna(), 'Other'),
+        'unit': unit.where(unit.notna(), 'pcs'),
+        'low_stock_alert': numbers['low_stock_alert'].fillna(10).astype('int64'),
+        # purchase_price takes priority over cost_price
+        'cost_price': numbers['purchase_price'].combine_first(numbers['cost_price']),
+        'mrp': numbers['mrp'],
+        'gst_percentage': numbers['gst_percentage'].fillna(0),
+        'hsn_code': _text(df, 'hsn_code').fillna(''),
+        'item_code': _text(df, 'item_code'),
+        'barcode': _text(df, 'barcode'),
+        'error': error,
+    })
+    return rows
+
+
+def _merge_products(valid: pd.DataFrame) -> pd.DataFrame:
+    """One row per product name, in order of first appearance"""
+    return valid.groupby('product_name', sort=False).agg(
+        row=('row', 'first'),
+        row_count=('row', 'size'),
+        quantity=('quantity', 'sum'),
+        rate=('rate', 'last'),
+        category=('category', 'last'),
+        unit=('unit', 'last'),
+        low_stock_alert=('low_stock_alert', 'last'),
+        cost_price=('cost_price', 'last'),
+        mrp=('mrp', 'last'),
+        gst_percentage=('gst_percentage', 'last'),
+        hsn_code=('hsn_code', 'last'),
+        item_code=('item_code', 'first'),
+        barcode=('barcode', 'first'),
+    ).reset_index()
+
+
+def _chunks(values: List, size: int = LOOKUP_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _find_existing(client_id: str, names: List[str]) -> Dict[str, tuple]:
+    """Existing products by name: name -> (product_id, item_code, barcode, cost_price, mrp)"""
+    existing = {}
+    for chunk in _chunks(names):
+        rows = db.session.query(
+            StockEntry.product_name, StockEntry.product_id, StockEntry.item_code,
+            StockEntry.barcode, StockEntry.cost_price, StockEntry.mrp
+        ).filter(
+            StockEntry.client_id == client_id,
+            StockEntry.product_name.in_(chunk)
+        ).all()
+        for row in rows:
+            existing.setdefault(row.product_name, tuple(row[1:]))
+    return existing
+
+
+def _barcode_owners(barcodes: List[str]) -> Dict[str, str]:
+    """Barcode -> product_id for barcodes already in use (barcodes are globally unique)"""
+    owners = {}
+    for chunk in _chunks(barcodes):
+        for barcode, product_id in db.session.query(StockEntry.barcode, StockEntry.product_id).filter(
+            StockEntry.barcode.in_(chunk)
+        ).all():
+            owners[barcode] = str(product_id)
+    return owners
+
+
+def allocate_item_codes(client_id: str, product_names: List[str], reserved: Optional[set] = None) -> List[str]:
+    """
+    Generate item codes for many products at once (same format as
+    routes.stock.generate_item_code: {PRODUCT_INITIALS}-{CLIENT_PREFIX}-{SEQUENCE}).
+
+    One COUNT and one query for existing codes instead of a query per product.
+    """
+    client_prefix = str(client_id)[:3].upper()
+    next_sequence = (db.session.query(func.count(StockEntry.product_id)).filter_by(client_id=client_id).scalar() or 0) + 1
+    taken = {
+        code for (code,) in db.session.query(StockEntry.item_code).filter(
+            StockEntry.client_id == client_id,
+            StockEntry.item_code.isnot(None)
+        )
+    }
+    taken |= reserved or set()
+
+    codes = []
+    for product_name in product_names:
+        clean_name = re.sub(r'[^a-zA-Z0-9]', '', product_name)
+        product_prefix = clean_name[:3].upper() if clean_name else 'ITM'
+        while True:
+            item_code = f"{product_prefix}-{client_prefix}-{next_sequence:03d}"
+            next_sequence += 1
+            if item_code not in taken:
+                break
+        taken.add(item_code)
+        codes.append(item_code)
+    return codes
+
+
+def import_stock_frame(client_id: str, df: pd.DataFrame) -> Tuple[dict, dict]:
+    """
+    Import a stock DataFrame for a client in the current transaction (caller commits).
+
+    Returns:
+        Tuple of (summary, audit_data)
+    """
+    rows = prepare_stock_rows(df)
+    row_errors = [
+        {'row': int(row), 'error': message}
+        for row, message in rows.loc[rows['error'].notna(), ['row', 'error']].itertuples(index=False)
+    ]
+
+    products = _merge_products(rows[rows['error'].isna()])
+    names = products['product_name'].tolist()
+    existing = _find_existing(client_id, names)
+    is_existing = products['product_name'].isin(existing.keys())
+
+    # Barcodes that would be written: new products, or existing products without one
+    existing_barcode = products['product_name'].map(lambda name: existing.get(name, (None,) * 5)[2])
+    writes_barcode = products['barcode'].notna() & (~is_existing | existing_barcode.isna() | (existing_barcode == ''))
+    products['barcode'] = products['barcode'].where(writes_barcode, None)
+
+    owners = _barcode_owners(products.loc[writes_barcode, 'barcode'].unique().tolist())
+    rejected = pd.Series(False, index=products.index)
+    seen_barcodes = set()
+    for index, name, barcode, row in products.loc[writes_barcode, ['product_name', 'barcode', 'row']].itertuples():
+        own_id = str(existing[name][0]) if name in existing else None
+        if (barcode in owners and owners[barcode] != own_id) or barcode in seen_barcodes:
+            rejected[index] = True
+            row_errors.append({'row': int(row), 'error': f"Barcode {barcode} is already used by another product"})
+        seen_barcodes.add(barcode)
+
+    rejected_rows = int(products.loc[rejected, 'row_count'].sum())
+    products = products[~rejected]
+    is_existing = is_existing[~rejected]
+
+    # Item codes: file value, else keep existing, else allocate a block
+    existing_code = products['product_name'].map(lambda name: existing.get(name, (None,) * 5)[1])
+    has_code = existing_code.notna() & (existing_code != '')
+    item_code = existing_code.where(has_code & is_existing, products['item_code'])
+    needs_code = item_code.isna()
+    if needs_code.any():
+        generated = allocate_item_codes(
+            client_id,
+            products.loc[needs_code, 'product_name'].tolist(),
+            reserved=set(item_code.dropna())
+        )
+        item_code.loc[needs_code] = generated
+    products = products.assign(item_code=item_code)
+
+    now = datetime.utcnow()
+    new_products = products[~is_existing]
+    updated_products = products[is_existing]
+
+    inserts = [
+        {
+            'product_id': str(uuid.uuid4()),
+            'client_id': client_id,
+            'product_name': product.product_name,
+            'category': product.category,
+            'quantity': int(product.quantity),
+            'rate': float(product.rate),
+            'cost_price': None if pd.isna(product.cost_price) else float(product.cost_price),
+            'mrp': None if pd.isna(product.mrp) else float(product.mrp),
+            'unit': product.unit,
+            'low_stock_alert': int(product.low_stock_alert),
+            'item_code': product.item_code,
+            'barcode': product.barcode,
+            'gst_percentage': float(product.gst_percentage),
+            'hsn_code': product.hsn_code,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for product in new_products.itertuples(index=False)
+    ]
+
+    updates = []
+    for product in updated_products.itertuples(index=False):
+        product_id, _, barcode, cost_price, mrp = existing[product.product_name]
+        updates.append({
+            'b_product_id': product_id,
+            'b_quantity': int(product.quantity),
+            'b_rate': float(product.rate),
+            'b_cost_price': cost_price if pd.isna(product.cost_price) else float(product.cost_price),
+            'b_mrp': mrp if pd.isna(product.mrp) else float(product.mrp),
+            'b_category': product.category,
+            'b_unit': product.unit,
+            'b_low_stock_alert': int(product.low_stock_alert),
+            'b_gst_percentage': float(product.gst_percentage),
+            'b_hsn_code': product.hsn_code,
+            'b_item_code': product.item_code,
+            'b_barcode': product.barcode or barcode,
+            'b_updated_at': now,
+        })
+
+    table = StockEntry.__table__
+    for batch in _chunks(inserts, WRITE_BATCH_SIZE):
+        db.session.execute(insert(table), batch)
+    record_changes('stock_entry', [row['product_id'] for row in inserts], 'insert', client_id)
+
+    if updates:
+        # Quantity is incremented in SQL so concurrent sales are not overwritten
+        update_stmt = update(table).where(
+            table.c.client_id == client_id,
+            table.c.product_id == bindparam('b_product_id')
+        ).values(
+            quantity=table.c.quantity + bindparam('b_quantity'),
+            rate=bindparam('b_rate'),
+            cost_price=bindparam('b_cost_price'),
+            mrp=bindparam('b_mrp'),
+            category=bindparam('b_category'),
+            unit=bindparam('b_unit'),
+            low_stock_alert=bindparam('b_low_stock_alert'),
+            gst_percentage=bindparam('b_gst_percentage'),
+            hsn_code=bindparam('b_hsn_code'),
+            item_code=bindparam('b_item_code'),
+            barcode=bindparam('b_barcode'),
+            updated_at=bindparam('b_updated_at'),
+        )
+        for batch in _chunks(updates, WRITE_BATCH_SIZE):
+            db.session.execute(update_stmt, batch)
+        record_changes('stock_entry', [row['b_product_id'] for row in updates], 'update', client_id)
+
+    # Rows are counted like the row-by-row import: the first row of a new product
+    # creates it, every further row for a product updates it
+    created_count = len(inserts)
+    success_count = int(products['row_count'].sum())
+    row_errors.sort(key=lambda e: e['row'])
+
+    summary = {
+        'total_rows': len(df),
+        'success_count': success_count,
+        'created_count': created_count,
+        'updated_count': success_count - created_count,
+        'error_count': len(df) - success_count,
+        'barcode_conflict_count': rejected_rows,  # rows of products skipped for a barcode in use (part of error_count)
+        'errors': [f"Row {e['row']}: {e['error']}" for e in row_errors[:10]],
+        'row_errors': row_errors[:MAX_REPORTED_ERRORS],
+    }
+
+    audit_data = {
+        'created_count': created_count,
+        'updated_count': summary['updated_count'],
+        'error_count': summary['error_count'],
+        'created_product_ids': [row['product_id'] for row in inserts],
+        'updated_product_ids': [str(row['b_product_id']) for row in updates],
+    }
+    return summary, audit_data
+
+
+__all__ = ['REQUIRED_COLUMNS', 'read_import_file', 'prepare_stock_rows', 'allocate_item_codes', 'import_stock_frame']
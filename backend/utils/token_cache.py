@@ -0,0 +1,163 @@
+"""
+RYX Billing - Verified JWT Cache
+The frontend sends the same long-lived bearer token with every dashboard poll
+and scanner lookup. Instead of re-running jwt.decode (HMAC check + JSON parse)
+each time, the claims of a verified token are kept per process, keyed by the
+token's SHA-256 digest, until the token's exp.
+
+- Only tokens that passed jwt.decode are stored; invalid tokens are never cached.
+- A cached token past its exp raises jwt.ExpiredSignatureError like jwt.decode.
+- Revoked tokens raise jwt.InvalidTokenError. Revocations go to a deny-list in
+  the shared cache (utils.cache), which every worker checks before using its
+  memo: revoke_token() (logout) by the token's jti, revoke_user_tokens() /
+  revoke_client_tokens() (deactivation, deletion) by time - every token issued
+  (iat) before the revocation. With CACHE_BACKEND=memory the deny-list only
+  covers the worker that revoked.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+
+import jwt
+
+from config import Config
+from utils.cache import cache
+
+# Verified tokens kept in memory per process (least recently used are dropped)
+MAX_TOKENS = int(os.getenv('TOKEN_CACHE_SIZE', '1024'))
+# Lifetime of a cached token without an exp claim
+NO_EXP_TTL = 3600
+# Deny-list entries outlive every token they can match (longest token lifetime)
+REVOKED_TTL = max(Config.JWT_EXPIRATION_HOURS, Config.JWT_DESKTOP_EXPIRATION_HOURS) * 3600
+
+
+def _revoked_key(kind: str, value) -> str:
+    return f"token_revoked:{kind}:{value}"
+
+
+def _is_revoked(claims: Dict) -> bool:
+    """Deny-list check: this token's jti, or a revocation of its user or client after its iat"""
+    jti = claims.get('jti')
+    if jti and cache.get(_revoked_key('jti', jti)):
+        return True
+
+    issued_at = float(claims.get('iat') or 0)  # tokens without iat predate any revocation
+    for kind in ('user', 'client'):
+        value = claims.get(f'{kind}_id')
+        revoked_at = cache.get(_revoked_key(kind, value)) if value else None
+        if revoked_at is not None and issued_at < revoked_at:
+            return True
+    return False
+
+
+class TokenCache:
+    """Per-process cache of verified JWT claims"""
+
+    def __init__(self, max_size: int = MAX_TOKENS):
+        self._tokens = OrderedDict()  # digest -> (claims, expires_at), least recently used first
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, token: str) -> Dict:
+        """
+        Verified claims of a token (same result and exceptions as jwt.decode)
+
+        The returned dict is shared between requests - do not modify it.
+        """
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        entry = self._tokens.get(digest)
+        if entry is not None:
+            if time.time() >= entry[1]:
+                with self._lock:
+                    self._tokens.pop(digest, None)
+                raise jwt.ExpiredSignatureError('Signature has expired')
+            if _is_revoked(entry[0]):
+                with self._lock:
+                    self._tokens.pop(digest, None)
+                raise jwt.InvalidTokenError('Token has been revoked')
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        claims = jwt.decode(token, Config.JWT_SECRET, algorithms=[Config.JWT_ALGORITHM])
+        if _is_revoked(claims):
+            raise jwt.InvalidTokenError('Token has been revoked')
+        exp = claims.get('exp')
+        expires_at = float(exp) if exp is not None else time.time() + NO_EXP_TTL
+
+        with self._lock:
+            self._tokens[digest] = (claims, expires_at)
+            self._tokens.move_to_end(digest)
+            while len(self._tokens) > self._max_size:
+                self._tokens.popitem(last=False)
+        return claims
+
+    def _revoke(self, claim: str, values):
+        """Deny every token of these users / clients issued until now, in all workers"""
+        values = {str(value) for value in values}
+        now = time.time()
+        for value in values:
+            cache.set(_revoked_key(claim[:-len('_id')], value), now, ttl_seconds=REVOKED_TTL)
+        with self._lock:
+            for digest in [digest for digest, (claims, _) in self._tokens.items()
+                           if str(claims.get(claim)) in values]:
+                del self._tokens[digest]
+
+    def revoke_users(self, user_ids):
+        self._revoke('user_id', user_ids)
+
+    def revoke_client(self, client_id: str):
+        self._revoke('client_id', [client_id])
+
+    def revoke_token(self, token: str):
+        """Deny one token (by its jti) until it expires, in all workers"""
+        try:
+            claims = self.decode(token)
+        except jwt.InvalidTokenError:
+            return  # expired, revoked or invalid already
+        jti = claims.get('jti')
+        if jti:
+            ttl = float(claims['exp']) - time.time() if claims.get('exp') is not None else NO_EXP_TTL
+            cache.set(_revoked_key('jti', jti), True, ttl_seconds=max(int(ttl) + 1, 1))
+        else:
+            self._revoke('user_id', [claims.get('user_id')])  # older token: no jti to deny it by
+        with self._lock:
+            self._tokens.pop(hashlib.sha256(token.encode('utf-8')).digest(), None)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def get_stats(self) -> Dict:
+        return {
+            'tokens': len(self._tokens),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+# Global token cache instance
+token_cache = TokenCache()
+
+
+def revoke_token(token: str):
+    """Call on logout"""
+    token_cache.revoke_token(token)
+
+
+def revoke_user_tokens(*user_ids):
+    """Call after deactivating or deleting users"""
+    token_cache.revoke_users(user_ids)
+
+
+def revoke_client_tokens(client_id: str):
+    """Call after deactivating or deleting a client"""
+    token_cache.revoke_client(client_id)
+
+
+__all__ = ['token_cache', 'TokenCache', 'revoke_token', 'revoke_user_tokens', 'revoke_client_tokens']